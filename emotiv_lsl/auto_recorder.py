@@ -0,0 +1,253 @@
+"""
+Recorder daemon that starts recording as soon as Emotiv streams appear on the network.
+
+`AutoRecorder` keeps a `pylsl.ContinuousResolver` running for streams whose name starts with `name_prefix` (default 'Epoc X'). As soon as a stream is
+listed, its inlet is opened (with LSL clock synchronization, so timestamps are in this machine's clock) and subscribed, and a recording is started if
+none is running: samples are recorded from the first pull after the resolver lists the stream (liblsl re-queries every 0.5 s by default,
+`ContinuousResolveInterval` in lsl_api.cfg). Streams appearing later, such as the motion outlet that
+`EmotivBase.main_loop` creates on the first motion packet, are attached to the running recording. Inlets are opened without liblsl's automatic
+recovery, so a stream is dropped when a pull reports it lost (`LostError`), not when the resolver stops listing it (which a busy network can
+cause while samples still arrive); a restarted outlet has a new uid and is subscribed again. When no matching stream has been subscribed for
+`idle_timeout` seconds the recording is closed; the next stream to appear starts a new file.
+
+Recordings use the same sinks as `RecorderService` (backend 'native', 'hdf5', 'edf', 'bdf' or 'journal'), fed from the inlets instead of a delegate.
+
+Usage:
+    recorder = AutoRecorder(output_directory='recordings', backend='native')
+    recorder.start() ## background thread
+    ...
+    recorder.stop() ## closes the running recording
+
+    python -m emotiv_lsl.auto_recorder -o recordings/ [--prefix "Epoc X"] [--backend native]
+"""
+import argparse
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import pylsl
+from pylsl import StreamInfo, StreamInlet
+from attrs import define, field
+try:
+    from pylsl import LostError
+except ImportError: ## pylsl >= 1.17 only exports it from pylsl.util
+    from pylsl.util import LostError
+
+from emotiv_lsl.sample_sink import SampleSink
+from emotiv_lsl.recorder_service import SINK_BACKENDS, create_recording_sink, close_recording_sink, default_recording_filename
+
+logger = logging.getLogger(__name__)
+
+
+@define(slots=False)
+class AutoRecordedStream:
+    """ one subscribed stream of an `AutoRecorder` """
+    uid: str = field()
+    name: str = field()
+    inlet: StreamInlet = field()
+    info: StreamInfo = field() ## full info, with the `<desc>` channel metadata the sinks store
+    sample_count: int = field(default=0)
+
+
+@define(slots=False)
+class AutoRecorder:
+    """ Event-driven recorder: see the module docstring.
+
+    The resolver is polled every `resolve_interval` seconds (it keeps resolving in the background; polling only reads its current results), inlets are
+    polled with non-blocking `pull_chunk` calls, and the loop sleeps `poll_interval` when no inlet had data.
+    """
+    output_directory: Path = field(default=Path('.'), converter=Path)
+    backend: str = field(default='native')
+    name_prefix: str = field(default='Epoc X')
+    resolve_interval: float = field(default=0.1)
+    poll_interval: float = field(default=0.005)
+    idle_timeout: float = field(default=10.0) ## close the recording after this long without any matching stream
+    forget_after: float = field(default=5.0) ## the resolver stops listing a stream it has not heard from for this long (subscribed streams are kept until lost)
+    max_buflen: int = field(default=360)
+    max_pull_samples: int = field(default=1024)
+
+    filename: Optional[Path] = field(default=None, init=False) ## of the running recording
+    recorded_filenames: List[Path] = field(factory=list, init=False)
+    _streams: Dict[str, AutoRecordedStream] = field(factory=dict, init=False) ## by stream uid
+    _lost_uids: Set[str] = field(factory=set, init=False) ## lost streams the resolver still lists, not resubscribed
+    _sink: Optional[SampleSink] = field(default=None, init=False)
+    _resolver: Optional[pylsl.ContinuousResolver] = field(default=None, init=False)
+    _thread: Optional[threading.Thread] = field(default=None, init=False)
+    _running: bool = field(default=False, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+    _last_stream_time: float = field(default=0.0, init=False)
+
+    def __attrs_post_init__(self):
+        if self.backend not in SINK_BACKENDS:
+            raise ValueError(f"unknown backend {self.backend!r} (expected one of {SINK_BACKENDS})")
+        self.output_directory.mkdir(parents=True, exist_ok=True)
+
+
+    @property
+    def is_recording(self) -> bool:
+        return self._sink is not None
+
+
+    def _make_resolver(self) -> pylsl.ContinuousResolver:
+        return pylsl.ContinuousResolver(pred=f"starts-with(name,'{self.name_prefix}')", forget_after=self.forget_after)
+
+
+    def start(self):
+        """ starts resolving and recording on a background thread """
+        if self._running:
+            return
+        self._resolver = self._make_resolver()
+        self._running = True
+        self._thread = threading.Thread(target=self.run, name='AutoRecorder', daemon=True)
+        self._thread.start()
+        logger.info(f"waiting for streams named {self.name_prefix!r}* (recording to {self.output_directory}, {self.backend})")
+
+
+    def stop(self, timeout: float = 5.0):
+        """ stops the loop and closes the running recording """
+        self._running = False
+        if (self._thread is not None) and (self._thread is not threading.current_thread()):
+            self._thread.join(timeout)
+        self._thread = None
+        with self._lock:
+            self._close_recording()
+            for a_stream in self._streams.values():
+                a_stream.inlet.close_stream()
+            self._streams.clear()
+        self._resolver = None
+
+
+    def run(self):
+        """ resolve/pull loop, until `stop`. `start` runs it on a thread; call it directly to block instead """
+        if self._resolver is None:
+            self._resolver = self._make_resolver()
+            self._running = True
+        last_resolve = -float('inf')
+        while self._running:
+            now = time.monotonic()
+            if (now - last_resolve) >= self.resolve_interval:
+                last_resolve = now
+                self._update_streams(now)
+            n_pulled = self._pull_all()
+            if n_pulled == 0:
+                time.sleep(self.poll_interval)
+
+
+    def _update_streams(self, now: float):
+        """ subscribes to newly listed streams, and closes the recording once none has been subscribed for `idle_timeout` """
+        listed = {an_info.uid(): an_info for an_info in self._resolver.results()}
+        with self._lock:
+            self._lost_uids.intersection_update(listed)
+            new_infos = [an_info for uid, an_info in listed.items() if (uid not in self._streams) and (uid not in self._lost_uids)]
+        for an_info in new_infos:
+            self._subscribe(an_info)
+        with self._lock:
+            if self._streams:
+                self._last_stream_time = now
+            elif (self._sink is not None) and ((now - self._last_stream_time) >= self.idle_timeout):
+                logger.info(f"no {self.name_prefix!r}* stream for {self.idle_timeout:.0f} s")
+                self._close_recording()
+
+
+    def _subscribe(self, info: StreamInfo):
+        """ opens an inlet (blocking for up to a few seconds, so without holding `_lock`), then registers it and starts or extends the recording """
+        try:
+            inlet = StreamInlet(info, max_buflen=self.max_buflen, recover=False, processing_flags=pylsl.proc_clocksync)
+            inlet.open_stream(timeout=2.0)
+            full_info = inlet.info(timeout=2.0)
+        except Exception as e:
+            if isinstance(e, LostError):
+                with self._lock:
+                    self._lost_uids.add(info.uid())
+            logger.warning(f"could not subscribe to {info.name()!r} ({info.uid()}): {e}")
+            return
+        a_stream = AutoRecordedStream(uid=info.uid(), name=info.name(), inlet=inlet, info=full_info)
+        with self._lock:
+            if not self._running: ## stopped while the inlet was opening
+                inlet.close_stream()
+                return
+            self._streams[a_stream.uid] = a_stream
+            if self._sink is None:
+                self._open_recording()
+            if self._sink is not None:
+                self._sink.on_stream_started(a_stream.name, full_info)
+        logger.info(f"subscribed to {a_stream.name!r} ({a_stream.uid}, {full_info.channel_count()} ch @ {full_info.nominal_srate():g} Hz, host {full_info.hostname()})")
+
+
+    def _open_recording(self):
+        filename = self.output_directory.joinpath(default_recording_filename(self.backend))
+        try:
+            self._sink = create_recording_sink(self.backend, filename)
+        except OSError as e:
+            logger.error(f"Failed to start recording: {e}")
+            return
+        self.filename = filename
+        for a_stream in self._streams.values(): ## streams already subscribed, when a recording is reopened after an idle period
+            self._sink.on_stream_started(a_stream.name, a_stream.info)
+        logger.info(f"Started recording to {self.filename} ({self.backend})")
+
+
+    def _close_recording(self):
+        if self._sink is None:
+            return
+        sink, self._sink = self._sink, None
+        try:
+            close_recording_sink(self.backend, sink, self.filename)
+            self.recorded_filenames.append(self.filename)
+            logger.info(f"Stopped recording. File saved to: {self.filename}")
+        except Exception as e:
+            logger.error(f"Error stopping recording: {e}")
+
+
+    def _pull_all(self) -> int:
+        n_pulled = 0
+        with self._lock:
+            for a_stream in list(self._streams.values()):
+                try:
+                    samples, timestamps = a_stream.inlet.pull_chunk(timeout=0.0, max_samples=self.max_pull_samples)
+                except LostError:
+                    self._streams.pop(a_stream.uid, None)
+                    self._lost_uids.add(a_stream.uid)
+                    a_stream.inlet.close_stream()
+                    logger.info(f"stream {a_stream.name!r} ({a_stream.uid}) is gone after {a_stream.sample_count} samples")
+                    continue
+                if not timestamps:
+                    continue
+                if self._sink is not None:
+                    for a_sample, a_timestamp in zip(samples, timestamps):
+                        self._sink.on_sample(a_stream.name, a_sample, a_timestamp)
+                a_stream.sample_count += len(timestamps)
+                n_pulled += len(timestamps)
+        return n_pulled
+
+
+    def get_status(self) -> Dict:
+        with self._lock:
+            status = self._sink.get_status() if self._sink is not None else {'recording': False, 'filename': None}
+            status['subscribed'] = {a_stream.name: a_stream.sample_count for a_stream in self._streams.values()}
+            status['recorded_filenames'] = [str(a_path) for a_path in self.recorded_filenames]
+        return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record Emotiv LSL streams automatically whenever they are on the network.')
+    parser.add_argument('--output', '-o', type=str, default='.', help='Directory for the recordings')
+    parser.add_argument('--backend', type=str, default='native', choices=SINK_BACKENDS)
+    parser.add_argument('--prefix', type=str, default='Epoc X', help="Record streams whose name starts with this (default: 'Epoc X')")
+    parser.add_argument('--idle-timeout', type=float, default=10.0, help='Close the recording after this many seconds without streams (default: 10)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    recorder = AutoRecorder(output_directory=args.output, backend=args.backend, name_prefix=args.prefix, idle_timeout=args.idle_timeout)
+    try:
+        recorder.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.stop()
+
+
+if __name__ == '__main__':
+    main()
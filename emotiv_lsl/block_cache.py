@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from typing import Any, Dict
+
+from attrs import define, field, Factory
+
+
+AES_BLOCK_SIZE: int = 16
+
+
+@define(slots=False)
+class CachedBlockCipher:
+    """ Memoizes ECB block decryption: identical 16-byte ciphertext blocks always decrypt to identical plaintext.
+
+    Drop-in for `cipher.decrypt(...)`, keyed per 16-byte block with a bounded LRU. The blocks of an input that miss are decrypted together in one call,
+    so a report is only free when all of its blocks are cached (a decrypt call costs about the same for 16 or 32 bytes).
+    Inputs of `batch_threshold_blocks` or more (`EmotivEpocX.decode_packets`) go straight to one decrypt call: it runs at a few ns per block,
+    cheaper than any per-block lookup. They are counted in `bypassed_blocks`.
+
+    Usage:
+        emotiv = EmotivEpocX(enable_block_cache=True)
+        ...
+        print(emotiv.cipher.get_stats())
+    """
+    cipher: Any = field()
+    max_entries: int = field(default=1024)
+    batch_threshold_blocks: int = field(default=64)
+
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+    decrypt_calls_saved: int = field(default=0, init=False)
+    bypassed_blocks: int = field(default=0, init=False)
+    _cache: "OrderedDict[bytes, bytes]" = field(default=Factory(OrderedDict), init=False)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return (self.hits / total) if total > 0 else 0.0
+
+    @property
+    def n_entries(self) -> int:
+        return len(self._cache)
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate, 'decrypt_calls_saved': self.decrypt_calls_saved,
+                'bypassed_blocks': self.bypassed_blocks, 'entries': self.n_entries, 'max_entries': self.max_entries}
+
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+        self.decrypt_calls_saved = 0
+        self.bypassed_blocks = 0
+
+
+    def decrypt(self, data) -> bytes:
+        data = bytes(data)
+        n_blocks, remainder = divmod(len(data), AES_BLOCK_SIZE)
+        if remainder != 0:
+            raise ValueError(f'data length {len(data)} is not a multiple of the {AES_BLOCK_SIZE}-byte AES block size')
+        if n_blocks >= self.batch_threshold_blocks:
+            self.bypassed_blocks += n_blocks
+            return self.cipher.decrypt(data)
+
+        blocks = [data[i:i + AES_BLOCK_SIZE] for i in range(0, len(data), AES_BLOCK_SIZE)]
+        plain_blocks = [self._cache.get(a_block) for a_block in blocks]
+        missing = [j for j, a_plain in enumerate(plain_blocks) if a_plain is None]
+        self.hits += n_blocks - len(missing)
+        self.misses += len(missing)
+
+        if len(missing) == 0:
+            self.decrypt_calls_saved += 1
+        else:
+            missing_plain = self.cipher.decrypt(b''.join(blocks[j] for j in missing))
+            for k, j in enumerate(missing):
+                plain_blocks[j] = missing_plain[k * AES_BLOCK_SIZE:(k + 1) * AES_BLOCK_SIZE]
+                self._cache[blocks[j]] = plain_blocks[j]
+
+        for a_block in blocks:
+            self._cache.move_to_end(a_block)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return b''.join(plain_blocks)
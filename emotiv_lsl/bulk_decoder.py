@@ -0,0 +1,162 @@
+"""
+Offline bulk decoder for raw Emotiv packet captures.
+
+AES-ECB has no cross-packet state, so a capture can be split into independent chunks, decoded across a process pool with the vectorized `EmotivEpocX.decode_packets`, and reassembled in the original order.
+
+Usage:
+    python -m emotiv_lsl.bulk_decoder session.emraw --serial UD20221202006B1C -o session_decoded.npz
+    python -m emotiv_lsl.bulk_decoder session.emraw --key 6566565666756557 -o session_raw.fif --workers 8
+"""
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from attrs import define, field, asdict
+
+from emotiv_lsl.emotiv_epoc_x import EmotivEpocX
+from emotiv_lsl.decoded_chunk import DecodedChunk
+from emotiv_lsl.raw_capture import read_raw_capture, RAW_CAPTURE_EXTENSION
+from emotiv_lsl.usbmon_capture import read_pcap_reports
+from config import MOTION_SRATE, SRATE
+
+logger = logging.getLogger(__name__)
+
+## per-process decoder, built once by `_init_worker`
+_worker_decoder: Optional[EmotivEpocX] = None
+
+
+def parse_crypto_key(key: str) -> bytearray:
+    """ accepts the 16-character key as printed by `main.py` (e.g. '6566565666756557') or its 32-digit hex form """
+    if len(key) == 32:
+        return bytearray.fromhex(key)
+    if len(key) == 16:
+        return bytearray(key.encode('latin-1'))
+    raise ValueError(f'crypto key must be 16 characters or 32 hex digits, got {len(key)} characters')
+
+
+def crypto_key_for_serial(serial_number: str) -> bytearray:
+    return EmotivEpocX(serial_number=serial_number).get_crypto_key()
+
+
+def _init_worker(crypto_key: bytes):
+    global _worker_decoder
+    _worker_decoder = EmotivEpocX.init_with_serial(serial_number=None, cryptokey=bytearray(crypto_key))
+
+
+def _decode_slice(args: Tuple[np.ndarray, Optional[np.ndarray], int]) -> DecodedChunk:
+    packets, timestamps, offset = args
+    return _worker_decoder.decode_packets(packets, timestamps=timestamps).offset_packet_index(offset)
+
+
+@define(slots=False)
+class BulkDecodeStats:
+    n_packets: int = field(default=0)
+    n_eeg: int = field(default=0)
+    n_motion: int = field(default=0)
+    n_chunks: int = field(default=0)
+    n_workers: int = field(default=1)
+    elapsed_seconds: float = field(default=0.0)
+
+    @property
+    def packets_per_second(self) -> float:
+        return (self.n_packets / self.elapsed_seconds) if self.elapsed_seconds > 0 else float('nan')
+
+    def to_dict(self) -> Dict:
+        return {**asdict(self), 'packets_per_second': self.packets_per_second}
+
+    def __str__(self) -> str:
+        return (f'decoded {self.n_packets} packets ({self.n_eeg} EEG, {self.n_motion} motion) in {self.n_chunks} chunks on {self.n_workers} worker(s): '
+                f'{self.elapsed_seconds:.3f} s, {self.packets_per_second:,.0f} packets/s')
+
+
+def load_capture_packets(path: Union[str, Path]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """ Loads (packets, timestamps) from a capture file.
+
+    Supported: `.emraw` raw captures, `.pcap`/`.pcapng` USB captures (all 32-byte interrupt-IN reports), `.npy` (n, 32) uint8 arrays and `.npz` files with a `packets` (and optional `timestamps`) array.
+    Records of a raw capture whose report was not exactly `packet_size` bytes long (truncated or zero-padded on capture) are dropped, so the
+    `packet_index` of the decoded samples counts the kept records only.
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == RAW_CAPTURE_EXTENSION:
+        capture = read_raw_capture(path)
+        is_valid = (capture.records['length'] == capture.packet_size)
+        if np.all(is_valid):
+            return capture.packets, capture.timestamps
+        logger.warning(f'{path.name}: dropping {len(is_valid) - np.count_nonzero(is_valid)} of {len(is_valid)} records with a report length other than {capture.packet_size} bytes')
+        return capture.packets[is_valid], capture.timestamps[is_valid]
+    elif suffix in ('.pcap', '.pcapng'):
+        return read_pcap_reports(path)
+    elif suffix == '.npy':
+        return np.load(path, mmap_mode='r'), None
+    elif suffix == '.npz':
+        with np.load(path) as npz:
+            return npz['packets'], (npz['timestamps'] if 'timestamps' in npz else None)
+    raise ValueError(f'unsupported capture format: {path}')
+
+
+def bulk_decode_packets(packets: np.ndarray, crypto_key: bytearray, timestamps: Optional[np.ndarray] = None, n_workers: Optional[int] = None, chunk_size: int = 65536) -> Tuple[DecodedChunk, BulkDecodeStats]:
+    """ Decodes an (n, 32) array of raw reports across a process pool. The result is in the original packet order.
+
+    With `n_workers=1`, or when everything fits in one chunk, decoding runs in-process.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_packets = len(packets)
+    bounds = [(start, min(start + chunk_size, n_packets)) for start in range(0, n_packets, chunk_size)]
+    tasks = [(np.asarray(packets[start:stop]), (None if timestamps is None else np.asarray(timestamps[start:stop])), start) for start, stop in bounds]
+    n_workers = max(1, min(n_workers, len(tasks)))
+
+    start_time = time.perf_counter()
+    if n_workers == 1:
+        _init_worker(bytes(crypto_key))
+        chunks: List[DecodedChunk] = [_decode_slice(a_task) for a_task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(bytes(crypto_key),)) as executor:
+            chunks = list(executor.map(_decode_slice, tasks)) ## map preserves submission order
+    result = DecodedChunk.concatenate(chunks)
+    elapsed = time.perf_counter() - start_time
+
+    stats = BulkDecodeStats(n_packets=n_packets, n_eeg=result.n_eeg, n_motion=result.n_motion, n_chunks=len(tasks), n_workers=n_workers, elapsed_seconds=elapsed)
+    logger.info(str(stats))
+    return result, stats
+
+
+def bulk_decode_capture(path: Union[str, Path], crypto_key: bytearray, output_path: Optional[Union[str, Path]] = None, n_workers: Optional[int] = None, chunk_size: int = 65536) -> Tuple[DecodedChunk, BulkDecodeStats]:
+    """ Decodes a capture file and optionally writes the result to `.npz` or `.fif` (chosen by the output suffix). """
+    packets, timestamps = load_capture_packets(path)
+    result, stats = bulk_decode_packets(packets, crypto_key=crypto_key, timestamps=timestamps, n_workers=n_workers, chunk_size=chunk_size)
+    if output_path is not None:
+        output_path = Path(output_path)
+        if output_path.suffix.lower() == '.fif':
+            written = result.to_fif(output_path, eeg_sfreq=SRATE, motion_sfreq=MOTION_SRATE)
+        else:
+            written = [result.to_npz(output_path)]
+        logger.info(f'wrote {[str(a_path) for a_path in written]}')
+    return result, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode a raw Emotiv packet capture offline across a process pool.')
+    parser.add_argument('capture', type=str, help='Capture file (.emraw, .pcap, .pcapng, .npy or .npz)')
+    key_group = parser.add_mutually_exclusive_group(required=True)
+    key_group.add_argument('--serial', type=str, help='Dongle serial number the key is derived from')
+    key_group.add_argument('--key', type=str, help='AES key (16 characters or 32 hex digits)')
+    parser.add_argument('--output', '-o', type=str, default=None, help='Output .npz or .fif file')
+    parser.add_argument('--workers', '-j', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=65536, help='Packets per work item (default: 65536)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    crypto_key = parse_crypto_key(args.key) if args.key is not None else crypto_key_for_serial(args.serial)
+    _result, stats = bulk_decode_capture(args.capture, crypto_key=crypto_key, output_path=args.output, n_workers=args.workers, chunk_size=args.chunk_size)
+    print(stats)
+
+
+if __name__ == '__main__':
+    main()
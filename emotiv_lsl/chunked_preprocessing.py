@@ -0,0 +1,375 @@
+"""
+Out-of-core preprocessing of FIF recordings: re-referencing, band-pass/notch filtering and resampling in bounded memory.
+
+Each file is read `block_seconds` at a time (`preload=False`) and pushed through streaming stages that keep just enough history to give the same
+result as processing the whole file at once:
+    - causal filtering (`zero_phase=False`) carries the IIR state from block to block, which is exact;
+    - zero-phase filtering runs `sosfiltfilt` over each block plus `overlap_seconds` of real signal on both sides, which is then discarded, so the
+      only difference from a whole-file `sosfiltfilt` is the filter's response beyond the overlap;
+    - resampling (`resample_poly`) uses overlapping blocks aligned to the decimation factor, with more overlap than the anti-aliasing filter is long,
+      which is exact.
+Results are written block by block into a memory-mapped array, then streamed into the output FIF file through MNE's buffered writer, so peak memory is
+a few blocks whatever the recording length.
+
+Files and channel groups are processed in parallel by a process pool: each (file, channel group) job writes its own rows of the file's output array.
+An average reference needs every channel, so with `reference='average'` each job also reads the reference channels.
+
+Usage:
+    spec = PreprocessingSpec(l_freq=0.5, h_freq=40.0, notch_freqs=(50.0,), resample_sfreq=100.0, reference='average')
+    preprocess_fif_files(['session_raw.fif', ...], 'preprocessed/', spec, max_workers=8, channel_groups=2)
+
+    python -m emotiv_lsl.chunked_preprocessing recordings/*.fif -o preprocessed/ --l-freq 0.5 --h-freq 40 --notch 50 --resample 100 --reference average -j 8
+"""
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fractions import Fraction
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from attrs import define, field
+
+logger = logging.getLogger(__name__)
+
+PROCESSING_ARRAY_SUFFIX: str = '.processing.npy'
+
+
+@define(slots=False)
+class PreprocessingSpec:
+    """ what to do to each recording, applied in this order: reference, filters (band-pass, then notches), resampling """
+    l_freq: Optional[float] = field(default=None)
+    h_freq: Optional[float] = field(default=None)
+    notch_freqs: Tuple[float, ...] = field(default=(), converter=tuple)
+    notch_quality: float = field(default=30.0)
+    filter_order: int = field(default=4) ## Butterworth order (doubled in effect when `zero_phase`)
+    zero_phase: bool = field(default=True)
+    overlap_seconds: float = field(default=10.0) ## context on each side of a block for zero-phase filtering
+    resample_sfreq: Optional[float] = field(default=None)
+    reference: Optional[Union[str, List[str]]] = field(default=None) ## None, 'average', or the channel names whose mean is subtracted
+
+    def design_sos(self, sfreq: float) -> Optional[np.ndarray]:
+        """ second-order sections of the band-pass and notch filters, or None if there is nothing to filter """
+        from scipy.signal import butter, iirnotch, tf2sos
+        sections = []
+        if (self.l_freq is not None) and (self.h_freq is not None):
+            sections.append(butter(self.filter_order, [self.l_freq, self.h_freq], btype='bandpass', fs=sfreq, output='sos'))
+        elif self.l_freq is not None:
+            sections.append(butter(self.filter_order, self.l_freq, btype='highpass', fs=sfreq, output='sos'))
+        elif self.h_freq is not None:
+            sections.append(butter(self.filter_order, self.h_freq, btype='lowpass', fs=sfreq, output='sos'))
+        for a_freq in self.notch_freqs:
+            if a_freq < (sfreq / 2.0):
+                sections.append(tf2sos(*iirnotch(a_freq, self.notch_quality, fs=sfreq)))
+        return np.concatenate(sections, axis=0) if sections else None
+
+    def resample_ratio(self, sfreq: float) -> Optional[Tuple[int, int]]:
+        """ (up, down) of the resampling, or None if the rate is unchanged """
+        if (self.resample_sfreq is None) or np.isclose(self.resample_sfreq, sfreq):
+            return None
+        ratio = Fraction(self.resample_sfreq / sfreq).limit_denominator(1000)
+        return ratio.numerator, ratio.denominator
+
+    def describe(self) -> str:
+        parts = []
+        if self.reference is not None:
+            parts.append(f'reference {self.reference if isinstance(self.reference, str) else "+".join(self.reference)}')
+        if (self.l_freq is not None) or (self.h_freq is not None):
+            parts.append(f'{"zero-phase" if self.zero_phase else "causal"} Butterworth {self.l_freq}-{self.h_freq} Hz')
+        if self.notch_freqs:
+            parts.append('notch ' + ', '.join(f'{a_freq:g}' for a_freq in self.notch_freqs) + ' Hz')
+        if self.resample_sfreq is not None:
+            parts.append(f'resampled to {self.resample_sfreq:g} Hz')
+        return '; '.join(parts) or 'unchanged'
+
+
+class OverlapSaveStage:
+    """ Streaming stage that needs `pad` samples of context on both sides of what it outputs. Input arrives in arbitrary blocks; output is produced for
+    input ranges whose bounds are multiples of `align`, as soon as `pad` samples past them are available. `process(segment, left, core_length, is_last)`
+    gets the core range with up to `pad` samples of real context on either side (`left` of them before it) and returns the output for the core.
+    """
+
+    def __init__(self, pad: int, align: int, process: Callable[[np.ndarray, int, int, bool], np.ndarray]):
+        self.align = max(int(align), 1)
+        self.pad = -(-int(pad) // self.align) * self.align ## a multiple of `align`, so segment starts stay aligned
+        self.process = process
+        self._buffer: Optional[np.ndarray] = None
+        self._buffer_start = 0 ## absolute input index of `_buffer[0]`
+        self._emitted = 0 ## absolute input index up to which output has been produced
+        self._total = 0
+
+
+    def push(self, block: np.ndarray) -> np.ndarray:
+        self._buffer = block if self._buffer is None else np.concatenate([self._buffer, block], axis=0)
+        self._total += len(block)
+        ready = ((self._total - self.pad) // self.align) * self.align
+        if ready <= self._emitted:
+            return block[:0]
+        return self._run(ready, is_last=False)
+
+
+    def finish(self) -> np.ndarray:
+        if self._buffer is None:
+            return np.zeros((0, 0))
+        return self._run(self._total, is_last=True)
+
+
+    def _run(self, core_end: int, is_last: bool) -> np.ndarray:
+        segment_start = max(self._emitted - self.pad, 0)
+        segment_end = min(core_end + self.pad, self._total)
+        segment = self._buffer[segment_start - self._buffer_start:segment_end - self._buffer_start]
+        output = self.process(segment, self._emitted - segment_start, core_end - self._emitted, is_last)
+        self._emitted = core_end
+        keep_from = max(core_end - self.pad, 0)
+        self._buffer = self._buffer[keep_from - self._buffer_start:]
+        self._buffer_start = keep_from
+        return output
+
+
+def make_resampling_stage(up: int, down: int) -> OverlapSaveStage:
+    from scipy.signal import resample_poly
+    half_length = -(-10 * max(up, down) // up) + 1 ## `resample_poly`'s default filter reaches 10 * max(up, down) upsampled samples to each side
+
+    def _process(segment: np.ndarray, left: int, core_length: int, is_last: bool) -> np.ndarray:
+        if core_length == 0:
+            return segment[:0]
+        resampled = resample_poly(segment, up, down, axis=0)
+        first = (left * up) // down
+        n_out = -(-core_length * up // down) if is_last else (core_length * up) // down
+        return resampled[first:first + n_out]
+
+    return OverlapSaveStage(pad=half_length, align=down, process=_process)
+
+
+def make_zero_phase_stage(sos: np.ndarray, pad: int) -> OverlapSaveStage:
+    from scipy.signal import sosfiltfilt
+
+    def _process(segment: np.ndarray, left: int, core_length: int, is_last: bool) -> np.ndarray:
+        if core_length == 0:
+            return segment[:0]
+        return sosfiltfilt(sos, segment, axis=0)[left:left + core_length]
+
+    return OverlapSaveStage(pad=pad, align=1, process=_process)
+
+
+def output_length(n_times: int, sfreq: float, spec: PreprocessingSpec) -> int:
+    n_times, ratio = int(n_times), spec.resample_ratio(sfreq)
+    return n_times if ratio is None else -(-n_times * ratio[0] // ratio[1])
+
+
+def process_channel_group(path: Union[str, Path], output_array_path: Union[str, Path], spec: PreprocessingSpec, channel_names: Sequence[str], first_row: int,
+                          block_seconds: float = 60.0) -> int:
+    """ process-pool job: streams `channel_names` of one FIF file through the stages of `spec` and writes them to rows `first_row:` of the output array.
+    Returns the number of output samples written.
+    """
+    import mne
+    from scipy.signal import sosfilt, sosfilt_zi
+
+    raw = mne.io.read_raw_fif(path, preload=False, verbose=False)
+    sfreq = float(raw.info['sfreq'])
+    reference_names: List[str] = []
+    if spec.reference == 'average':
+        reference_names = [raw.ch_names[i] for i in mne.pick_types(raw.info, eeg=True)] or list(raw.ch_names)
+    elif spec.reference is not None:
+        reference_names = list(spec.reference)
+    read_names = list(channel_names) + [a_name for a_name in reference_names if a_name not in channel_names]
+    read_picks = [raw.ch_names.index(a_name) for a_name in read_names]
+    reference_columns = [read_names.index(a_name) for a_name in reference_names]
+    n_group = len(channel_names)
+
+    sos = spec.design_sos(sfreq)
+    filter_state = None
+    zero_phase_stage = make_zero_phase_stage(sos, int(spec.overlap_seconds * sfreq)) if (sos is not None and spec.zero_phase) else None
+    ratio = spec.resample_ratio(sfreq)
+    resampling_stage = make_resampling_stage(*ratio) if ratio is not None else None
+
+    output = np.load(output_array_path, mmap_mode='r+')
+    cursor = 0
+
+    def _write(block: np.ndarray):
+        nonlocal cursor
+        if len(block) == 0:
+            return
+        output[first_row:first_row + n_group, cursor:cursor + len(block)] = block.T
+        cursor += len(block)
+
+    def _resample_and_write(block: np.ndarray, is_last: bool = False):
+        if resampling_stage is None:
+            _write(block)
+            return
+        if len(block) > 0:
+            _write(resampling_stage.push(block))
+        if is_last:
+            _write(resampling_stage.finish())
+
+    block_samples = max(int(block_seconds * sfreq), 1)
+    for block_start in range(0, raw.n_times, block_samples):
+        block = raw.get_data(picks=read_picks, start=block_start, stop=min(block_start + block_samples, raw.n_times)).T
+        if reference_columns:
+            block = block - block[:, reference_columns].mean(axis=1, keepdims=True)
+        block = block[:, :n_group]
+        if zero_phase_stage is not None:
+            block = zero_phase_stage.push(block)
+        elif sos is not None:
+            if filter_state is None:
+                filter_state = sosfilt_zi(sos)[:, :, np.newaxis] * block[0][np.newaxis, np.newaxis, :] ## start in steady state, no onset transient
+            block, filter_state = sosfilt(sos, block, axis=0, zi=filter_state)
+        _resample_and_write(block)
+    tail = zero_phase_stage.finish() if zero_phase_stage is not None else np.zeros((0, n_group))
+    _resample_and_write(tail.reshape(-1, n_group), is_last=True)
+    output.flush()
+    del output
+    return cursor
+
+
+def _make_array_raw_class():
+    import mne
+
+    class _ArrayFileRaw(mne.io.BaseRaw):
+        """ Raw whose samples are read on demand from a (n_channels, n_times) `.npy` file, so `save` streams it to FIF block by block """
+
+        def __init__(self, info, array_path: Path, n_times: int):
+            super().__init__(info, preload=False, first_samps=(0,), last_samps=(n_times - 1,), filenames=(str(array_path),), raw_extras=({'array_path': str(array_path)},),
+                             orig_format='single', verbose=False)
+
+        def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+            block = np.load(self._raw_extras[fi]['array_path'], mmap_mode='r')[:, start:stop]
+            if mult is not None:
+                data[:] = mult @ block[idx]
+            else:
+                data[:] = block[idx]
+                data *= cals
+
+    return _ArrayFileRaw
+
+
+def output_fif_path(path: Union[str, Path], output_directory: Union[str, Path]) -> Path:
+    """ 'session_raw.fif' -> '<output_directory>/session_proc_raw.fif' """
+    name = Path(path).name
+    name = name[:-len('_raw.fif')] if name.endswith('_raw.fif') else Path(name).stem
+    return Path(output_directory).joinpath(f'{name}_proc_raw.fif')
+
+
+def finalize_fif(path: Union[str, Path], array_path: Union[str, Path], output_path: Union[str, Path], spec: PreprocessingSpec, channel_names: List[str],
+                 block_seconds: float = 60.0, keep_array: bool = False) -> Path:
+    """ streams the processed array into `output_path` with the input's channel types, measurement date, annotations and description """
+    import mne
+    raw = mne.io.read_raw_fif(path, preload=False, verbose=False)
+    sfreq = float(raw.info['sfreq'])
+    out_sfreq = spec.resample_sfreq if spec.resample_ratio(sfreq) is not None else sfreq
+    picks = [raw.ch_names.index(a_name) for a_name in channel_names]
+    info = mne.create_info(ch_names=channel_names, sfreq=out_sfreq, ch_types=[raw.get_channel_types()[i] for i in picks])
+    n_out = np.load(array_path, mmap_mode='r').shape[1]
+    processed = _make_array_raw_class()(info, Path(array_path), n_out)
+    if raw.info['meas_date'] is not None:
+        processed.set_meas_date(raw.info['meas_date'])
+    if len(raw.annotations) > 0:
+        processed.set_annotations(mne.Annotations(raw.annotations.onset, raw.annotations.duration, raw.annotations.description, orig_time=processed.info['meas_date']))
+    processed.info['description'] = f"{raw.info.get('description') or ''}; preprocessed: {spec.describe()}".lstrip('; ')
+    processed.save(output_path, overwrite=True, buffer_size_sec=block_seconds, verbose=False)
+    if not keep_array:
+        os.remove(array_path)
+    return Path(output_path)
+
+
+def split_channel_groups(channel_names: List[str], n_groups: int) -> List[List[str]]:
+    n_groups = max(min(n_groups, len(channel_names)), 1)
+    return [list(a_group) for a_group in np.array_split(np.array(channel_names, dtype=object), n_groups) if len(a_group) > 0]
+
+
+def preprocess_fif_files(paths: Sequence[Union[str, Path]], output_directory: Union[str, Path], spec: PreprocessingSpec, max_workers: Optional[int] = None,
+                         channel_groups: int = 1, block_seconds: float = 60.0, picks: Optional[List[str]] = None) -> Dict[str, Path]:
+    """ preprocesses FIF files into `<output_directory>/<name>_proc_raw.fif`, splitting each file's channels into `channel_groups` jobs, `max_workers` jobs
+    at a time (default: CPU count). Each file is finalized as soon as its last group finishes. Returns input path -> output path for the files that succeeded.
+    """
+    import mne
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    start_time = time.perf_counter()
+    plans = {}
+    jobs = []
+    for a_path in paths:
+        a_path = str(Path(a_path).resolve())
+        raw = mne.io.read_raw_fif(a_path, preload=False, verbose=False)
+        channel_names = list(picks) if picks is not None else list(raw.ch_names)
+        n_out = output_length(raw.n_times, float(raw.info['sfreq']), spec)
+        output_path = output_fif_path(a_path, output_directory)
+        array_path = output_path.with_name(output_path.name + PROCESSING_ARRAY_SUFFIX)
+        np.lib.format.open_memmap(array_path, mode='w+', dtype=np.float32, shape=(len(channel_names), n_out)).flush()
+        groups = split_channel_groups(channel_names, channel_groups)
+        plans[a_path] = {'channel_names': channel_names, 'array_path': array_path, 'output_path': output_path, 'n_out': n_out, 'remaining': len(groups), 'failed': False}
+        first_row = 0
+        for a_group in groups:
+            jobs.append((a_path, str(array_path), spec, a_group, first_row, block_seconds))
+            first_row += len(a_group)
+
+    results: Dict[str, Path] = {}
+
+    def _job_done(a_path: str, n_written: Optional[int]):
+        plan = plans[a_path]
+        if (n_written is None) or (n_written != plan['n_out']):
+            if n_written is not None:
+                logger.error(f'{a_path}: wrote {n_written} samples, expected {plan["n_out"]}')
+            plan['failed'] = True
+        plan['remaining'] -= 1
+        if plan['remaining'] > 0:
+            return
+        if plan['failed']:
+            os.remove(plan['array_path'])
+            return
+        results[a_path] = finalize_fif(a_path, plan['array_path'], plan['output_path'], spec, plan['channel_names'], block_seconds=block_seconds)
+        logger.info(f'preprocessed {a_path} -> {plan["output_path"]}')
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if (max_workers == 1) or (len(jobs) <= 1):
+        for a_job in jobs:
+            try:
+                n_written = process_channel_group(*a_job)
+            except Exception as e:
+                logger.error(f'failed to preprocess {a_job[0]} ({a_job[3]}): {e}')
+                n_written = None
+            _job_done(a_job[0], n_written)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(process_channel_group, *a_job): a_job for a_job in jobs}
+            for a_future in as_completed(futures):
+                a_job = futures[a_future]
+                try:
+                    n_written = a_future.result()
+                except Exception as e:
+                    logger.error(f'failed to preprocess {a_job[0]} ({a_job[3]}): {e}')
+                    n_written = None
+                _job_done(a_job[0], n_written)
+    logger.info(f'preprocessed {len(results)}/{len(plans)} files in {time.perf_counter() - start_time:.1f} s')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Filter, re-reference and resample FIF recordings out of core, in parallel.')
+    parser.add_argument('inputs', nargs='+', help='FIF files')
+    parser.add_argument('--output', '-o', type=str, required=True, help='Output directory')
+    parser.add_argument('--l-freq', type=float, default=None)
+    parser.add_argument('--h-freq', type=float, default=None)
+    parser.add_argument('--notch', type=float, nargs='*', default=[], help='Notch frequencies, e.g. 50 100')
+    parser.add_argument('--resample', type=float, default=None, help='Output sampling rate')
+    parser.add_argument('--reference', type=str, nargs='*', default=None, help="'average' or channel names")
+    parser.add_argument('--causal', action='store_true', help='Causal (single-pass) filtering instead of zero-phase')
+    parser.add_argument('--block-seconds', type=float, default=60.0)
+    parser.add_argument('--workers', '-j', type=int, default=None)
+    parser.add_argument('--channel-groups', type=int, default=1, help='Split each file into this many channel groups processed in parallel')
+    args = parser.parse_args()
+
+    reference = None
+    if args.reference:
+        reference = 'average' if args.reference == ['average'] else args.reference
+    spec = PreprocessingSpec(l_freq=args.l_freq, h_freq=args.h_freq, notch_freqs=tuple(args.notch), resample_sfreq=args.resample, reference=reference, zero_phase=not args.causal)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    results = preprocess_fif_files(args.inputs, args.output, spec, max_workers=args.workers, channel_groups=args.channel_groups, block_seconds=args.block_seconds)
+    for an_input, an_output in results.items():
+        print(f'{an_input} -> {an_output}')
+
+
+if __name__ == '__main__':
+    main()
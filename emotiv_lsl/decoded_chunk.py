@@ -0,0 +1,101 @@
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+from attrs import define, field, Factory
+
+
+EEG_CHANNEL_NAMES: List[str] = ['AF3', 'F7', 'F3', 'FC5', 'T7', 'P7', 'O1', 'O2', 'P8', 'T8', 'FC6', 'F4', 'F8', 'AF4']
+MOTION_CHANNEL_NAMES: List[str] = ['AccX', 'AccY', 'AccZ', 'GyroX', 'GyroY', 'GyroZ']
+MARKER_EVENT_CHANNEL_NAME: str = 'MARKER' ## label of the 'stim' channel `EmotivBase.enable_marker_event_channel` appends to the EEG stream
+
+
+def _empty(shape, dtype):
+    return Factory(lambda: np.zeros(shape, dtype=dtype))
+
+
+@define(slots=False)
+class DecodedChunk:
+    """ Decoded EEG, motion and electrode-quality samples from a run of consecutive packets, as NumPy arrays.
+
+    Rows are in packet order. `*_packet_index` is the position of each sample's packet in the source (capture file or live packet count), `*_counter` is the device's own packet counter byte
+    (empty when the decoding model does not expose one).
+    """
+    eeg: np.ndarray = field(default=_empty((0, 14), np.float32))
+    eeg_timestamps: np.ndarray = field(default=_empty((0,), np.float64))
+    eeg_counter: np.ndarray = field(default=_empty((0,), np.uint8))
+    eeg_packet_index: np.ndarray = field(default=_empty((0,), np.int64))
+    quality: np.ndarray = field(default=_empty((0, 14), np.uint8))
+
+    motion: np.ndarray = field(default=_empty((0, 6), np.float32))
+    motion_timestamps: np.ndarray = field(default=_empty((0,), np.float64))
+    motion_counter: np.ndarray = field(default=_empty((0,), np.uint8))
+    motion_packet_index: np.ndarray = field(default=_empty((0,), np.int64))
+
+    n_packets: int = field(default=0)
+
+    @property
+    def n_eeg(self) -> int:
+        return len(self.eeg)
+
+    @property
+    def n_motion(self) -> int:
+        return len(self.motion)
+
+    @property
+    def is_empty(self) -> bool:
+        return (self.n_eeg == 0) and (self.n_motion == 0)
+
+
+    def offset_packet_index(self, offset: int) -> "DecodedChunk":
+        """ shifts the packet indices in place, used when a chunk was decoded from a slice of a longer capture """
+        self.eeg_packet_index += offset
+        self.motion_packet_index += offset
+        return self
+
+
+    @classmethod
+    def concatenate(cls, chunks: List["DecodedChunk"]) -> "DecodedChunk":
+        """ joins chunks in the given order """
+        if len(chunks) == 0:
+            return cls()
+        kwargs = {a_name: np.concatenate([getattr(a_chunk, a_name) for a_chunk in chunks]) for a_name in ('eeg', 'eeg_timestamps', 'eeg_counter', 'eeg_packet_index', 'quality',
+                                                                                                        'motion', 'motion_timestamps', 'motion_counter', 'motion_packet_index')}
+        return cls(n_packets=sum(a_chunk.n_packets for a_chunk in chunks), **kwargs)
+
+
+    def to_npz(self, path: Union[str, Path]) -> Path:
+        path = Path(path)
+        np.savez(path, eeg=self.eeg, eeg_timestamps=self.eeg_timestamps, eeg_counter=self.eeg_counter, eeg_packet_index=self.eeg_packet_index, quality=self.quality,
+                 motion=self.motion, motion_timestamps=self.motion_timestamps, motion_counter=self.motion_counter, motion_packet_index=self.motion_packet_index,
+                 eeg_channel_names=np.array(EEG_CHANNEL_NAMES), motion_channel_names=np.array(MOTION_CHANNEL_NAMES), n_packets=self.n_packets)
+        return path
+
+
+    @classmethod
+    def from_npz(cls, path: Union[str, Path]) -> "DecodedChunk":
+        with np.load(path) as npz:
+            kwargs = {a_name: npz[a_name] for a_name in ('eeg', 'eeg_timestamps', 'eeg_counter', 'eeg_packet_index', 'quality',
+                                                           'motion', 'motion_timestamps', 'motion_counter', 'motion_packet_index')}
+            return cls(n_packets=int(npz['n_packets']), **kwargs)
+
+
+    def to_fif(self, path: Union[str, Path], eeg_sfreq: float, motion_sfreq: Optional[float] = None, overwrite: bool = True) -> List[Path]:
+        """ writes EEG (plus the quality values as `misc` channels) to `path`, and motion to a sibling `*_motion_raw.fif` if there is any """
+        import mne
+
+        path = Path(path)
+        written = []
+        if self.n_eeg > 0:
+            ch_names = EEG_CHANNEL_NAMES + [f'q{a_name}' for a_name in EEG_CHANNEL_NAMES]
+            info = mne.create_info(ch_names=ch_names, sfreq=eeg_sfreq, ch_types=(['eeg'] * 14) + (['misc'] * 14))
+            data = np.concatenate([self.eeg.T, self.quality.T], axis=0).astype(np.float64)
+            mne.io.RawArray(data, info, verbose=False).save(path, overwrite=overwrite, verbose=False)
+            written.append(path)
+
+        if (self.n_motion > 0) and (motion_sfreq is not None):
+            motion_path = path.with_name(path.name.replace('_raw.fif', '').replace('.fif', '') + '_motion_raw.fif')
+            info = mne.create_info(ch_names=MOTION_CHANNEL_NAMES, sfreq=motion_sfreq, ch_types='misc')
+            mne.io.RawArray(self.motion.T.astype(np.float64), info, verbose=False).save(motion_path, overwrite=overwrite, verbose=False)
+            written.append(motion_path)
+        return written
@@ -0,0 +1,317 @@
+"""
+Constant-memory streaming EDF+/BDF+ writer.
+
+`StreamingEdfWriter` writes the header up front with the data-record count set to -1 ("unknown"), appends one fixed-duration data record each time
+`record_duration` seconds of samples have been staged, and patches the record count on close. Only the current record is held in memory,
+whatever the session length. EDF stores 16-bit samples, BDF 24-bit; both are written as continuous EDF+C/BDF+C files with the required
+"EDF Annotations" signal, which EDFbrowser, MNE and clinical viewers open directly.
+
+`EdfRecorderSink` is a `SampleSink` that writes one file per published stream, e.g. `session_Epoc_X.edf`, `session_Epoc_X_Motion.edf`.
+
+Usage:
+    sink = EdfRecorderSink('session.bdf')
+    emotiv.add_sample_sink(sink)
+    ...
+    emotiv.remove_sample_sink(sink)
+    sink.close()
+"""
+import logging
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pylsl
+from pylsl import StreamInfo
+from attrs import define, field
+
+from emotiv_lsl.sample_sink import SampleSink
+from emotiv_lsl.hdf5_store import get_stream_channel_labels
+from emotiv_lsl.decoded_chunk import MARKER_EVENT_CHANNEL_NAME
+
+logger = logging.getLogger(__name__)
+
+EDF_EXTENSION: str = '.edf'
+BDF_EXTENSION: str = '.bdf'
+
+_EDF_DIGITAL_RANGE = (-32768, 32767)
+_BDF_DIGITAL_RANGE = (-8388608, 8388607)
+_ANNOTATION_BYTES_PER_RECORD: int = 96
+_NUM_RECORDS_OFFSET: int = 236 ## byte offset of the 8-character "number of data records" header field
+_MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
+## physical ranges of the decoded Epoc X channels, from the conversions in `EmotivEpocX.decode_data`/`decode_motion_data` over all byte values.
+## At 16 bits the EEG range gives ~0.128 uV per digital step, the device's own resolution.
+EEG_PHYSICAL_RANGE: Tuple[float, float] = (0.0, 8402.0)
+ACCELEROMETER_PHYSICAL_RANGE: Tuple[float, float] = (-0.001, 1.012)
+GYROSCOPE_PHYSICAL_RANGE: Tuple[float, float] = (-0.005, 126.6)
+QUALITY_PHYSICAL_RANGE: Tuple[float, float] = (0.0, 15.0)
+## marker sequence numbers of the EEG stream's event channel; in EDF one digital step is exactly one
+MARKER_PHYSICAL_RANGE: Tuple[float, float] = (0.0, 65535.0)
+DEFAULT_PHYSICAL_RANGE: Tuple[float, float] = (-1.0e6, 1.0e6)
+
+
+@define(slots=False)
+class EdfSignal:
+    """ one EDF signal (channel) header """
+    label: str = field()
+    physical_dimension: str = field(default='')
+    physical_min: float = field(default=DEFAULT_PHYSICAL_RANGE[0])
+    physical_max: float = field(default=DEFAULT_PHYSICAL_RANGE[1])
+    transducer: str = field(default='')
+    prefilter: str = field(default='')
+
+
+def emotiv_edf_signals(stream_name: str, channel_labels: Sequence[str], stream_type: str = '') -> List[EdfSignal]:
+    """ EDF signal headers for an Emotiv stream; unknown streams get the wide `DEFAULT_PHYSICAL_RANGE` """
+    signals = []
+    for a_label in channel_labels:
+        if a_label.startswith('Acc'):
+            signals.append(EdfSignal(a_label, 'g', *ACCELEROMETER_PHYSICAL_RANGE, transducer='ICM-20948 accelerometer'))
+        elif a_label.startswith('Gyro'):
+            signals.append(EdfSignal(a_label, 'deg/s', *GYROSCOPE_PHYSICAL_RANGE, transducer='ICM-20948 gyroscope'))
+        elif a_label == MARKER_EVENT_CHANNEL_NAME:
+            signals.append(EdfSignal(a_label, '', *MARKER_PHYSICAL_RANGE, transducer='marker sequence number'))
+        elif ('quality' in stream_name.lower()) or a_label.startswith('q'):
+            signals.append(EdfSignal(a_label, '', *QUALITY_PHYSICAL_RANGE))
+        elif stream_type.upper() == 'EEG':
+            signals.append(EdfSignal(a_label, 'uV', *EEG_PHYSICAL_RANGE, transducer='Emotiv saline electrode'))
+        else:
+            signals.append(EdfSignal(a_label, '', *DEFAULT_PHYSICAL_RANGE))
+    return signals
+
+
+def _field(value, width: int) -> bytes:
+    """ left-justified, space-padded ASCII header field; numbers are shortened to fit """
+    if isinstance(value, float):
+        text = f'{value:.{width}g}'
+        precision = width
+        while len(text) > width and precision > 1:
+            precision -= 1
+            text = f'{value:.{precision}g}'
+        value = text
+    encoded = str(value).encode('ascii', errors='replace')[:width]
+    return encoded.ljust(width, b' ')
+
+
+@define(slots=False)
+class StreamingEdfWriter:
+    """ Appends fixed-duration data records to an EDF+ (16-bit) or BDF+ (24-bit) file as samples arrive.
+
+    `sample_rate * record_duration` must be a whole number of samples. Values outside a signal's physical range are clipped.
+    If the last record is incomplete when the file is closed, it is padded by repeating the last sample and an annotation marks where the padding starts.
+    """
+    path: Path = field(converter=Path)
+    signals: List[EdfSignal] = field()
+    sample_rate: float = field()
+    record_duration: float = field(default=1.0)
+    file_format: Optional[str] = field(default=None) ## 'edf' or 'bdf', taken from the file suffix if None
+    start_datetime: Optional[datetime] = field(default=None)
+    first_timestamp: Optional[float] = field(default=None) ## LSL timestamp of the first sample, stored as an annotation in the first record
+    patient_id: str = field(default='X X X X')
+    equipment: str = field(default='emotiv_lsl')
+
+    n_records: int = field(default=0, init=False)
+    n_samples: int = field(default=0, init=False)
+    samples_per_record: int = field(init=False)
+    _file: Optional[object] = field(default=None, init=False)
+    _record: np.ndarray = field(default=None, init=False)
+    _n_staged: int = field(default=0, init=False)
+    _bytes_per_sample: int = field(default=2, init=False)
+    _digital_range: Tuple[int, int] = field(default=_EDF_DIGITAL_RANGE, init=False)
+    _scale: np.ndarray = field(default=None, init=False)
+    _offset: np.ndarray = field(default=None, init=False)
+
+
+    def __attrs_post_init__(self):
+        if self.file_format is None:
+            self.file_format = 'bdf' if self.path.suffix.lower() == BDF_EXTENSION else 'edf'
+        if self.file_format not in ('edf', 'bdf'):
+            raise ValueError(f"file_format must be 'edf' or 'bdf', got {self.file_format!r}")
+        self.samples_per_record = int(round(self.sample_rate * self.record_duration))
+        if abs(self.samples_per_record - self.sample_rate * self.record_duration) > 1e-6:
+            raise ValueError(f'sample_rate * record_duration must be a whole number of samples, got {self.sample_rate} * {self.record_duration}')
+        if self.file_format == 'bdf':
+            self._bytes_per_sample, self._digital_range = 3, _BDF_DIGITAL_RANGE
+        if self.start_datetime is None:
+            self.start_datetime = datetime.now(timezone.utc)
+
+        physical_min = np.array([a_signal.physical_min for a_signal in self.signals], dtype=np.float64)
+        physical_max = np.array([a_signal.physical_max for a_signal in self.signals], dtype=np.float64)
+        digital_min, digital_max = self._digital_range
+        self._scale = (digital_max - digital_min) / (physical_max - physical_min)
+        self._offset = digital_min - physical_min * self._scale
+        self._record = np.zeros((self.samples_per_record, len(self.signals)), dtype=np.float64)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'wb', buffering=1 << 20)
+        self._file.write(self._build_header())
+
+
+    @property
+    def n_annotation_samples(self) -> int:
+        return _ANNOTATION_BYTES_PER_RECORD // self._bytes_per_sample
+
+
+    def _build_header(self) -> bytes:
+        start = self.start_datetime.astimezone()
+        n_signals = len(self.signals) + 1 ## + "EDF Annotations"
+        digital_min, digital_max = self._digital_range
+        version = b'\xffBIOSEMI' if self.file_format == 'bdf' else _field('0', 8)
+        recording_id = f'Startdate {start.day:02d}-{_MONTHS[start.month - 1]}-{start.year} X X {self.equipment.replace(" ", "_")}'
+        header = [version, _field(self.patient_id, 80), _field(recording_id, 80), _field(start.strftime('%d.%m.%y'), 8), _field(start.strftime('%H.%M.%S'), 8),
+                  _field(256 * (n_signals + 1), 8), _field('BDF+C' if self.file_format == 'bdf' else 'EDF+C', 44), _field(-1, 8),
+                  _field(float(self.record_duration), 8), _field(n_signals, 4)]
+        annotation = EdfSignal('EDF Annotations', '', -1.0, 1.0)
+        signals = self.signals + [annotation]
+        header += [_field(a_signal.label, 16) for a_signal in signals]
+        header += [_field(a_signal.transducer, 80) for a_signal in signals]
+        header += [_field(a_signal.physical_dimension, 8) for a_signal in signals]
+        header += [_field(float(a_signal.physical_min), 8) for a_signal in signals]
+        header += [_field(float(a_signal.physical_max), 8) for a_signal in signals]
+        header += [_field(digital_min, 8) for _ in signals]
+        header += [_field(digital_max, 8) for _ in signals]
+        header += [_field(a_signal.prefilter, 80) for a_signal in signals]
+        header += [_field(self.samples_per_record, 8) for _ in self.signals] + [_field(self.n_annotation_samples, 8)]
+        header += [_field('', 32) for _ in signals]
+        return b''.join(header)
+
+
+    def _annotation_block(self, extra: Sequence[Tuple[float, str]] = ()) -> bytes:
+        """ time-keeping TAL of the current record plus optional (onset, text) annotations, zero-padded to the annotation signal size """
+        onset = self.n_records * self.record_duration
+        tal = f'+{onset:g}\x14\x14\x00'.encode('ascii')
+        if (self.n_records == 0) and (self.first_timestamp is not None):
+            tal += f'+0\x14LSL first timestamp {self.first_timestamp!r}\x14\x00'.encode('ascii')
+        for an_onset, a_text in extra:
+            tal += f'+{an_onset:g}\x14{a_text}\x14\x00'.encode('ascii', errors='replace')
+        return tal[:_ANNOTATION_BYTES_PER_RECORD].ljust(_ANNOTATION_BYTES_PER_RECORD, b'\x00')
+
+
+    def _write_record(self, extra_annotations: Sequence[Tuple[float, str]] = ()):
+        digital_min, digital_max = self._digital_range
+        digital = np.clip(np.rint(self._record * self._scale + self._offset), digital_min, digital_max).astype('<i4').T ## (n_signals, samples_per_record): signal-major, as EDF stores it
+        if self._bytes_per_sample == 2:
+            data = digital.astype('<i2').tobytes()
+        else:
+            data = np.ascontiguousarray(digital).view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+        self._file.write(data + self._annotation_block(extra_annotations))
+        self.n_records += 1
+        self._n_staged = 0
+
+
+    def write_samples(self, samples: np.ndarray):
+        """ appends an (n, n_signals) block of physical values """
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, len(self.signals))
+        i = 0
+        while i < len(samples):
+            n = min(len(samples) - i, self.samples_per_record - self._n_staged)
+            self._record[self._n_staged:self._n_staged + n] = samples[i:i + n]
+            self._n_staged += n
+            i += n
+            if self._n_staged == self.samples_per_record:
+                self._write_record()
+        self.n_samples += len(samples)
+
+
+    def write_sample(self, sample: Sequence[float]):
+        """ appends one sample; cheaper than `write_samples` for a single row """
+        self._record[self._n_staged] = sample
+        self._n_staged += 1
+        self.n_samples += 1
+        if self._n_staged == self.samples_per_record:
+            self._write_record()
+
+
+    def close(self) -> Path:
+        """ pads and writes the partial last record, then patches the data-record count in the header """
+        if self._file is None:
+            return self.path
+        if self._n_staged > 0:
+            padding_onset = self.n_records * self.record_duration + self._n_staged / self.sample_rate
+            self._record[self._n_staged:] = self._record[self._n_staged - 1]
+            self._write_record(extra_annotations=[(padding_onset, 'padding')])
+        self._file.seek(_NUM_RECORDS_OFFSET)
+        self._file.write(_field(self.n_records, 8))
+        self._file.close()
+        self._file = None
+        return self.path
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+@define(slots=False)
+class EdfRecorderSink(SampleSink):
+    """ Records each stream published by an `EmotivBase` delegate to its own streaming EDF+/BDF+ file, `<path stem>_<stream name><path suffix>`.
+
+    The file is created when the stream's first sample arrives, so its start date and first-timestamp annotation are those of that sample.
+    """
+    path: Path = field(converter=Path)
+    record_duration: float = field(default=1.0)
+
+    is_open: bool = field(default=False, init=False)
+    _infos: Dict[str, StreamInfo] = field(factory=dict, init=False)
+    _writers: Dict[str, StreamingEdfWriter] = field(factory=dict, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+
+
+    def __attrs_post_init__(self):
+        self.is_open = True
+
+
+    @property
+    def stream_names(self) -> List[str]:
+        return list(self._infos.keys())
+
+
+    def get_stream_path(self, stream_name: str) -> Path:
+        return self.path.with_name(f"{self.path.stem}_{stream_name.replace(' ', '_')}{self.path.suffix or EDF_EXTENSION}")
+
+
+    def on_stream_started(self, stream_name: str, info: StreamInfo):
+        with self._lock:
+            if info.channel_format() == pylsl.cf_string:
+                logger.warning(f'stream {stream_name!r} has string samples, which EDF cannot store')
+                return
+            self._infos.setdefault(stream_name, info)
+
+
+    def _open_writer(self, stream_name: str, timestamp: float) -> StreamingEdfWriter:
+        info = self._infos[stream_name]
+        start = datetime.fromtimestamp(datetime.now(timezone.utc).timestamp() - pylsl.local_clock() + timestamp, tz=timezone.utc)
+        writer = StreamingEdfWriter(path=self.get_stream_path(stream_name), signals=emotiv_edf_signals(stream_name, get_stream_channel_labels(info), info.type()),
+                                    sample_rate=info.nominal_srate(), record_duration=self.record_duration, start_datetime=start, first_timestamp=timestamp)
+        self._writers[stream_name] = writer
+        logger.info(f'writing stream {stream_name!r} to {writer.path}')
+        return writer
+
+
+    def on_sample(self, stream_name: str, sample: Sequence[float], timestamp: float):
+        with self._lock:
+            if not self.is_open:
+                return
+            writer = self._writers.get(stream_name)
+            if writer is None:
+                if stream_name not in self._infos:
+                    return
+                writer = self._open_writer(stream_name, timestamp)
+            writer.write_sample(sample)
+
+
+    def close(self) -> List[Path]:
+        with self._lock:
+            self.is_open = False
+            paths = [a_writer.close() for a_writer in self._writers.values()]
+        return paths
+
+
+    def get_status(self) -> Dict:
+        return {'recording': self.is_open, 'filename': str(self.path), 'streams': self.stream_names,
+                'files': {a_name: str(a_writer.path) for a_name, a_writer in self._writers.items()},
+                'sample_counts': {a_name: a_writer.n_samples for a_name, a_writer in self._writers.items()}}
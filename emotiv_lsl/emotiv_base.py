@@ -1,7 +1,11 @@
-from typing import Dict, List, Tuple, Optional, Callable, Union, Any
+from typing import Dict, List, Tuple, Optional, Callable, Union, Any, Iterator, AsyncIterator
 from datetime import datetime, timedelta
 # import hid
+import asyncio
+import bisect
+import collections
 import logging
+import threading
 from Crypto.Cipher import AES
 import numpy as np
 import pylsl
@@ -9,6 +13,12 @@ from pylsl import StreamInfo, StreamOutlet
 from attrs import define, field, Factory
 from phopylslhelper.easy_time_sync import EasyTimeSyncParsingMixin, readable_dt_str, from_readable_dt_str
 
+from emotiv_lsl.decoded_chunk import DecodedChunk, MARKER_EVENT_CHANNEL_NAME
+from emotiv_lsl.marker_server import DEFAULT_MARKER_SOCKET_PATH, DEFAULT_MARKER_PORT, summarize_latencies
+from emotiv_lsl.raw_capture import PACKET_STATUS_NAMES, PACKET_STATUS_UNKNOWN, PACKET_STATUS_EEG, PACKET_STATUS_MOTION, PACKET_STATUS_INVALID_LENGTH, PACKET_STATUS_DECODE_FAILED, PACKET_STATUS_UNKNOWN_CHANNEL_COUNT
+
+HID_READ_TIMEOUT_MS: int = 100 ## `iter_raw_packets` checks its stop event at least this often while the headset sends nothing
+
 
 @define(slots=False)
 class EmotivBase(EasyTimeSyncParsingMixin):
@@ -24,6 +34,26 @@ class EmotivBase(EasyTimeSyncParsingMixin):
     is_reverse_engineer_mode: bool = field(default=False)
     enable_electrode_quality_stream: bool = field(default=False)
     enable_motion_data: bool = field(default=False)
+    enable_block_cache: bool = field(default=False)
+    block_cache_size: int = field(default=1024)
+    enable_flight_recorder: bool = field(default=False)
+    flight_recorder: Any = field(default=None) ## `PacketFlightRecorder`, created by `main_loop` when `enable_flight_recorder` is set
+    enable_shared_memory_ring: bool = field(default=False)
+    shared_memory_ring: Any = field(default=None) ## `SharedMemoryRingPublisher`, created, attached and (on exit) closed by `main_loop` when `enable_shared_memory_ring` is set; one passed in is closed by its owner
+    enable_marker_server: bool = field(default=False)
+    marker_server_path: Optional[str] = field(default=DEFAULT_MARKER_SOCKET_PATH) ## Unix domain socket of the marker server, None for TCP on `marker_server_port`
+    marker_server_port: int = field(default=DEFAULT_MARKER_PORT)
+    marker_server: Any = field(default=None) ## `MarkerServer`, created and started by `main_loop` when `enable_marker_server` is set
+    enable_marker_event_channel: bool = field(default=False) ## adds a MARKER channel to the EEG stream holding the sequence number of each injected marker
+    last_packet_counter: Optional[int] = field(default=None) ## device counter byte of the last decoded packet, if the model exposes one
+    _sample_sinks: Tuple = field(default=(), init=False) ## `SampleSink`s, replaced (never mutated) so `main_loop` can iterate without locking
+    _active_stream_infos: Dict[str, StreamInfo] = field(factory=dict, init=False) ## stream name -> info of each outlet `main_loop` has created
+    _sink_lock: threading.Lock = field(factory=threading.Lock, init=False)
+    _chunk_stop_events: List[threading.Event] = field(factory=list, init=False) ## one per running `iter_chunks`, set by `stop_chunks`
+    _pending_markers: collections.deque = field(factory=collections.deque, init=False) ## (seq, label, timestamp, injected at) injected but not yet published by `main_loop`
+    _marker_lock: threading.Lock = field(factory=threading.Lock, init=False)
+    _marker_count: int = field(default=0, init=False)
+    _marker_publish_delays: collections.deque = field(factory=lambda: collections.deque(maxlen=1000), init=False) ## seconds from injection to publishing, recent markers
 
     # def __attrs_post_init__(self):
     #     self.cipher = Cipher(self.serial_number)
@@ -56,6 +86,84 @@ class EmotivBase(EasyTimeSyncParsingMixin):
         self.init_EasyTimeSyncParsingMixin()
         
 
+    def wrap_cipher_with_block_cache(self):
+        """ puts a `CachedBlockCipher` in front of `self.cipher` if `self.enable_block_cache` is set. Called by subclasses once the cipher exists. """
+        from emotiv_lsl.block_cache import CachedBlockCipher
+        if self.enable_block_cache and (self.cipher is not None) and (not isinstance(self.cipher, CachedBlockCipher)):
+            self.cipher = CachedBlockCipher(cipher=self.cipher, max_entries=self.block_cache_size)
+
+
+    def get_block_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """ hit/miss counters of the block cache, or None if it is disabled """
+        get_stats = getattr(self.cipher, 'get_stats', None)
+        return get_stats() if get_stats is not None else None
+
+
+    def add_sample_sink(self, sink):
+        """ attaches a `SampleSink` to the publishing path. Streams that are already running are replayed to `sink.on_stream_started` first. Safe to call while `main_loop` runs. """
+        with self._sink_lock:
+            for stream_name, info in self._active_stream_infos.items():
+                sink.on_stream_started(stream_name, info)
+            self._sample_sinks = self._sample_sinks + (sink,)
+
+
+    def remove_sample_sink(self, sink) -> bool:
+        with self._sink_lock:
+            if sink not in self._sample_sinks:
+                return False
+            self._sample_sinks = tuple(a_sink for a_sink in self._sample_sinks if a_sink is not sink)
+            return True
+
+
+    def _detach_failed_sink(self, sink, error: Exception):
+        logging.getLogger(f'emotiv.{self.device_name.replace(" ", "_").lower()}').error(f'sample sink {type(sink).__name__} raised {error!r}, detaching it')
+        self.remove_sample_sink(sink)
+
+
+    def register_outlet(self, outlet: StreamOutlet) -> str:
+        """ records a newly created outlet's info and announces it to the attached sinks. Returns the stream name used by `push_sample`. """
+        info = outlet.get_info()
+        stream_name = info.name()
+        with self._sink_lock:
+            self._active_stream_infos[stream_name] = info
+            sinks = self._sample_sinks
+        for a_sink in sinks:
+            try:
+                a_sink.on_stream_started(stream_name, info)
+            except Exception as e:
+                self._detach_failed_sink(a_sink, e)
+        return stream_name
+
+
+    def push_sample(self, outlet: StreamOutlet, stream_name: str, sample, timestamp: float):
+        """ pushes `sample` to its outlet with an explicit timestamp and hands the same (sample, timestamp) to every attached sink """
+        outlet.push_sample(sample, timestamp)
+        for a_sink in self._sample_sinks:
+            try:
+                a_sink.on_sample(stream_name, sample, timestamp)
+            except Exception as e:
+                self._detach_failed_sink(a_sink, e)
+
+
+    def inject_marker(self, label: str, timestamp: Optional[float] = None) -> Tuple[int, float]:
+        """ Queues an event marker for the markers stream, stamped with `pylsl.local_clock()` now (the clock every packet is stamped with) unless `timestamp` is given.
+        `main_loop` publishes it before its next packet. Thread-safe. Returns the marker's sequence number (1-based) and timestamp.
+        """
+        injected_at = pylsl.local_clock()
+        if timestamp is None:
+            timestamp = injected_at
+        with self._marker_lock:
+            self._marker_count += 1
+            seq = self._marker_count
+            self._pending_markers.append((seq, label, timestamp, injected_at))
+        return seq, timestamp
+
+
+    def get_marker_stats(self) -> Dict[str, Any]:
+        """ markers injected so far, markers waiting for `main_loop`, and the delay from `inject_marker` to publishing of the recent ones (whatever their timestamp) """
+        return {'n_injected': self._marker_count, 'n_pending': len(self._pending_markers), 'publish_delay': summarize_latencies(list(self._marker_publish_delays))}
+
+
     def get_crypto_key(self) -> bytearray:
         raise NotImplementedError('get_crypto_key method must be implemented in subclass')
 
@@ -99,6 +207,28 @@ class EmotivBase(EasyTimeSyncParsingMixin):
         return info
     
 
+    def get_lsl_outlet_marker_stream_info(self) -> StreamInfo:
+        """ Create LSL stream info for injected markers: one string channel at irregular rate, named after the EEG stream (e.g. 'Epoc X Markers') """
+        eeg_info = self.get_lsl_outlet_eeg_stream_info()
+        info = StreamInfo(f'{eeg_info.name()} Markers', type='Markers', channel_count=1, nominal_srate=pylsl.IRREGULAR_RATE, channel_format=pylsl.cf_string, source_id=f'{eeg_info.source_id()}_markers')
+        info.desc().append_child_value("clock", f"pylsl.local_clock, as the '{eeg_info.name()}' samples")
+        if self.enable_marker_event_channel:
+            info.desc().append_child_value("event_channel", f"{eeg_info.name()}/{MARKER_EVENT_CHANNEL_NAME}")
+        info = self.add_lsl_outlet_info_common(info=info)
+        return info
+
+
+    def append_marker_event_channel_info(self, chns):
+        """ describes the EEG channel added by `enable_marker_event_channel`: the sequence number of the marker at that sample, 0 elsewhere.
+        Its 'stim' type (MNE's trigger channel type) is what keeps it out of the electrode channels, see `quality_report.eeg_signal_columns`.
+        """
+        ch = chns.append_child("channel")
+        ch.append_child_value("label", MARKER_EVENT_CHANNEL_NAME)
+        ch.append_child_value("unit", "none")
+        ch.append_child_value("type", "stim")
+        ch.append_child_value("scaling_factor", "1")
+    
+
     def get_lsl_outlet_raw_debugging_stream_info(self) -> StreamInfo:
         """ 
         raw_packet_outlet = None
@@ -172,9 +302,168 @@ class EmotivBase(EasyTimeSyncParsingMixin):
         
 
 
-    def main_loop(self):
+    def iter_raw_packets(self, stop_event: Optional[threading.Event] = None):
+        """ Yields raw reports from the headset's HID device until `stop_event` is set (forever without one). Reads time out after
+        `HID_READ_TIMEOUT_MS` so the event is checked even while no reports arrive; empty reads are skipped. Subclasses with another capture source
+        (e.g. usbmon) override this.
+        """
         import hid
 
+        ## Get the device info
+        device = self.get_hid_device()
+        hid_device = hid.Device(path=device['path'])
+
+        if self.is_reverse_engineer_mode:
+            logging.getLogger(f'emotiv.{self.device_name.replace(" ", "_").lower()}').debug(f'hid_device: {hid_device}\n\twith path: {device["path"]}\n')
+
+        try:
+            while (stop_event is None) or (not stop_event.is_set()):
+                data = hid_device.read(self.READ_SIZE, timeout=HID_READ_TIMEOUT_MS)
+                if data:
+                    yield data
+        finally:
+            hid_device.close() ## when the consumer stops iterating (`iter_chunks` closes it on exit)
+
+
+    def decode_packets(self, packets: np.ndarray, timestamps: Optional[np.ndarray] = None) -> DecodedChunk:
+        """ Decodes an (n, READ_SIZE) block of raw reports into a `DecodedChunk`, one `decode_data` call per packet. Models with a vectorized decoder (`EmotivEpocX`) override this.
+        Quality rows are zero for EEG packets that carry no quality values. Counters are the `last_packet_counter` that `decode_data` sets; the
+        counter arrays are left empty if it does not set one for every packet.
+        """
+        packets = np.ascontiguousarray(packets, dtype=np.uint8).reshape(len(packets), -1)
+        timestamps = np.full(len(packets), np.nan) if timestamps is None else np.asarray(timestamps, dtype=np.float64)
+        eeg_rows, quality_rows, eeg_idx, eeg_counter = [], [], [], []
+        motion_rows, motion_idx, motion_counter = [], [], []
+        for i, data in enumerate(packets):
+            self.last_packet_counter = None
+            decoded, eeg_quality_data = self.decode_data(bytes(data))
+            if decoded is None:
+                continue
+            counter = self.last_packet_counter
+            if len(decoded) == 14:
+                eeg_rows.append(np.asarray(decoded, dtype=np.float32))
+                quality_rows.append(np.asarray(eeg_quality_data, dtype=np.uint8) if (eeg_quality_data is not None) and (len(eeg_quality_data) == 14) else np.zeros(14, dtype=np.uint8))
+                eeg_idx.append(i)
+                eeg_counter.append(counter)
+            elif len(decoded) == 6:
+                motion_rows.append(np.asarray(decoded, dtype=np.float32))
+                motion_idx.append(i)
+                motion_counter.append(counter)
+        eeg_idx, motion_idx = np.asarray(eeg_idx, dtype=np.int64), np.asarray(motion_idx, dtype=np.int64)
+        if any(a_counter is None for a_counter in eeg_counter + motion_counter): ## missing rather than made up
+            eeg_counter, motion_counter = [], []
+        return DecodedChunk(eeg=np.asarray(eeg_rows, dtype=np.float32).reshape(-1, 14), eeg_timestamps=timestamps[eeg_idx], eeg_counter=np.asarray(eeg_counter, dtype=np.uint8),
+                            eeg_packet_index=eeg_idx, quality=np.asarray(quality_rows, dtype=np.uint8).reshape(-1, 14),
+                            motion=np.asarray(motion_rows, dtype=np.float32).reshape(-1, 6), motion_timestamps=timestamps[motion_idx], motion_counter=np.asarray(motion_counter, dtype=np.uint8),
+                            motion_packet_index=motion_idx, n_packets=len(packets))
+
+
+    def iter_chunks(self, max_latency: float = 0.05, max_packets: int = 256, stop_event: Optional[threading.Event] = None) -> Iterator[DecodedChunk]:
+        """ Reads the headset (`iter_raw_packets`) and yields its decoded samples as `DecodedChunk`s, without any LSL outlet or sink.
+
+        Packets are timestamped with `pylsl.local_clock()` as they are read (the clock `main_loop` stamps its outlets with) and decoded with
+        `decode_packets` in batches: a chunk is yielded once `max_latency` seconds have passed since its first packet, or it holds `max_packets` packets.
+        `*_packet_index` counts every packet read since the call, invalid ones included. Iteration ends when the consumer stops (breaks out of the
+        loop or closes the generator), when another thread calls `stop_chunks` or sets `stop_event` (noticed within `HID_READ_TIMEOUT_MS` even if the
+        headset sends nothing), or when the packet source ends; the HID device is closed in every case.
+
+        Usage:
+            for chunk in emotiv.iter_chunks(max_latency=0.02):
+                process(chunk.eeg, chunk.eeg_timestamps, chunk.quality)
+        """
+        if stop_event is None:
+            stop_event = threading.Event()
+        self._chunk_stop_events.append(stop_event)
+        packets, timestamps, packet_indices = [], [], []
+        batch_start = None
+        packet_count = 0
+        source = self.iter_raw_packets(stop_event=stop_event)
+        try:
+            for data in source:
+                timestamp = pylsl.local_clock()
+                if self.validate_data(data):
+                    packets.append(bytes(data))
+                    timestamps.append(timestamp)
+                    packet_indices.append(packet_count)
+                    if batch_start is None:
+                        batch_start = timestamp
+                packet_count += 1
+                if packets and ((len(packets) >= max_packets) or ((timestamp - batch_start) >= max_latency)):
+                    yield self._decode_chunk_batch(packets, timestamps, packet_indices)
+                    packets, timestamps, packet_indices = [], [], []
+                    batch_start = None
+                if stop_event.is_set():
+                    break
+            if packets:
+                yield self._decode_chunk_batch(packets, timestamps, packet_indices)
+        finally:
+            source.close()
+            self._chunk_stop_events.remove(stop_event)
+
+
+    def _decode_chunk_batch(self, packets: List[bytes], timestamps: List[float], packet_indices: List[int]) -> DecodedChunk:
+        a_chunk = self.decode_packets(np.frombuffer(b''.join(packets), dtype=np.uint8).reshape(len(packets), -1), timestamps=np.asarray(timestamps))
+        packet_indices = np.asarray(packet_indices, dtype=np.int64)
+        a_chunk.eeg_packet_index = packet_indices[a_chunk.eeg_packet_index]
+        a_chunk.motion_packet_index = packet_indices[a_chunk.motion_packet_index]
+        return a_chunk
+
+
+    def stop_chunks(self):
+        """ ends every running `iter_chunks`/`stream` after the packet being read, or the current read timing out (thread-safe) """
+        for an_event in list(self._chunk_stop_events):
+            an_event.set()
+
+
+    async def stream(self, max_latency: float = 0.05, max_packets: int = 256, stop_timeout: float = 2.0) -> AsyncIterator[DecodedChunk]:
+        """ `iter_chunks` as an async generator: the blocking packet reads run on a worker thread and chunks are handed to the event loop as they are
+        decoded (they queue up if the consumer is slower). Closing the generator stops the reader and waits up to `stop_timeout` seconds for it; call
+        `aclose()` when leaving the `async for` early, otherwise that only happens once the generator is garbage collected.
+
+        Usage:
+            chunks = emotiv.stream(max_latency=0.02)
+            try:
+                async for chunk in chunks:
+                    await handle(chunk)
+            finally:
+                await chunks.aclose()
+        """
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        finished = object()
+        stop_event = threading.Event()
+
+        def hand_over(item):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:
+                pass ## the event loop is closed
+
+        def read_chunks():
+            try:
+                for a_chunk in self.iter_chunks(max_latency=max_latency, max_packets=max_packets, stop_event=stop_event):
+                    hand_over(a_chunk)
+            except Exception as e:
+                hand_over(e)
+            finally:
+                hand_over(finished)
+
+        reader = threading.Thread(target=read_chunks, name='EmotivChunkReader', daemon=True)
+        reader.start()
+        try:
+            while True:
+                item = await chunks.get()
+                if item is finished:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop_event.set()
+            await loop.run_in_executor(None, reader.join, stop_timeout)
+
+
+    def main_loop(self):
         # Create EEG outlet
         eeg_outlet = None 
 
@@ -182,6 +471,7 @@ class EmotivBase(EasyTimeSyncParsingMixin):
         motion_outlet = None
         if self.has_motion_data and self.enable_motion_data:
             motion_outlet = StreamOutlet(self.get_lsl_outlet_motion_stream_info())
+            motion_stream_name = self.register_outlet(motion_outlet)
             print(f'Setup motion outlet')
             
         # Create motion outlet if the device supports it
@@ -191,70 +481,136 @@ class EmotivBase(EasyTimeSyncParsingMixin):
             print(f'Setup raw_packet_outlet (for reverse-engineering)')
             
         eeg_quality_outlet = None
+        marker_outlet = None
+        marker_events = [] ## (timestamp, seq) of published markers not yet written to the EEG event channel, sorted
         
-        ## Get the device info
-        device = self.get_hid_device()
-        hid_device = hid.Device(path=device['path'])
         logger = logging.getLogger(f'emotiv.{self.device_name.replace(" ", "_").lower()}')
-        
-        if self.is_reverse_engineer_mode:
-            logger.debug(f'hid_device: {hid_device}\n\twith path: {device["path"]}\n')
+
+        if self.enable_flight_recorder and (self.flight_recorder is None):
+            from emotiv_lsl.flight_recorder import PacketFlightRecorder
+            self.flight_recorder = PacketFlightRecorder(packet_size=self.READ_SIZE, device_name=self.device_name)
+        flight_recorder = self.flight_recorder
+
+        owned_shared_memory_ring = None
+        if self.enable_shared_memory_ring and (self.shared_memory_ring is None):
+            from emotiv_lsl.shared_memory_ring import SharedMemoryRingPublisher
+            self.shared_memory_ring = owned_shared_memory_ring = SharedMemoryRingPublisher()
+            self.add_sample_sink(self.shared_memory_ring)
+
+        if self.enable_marker_server and (self.marker_server is None):
+            from emotiv_lsl.marker_server import MarkerServer
+            self.marker_server = MarkerServer(emotiv=self, path=self.marker_server_path, port=self.marker_server_port)
+        if self.marker_server is not None:
+            self.marker_server.start()
         
         packet_count = 0
         
-        while True:
-            data = hid_device.read(self.READ_SIZE)
-            packet_count += 1
+        try:
+            for data in self.iter_raw_packets():
+                packet_count += 1
+                timestamp = pylsl.local_clock() ## one timestamp per packet, shared by the outlet push, the sinks and the flight recorder
+                packet_status = PACKET_STATUS_UNKNOWN
+
+                while self._pending_markers:
+                    seq, label, marker_timestamp, injected_at = self._pending_markers.popleft()
+                    if marker_outlet is None:
+                        marker_outlet = StreamOutlet(self.get_lsl_outlet_marker_stream_info())
+                        marker_stream_name = self.register_outlet(marker_outlet)
+                        logger.debug(f'set up marker outlet!')
+                    self.push_sample(marker_outlet, marker_stream_name, [label], marker_timestamp)
+                    self._marker_publish_delays.append(pylsl.local_clock() - injected_at)
+                    if self.enable_marker_event_channel:
+                        bisect.insort(marker_events, (marker_timestamp, seq))
             
-            if (self.is_reverse_engineer_mode and (raw_packet_outlet is not None)):
-                ## output the raw data
-                raw_packet_outlet.push_sample(data)
-
-
-            if self.validate_data(data):
-                if self.enable_debug_logging:
-                    logger.debug(f"Packet #{packet_count}: Valid data packet, length={len(data)}")
-
-                decoded, eeg_quality_data = self.decode_data(data)
+                if (self.is_reverse_engineer_mode and (raw_packet_outlet is not None)):
+                    ## output the raw data
+                    raw_packet_outlet.push_sample(data)
+
+
+                if self.validate_data(data):
+                    if self.enable_debug_logging:
+                        logger.debug(f"Packet #{packet_count}: Valid data packet, length={len(data)}")
+
+                    try:
+                        decoded, eeg_quality_data = self.decode_data(data)
+                    except Exception:
+                        if flight_recorder is not None:
+                            ## the exception may end the process: write the snapshot now, not on a daemon thread, and regardless of the dump rate limit
+                            flight_recorder.record(data, timestamp, PACKET_STATUS_DECODE_FAILED, allow_dump=False)
+                            flight_recorder.dump(reason=PACKET_STATUS_NAMES[PACKET_STATUS_DECODE_FAILED], blocking=True)
+                        raise
                 
-                if (eeg_quality_data is not None) and len(eeg_quality_data) == 14:
-                    if self.is_reverse_engineer_mode:
-                        logger.debug(f'got eeg quality data: {eeg_quality_data}')
-                    if eeg_quality_outlet is None:
-                        eeg_quality_outlet = StreamOutlet(self.get_lsl_outlet_electrode_quality_stream_info())
-                        logger.debug(f'set up EEG Sensor Quality outlet!')
-                    eeg_quality_outlet.push_sample(eeg_quality_data)
+                    if (eeg_quality_data is not None) and len(eeg_quality_data) == 14:
+                        if self.is_reverse_engineer_mode:
+                            logger.debug(f'got eeg quality data: {eeg_quality_data}')
+                        if eeg_quality_outlet is None:
+                            eeg_quality_outlet = StreamOutlet(self.get_lsl_outlet_electrode_quality_stream_info())
+                            eeg_quality_stream_name = self.register_outlet(eeg_quality_outlet)
+                            logger.debug(f'set up EEG Sensor Quality outlet!')
+                        self.push_sample(eeg_quality_outlet, eeg_quality_stream_name, eeg_quality_data, timestamp)
                         
-                # else:
-                # decoded = self.decode_data(data)
+                    # else:
+                    # decoded = self.decode_data(data)
                     
-                if decoded is not None:
-                    # Check if this is motion data (based on number of channels)
-                    if len(decoded) == 6:
-                        if self.enable_motion_data:
+                    if decoded is not None:
+                        # Check if this is motion data (based on number of channels)
+                        if len(decoded) == 6:
+                            packet_status = PACKET_STATUS_MOTION
+                            if self.enable_motion_data:
+                                if self.enable_debug_logging:
+                                    logger.debug(f"Packet #{packet_count}: Motion data decoded, {len(decoded)} channels")
+                                if not self.has_motion_data:
+                                    self.has_motion_data = True
+                                    logger.debug(f'got first motion data!')
+
+                                if motion_outlet is None:
+                                    motion_outlet = StreamOutlet(self.get_lsl_outlet_motion_stream_info())
+                                    motion_stream_name = self.register_outlet(motion_outlet)
+                                    logger.debug(f'set up motion outlet!')
+                                self.push_sample(motion_outlet, motion_stream_name, decoded, timestamp)
+                            elif self.enable_debug_logging:
+                                logger.debug(f"Packet #{packet_count}: Motion data decoded but disabled (enable_motion_data=False)")
+
+                        elif len(decoded) == 14:  # EEG data has 14 channels
+                            packet_status = PACKET_STATUS_EEG
                             if self.enable_debug_logging:
-                                logger.debug(f"Packet #{packet_count}: Motion data decoded, {len(decoded)} channels")
-                            if not self.has_motion_data:
-                                self.has_motion_data = True
-                                logger.debug(f'got first motion data!')
-
-                            if motion_outlet is None:
-                                motion_outlet = StreamOutlet(self.get_lsl_outlet_motion_stream_info())
-                                logger.debug(f'set up motion outlet!')
-                            motion_outlet.push_sample(decoded)
-                        elif self.enable_debug_logging:
-                            logger.debug(f"Packet #{packet_count}: Motion data decoded but disabled (enable_motion_data=False)")
-
-                    elif len(decoded) == 14:  # EEG data has 14 channels
-                        if self.enable_debug_logging:
-                            logger.debug(f"Packet #{packet_count}: EEG data decoded, {len(decoded)} channels")
-                        if eeg_outlet is None:
-                            eeg_outlet = StreamOutlet(self.get_lsl_outlet_eeg_stream_info())
-                            logger.debug(f'set up EEG outlet!')                                                        
-                        eeg_outlet.push_sample(decoded)
+                                logger.debug(f"Packet #{packet_count}: EEG data decoded, {len(decoded)} channels")
+                            if eeg_outlet is None:
+                                eeg_outlet = StreamOutlet(self.get_lsl_outlet_eeg_stream_info())
+                                eeg_stream_name = self.register_outlet(eeg_outlet)
+                                logger.debug(f'set up EEG outlet!')                                                        
+                            if self.enable_marker_event_channel:
+                                ## the first EEG sample stamped at or after a marker carries its sequence number (the latest one, if several)
+                                event_value = 0
+                                while marker_events and (marker_events[0][0] <= timestamp):
+                                    event_value = marker_events.pop(0)[1]
+                                decoded = list(decoded) + [event_value]
+                            self.push_sample(eeg_outlet, eeg_stream_name, decoded, timestamp)
+                        else:
+                            packet_status = PACKET_STATUS_UNKNOWN_CHANNEL_COUNT
+                            logger.debug(f"Packet #{packet_count}: Unknown data type with {len(decoded)} channels")
                     else:
-                        logger.debug(f"Packet #{packet_count}: Unknown data type with {len(decoded)} channels")
+                        packet_status = PACKET_STATUS_DECODE_FAILED
+                        logger.debug(f"Packet #{packet_count}: self.decode_data(data) failed -- data packet (skipped)")
                 else:
-                    logger.debug(f"Packet #{packet_count}: self.decode_data(data) failed -- data packet (skipped)")
-            else:
-                logger.debug(f"Packet #{packet_count}: Invalid data packet, length={len(data)}")
\ No newline at end of file
+                    packet_status = PACKET_STATUS_INVALID_LENGTH
+                    logger.debug(f"Packet #{packet_count}: Invalid data packet, length={len(data)}")
+
+                if flight_recorder is not None:
+                    flight_recorder.record(data, timestamp, packet_status, counter=(self.last_packet_counter if packet_status in (PACKET_STATUS_EEG, PACKET_STATUS_MOTION) else None))
+        finally:
+            if self.marker_server is not None:
+                self.marker_server.stop()
+            with self._sink_lock:
+                self._active_stream_infos.clear()
+                sinks = self._sample_sinks
+            for a_sink in sinks:
+                try:
+                    a_sink.on_source_stopped()
+                except Exception as e:
+                    logger.error(f'sample sink {type(a_sink).__name__} failed to stop: {e!r}')
+            if owned_shared_memory_ring is not None: ## unlink the segments and close the notification socket, the next run creates a new publisher
+                self.remove_sample_sink(owned_shared_memory_ring)
+                owned_shared_memory_ring.close()
+                if self.shared_memory_ring is owned_shared_memory_ring:
+                    self.shared_memory_ring = None
@@ -25,6 +25,7 @@ class EmotivEpocPlus(EmotivBase):
     def __attrs_post_init__(self):
         ## immediately calls the self.get_crypto_key() function to try and set self.cypher
         self.cipher = AES.new(self.get_crypto_key(), AES.MODE_ECB)
+        self.wrap_cipher_with_block_cache()
         self.init_EasyTimeSyncParsingMixin()
 
 
@@ -56,7 +57,7 @@ class EmotivEpocPlus(EmotivBase):
 
     def get_lsl_outlet_eeg_stream_info(self) -> StreamInfo:
         ch_names = ['AF3', 'F7', 'F3', 'FC5', 'T7', 'P7', 'O1', 'O2', 'P8', 'T8', 'FC6', 'F4', 'F8', 'AF4']
-        n_channels = len(ch_names)
+        n_channels = len(ch_names) + int(self.enable_marker_event_channel)
 
         info = StreamInfo('Epoc+', 'EEG', n_channels, SRATE, 'float32')
         chns = info.desc().append_child("channels")
@@ -67,6 +68,9 @@ class EmotivEpocPlus(EmotivBase):
             ch.append_child_value("type", "EEG")
             ch.append_child_value("scaling_factor", "1")
 
+        if self.enable_marker_event_channel:
+            self.append_marker_event_channel_info(chns)
+
         cap = info.desc().append_child("cap")
         cap.append_child_value("name", "easycap-M1")
         cap.append_child_value("labelscheme", "10-20")
@@ -89,6 +93,7 @@ class EmotivEpocPlus(EmotivBase):
         ## Epoc+
         join_data = ''.join(map(chr, data[1:]))
         data = self.cipher.decrypt(bytes(join_data,'latin-1')[0:32])
+        self.last_packet_counter = data[0]
         if str(data[1]) == "32": # No Gyro Data.
             logging.getLogger('emotiv.epoc_plus').debug(f"Motion/gyro packet detected: data[1]={data[1]}. WARN: NOT YET IMPLEMENTED FOR EPOC+")
             return None, None
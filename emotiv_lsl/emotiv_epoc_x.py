@@ -3,16 +3,32 @@ import logging
 from Crypto.Cipher import AES
 from typing import Dict, List, Tuple, Optional, Callable, Union, Any
 # from nptyping import NDArray
+import numpy as np
 import pylsl
 from pylsl import StreamInfo
 from attrs import define, field, Factory
 
 from emotiv_lsl.emotiv_base import EmotivBase
+from emotiv_lsl.decoded_chunk import DecodedChunk
 from config import MOTION_SRATE, SRATE
 
 
 logger = logging.getLogger("emotiv_lsl")
 
+## byte layout of a decrypted 32-byte report, as used by `decode_data`/`decode_motion_data`
+EEG_LOW_BYTE_POSITIONS = np.array([2, 4, 6, 8, 10, 12, 14, 18, 20, 22, 24, 26, 28, 30])
+EEG_CHANNEL_ORDER = np.array([2, 3, 0, 1, 4, 5, 6, 7, 8, 9, 12, 13, 10, 11]) ## the AF3/F3, AF4/F4, F7/FC5 and FC6/F8 swaps
+QUALITY_BYTE_POSITIONS = np.arange(16, 23)
+MOTION_LOW_BYTE_POSITIONS = np.array([2, 4, 6, 8, 10, 12])
+MOTION_SCALES = np.array([1.0 / 16384.0] * 3 + [1.0 / 131.0] * 3) ## ±2g accelerometer, ±250 deg/s gyro
+EEG_PACKET_MARKER = 16 ## decrypted byte 1 of an EEG report
+MOTION_PACKET_MARKER = 32 ## decrypted byte 1 of a motion/gyro report
+EEG_COUNTER_MODULUS = 128 ## decrypted byte 0 counts EEG reports 0..127
+MOTION_COUNTER_MODULUS = 32 ## and motion reports 0..31
+
+## which serial-number characters (counted from the end) make up each of the 16 AES key bytes
+CRYPTO_KEY_SERIAL_POSITIONS = [-1, -2, -4, -4, -2, -1, -2, -4, -1, -4, -3, -2, -1, -2, -2, -3]
+
 @define(slots=False)
 class EmotivEpocX(EmotivBase):
     READ_SIZE: int = field(default=32)
@@ -26,8 +42,7 @@ class EmotivEpocX(EmotivBase):
         if (self.cipher is None):           
             crypto_key = self.get_crypto_key()
             self.cipher = AES.new(crypto_key, AES.MODE_ECB)
-        else:
-            print(f'working cipher was provided on startup!')
+        self.wrap_cipher_with_block_cache()
 
         if self.is_reverse_engineer_mode:
             print('starting with reverse engineer mode!')
@@ -56,7 +71,7 @@ class EmotivEpocX(EmotivBase):
         sn = bytearray()
         for i in range(0, len(serial)):
             sn += bytearray([ord(serial[i])])
-        return bytearray([sn[-1], sn[-2], sn[-4], sn[-4], sn[-2], sn[-1], sn[-2], sn[-4], sn[-1], sn[-4], sn[-3], sn[-2], sn[-1], sn[-2], sn[-2], sn[-3]])
+        return bytearray([sn[i] for i in CRYPTO_KEY_SERIAL_POSITIONS])
 
 
     def get_lsl_source_id(self) -> str:
@@ -96,7 +111,7 @@ class EmotivEpocX(EmotivBase):
 
     def get_lsl_outlet_eeg_stream_info(self) -> StreamInfo:
         ch_names = self.eeg_channel_names # ['AF3', 'F7', 'F3', 'FC5', 'T7', 'P7', 'O1', 'O2', 'P8', 'T8', 'FC6', 'F4', 'F8', 'AF4']
-        n_channels = len(ch_names)
+        n_channels = len(ch_names) + int(self.enable_marker_event_channel)
 
         info = StreamInfo('Epoc X', type='EEG', channel_count=n_channels, nominal_srate=SRATE, channel_format=pylsl.cf_float32, source_id=self.get_lsl_source_id())
         chns = info.desc().append_child("channels")
@@ -107,6 +122,9 @@ class EmotivEpocX(EmotivBase):
             ch.append_child_value("type", "EEG")
             ch.append_child_value("scaling_factor", "1")
 
+        if self.enable_marker_event_channel:
+            self.append_marker_event_channel_info(chns)
+
         cap = info.desc().append_child("cap")
         cap.append_child_value("name", "easycap-M1")
         cap.append_child_value("labelscheme", "10-20")
@@ -157,6 +175,7 @@ class EmotivEpocX(EmotivBase):
             
         data = [el ^ 0x55 for el in data]
         data = self.cipher.decrypt(bytearray(data))
+        self.last_packet_counter = data[0]
         
         # Check for motion/gyro packet
         if str(data[1]) == "32":
@@ -242,6 +261,44 @@ class EmotivEpocX(EmotivBase):
         
         return [0.0] * 6  # Return zeros if not enough data
 
+    def decode_packets(self, packets: np.ndarray, timestamps: Optional[np.ndarray] = None) -> DecodedChunk:
+        """ Vectorized equivalent of `decode_data`/`decode_motion_data` for an (n, 32) block of raw reports.
+
+        The whole block is decrypted with a single `self.cipher.decrypt` call (ECB has no cross-block state), then converted with array arithmetic.
+        EEG values match `decode_data` to within its 8-decimal string formatting. Quality values are always extracted.
+        """
+        packets = np.ascontiguousarray(packets, dtype=np.uint8).reshape(-1, 32)
+        n_packets = len(packets)
+        if timestamps is None:
+            timestamps = np.full(n_packets, np.nan)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+
+        plain = np.frombuffer(self.cipher.decrypt((packets ^ 0x55).tobytes()), dtype=np.uint8).reshape(n_packets, 32)
+        is_motion = (plain[:, 1] == MOTION_PACKET_MARKER)
+        eeg_idx = np.flatnonzero(~is_motion)
+        motion_idx = np.flatnonzero(is_motion)
+
+        eeg_plain = plain[eeg_idx]
+        low = eeg_plain[:, EEG_LOW_BYTE_POSITIONS].astype(np.float64)
+        high = eeg_plain[:, EEG_LOW_BYTE_POSITIONS + 1].astype(np.float64)
+        eeg = ((low * .128205128205129) + 4201.02564096001) + ((high - 128) * 32.82051289)
+        quality_bytes = eeg_plain[:, QUALITY_BYTE_POSITIONS]
+        quality = np.empty((len(eeg_plain), 14), dtype=np.uint8)
+        quality[:, 0::2] = quality_bytes & 0xF
+        quality[:, 1::2] = (quality_bytes >> 4) & 0xF
+
+        motion_plain = plain[motion_idx]
+        low = motion_plain[:, MOTION_LOW_BYTE_POSITIONS].astype(np.float64)
+        high = motion_plain[:, MOTION_LOW_BYTE_POSITIONS + 1].astype(np.float64)
+        motion = ((8191.88296790168 + (low * 1.00343814821)) + ((high - 128.00001) * 64.00318037383)) * MOTION_SCALES
+        if len(motion_idx) > 0:
+            self.has_motion_data = True
+
+        return DecodedChunk(eeg=eeg[:, EEG_CHANNEL_ORDER].astype(np.float32), eeg_timestamps=timestamps[eeg_idx], eeg_counter=eeg_plain[:, 0].copy(), eeg_packet_index=eeg_idx.astype(np.int64), quality=quality,
+                            motion=motion.astype(np.float32), motion_timestamps=timestamps[motion_idx], motion_counter=motion_plain[:, 0].copy(), motion_packet_index=motion_idx.astype(np.int64),
+                            n_packets=n_packets)
+
+
     def validate_data(self, data) -> bool:
         if self.is_reverse_engineer_mode:
             return (len(data) == self.READ_SIZE)
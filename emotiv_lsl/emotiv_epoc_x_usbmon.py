@@ -0,0 +1,53 @@
+import logging
+import threading
+from typing import Optional
+
+from attrs import define, field
+
+from emotiv_lsl.emotiv_epoc_x import EmotivEpocX
+from emotiv_lsl.usbmon_capture import UsbReportFilter, UsbmonLiveCapture, find_emotiv_usb_address, iter_pcap_reports
+
+logger = logging.getLogger("emotiv_lsl")
+
+
+@define(slots=False)
+class EmotivEpocXUsbmon(EmotivEpocX):
+    """ Epoc X fed from the Linux binary usbmon interface (live) or from a pcap/pcapng file (offline) instead of hidapi. Replacement for `EmotivEpocXPyShark`.
+
+    Usage:
+        emotiv = EmotivEpocXUsbmon(serial_number='UD2022...')                          # live, dongle located via sysfs
+        emotiv = EmotivEpocXUsbmon(serial_number='UD2022...', pcap_path='cap.pcapng')  # offline replay
+        emotiv.main_loop()
+    """
+    pcap_path: Optional[str] = field(default=None)
+    usb_bus: Optional[int] = field(default=None)
+    usb_device_address: Optional[int] = field(default=None)
+    usb_endpoint: Optional[int] = field(default=None)
+
+
+    def get_report_filter(self) -> UsbReportFilter:
+        report_filter = UsbReportFilter(bus=self.usb_bus, device_address=self.usb_device_address, endpoint=self.usb_endpoint, report_size=self.READ_SIZE)
+        if (self.pcap_path is None) and (report_filter.device_address is None):
+            address = find_emotiv_usb_address()
+            if address is None:
+                raise Exception('Emotiv Epoc X dongle not found in /sys/bus/usb/devices')
+            report_filter.bus, report_filter.device_address = address
+        return report_filter
+
+
+    def iter_raw_packets(self, stop_event: Optional[threading.Event] = None):
+        """ reports from the pcap file or the live usbmon capture; `stop_event` is checked between reports """
+        report_filter = self.get_report_filter()
+        if self.pcap_path is not None:
+            logger.info(f'reading reports from {self.pcap_path} ({report_filter})')
+            for a_report in iter_pcap_reports(self.pcap_path, report_filter=report_filter):
+                if (stop_event is not None) and stop_event.is_set():
+                    return
+                yield bytearray(a_report.data)
+        else:
+            with UsbmonLiveCapture(report_filter=report_filter) as capture:
+                logger.info(f'capturing from {capture.device_path} ({report_filter})')
+                for a_report in capture:
+                    if (stop_event is not None) and stop_event.is_set():
+                        return
+                    yield bytearray(a_report.data)
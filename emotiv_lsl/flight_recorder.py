@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+from attrs import define, field
+
+from emotiv_lsl.raw_capture import (RawCaptureWriter, raw_capture_record_dtype, PACKET_STATUS_NAMES, PACKET_STATUS_EEG, PACKET_STATUS_MOTION, PACKET_STATUS_INVALID_LENGTH,
+                                    PACKET_STATUS_DECODE_FAILED, PACKET_STATUS_COUNTER_GAP, PACKET_STATUS_UNKNOWN_CHANNEL_COUNT)
+from emotiv_lsl.emotiv_epoc_x import EEG_COUNTER_MODULUS, MOTION_COUNTER_MODULUS
+from config import MOTION_SRATE, SRATE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DUMP_DIRECTORY: Path = Path('~/.emotiv-lsl/flight_recorder_dumps') ## per-user, so dumps do not land in whatever directory the server was started from
+
+ANOMALY_STATUSES = frozenset([PACKET_STATUS_INVALID_LENGTH, PACKET_STATUS_DECODE_FAILED, PACKET_STATUS_COUNTER_GAP, PACKET_STATUS_UNKNOWN_CHANNEL_COUNT])
+
+
+@define(slots=False)
+class PacketFlightRecorder:
+    """ Fixed-memory ring of the last `duration_seconds` of raw packets and their decode outcomes, opt-in via `EmotivBase.enable_flight_recorder`.
+
+    Recording a packet is a handful of array writes into a preallocated ring. When a packet's status is an anomaly (invalid length, decode failure, counter gap,
+    unknown channel count) the ring is snapshotted and dumped in the background to a `.emraw` capture in `dump_directory` (`~` is expanded), rate-limited by
+    `min_dump_interval_seconds` and capped at `max_dumps`. Decode dumps offline with `python -m emotiv_lsl.bulk_decoder`; the `status` column holds the outcome.
+
+    Usage:
+        recorder = PacketFlightRecorder(duration_seconds=30)
+        recorder.record(data, timestamp, PACKET_STATUS_EEG, counter=decrypted[0])
+    """
+    duration_seconds: float = field(default=30.0)
+    packet_size: int = field(default=32)
+    packets_per_second: float = field(default=float(SRATE + MOTION_SRATE))
+    dump_directory: Path = field(default=DEFAULT_DUMP_DIRECTORY, converter=lambda p: Path(p).expanduser())
+    min_dump_interval_seconds: float = field(default=60.0)
+    max_dumps: int = field(default=20)
+    device_name: str = field(default='Emotiv Epoc X')
+
+    capacity: int = field(init=False)
+    n_recorded: int = field(default=0, init=False)
+    n_anomalies: int = field(default=0, init=False)
+    n_dumps: int = field(default=0, init=False)
+    last_dump_path: Optional[Path] = field(default=None, init=False)
+    _records: np.ndarray = field(default=None, init=False)
+    _last_counters: Dict[int, int] = field(factory=dict, init=False)
+    _last_dump_time: float = field(default=-np.inf, init=False)
+
+
+    def __attrs_post_init__(self):
+        self.capacity = int(np.ceil(self.duration_seconds * self.packets_per_second * 1.25)) ## headroom for bursts
+        self._records = np.zeros(self.capacity, dtype=raw_capture_record_dtype(self.packet_size))
+
+
+    def check_counter(self, status: int, counter: Optional[int]) -> int:
+        """ returns PACKET_STATUS_COUNTER_GAP if `counter` does not follow the previous counter of the same packet type, otherwise `status` """
+        if counter is None:
+            return status
+        modulus = {PACKET_STATUS_EEG: EEG_COUNTER_MODULUS, PACKET_STATUS_MOTION: MOTION_COUNTER_MODULUS}.get(status)
+        if modulus is None:
+            return status
+        previous = self._last_counters.get(status)
+        self._last_counters[status] = counter
+        if (previous is not None) and (((counter - previous) % modulus) != 1):
+            return PACKET_STATUS_COUNTER_GAP
+        return status
+
+
+    def record(self, data, timestamp: float, status: int, counter: Optional[int] = None, allow_dump: bool = True) -> int:
+        """ stores one packet and its outcome, dumping the ring if it is an anomaly (and `allow_dump`, callers that dump themselves pass False). Returns the final status. """
+        status = self.check_counter(status, counter)
+        i = self.n_recorded % self.capacity
+        n_bytes = min(len(data), self.packet_size)
+        records = self._records
+        records['timestamp'][i] = timestamp
+        records['length'][i] = len(data)
+        records['status'][i] = status
+        records['data'][i, :n_bytes] = np.frombuffer(bytes(data[:n_bytes]), dtype=np.uint8)
+        records['data'][i, n_bytes:] = 0
+        self.n_recorded += 1
+
+        if status in ANOMALY_STATUSES:
+            self.n_anomalies += 1
+            now = time.monotonic()
+            if allow_dump and (self.n_dumps < self.max_dumps) and ((now - self._last_dump_time) >= self.min_dump_interval_seconds):
+                self._last_dump_time = now
+                self.dump(reason=PACKET_STATUS_NAMES[status])
+        return status
+
+
+    def snapshot(self) -> np.ndarray:
+        """ copy of the ring contents, oldest first """
+        if self.n_recorded <= self.capacity:
+            return self._records[:self.n_recorded].copy()
+        i = self.n_recorded % self.capacity
+        return np.concatenate([self._records[i:], self._records[:i]])
+
+
+    def dump(self, reason: str = 'manual', blocking: bool = False) -> Path:
+        """ writes the current snapshot to `<dump_directory>/flight_<timestamp>_<reason>.emraw`. The file is written on a background thread unless `blocking`. """
+        records = self.snapshot()
+        self.dump_directory.mkdir(parents=True, exist_ok=True)
+        path = self.dump_directory.joinpath(f"flight_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{reason}.emraw")
+        self.n_dumps += 1
+        self.last_dump_path = path
+        logger.warning(f'flight recorder: {reason} anomaly, dumping last {len(records)} packets to {path}')
+
+        def _write():
+            with RawCaptureWriter(path, packet_size=self.packet_size, device_name=self.device_name) as writer:
+                writer.write_records(records)
+
+        if blocking:
+            _write()
+        else:
+            threading.Thread(target=_write, name='flight-recorder-dump', daemon=True).start()
+        return path
+
+
+    def get_stats(self) -> Dict:
+        return {'recorded': self.n_recorded, 'capacity': self.capacity, 'anomalies': self.n_anomalies, 'dumps': self.n_dumps, 'last_dump_path': (str(self.last_dump_path) if self.last_dump_path else None)}
@@ -0,0 +1,242 @@
+"""
+Append-only HDF5 session store.
+
+One group per stream under `/streams`, each with resizable chunked datasets that grow as samples arrive:
+    /streams/<name>/data        (n_samples, n_channels), stream channel format, compressed
+    /streams/<name>/timestamps  (n_samples,) float64 LSL timestamps
+    /streams/<name>/time_index  one (timestamp, offset) row per appended block: the first timestamp of the block and its sample offset
+
+`read_hdf5_time_range` binary-searches `time_index`, then reads only the chunks that cover the requested range.
+
+Usage:
+    store = Hdf5SessionStore('session.h5', compression='gzip', compression_opts=4)
+    emotiv.add_sample_sink(store)
+    ...
+    emotiv.remove_sample_sink(store)
+    store.close()
+
+    data, timestamps = read_hdf5_time_range('session.h5', 'Epoc X', start=t0, stop=t0 + 10.0)
+"""
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pylsl
+from pylsl import StreamInfo
+from attrs import define, field
+
+from emotiv_lsl.sample_sink import SampleSink
+from emotiv_lsl.xdf_writer import LSL_CHANNEL_FORMAT_NAMES, XDF_CHANNEL_FORMAT_DTYPES
+
+logger = logging.getLogger(__name__)
+
+HDF5_EXTENSION: str = '.h5'
+HDF5_STORE_FORMAT_VERSION: int = 1
+
+TIME_INDEX_DTYPE = np.dtype([('timestamp', '<f8'), ('offset', '<i8')])
+
+
+def get_stream_channel_labels(info: StreamInfo) -> List[str]:
+    """ channel labels from the `<channels>` description of a stream, or generic `CH<n>` names if it has none """
+    labels = []
+    a_channel = info.desc().child('channels').child('channel')
+    while not a_channel.empty():
+        labels.append(a_channel.child_value('label'))
+        a_channel = a_channel.next_sibling('channel')
+    if len(labels) != info.channel_count() or not all(labels):
+        labels = [f'CH{i + 1}' for i in range(info.channel_count())]
+    return labels
+
+
+@define(slots=False)
+class Hdf5StreamState:
+    """ per-stream staging block and datasets of an `Hdf5SessionStore` """
+    name: str = field()
+    data: object = field() ## h5py datasets
+    timestamps: object = field()
+    time_index: object = field()
+    block_values: np.ndarray = field()
+    block_timestamps: np.ndarray = field()
+    n_buffered: int = field(default=0)
+    n_written: int = field(default=0) ## samples in completed blocks; staged samples may also be in the datasets already, after a periodic flush
+    block_indexed: bool = field(default=False) ## the staged block already has its `time_index` row
+
+
+@define(slots=False)
+class Hdf5SessionStore(SampleSink):
+    """ Records every stream published by an `EmotivBase` delegate into an append-only, chunked and compressed HDF5 file.
+
+    Samples are staged per stream and appended `chunk_samples` rows at a time, so each append fills exactly one HDF5 chunk. Every `flush_interval`
+    seconds the staged samples are also written and the file flushed, so a crash loses at most that much data; they stay staged, and the next write
+    of the block rewrites the same chunk-aligned rows instead of starting a new, misaligned block.
+    `compression` is any h5py filter ('gzip', 'lzf', or None); `shuffle` adds the byte-shuffle filter, which helps gzip on float data.
+    """
+    path: Path = field(converter=Path)
+    chunk_samples: int = field(default=512)
+    compression: Optional[str] = field(default='gzip')
+    compression_opts: Optional[int] = field(default=4)
+    shuffle: bool = field(default=True)
+    flush_interval: float = field(default=5.0)
+
+    is_open: bool = field(default=False, init=False)
+    _file: Optional[object] = field(default=None, init=False)
+    _streams: Dict[str, Hdf5StreamState] = field(factory=dict, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+    _last_flush_time: float = field(default=-np.inf, init=False)
+
+
+    def __attrs_post_init__(self):
+        import h5py
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = h5py.File(self.path, 'a')
+        self._file.attrs.setdefault('format_version', HDF5_STORE_FORMAT_VERSION)
+        self._file.attrs.setdefault('created', time.time())
+        self._file.attrs.setdefault('created_lsl_clock', pylsl.local_clock()) ## with `created`, maps the stored LSL timestamps to wall-clock time
+        self._file.require_group('streams')
+        self.is_open = True
+        self._last_flush_time = pylsl.local_clock()
+
+
+    @property
+    def stream_names(self) -> List[str]:
+        return list(self._streams.keys())
+
+
+    def _require_dataset(self, group, name: str, shape: Tuple[int, ...], dtype, compress: bool):
+        if name in group:
+            return group[name]
+        filters = dict(compression=self.compression, compression_opts=self.compression_opts, shuffle=self.shuffle) if (compress and self.compression is not None) else {}
+        if filters.get('compression') == 'lzf':
+            filters.pop('compression_opts')
+        return group.create_dataset(name, shape=(0, *shape), maxshape=(None, *shape), chunks=(self.chunk_samples, *shape), dtype=dtype, **filters)
+
+
+    def on_stream_started(self, stream_name: str, info: StreamInfo):
+        with self._lock:
+            if (not self.is_open) or (stream_name in self._streams):
+                return
+            channel_format = LSL_CHANNEL_FORMAT_NAMES[info.channel_format()]
+            if channel_format == 'string':
+                logger.warning(f'stream {stream_name!r} has string samples, which the HDF5 store does not record')
+                return
+            dtype = np.dtype(XDF_CHANNEL_FORMAT_DTYPES[channel_format])
+            channel_count = info.channel_count()
+            group = self._file['streams'].require_group(stream_name)
+            group.attrs['type'] = info.type()
+            group.attrs['nominal_srate'] = info.nominal_srate()
+            group.attrs['channel_format'] = channel_format
+            group.attrs['channel_labels'] = get_stream_channel_labels(info)
+            group.attrs['source_id'] = info.source_id()
+            group.attrs['info_xml'] = info.as_xml()
+            ## appending to an existing group (reopened file or restarted outlet) continues after its last sample
+            state = Hdf5StreamState(name=stream_name, data=self._require_dataset(group, 'data', (channel_count,), dtype, compress=True),
+                                    timestamps=self._require_dataset(group, 'timestamps', (), np.float64, compress=True),
+                                    time_index=self._require_dataset(group, 'time_index', (), TIME_INDEX_DTYPE, compress=False),
+                                    block_values=np.zeros((self.chunk_samples, channel_count), dtype=dtype), block_timestamps=np.zeros(self.chunk_samples, dtype=np.float64))
+            state.n_written = state.timestamps.shape[0]
+            self._streams[stream_name] = state
+            logger.info(f'storing stream {stream_name!r} in {self.path} ({channel_count} x {channel_format})')
+
+
+    def on_sample(self, stream_name: str, sample: Sequence[float], timestamp: float):
+        with self._lock:
+            state = self._streams.get(stream_name)
+            if (state is None) or (not self.is_open):
+                return
+            i = state.n_buffered
+            state.block_timestamps[i] = timestamp
+            state.block_values[i] = sample
+            state.n_buffered += 1
+            if state.n_buffered == self.chunk_samples:
+                self._write_block(state, complete=True)
+            if (timestamp - self._last_flush_time) >= self.flush_interval:
+                self._flush_locked()
+                self._last_flush_time = timestamp
+
+
+    def on_source_stopped(self):
+        self.flush()
+
+
+    def _write_block(self, state: Hdf5StreamState, complete: bool):
+        """ writes the staged samples at the end of the completed blocks; an incomplete block stays staged and is rewritten in place as it fills """
+        n = state.n_buffered
+        if n == 0:
+            return
+        start, stop = state.n_written, state.n_written + n
+        if state.timestamps.shape[0] < stop:
+            state.data.resize(stop, axis=0)
+            state.timestamps.resize(stop, axis=0)
+        state.data[start:stop] = state.block_values[:n]
+        state.timestamps[start:stop] = state.block_timestamps[:n]
+        if not state.block_indexed:
+            n_index = state.time_index.shape[0]
+            state.time_index.resize(n_index + 1, axis=0)
+            state.time_index[n_index] = (state.block_timestamps[0], start)
+            state.block_indexed = True
+        if complete:
+            state.n_written = stop
+            state.n_buffered = 0
+            state.block_indexed = False
+
+
+    def _flush_locked(self, complete: bool = False):
+        for a_state in self._streams.values():
+            self._write_block(a_state, complete=complete)
+        self._file.flush()
+
+
+    def flush(self):
+        with self._lock:
+            if self.is_open:
+                self._flush_locked()
+
+
+    def close(self) -> Path:
+        with self._lock:
+            if not self.is_open:
+                return self.path
+            self._flush_locked(complete=True)
+            self._file.close()
+            self.is_open = False
+        logger.info(f'closed {self.path} (' + ', '.join(f'{a_state.name}: {a_state.n_written} samples' for a_state in self._streams.values()) + ')')
+        return self.path
+
+
+    def get_status(self) -> Dict:
+        return {'recording': self.is_open, 'filename': str(self.path), 'streams': self.stream_names,
+                'sample_counts': {a_name: a_state.n_written + a_state.n_buffered for a_name, a_state in self._streams.items()}}
+
+
+def list_hdf5_streams(path: Union[str, Path]) -> Dict[str, Dict]:
+    """ stream name -> attributes and sample count of every stream in a session store """
+    import h5py
+    with h5py.File(path, 'r') as f:
+        return {a_name: {**dict(a_group.attrs), 'n_samples': a_group['timestamps'].shape[0]} for a_name, a_group in f['streams'].items()}
+
+
+def read_hdf5_time_range(path: Union[str, Path], stream_name: str, start: Optional[float] = None, stop: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """ (data, timestamps) of the samples of `stream_name` with `start <= timestamp < stop`; None means unbounded.
+
+    The block index narrows the read to the blocks overlapping the range, so only those chunks are read and decompressed.
+    """
+    import h5py
+    with h5py.File(path, 'r') as f:
+        group = f['streams'][stream_name]
+        n_samples = group['timestamps'].shape[0]
+        index = group['time_index'][()]
+        first, last = 0, n_samples
+        if len(index) > 0:
+            if start is not None:
+                first = int(index['offset'][max(np.searchsorted(index['timestamp'], start, side='right') - 1, 0)])
+            if stop is not None:
+                next_block = np.searchsorted(index['timestamp'], stop, side='left')
+                last = int(index['offset'][next_block]) if next_block < len(index) else n_samples
+        timestamps = group['timestamps'][first:last]
+        lo = np.searchsorted(timestamps, start, side='left') if start is not None else 0
+        hi = np.searchsorted(timestamps, stop, side='left') if stop is not None else len(timestamps)
+        data = group['data'][first + lo:first + hi]
+        return data, timestamps[lo:hi]
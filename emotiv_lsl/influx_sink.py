@@ -0,0 +1,380 @@
+"""
+Long-term trend storage in InfluxDB: per-bucket aggregates of the live streams, written in batches from a background thread.
+
+`InfluxTrendSink` is a `SampleSink`. On the acquisition thread it only copies samples into the current time bucket of their stream (`bucket_seconds`,
+aligned to wall-clock time); completed buckets go to a worker thread, which reduces them to a few line-protocol points:
+    eeg_band_power  one point per EEG channel: absolute delta/theta/alpha/beta/gamma power (Welch periodogram of the de-meaned bucket, uV^2)
+    eeg_quality     one point per channel of the quality stream: mean/min/max of the 0-15 contact quality
+    motion          head-movement fraction (accelerometer vector away from the bucket median, as in `quality_report.MotionStats`), mean and std of
+                    the acceleration magnitude, gyro RMS
+Every point is tagged with `stream`, `source_id` and the sink's `tags` (e.g. subject, session).
+
+The worker writes the pending points in batches of up to `batch_size` lines every `flush_interval` seconds with `influxdb_client`'s synchronous write
+API (its own batching is not used, so that failures are seen here). A failed write is retried with exponential backoff (`retry_interval`, doubling up to
+`max_retry_interval`) while points keep accumulating. The in-memory buffer is bounded by `max_buffer_lines`; beyond it the oldest lines are spilled to
+line-protocol files in `spill_directory` (dropped and counted if it is None), which are replayed, oldest first, once writes succeed again. `close` spills
+whatever could not be written, so the next sink using the same directory sends it.
+
+Usage:
+    sink = InfluxTrendSink(url='http://localhost:8086', token='...', org='lab', bucket='emotiv_trends', tags={'subject': 'S01'}, spill_directory='influx_spill')
+    emotiv.add_sample_sink(sink)
+    ...
+    emotiv.remove_sample_sink(sink)
+    sink.close()
+"""
+import collections
+import logging
+import math
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pylsl
+from pylsl import StreamInfo
+from attrs import define, field
+
+from emotiv_lsl.sample_sink import SampleSink
+from emotiv_lsl.hdf5_store import get_stream_channel_labels
+from emotiv_lsl.decoded_chunk import MOTION_CHANNEL_NAMES
+from emotiv_lsl.quality_report import EEG_STREAM_NAME, QUALITY_STREAM_NAME, MOTION_STREAM_NAME, MotionStats, eeg_signal_columns
+
+logger = logging.getLogger(__name__)
+
+INFLUX_BANDS: Dict[str, Tuple[float, float]] = {'delta': (1.0, 4.0), 'theta': (4.0, 8.0), 'alpha': (8.0, 12.0), 'beta': (12.0, 30.0), 'gamma': (30.0, 45.0)}
+SPILL_FILE_PREFIX: str = 'influx_spill_'
+SPILL_FILE_SUFFIX: str = '.lp'
+MIN_BUCKET_SAMPLES: int = 16 ## shorter buckets (start/end of a session) are not aggregated
+
+
+def _escape(value: str, characters: str = ', =') -> str:
+    for a_character in ('\\',) + tuple(characters):
+        value = value.replace(a_character, '\\' + a_character)
+    return value
+
+
+def format_line_protocol(measurement: str, tags: Dict[str, str], fields: Dict[str, Union[float, int]], timestamp_ns: int) -> Optional[str]:
+    """ one line-protocol point; non-finite float fields are left out (InfluxDB rejects them), and None is returned if no field is left """
+    formatted_fields = []
+    for a_key, a_value in fields.items():
+        if isinstance(a_value, (int, np.integer)) and not isinstance(a_value, bool):
+            formatted_fields.append(f'{_escape(a_key)}={int(a_value)}i')
+        elif math.isfinite(a_value):
+            formatted_fields.append(f'{_escape(a_key)}={float(a_value)!r}')
+    if not formatted_fields:
+        return None
+    formatted_tags = ''.join(f',{_escape(a_key)}={_escape(str(a_value))}' for a_key, a_value in sorted(tags.items()) if str(a_value) != '')
+    return f"{_escape(measurement, ', ')}{formatted_tags} {','.join(formatted_fields)} {timestamp_ns}"
+
+
+def eeg_band_power_fields(values: np.ndarray, srate: float) -> List[Dict[str, float]]:
+    """ per channel, the absolute power of each of `INFLUX_BANDS` (value units squared) """
+    from scipy.signal import welch
+    frequencies, psd = welch(values - values.mean(axis=0), fs=srate, nperseg=min(len(values), int(2 * srate)), axis=0)
+    resolution = frequencies[1] - frequencies[0]
+    powers = {a_band: psd[(frequencies >= low) & (frequencies < high)].sum(axis=0) * resolution for a_band, (low, high) in INFLUX_BANDS.items()}
+    return [{a_band: float(powers[a_band][i]) for a_band in INFLUX_BANDS} for i in range(values.shape[1])]
+
+
+@define(slots=False)
+class TrendBucket:
+    """ samples of one stream in one time bucket, handed to the worker """
+    stream_name: str = field()
+    start: float = field() ## wall-clock seconds
+    timestamps: np.ndarray = field()
+    values: np.ndarray = field()
+
+
+@define(slots=False)
+class TrendStream:
+    """ per-stream staging of an `InfluxTrendSink` """
+    name: str = field()
+    nominal_srate: float = field()
+    channel_labels: List[str] = field()
+    tags: Dict[str, str] = field()
+    block_values: np.ndarray = field()
+    block_timestamps: np.ndarray = field()
+    n_staged: int = field(default=0)
+    bucket_index: Optional[int] = field(default=None)
+
+
+@define(slots=False)
+class InfluxTrendSink(SampleSink):
+    """ Aggregates the EEG, quality and motion streams into time buckets and writes them to InfluxDB; see the module docstring. """
+    url: str = field(default='http://localhost:8086')
+    token: Optional[str] = field(default=None)
+    org: Optional[str] = field(default=None)
+    bucket: str = field(default='emotiv')
+    tags: Dict[str, str] = field(factory=dict)
+    bucket_seconds: float = field(default=10.0)
+    batch_size: int = field(default=5000) ## lines per write
+    flush_interval: float = field(default=5.0)
+    retry_interval: float = field(default=1.0)
+    max_retry_interval: float = field(default=60.0)
+    max_buffer_lines: int = field(default=100_000)
+    spill_directory: Optional[Path] = field(default=None, converter=lambda value: (Path(value) if value is not None else None))
+    timeout: float = field(default=10.0) ## seconds per HTTP request
+    eeg_stream_name: str = field(default=EEG_STREAM_NAME)
+    quality_stream_name: str = field(default=QUALITY_STREAM_NAME)
+    motion_stream_name: str = field(default=MOTION_STREAM_NAME)
+
+    is_open: bool = field(default=True, init=False)
+    lines_written: int = field(default=0, init=False)
+    batches_written: int = field(default=0, init=False)
+    write_failures: int = field(default=0, init=False)
+    lines_spilled: int = field(default=0, init=False)
+    lines_dropped: int = field(default=0, init=False)
+    last_error: Optional[str] = field(default=None, init=False)
+    _streams: Dict[str, TrendStream] = field(factory=dict, init=False)
+    _buckets: queue.Queue = field(factory=queue.Queue, init=False) ## `TrendBucket`s for the worker; None stops it
+    _pending: Deque[str] = field(factory=collections.deque, init=False) ## line-protocol lines not written yet, oldest first
+    _pending_lock: threading.Lock = field(factory=threading.Lock, init=False)
+    _write_lock: threading.Lock = field(factory=threading.Lock, init=False) ## one writer at a time: the worker, or `flush`/`close`
+    _worker: Optional[threading.Thread] = field(default=None, init=False)
+    _clock_offset: float = field(default=0.0, init=False) ## wall-clock minus LSL time
+    _retry_delay: float = field(default=0.0, init=False)
+    _next_attempt: float = field(default=0.0, init=False)
+    _spill_sequence: int = field(default=0, init=False)
+    _client: object = field(default=None, init=False)
+    _write_api: object = field(default=None, init=False)
+
+    def __attrs_post_init__(self):
+        self._clock_offset = time.time() - pylsl.local_clock()
+        if self.spill_directory is not None:
+            self.spill_directory.mkdir(parents=True, exist_ok=True)
+        self._worker = threading.Thread(target=self._run_worker, name='InfluxTrendSink', daemon=True)
+        self._worker.start()
+
+
+    @property
+    def stream_names(self) -> List[str]:
+        return list(self._streams.keys())
+
+
+    ## acquisition side ________________________________________________________________________________________________________________________ #
+    def on_stream_started(self, stream_name: str, info: StreamInfo):
+        if stream_name not in (self.eeg_stream_name, self.quality_stream_name, self.motion_stream_name):
+            return
+        if stream_name in self._streams:
+            return
+        srate = info.nominal_srate()
+        capacity = int(math.ceil(self.bucket_seconds * (srate if srate > 0 else 128.0) * 1.25)) + 1
+        self._streams[stream_name] = TrendStream(name=stream_name, nominal_srate=srate, channel_labels=get_stream_channel_labels(info),
+                                                 tags={**self.tags, 'stream': stream_name, 'source_id': info.source_id()},
+                                                 block_values=np.zeros((capacity, info.channel_count()), dtype=np.float64), block_timestamps=np.zeros(capacity, dtype=np.float64))
+        logger.info(f'aggregating stream {stream_name!r} into {self.bucket_seconds:g} s buckets for InfluxDB bucket {self.bucket!r}')
+
+
+    def on_sample(self, stream_name: str, sample: Sequence[float], timestamp: float):
+        a_stream = self._streams.get(stream_name)
+        if (a_stream is None) or (not self.is_open):
+            return
+        bucket_index = int((timestamp + self._clock_offset) // self.bucket_seconds)
+        if (bucket_index != a_stream.bucket_index) or (a_stream.n_staged == len(a_stream.block_timestamps)):
+            self._hand_off(a_stream)
+            a_stream.bucket_index = bucket_index
+        i = a_stream.n_staged
+        a_stream.block_values[i] = sample
+        a_stream.block_timestamps[i] = timestamp
+        a_stream.n_staged += 1
+
+
+    def on_source_stopped(self):
+        for a_stream in list(self._streams.values()):
+            self._hand_off(a_stream)
+
+
+    def _hand_off(self, a_stream: TrendStream):
+        n = a_stream.n_staged
+        if n == 0:
+            return
+        self._buckets.put(TrendBucket(stream_name=a_stream.name, start=a_stream.bucket_index * self.bucket_seconds,
+                                      timestamps=a_stream.block_timestamps[:n].copy(), values=a_stream.block_values[:n].copy()))
+        a_stream.n_staged = 0
+
+
+    ## worker side _____________________________________________________________________________________________________________________________ #
+    def aggregate(self, a_bucket: TrendBucket) -> List[str]:
+        """ line-protocol points of one bucket """
+        a_stream = self._streams[a_bucket.stream_name]
+        values = a_bucket.values
+        if len(values) < MIN_BUCKET_SAMPLES:
+            return []
+        timestamp_ns = int(round(a_bucket.start * 1e9))
+        srate = a_stream.nominal_srate if a_stream.nominal_srate > 0 else (len(values) - 1) / max(a_bucket.timestamps[-1] - a_bucket.timestamps[0], 1e-9)
+        points = []
+        if a_bucket.stream_name == self.eeg_stream_name:
+            columns = eeg_signal_columns(a_stream.channel_labels)
+            for a_label, some_fields in zip([a_stream.channel_labels[i] for i in columns], eeg_band_power_fields(values[:, columns], srate)):
+                points.append(format_line_protocol('eeg_band_power', {**a_stream.tags, 'channel': a_label}, {**some_fields, 'n_samples': len(values)}, timestamp_ns))
+        elif a_bucket.stream_name == self.quality_stream_name:
+            means, minima, maxima = values.mean(axis=0), values.min(axis=0), values.max(axis=0)
+            for i, a_label in enumerate(a_stream.channel_labels):
+                points.append(format_line_protocol('eeg_quality', {**a_stream.tags, 'channel': a_label}, {'mean': means[i], 'min': minima[i], 'max': maxima[i]}, timestamp_ns))
+        elif a_bucket.stream_name == self.motion_stream_name:
+            motion_stats = MotionStats(channel_labels=a_stream.channel_labels, srate=srate)
+            motion_stats.add(values)
+            some_fields = {'moving_fraction': motion_stats.summary()['artifact_fraction'], 'n_samples': len(values)}
+            labels = a_stream.channel_labels if len(a_stream.channel_labels) == values.shape[1] else MOTION_CHANNEL_NAMES
+            accel_columns = [i for i, a_label in enumerate(labels) if a_label.lower().startswith('acc')]
+            gyro_columns = [i for i, a_label in enumerate(labels) if a_label.lower().startswith('gyro')]
+            if accel_columns:
+                magnitude = np.linalg.norm(values[:, accel_columns], axis=1)
+                some_fields.update(accel_magnitude_mean=magnitude.mean(), accel_magnitude_std=magnitude.std())
+            if gyro_columns:
+                some_fields['gyro_rms'] = float(np.sqrt(np.mean(np.sum(values[:, gyro_columns] ** 2, axis=1))))
+            points.append(format_line_protocol('motion', a_stream.tags, some_fields, timestamp_ns))
+        return [a_point for a_point in points if a_point is not None]
+
+
+    def _run_worker(self):
+        last_flush = time.monotonic()
+        stopping = False
+        while True:
+            try:
+                a_bucket = self._buckets.get(timeout=0.25)
+            except queue.Empty:
+                a_bucket = None
+            else:
+                if a_bucket is None:
+                    stopping = True
+            if a_bucket is not None:
+                try:
+                    lines = self.aggregate(a_bucket)
+                except Exception as e:
+                    logger.error(f'could not aggregate a bucket of {a_bucket.stream_name!r}: {e!r}')
+                    lines = []
+                self._enqueue_lines(lines)
+            now = time.monotonic()
+            if stopping:
+                return
+            if (now >= self._next_attempt) and ((now - last_flush) >= self.flush_interval or len(self._pending) >= self.batch_size):
+                last_flush = now
+                self._write_pending()
+
+
+    def _enqueue_lines(self, lines: List[str]):
+        if not lines:
+            return
+        with self._pending_lock:
+            self._pending.extend(lines)
+            if len(self._pending) > self.max_buffer_lines:
+                ## down to half the bound, so an outage produces a few large spill files rather than one per bucket
+                oldest = [self._pending.popleft() for _ in range(len(self._pending) - self.max_buffer_lines // 2)]
+                self._spill(oldest)
+
+
+    def _spill(self, lines: List[str]):
+        if self.spill_directory is None:
+            self.lines_dropped += len(lines)
+            logger.warning(f'InfluxDB buffer full, dropped {len(lines)} points ({self.lines_dropped} so far)')
+            return
+        self._spill_sequence += 1
+        path = self.spill_directory.joinpath(f'{SPILL_FILE_PREFIX}{time.time_ns()}_{self._spill_sequence:06d}{SPILL_FILE_SUFFIX}')
+        try:
+            path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+        except OSError as e:
+            self.lines_dropped += len(lines)
+            logger.error(f'could not spill {len(lines)} points to {path}: {e}')
+            return
+        self.lines_spilled += len(lines)
+        logger.info(f'spilled {len(lines)} points to {path}')
+
+
+    def spill_files(self) -> List[Path]:
+        """ spill files waiting to be replayed, oldest first """
+        if self.spill_directory is None:
+            return []
+        return sorted(self.spill_directory.glob(f'{SPILL_FILE_PREFIX}*{SPILL_FILE_SUFFIX}'))
+
+
+    def _write_batch(self, lines: List[str]) -> bool:
+        """ one synchronous write; schedules the next attempt with backoff when it fails """
+        try:
+            if self._write_api is None:
+                from influxdb_client import InfluxDBClient
+                from influxdb_client.client.write_api import SYNCHRONOUS
+                self._client = InfluxDBClient(url=self.url, token=self.token, org=self.org, timeout=int(self.timeout * 1000))
+                self._write_api = self._client.write_api(write_options=SYNCHRONOUS)
+            self._write_api.write(bucket=self.bucket, org=self.org, record='\n'.join(lines))
+        except Exception as e:
+            self.write_failures += 1
+            self.last_error = repr(e)
+            self._retry_delay = min(max(2.0 * self._retry_delay, self.retry_interval), self.max_retry_interval)
+            self._next_attempt = time.monotonic() + self._retry_delay
+            logger.warning(f'InfluxDB write of {len(lines)} points failed ({e!r}), retrying in {self._retry_delay:g} s ({len(self._pending)} points buffered)')
+            return False
+        if self._retry_delay > 0:
+            logger.info(f'InfluxDB writes recovered after {self.write_failures} failures')
+        self._retry_delay = 0.0
+        self.lines_written += len(lines)
+        self.batches_written += 1
+        return True
+
+
+    def _write_pending(self) -> bool:
+        """ writes the buffered points, then replays spill files; stops at the first failure. Returns whether everything was written. """
+        with self._write_lock:
+            return self._write_pending_locked()
+
+
+    def _write_pending_locked(self) -> bool:
+        while True:
+            with self._pending_lock:
+                batch = [self._pending[i] for i in range(min(self.batch_size, len(self._pending)))]
+            if not batch:
+                break
+            if not self._write_batch(batch):
+                return False
+            with self._pending_lock:
+                for _ in range(len(batch)):
+                    self._pending.popleft()
+        for a_path in self.spill_files():
+            lines = [a_line for a_line in a_path.read_text(encoding='utf-8').splitlines() if a_line]
+            for start in range(0, len(lines), self.batch_size):
+                if not self._write_batch(lines[start:start + self.batch_size]):
+                    a_path.write_text('\n'.join(lines[start:]) + '\n', encoding='utf-8') ## keep only what is left
+                    return False
+            a_path.unlink()
+            logger.info(f'replayed {len(lines)} spilled points from {a_path.name}')
+        return True
+
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """ waits for the staged buckets to be aggregated and tries to write everything now; returns whether nothing is left unwritten """
+        self.on_source_stopped()
+        deadline = time.monotonic() + timeout
+        while (not self._buckets.empty()) and (time.monotonic() < deadline):
+            time.sleep(0.01)
+        self._next_attempt = 0.0
+        return self._write_pending()
+
+
+    def close(self, timeout: float = 10.0) -> bool:
+        """ aggregates the partial buckets, makes a last write attempt and spills whatever is left. Returns whether everything was written. """
+        if not self.is_open:
+            return True
+        self.on_source_stopped()
+        self.is_open = False
+        self._buckets.put(None)
+        self._worker.join(timeout)
+        written = self._write_pending()
+        if not written:
+            with self._pending_lock:
+                remaining, self._pending = list(self._pending), collections.deque()
+            if remaining:
+                self._spill(remaining)
+        if self._client is not None:
+            self._client.close()
+        logger.info(f'closed InfluxDB sink ({self.lines_written} points written in {self.batches_written} batches, {self.write_failures} failed writes, '
+                    f'{self.lines_spilled} spilled, {self.lines_dropped} dropped)')
+        return written
+
+
+    def get_status(self) -> Dict:
+        return {'open': self.is_open, 'url': self.url, 'bucket': self.bucket, 'streams': self.stream_names, 'buffered_lines': len(self._pending),
+                'buckets_queued': self._buckets.qsize(), 'lines_written': self.lines_written, 'batches_written': self.batches_written, 'write_failures': self.write_failures,
+                'retry_delay': self._retry_delay, 'last_error': self.last_error, 'lines_spilled': self.lines_spilled, 'lines_dropped': self.lines_dropped,
+                'spill_files': [str(a_path) for a_path in self.spill_files()]}
@@ -0,0 +1,183 @@
+"""
+AES key recovery for Epoc X captures whose dongle serial number is unknown.
+
+`EmotivEpocX.get_crypto_key` only uses the last four characters of the serial (`CRYPTO_KEY_SERIAL_POSITIONS`), so the key space is |alphabet|^4.
+The search runs in two stages:
+    1. screen: every candidate decrypts the first 16-byte block of a few captured packets. Keys are built and plaintexts scored as whole NumPy batches
+        (packet-type marker byte is 16/32, EEG high bytes sit near the 128 midpoint of `convertEPOC_PLUS`), split across a process pool by the first serial character.
+    2. confirm: survivors decrypt a longer run of packets and are scored on EEG/motion packet-counter continuity.
+
+Usage:
+    python -m emotiv_lsl.key_search capture.pcapng
+    python -m emotiv_lsl.key_search capture.emraw --pattern '??B1' --alphabet 0123456789ABCDEF
+"""
+import argparse
+import itertools
+import logging
+import os
+import string
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+from attrs import define, field
+from Crypto.Cipher import AES
+
+from emotiv_lsl.emotiv_epoc_x import CRYPTO_KEY_SERIAL_POSITIONS, EEG_PACKET_MARKER, MOTION_PACKET_MARKER, EEG_COUNTER_MODULUS, MOTION_COUNTER_MODULUS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SERIAL_ALPHABET: str = string.digits + string.ascii_uppercase
+
+## positions of the 4 serial tail characters (sn[-4], sn[-3], sn[-2], sn[-1]) for each key byte
+_KEY_TAIL_INDEX = np.array([4 + i for i in CRYPTO_KEY_SERIAL_POSITIONS])
+## EEG high bytes within the first 16-byte block
+_FIRST_BLOCK_EEG_HIGH_BYTES = np.array([3, 5, 7, 9, 11, 13, 15])
+
+
+@define(slots=False)
+class KeyCandidate:
+    key: bytes = field()
+    serial_tail: str = field() ## last four serial characters
+    screen_score: float = field(default=0.0)
+    confidence: float = field(default=0.0)
+
+    def __str__(self) -> str:
+        return f"key: {self.key.decode('latin-1')!r} (hex {self.key.hex()}), serial ends with {self.serial_tail!r}, confidence: {self.confidence:.3f}"
+
+
+def keys_for_serial_tails(tails: np.ndarray) -> np.ndarray:
+    """ (n, 4) uint8 serial tails -> (n, 16) uint8 AES keys, applying the same permutation as `EmotivEpocX.get_crypto_key` """
+    return tails[:, _KEY_TAIL_INDEX]
+
+
+def score_first_blocks(plain: np.ndarray, high_byte_window: int = 24) -> np.ndarray:
+    """ Plausibility of a (n_candidates, n_packets, 16) batch of decrypted first blocks, in [0, 1] per candidate. """
+    marker = plain[:, :, 1]
+    is_eeg = (marker == EEG_PACKET_MARKER)
+    marker_score = (is_eeg | (marker == MOTION_PACKET_MARKER)).mean(axis=1)
+    high = plain[:, :, _FIRST_BLOCK_EEG_HIGH_BYTES].astype(np.int16)
+    plausible_high = (np.abs(high - 128) <= high_byte_window).mean(axis=2)
+    n_eeg = is_eeg.sum(axis=1)
+    high_score = np.where(n_eeg > 0, (plausible_high * is_eeg).sum(axis=1) / np.maximum(n_eeg, 1), 0.0)
+    return 0.5 * marker_score + 0.5 * high_score
+
+
+def counter_continuity(counters: np.ndarray, modulus: int) -> float:
+    """ fraction of consecutive counter steps equal to +1 (mod `modulus`) """
+    if len(counters) < 2:
+        return float('nan')
+    return float(np.mean((np.diff(counters.astype(np.int64)) % modulus) == 1))
+
+
+def confirm_candidate(packets: np.ndarray, key: bytes) -> float:
+    """ decrypts a longer run of (n, 32) raw reports with `key` and scores marker validity and EEG/motion counter continuity, in [0, 1] """
+    packets = np.ascontiguousarray(packets, dtype=np.uint8)
+    plain = np.frombuffer(AES.new(key, AES.MODE_ECB).decrypt((packets ^ 0x55).tobytes()), dtype=np.uint8).reshape(-1, 32)
+    is_eeg = (plain[:, 1] == EEG_PACKET_MARKER)
+    is_motion = (plain[:, 1] == MOTION_PACKET_MARKER)
+    scores = [float(np.mean(is_eeg | is_motion)), counter_continuity(plain[is_eeg, 0], EEG_COUNTER_MODULUS)]
+    if np.count_nonzero(is_motion) >= 2:
+        scores.append(counter_continuity(plain[is_motion, 0], MOTION_COUNTER_MODULUS))
+    scores = [a_score for a_score in scores if not np.isnan(a_score)]
+    return float(np.mean(scores)) if (np.count_nonzero(is_eeg) >= 2) else 0.0
+
+
+def _iter_tail_batches(first_char: int, alphabet: bytes, pattern: bytes, batch_size: int):
+    """ yields (n, 4) uint8 batches of serial tails starting with `first_char` that match `pattern` ('?' is a wildcard) """
+    choices = [bytes([first_char])] + [(alphabet if a_char == ord('?') else bytes([a_char])) for a_char in pattern[1:]]
+    product = itertools.product(*choices)
+    while True:
+        batch = list(itertools.islice(product, batch_size))
+        if len(batch) == 0:
+            return
+        yield np.array(batch, dtype=np.uint8)
+
+
+def _screen_partition(args) -> Tuple[int, List[Tuple[bytes, float]]]:
+    """ worker: screens every candidate whose serial tail starts with `first_char` """
+    first_char, alphabet, pattern, first_blocks, min_screen_score, batch_size = args
+    n_bytes = len(first_blocks)
+    n_packets = n_bytes // 16
+    survivors = []
+    n_tested = 0
+    for tails in _iter_tail_batches(first_char, alphabet, pattern, batch_size):
+        keys = keys_for_serial_tails(tails)
+        key_bytes = keys.tobytes()
+        out = bytearray(len(tails) * n_bytes)
+        out_view = memoryview(out)
+        for j in range(len(tails)):
+            AES.new(key_bytes[j * 16:(j + 1) * 16], AES.MODE_ECB).decrypt(first_blocks, output=out_view[j * n_bytes:(j + 1) * n_bytes])
+        scores = score_first_blocks(np.frombuffer(out, dtype=np.uint8).reshape(len(tails), n_packets, 16))
+        for j in np.flatnonzero(scores >= min_screen_score):
+            survivors.append((bytes(keys[j]), float(scores[j])))
+        n_tested += len(tails)
+    return n_tested, survivors
+
+
+def search_crypto_key(packets: np.ndarray, alphabet: str = DEFAULT_SERIAL_ALPHABET, pattern: str = '????', n_screen_packets: int = 8, n_confirm_packets: int = 512,
+                      min_screen_score: float = 0.6, min_confidence: float = 0.9, n_workers: Optional[int] = None, batch_size: int = 4096) -> List[KeyCandidate]:
+    """ Searches the serial tail space for keys that decrypt `packets` ((n, 32) raw reports) into plausible Epoc X data.
+
+    `pattern` constrains the last four serial characters (sn[-4], sn[-3], sn[-2], sn[-1]); '?' is a wildcard, anything else is fixed.
+    Returns the confirmed candidates, best first.
+    """
+    packets = np.ascontiguousarray(packets, dtype=np.uint8).reshape(-1, 32)
+    if len(packets) < n_screen_packets:
+        raise ValueError(f'need at least {n_screen_packets} packets, got {len(packets)}')
+    if len(pattern) != 4:
+        raise ValueError(f"pattern must have 4 characters (sn[-4] .. sn[-1]), got {pattern!r}")
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    alphabet_bytes = alphabet.encode('latin-1')
+    pattern_bytes = pattern.encode('latin-1')
+    first_blocks = (packets[:n_screen_packets, :16] ^ 0x55).tobytes()
+    first_chars = alphabet_bytes if pattern_bytes[0] == ord('?') else pattern_bytes[:1]
+    tasks = [(a_char, alphabet_bytes, pattern_bytes, first_blocks, min_screen_score, batch_size) for a_char in first_chars]
+
+    start_time = time.perf_counter()
+    if n_workers == 1:
+        results = [_screen_partition(a_task) for a_task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(tasks))) as executor:
+            results = list(executor.map(_screen_partition, tasks))
+    n_tested = sum(n for n, _survivors in results)
+    survivors = [a_survivor for _n, a_survivors in results for a_survivor in a_survivors]
+    elapsed = time.perf_counter() - start_time
+    logger.info(f'screened {n_tested} candidates in {elapsed:.2f} s ({n_tested / max(elapsed, 1e-9):,.0f} keys/s), {len(survivors)} survivor(s)')
+
+    confirm_packets = packets[:n_confirm_packets]
+    candidates = []
+    for key, screen_score in survivors:
+        confidence = confirm_candidate(confirm_packets, key)
+        if confidence >= min_confidence:
+            tail = ''.join(chr(key[CRYPTO_KEY_SERIAL_POSITIONS.index(-k)]) for k in (4, 3, 2, 1))
+            candidates.append(KeyCandidate(key=key, serial_tail=tail, screen_score=screen_score, confidence=confidence))
+    return sorted(candidates, key=lambda a_candidate: -a_candidate.confidence)
+
+
+def main():
+    from emotiv_lsl.bulk_decoder import load_capture_packets
+
+    parser = argparse.ArgumentParser(description='Recover the Epoc X AES key from a capture when the dongle serial number is unknown.')
+    parser.add_argument('capture', type=str, help='Capture file (.emraw, .pcap, .pcapng, .npy or .npz)')
+    parser.add_argument('--alphabet', type=str, default=DEFAULT_SERIAL_ALPHABET, help='Candidate serial characters (default: 0-9A-Z)')
+    parser.add_argument('--pattern', type=str, default='????', help="Known serial tail characters sn[-4..-1], '?' for unknown (default: '????')")
+    parser.add_argument('--skip', type=int, default=0, help='Skip this many packets at the start of the capture')
+    parser.add_argument('--workers', '-j', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser.add_argument('--min-confidence', type=float, default=0.9)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    packets, _timestamps = load_capture_packets(args.capture)
+    candidates = search_crypto_key(np.asarray(packets[args.skip:]), alphabet=args.alphabet, pattern=args.pattern, n_workers=args.workers, min_confidence=args.min_confidence)
+    if len(candidates) == 0:
+        print('No key found. Try a wider --alphabet or more packets (--skip past any startup noise).')
+    for a_candidate in candidates:
+        print(a_candidate)
+
+
+if __name__ == '__main__':
+    main()
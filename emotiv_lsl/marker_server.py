@@ -0,0 +1,307 @@
+"""
+Marker endpoint of a running acquisition process, so event markers share the EEG samples' clock.
+
+`EmotivBase.inject_marker(label)` is the in-process call: it stamps the marker with `pylsl.local_clock()` (the clock `main_loop` stamps every
+packet with) and queues it; `main_loop` publishes it on the `Epoc X Markers` string stream (through the sinks, like any other sample) before the
+next packet, and with `enable_marker_event_channel` also writes its sequence number into an extra `MARKER` channel of the first EEG sample stamped
+at or after it. `MarkerServer` exposes the same call to other processes on a Unix domain socket (`path`) or, where those are unavailable or
+`path` is None, on a loopback TCP port. The protocol is one UTF-8 line per request and one JSON line per reply:
+    {"label": "stim/onset", "timestamp": 1234.5}   inject a marker ("timestamp" is optional, `pylsl.local_clock()` seconds, e.g. a display flip time)
+    stim/onset                                     same, a plain line is the label
+    {"ping": true}                                 round trip only, nothing is injected
+    reply                                          {"seq": 12, "timestamp": 1234.5, "received": 1234.50002} or {"error": "..."}
+
+`MarkerClient.send` measures the round trip of every request; `get_latency_stats()` summarizes them, and the server logs the delay from injection
+to publishing (`EmotivBase.get_marker_stats()`) when it stops.
+
+Usage:
+    emotiv = EmotivEpocX(enable_marker_server=True) ## main_loop starts a MarkerServer on DEFAULT_MARKER_SOCKET_PATH
+    emotiv.inject_marker('rest/start') ## in-process
+
+    client = MarkerClient() ## from the stimulus program
+    ack = client.send('stim/onset')
+    print(ack.seq, ack.timestamp, ack.round_trip, client.get_latency_stats())
+
+    python -m emotiv_lsl.marker_server [--path /tmp/emotiv_lsl_markers.sock | --port 16573] ## runs the headset with the marker server
+    python -m emotiv_lsl.marker_server --send stim/onset ## injects one marker into a running acquisition
+    python -m emotiv_lsl.marker_server --benchmark 1000 ## measures round-trip latency with pings
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pylsl
+from attrs import define, field
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MARKER_PORT: int = 16573
+## Unix domain socket path used by default, None where the platform has no AF_UNIX (TCP on DEFAULT_MARKER_PORT is used instead)
+DEFAULT_MARKER_SOCKET_PATH: Optional[str] = os.path.join(tempfile.gettempdir(), 'emotiv_lsl_markers.sock') if hasattr(socket, 'AF_UNIX') else None
+MAX_MARKER_LINE_BYTES: int = 4096
+
+
+def summarize_latencies(latencies: Sequence[float]) -> Dict[str, float]:
+    """ count and percentiles (in milliseconds) of a list of latencies in seconds """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    if len(latencies) == 0:
+        return {'n': 0}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1e3
+    return {'n': len(latencies), 'mean_ms': float(latencies.mean() * 1e3), 'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(latencies.max() * 1e3)}
+
+
+def parse_marker_request(line: bytes) -> Dict[str, Any]:
+    """ decodes one request line: a JSON object, or a plain label """
+    text = line.decode('utf-8').strip()
+    if text.startswith('{'):
+        request = json.loads(text)
+        if not isinstance(request, dict):
+            raise ValueError('request must be a JSON object')
+        return request
+    return {'label': text}
+
+
+class _MarkerRequestHandler(socketserver.StreamRequestHandler):
+    """ one connection: answers each request line with one JSON line, until the client disconnects """
+
+    def setup(self):
+        super().setup()
+        if self.connection.family != getattr(socket, 'AF_UNIX', None):
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        emotiv = self.server.emotiv
+        for line in iter(lambda: self.rfile.readline(MAX_MARKER_LINE_BYTES), b''):
+            received = pylsl.local_clock()
+            try:
+                request = parse_marker_request(line)
+                if request.get('ping'):
+                    reply = {'timestamp': received, 'received': received}
+                else:
+                    label = request.get('label')
+                    if not isinstance(label, str) or (not label):
+                        raise ValueError('missing "label"')
+                    timestamp = request.get('timestamp')
+                    seq, timestamp = emotiv.inject_marker(label, timestamp=(float(timestamp) if timestamp is not None else received))
+                    reply = {'seq': seq, 'timestamp': timestamp, 'received': received}
+            except Exception as e:
+                reply = {'error': str(e)}
+            self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+
+class _ThreadingTCPMarkerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class _ThreadingUnixMarkerServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+@define(slots=False)
+class MarkerServer:
+    """ Accepts markers from other processes and injects them with `emotiv.inject_marker`, see the module docstring for the protocol.
+
+    Usage:
+        server = MarkerServer(emotiv=emotiv)
+        server.start()
+        ...
+        server.stop()
+    """
+    emotiv: Any = field() ## the `EmotivBase` whose `main_loop` publishes the markers
+    path: Optional[str] = field(default=DEFAULT_MARKER_SOCKET_PATH) ## Unix domain socket path, None to listen on TCP instead
+    host: str = field(default='127.0.0.1')
+    port: int = field(default=DEFAULT_MARKER_PORT)
+
+    _server: Optional[socketserver.BaseServer] = field(default=None, init=False)
+    _thread: Optional[threading.Thread] = field(default=None, init=False)
+
+    @property
+    def address(self) -> str:
+        return self.path if self.path is not None else f'{self.host}:{self.port}'
+
+    @property
+    def is_running(self) -> bool:
+        return (self._thread is not None) and self._thread.is_alive()
+
+
+    def start(self):
+        if self.is_running:
+            return
+        if self.path is not None:
+            if not hasattr(socketserver, 'ThreadingUnixStreamServer'):
+                raise OSError('Unix domain sockets are not available on this platform, use path=None for TCP')
+            if os.path.exists(self.path):
+                if not stat.S_ISSOCK(os.stat(self.path).st_mode):
+                    raise FileExistsError(f'{self.path} exists and is not a socket')
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(self.path)
+                except ConnectionRefusedError:
+                    os.unlink(self.path) ## stale socket of a previous run, nobody listens on it
+                else:
+                    raise OSError(f'another marker server is listening on {self.path}')
+                finally:
+                    probe.close()
+            self._server = _ThreadingUnixMarkerServer(self.path, _MarkerRequestHandler)
+        else:
+            self._server = _ThreadingTCPMarkerServer((self.host, self.port), _MarkerRequestHandler)
+            self.port = self._server.server_address[1] ## port 0 picks a free one
+        self._server.emotiv = self.emotiv
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.2}, name='MarkerServer', daemon=True)
+        self._thread.start()
+        logger.info(f'accepting markers on {self.address}')
+
+
+    def stop(self, timeout: float = 5.0):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._server = None
+        self._thread = None
+        if (self.path is not None) and os.path.exists(self.path):
+            os.unlink(self.path)
+        logger.info(f'stopped accepting markers on {self.address}, {self.emotiv.get_marker_stats()}')
+
+
+
+@define(slots=False)
+class MarkerAck:
+    seq: Optional[int] = field() ## sequence number of the marker in the markers stream (1-based), None for a ping
+    timestamp: float = field() ## `pylsl.local_clock()` time the marker was stamped with
+    sent: float = field() ## `pylsl.local_clock()` time the client sent the request
+    received: float = field() ## `pylsl.local_clock()` time the server read the request
+    round_trip: float = field() ## seconds from sending the request to reading the reply
+
+    @property
+    def delivery_delay(self) -> float:
+        """ one-way seconds from sending the request until the server read it (`local_clock` is shared by all processes on a host) """
+        return self.received - self.sent
+
+
+@define(slots=False)
+class MarkerClient:
+    """ Sends markers to a `MarkerServer` over one persistent connection (not thread-safe, use one client per thread).
+
+    Usage:
+        client = MarkerClient() ## or MarkerClient(path=None, port=16573) for TCP
+        ack = client.send('stim/onset')
+        client.close()
+    """
+    path: Optional[str] = field(default=DEFAULT_MARKER_SOCKET_PATH)
+    host: str = field(default='127.0.0.1')
+    port: int = field(default=DEFAULT_MARKER_PORT)
+    timeout: float = field(default=2.0)
+    max_latencies: int = field(default=10000) ## round trips kept for `get_latency_stats`
+
+    _socket: Optional[socket.socket] = field(default=None, init=False)
+    _reader: Any = field(default=None, init=False)
+    _round_trips: List[float] = field(factory=list, init=False)
+
+
+    def connect(self):
+        if self._socket is not None:
+            return
+        if self.path is not None:
+            a_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            a_socket.settimeout(self.timeout)
+            a_socket.connect(self.path)
+        else:
+            a_socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            a_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket = a_socket
+        self._reader = a_socket.makefile('rb')
+
+
+    def close(self):
+        if self._socket is not None:
+            self._reader.close()
+            self._socket.close()
+        self._socket = None
+        self._reader = None
+
+
+    def _request(self, request: Dict[str, Any]) -> MarkerAck:
+        self.connect()
+        sent = pylsl.local_clock()
+        self._socket.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        line = self._reader.readline()
+        round_trip = pylsl.local_clock() - sent
+        if not line:
+            self.close()
+            raise ConnectionError('marker server closed the connection')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise ValueError(f'marker server rejected {request!r}: {reply["error"]}')
+        self._round_trips.append(round_trip)
+        if len(self._round_trips) > self.max_latencies:
+            del self._round_trips[:len(self._round_trips) - self.max_latencies]
+        return MarkerAck(seq=reply.get('seq'), timestamp=reply['timestamp'], sent=sent, received=reply['received'], round_trip=round_trip)
+
+
+    def send(self, label: str, timestamp: Optional[float] = None) -> MarkerAck:
+        """ injects a marker, stamped by the server on arrival unless `timestamp` (`pylsl.local_clock()` seconds) is given """
+        request = {'label': label}
+        if timestamp is not None:
+            request['timestamp'] = timestamp
+        return self._request(request)
+
+
+    def ping(self) -> MarkerAck:
+        """ a round trip that injects nothing """
+        return self._request({'ping': True})
+
+
+    def get_latency_stats(self) -> Dict[str, float]:
+        """ round-trip latency of the requests sent so far """
+        return summarize_latencies(self._round_trips)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the Emotiv headset with a marker endpoint, or send markers to a running one.')
+    parser.add_argument('--path', type=str, default=DEFAULT_MARKER_SOCKET_PATH, help=f'Unix domain socket path (default: {DEFAULT_MARKER_SOCKET_PATH})')
+    parser.add_argument('--port', type=int, default=None, help=f'Use loopback TCP on this port instead of the Unix socket (e.g. {DEFAULT_MARKER_PORT})')
+    parser.add_argument('--event-channel', action='store_true', help='Also write marker sequence numbers into an extra MARKER channel of the EEG stream')
+    parser.add_argument('--send', type=str, default=None, metavar='LABEL', help='Send one marker to a running acquisition and exit')
+    parser.add_argument('--benchmark', type=int, default=0, metavar='N', help='Measure the round-trip latency of N pings to a running acquisition and exit')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    path = args.path if args.port is None else None
+    port = args.port if args.port is not None else DEFAULT_MARKER_PORT
+
+    if args.send or args.benchmark:
+        client = MarkerClient(path=path, port=port)
+        try:
+            if args.send:
+                ack = client.send(args.send)
+                print(f'marker #{ack.seq} {args.send!r} stamped at {ack.timestamp:.6f}, round trip {ack.round_trip * 1e3:.3f} ms')
+            for _ in range(args.benchmark):
+                client.ping()
+            print(json.dumps(client.get_latency_stats(), indent=1))
+        finally:
+            client.close()
+        return
+
+    from emotiv_lsl.emotiv_epoc_x import EmotivEpocX
+    emotiv = EmotivEpocX(enable_marker_server=True, marker_server_path=path, marker_server_port=port, enable_marker_event_channel=args.event_channel)
+    try:
+        emotiv.main_loop()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
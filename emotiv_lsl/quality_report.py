@@ -0,0 +1,527 @@
+"""
+Per-session signal quality reports, computed in vectorized blocks.
+
+Replaces eyeballing sessions in `pho_analyze.ipynb`: `build_quality_report` reads the EEG, electrode-quality and motion streams of one recording
+(native XDF or HDF5 session store) `block_seconds` at a time, carrying state between blocks, and reports
+    - per EEG channel: flat-line runs (identical consecutive values for at least `flat_min_seconds`), saturation at the conversion limits of
+      `convertEPOC_PLUS`, line-noise ratio (power within 1 Hz of 50 and 60 Hz over the 1 Hz..Nyquist power, from an averaged Hann periodogram) and spread;
+    - per quality channel: the histogram of quality levels, the mean, and the mean over time in `timeline_seconds` bins;
+    - the fraction of motion samples flagged as head movement: acceleration more than `accel_threshold` g away from its block median (which also catches
+      tilts), or optionally a bias-corrected gyro rate above `gyro_threshold` deg/s. The gyro is off by default, its decoded values being much noisier
+      than the accelerometer's on a still head.
+`write_quality_report` saves it as `<stem>.quality.json` and a self-contained `<stem>.quality.html`; `generate_quality_reports` does so for every
+recording under some directories in parallel, skipping sessions whose report is newer than the recording, and writes a `quality_index.html` overview.
+
+Usage:
+    report = build_quality_report('session.xdf')
+
+    python -m emotiv_lsl.quality_report recordings/ -o reports/ -j 8
+"""
+import argparse
+import html
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from attrs import define, field
+
+from emotiv_lsl.decoded_chunk import EEG_CHANNEL_NAMES, MOTION_CHANNEL_NAMES, MARKER_EVENT_CHANNEL_NAME
+from emotiv_lsl.hdf5_store import HDF5_EXTENSION
+from emotiv_lsl.xdf_writer import XDF_EXTENSION
+
+logger = logging.getLogger(__name__)
+
+EEG_STREAM_NAME: str = 'Epoc X'
+QUALITY_STREAM_NAME: str = 'Epoc X eQuality'
+MOTION_STREAM_NAME: str = 'Epoc X Motion'
+
+## range of `convertEPOC_PLUS(value_1, value_2)` over its two input bytes: (0, 0) and (255, 255)
+EEG_VALUE_MIN: float = (0 * .128205128205129) + 4201.02564096001 + ((0 - 128) * 32.82051289)
+EEG_VALUE_MAX: float = (255 * .128205128205129) + 4201.02564096001 + ((255 - 128) * 32.82051289)
+
+QUALITY_LEVELS: int = 16 ## quality values are 4-bit (see `extractQualityValues`)
+REPORT_JSON_SUFFIX: str = '.quality.json'
+REPORT_HTML_SUFFIX: str = '.quality.html'
+INDEX_FILENAME: str = 'quality_index.html'
+
+
+@define(slots=False)
+class StreamSource:
+    """ what `iter_stream_blocks` needs to know about one stream of a recording """
+    name: str = field()
+    nominal_srate: float = field()
+    channel_labels: List[str] = field()
+    sample_count: int = field()
+
+
+def list_recording_streams(path: Union[str, Path]) -> Dict[str, StreamSource]:
+    """ stream name -> StreamSource for a native XDF file or an HDF5 session store """
+    path = Path(path)
+    if path.suffix == HDF5_EXTENSION:
+        from emotiv_lsl.hdf5_store import list_hdf5_streams
+        return {a_name: StreamSource(name=a_name, nominal_srate=float(attrs.get('nominal_srate', 0.0)), channel_labels=[str(a_label) for a_label in attrs.get('channel_labels', [])],
+                                     sample_count=int(attrs['n_samples'])) for a_name, attrs in list_hdf5_streams(path).items()}
+    from emotiv_lsl.xdf_reader import IndexedXdfFile
+    xdf = IndexedXdfFile.open(path)
+    try:
+        return {a_stream.name: StreamSource(name=a_stream.name, nominal_srate=a_stream.nominal_srate, channel_labels=list(a_stream.channel_labels),
+                                            sample_count=xdf.chunk_index[stream_id].sample_count) for stream_id, a_stream in xdf.streams.items()}
+    finally:
+        xdf.close()
+
+
+def iter_stream_blocks(path: Union[str, Path], stream: StreamSource, block_seconds: float = 60.0) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """ (timestamps, float64 values) of consecutive blocks of about `block_seconds` of one stream """
+    path = Path(path)
+    block_samples = max(int(block_seconds * stream.nominal_srate), 1) if stream.nominal_srate > 0 else 10000
+    if path.suffix == HDF5_EXTENSION:
+        import h5py
+        with h5py.File(path, 'r') as f:
+            group = f['streams'][stream.name]
+            for first in range(0, stream.sample_count, block_samples):
+                yield group['timestamps'][first:first + block_samples], group['data'][first:first + block_samples].astype(np.float64)
+        return
+    from emotiv_lsl.xdf_reader import IndexedXdfFile
+    xdf = IndexedXdfFile.open(path)
+    try:
+        for first in range(0, stream.sample_count, block_samples):
+            timestamps, values = xdf.read_samples(stream.name, first, block_samples)
+            yield timestamps, np.asarray(values, dtype=np.float64)
+    finally:
+        xdf.close()
+
+
+@define(slots=False)
+class EegSignalStats:
+    """ flat-line runs, saturation, line noise and spread of EEG channels, accumulated block by block """
+    channel_labels: List[str] = field()
+    srate: float = field()
+    flat_min_seconds: float = field(default=1.0)
+    saturation_margin: float = field(default=10.0) ## a sample within this of EEG_VALUE_MIN/MAX counts as saturated
+    segment_samples: int = field(default=256) ## periodogram segment length
+    line_freqs: Tuple[float, ...] = field(default=(50.0, 60.0))
+
+    n_samples: int = field(default=0, init=False)
+    _sums: np.ndarray = field(default=None, init=False)
+    _squares: np.ndarray = field(default=None, init=False)
+    _saturated_low: np.ndarray = field(default=None, init=False)
+    _saturated_high: np.ndarray = field(default=None, init=False)
+    ## flat runs: number of consecutive "equal to the previous sample" steps at the end of the data seen so far, per channel
+    _open_run: np.ndarray = field(default=None, init=False)
+    _last_values: Optional[np.ndarray] = field(default=None, init=False)
+    _flat_runs: np.ndarray = field(default=None, init=False)
+    _flat_samples: np.ndarray = field(default=None, init=False)
+    _longest_flat: np.ndarray = field(default=None, init=False)
+    _power_sum: np.ndarray = field(default=None, init=False)
+    _n_segments: int = field(default=0, init=False)
+    _leftover: np.ndarray = field(default=None, init=False)
+
+    def __attrs_post_init__(self):
+        n_channels = len(self.channel_labels)
+        self._sums, self._squares = np.zeros(n_channels), np.zeros(n_channels)
+        self._saturated_low, self._saturated_high = np.zeros(n_channels, dtype=np.int64), np.zeros(n_channels, dtype=np.int64)
+        self._open_run = np.zeros(n_channels, dtype=np.int64)
+        self._flat_runs, self._flat_samples, self._longest_flat = (np.zeros(n_channels, dtype=np.int64) for _ in range(3))
+        self._power_sum = np.zeros((self.segment_samples // 2 + 1, n_channels))
+        self._leftover = np.zeros((0, n_channels))
+
+    @property
+    def flat_min_samples(self) -> int:
+        return max(int(round(self.flat_min_seconds * self.srate)), 2)
+
+
+    def _close_runs(self, channel: int, steps: np.ndarray):
+        """ records finished runs of `steps` equal steps (a run of k steps is k + 1 identical samples) """
+        lengths = steps + 1
+        lengths = lengths[lengths >= self.flat_min_samples]
+        if len(lengths) > 0:
+            self._flat_runs[channel] += len(lengths)
+            self._flat_samples[channel] += int(lengths.sum())
+            self._longest_flat[channel] = max(self._longest_flat[channel], int(lengths.max()))
+
+
+    def add(self, values: np.ndarray):
+        n = len(values)
+        if n == 0:
+            return
+        self.n_samples += n
+        self._sums += values.sum(axis=0)
+        self._squares += np.square(values).sum(axis=0)
+        self._saturated_low += np.count_nonzero(values <= (EEG_VALUE_MIN + self.saturation_margin), axis=0)
+        self._saturated_high += np.count_nonzero(values >= (EEG_VALUE_MAX - self.saturation_margin), axis=0)
+
+        previous = self._last_values if self._last_values is not None else np.full(values.shape[1], np.nan)
+        equal = (np.diff(values, axis=0, prepend=previous[np.newaxis, :]) == 0) ## sample i equals sample i - 1
+        self._last_values = values[-1].copy()
+        padded = np.zeros((n + 2, values.shape[1]), dtype=np.int8)
+        padded[1:-1] = equal
+        edges = np.diff(padded, axis=0)
+        for channel in range(values.shape[1]):
+            starts, ends = np.flatnonzero(edges[:, channel] == 1), np.flatnonzero(edges[:, channel] == -1)
+            steps = ends - starts
+            if len(steps) == 0:
+                self._close_runs(channel, self._open_run[channel:channel + 1])
+                self._open_run[channel] = 0
+                continue
+            if starts[0] == 0:
+                steps[0] += self._open_run[channel]
+            else:
+                self._close_runs(channel, self._open_run[channel:channel + 1])
+            if ends[-1] == n: ## still running at the end of the block
+                self._open_run[channel] = steps[-1]
+                steps = steps[:-1]
+            else:
+                self._open_run[channel] = 0
+            self._close_runs(channel, steps)
+
+        buffer = np.concatenate([self._leftover, values])
+        n_segments = len(buffer) // self.segment_samples
+        if n_segments > 0:
+            segments = buffer[:n_segments * self.segment_samples].reshape(n_segments, self.segment_samples, -1)
+            segments = (segments - segments.mean(axis=1, keepdims=True)) * np.hanning(self.segment_samples)[np.newaxis, :, np.newaxis]
+            self._power_sum += np.square(np.abs(np.fft.rfft(segments, axis=1))).sum(axis=0)
+            self._n_segments += n_segments
+        self._leftover = buffer[n_segments * self.segment_samples:]
+
+
+    def summary(self) -> Dict:
+        for channel in range(len(self.channel_labels)): ## close runs that last until the end of the recording
+            self._close_runs(channel, self._open_run[channel:channel + 1])
+        self._open_run[:] = 0
+        n = max(self.n_samples, 1)
+        means = self._sums / n
+        stds = np.sqrt(np.maximum(self._squares / n - np.square(means), 0.0))
+        freqs = np.fft.rfftfreq(self.segment_samples, d=1.0 / self.srate)
+        broadband = self._power_sum[(freqs >= 1.0)].sum(axis=0)
+        line_ratios = {}
+        for a_freq in self.line_freqs:
+            if a_freq < (self.srate / 2.0):
+                band = self._power_sum[np.abs(freqs - a_freq) <= 1.0].sum(axis=0)
+                line_ratios[f'{a_freq:g}'] = np.divide(band, broadband, out=np.full_like(band, np.nan), where=broadband > 0)
+        channels = {}
+        for i, a_label in enumerate(self.channel_labels):
+            channels[a_label] = {'mean': round(float(means[i]), 3), 'std': round(float(stds[i]), 3),
+                                 'flat_runs': int(self._flat_runs[i]), 'flat_fraction': round(float(self._flat_samples[i] / n), 5),
+                                 'longest_flat_seconds': round(float(self._longest_flat[i] / self.srate), 3),
+                                 'saturated_fraction': round(float((self._saturated_low[i] + self._saturated_high[i]) / n), 5),
+                                 'line_noise_ratio': {a_freq: (round(float(ratios[i]), 4) if np.isfinite(ratios[i]) else None) for a_freq, ratios in line_ratios.items()}}
+        return {'n_samples': self.n_samples, 'srate': self.srate, 'n_periodogram_segments': self._n_segments, 'channels': channels}
+
+
+@define(slots=False)
+class QualityValueStats:
+    """ distribution of electrode-quality levels, overall and over time """
+    channel_labels: List[str] = field()
+    timeline_seconds: float = field(default=60.0)
+
+    n_samples: int = field(default=0, init=False)
+    first_timestamp: Optional[float] = field(default=None, init=False)
+    _histogram: np.ndarray = field(default=None, init=False) ## (n_channels, QUALITY_LEVELS)
+    _bin_sums: np.ndarray = field(default=None, init=False) ## (n_bins, n_channels)
+    _bin_counts: np.ndarray = field(default=None, init=False)
+
+    def __attrs_post_init__(self):
+        n_channels = len(self.channel_labels)
+        self._histogram = np.zeros((n_channels, QUALITY_LEVELS), dtype=np.int64)
+        self._bin_sums = np.zeros((0, n_channels))
+        self._bin_counts = np.zeros(0, dtype=np.int64)
+
+
+    def add(self, timestamps: np.ndarray, values: np.ndarray):
+        n = len(values)
+        if n == 0:
+            return
+        if self.first_timestamp is None:
+            self.first_timestamp = float(timestamps[0])
+        self.n_samples += n
+        levels = np.clip(np.rint(values), 0, QUALITY_LEVELS - 1).astype(np.int64)
+        n_channels = values.shape[1]
+        ## one bincount over (channel, level) pairs
+        self._histogram += np.bincount((np.arange(n_channels)[np.newaxis, :] * QUALITY_LEVELS + levels).ravel(),
+                                       minlength=n_channels * QUALITY_LEVELS).reshape(n_channels, QUALITY_LEVELS)
+        bins = np.maximum(((timestamps - self.first_timestamp) // self.timeline_seconds).astype(np.int64), 0)
+        n_bins = int(bins.max()) + 1
+        if n_bins > len(self._bin_counts):
+            self._bin_sums = np.concatenate([self._bin_sums, np.zeros((n_bins - len(self._bin_counts), n_channels))])
+            self._bin_counts = np.concatenate([self._bin_counts, np.zeros(n_bins - len(self._bin_counts), dtype=np.int64)])
+        self._bin_counts += np.bincount(bins, minlength=len(self._bin_counts))
+        for channel in range(n_channels):
+            self._bin_sums[:, channel] += np.bincount(bins, weights=values[:, channel], minlength=len(self._bin_counts))
+
+
+    def summary(self) -> Dict:
+        levels = np.arange(QUALITY_LEVELS)
+        totals = np.maximum(self._histogram.sum(axis=1), 1)
+        means = (self._histogram * levels[np.newaxis, :]).sum(axis=1) / totals
+        with np.errstate(invalid='ignore'):
+            timeline = self._bin_sums / self._bin_counts[:, np.newaxis]
+        return {'n_samples': self.n_samples, 'timeline_seconds': self.timeline_seconds,
+                'channels': {a_label: {'mean': round(float(means[i]), 3), 'histogram': self._histogram[i].tolist()} for i, a_label in enumerate(self.channel_labels)},
+                'timeline_mean': [(round(float(a_value), 3) if np.isfinite(a_value) else None) for a_value in np.nanmean(timeline, axis=1)] if len(timeline) else [],
+                'timeline': {a_label: [(round(float(a_value), 2) if np.isfinite(a_value) else None) for a_value in timeline[:, i]] for i, a_label in enumerate(self.channel_labels)}}
+
+
+@define(slots=False)
+class MotionStats:
+    """ fraction of motion samples showing head movement """
+    channel_labels: List[str] = field()
+    srate: float = field()
+    accel_threshold: float = field(default=0.05) ## g, distance of the acceleration vector from the block median
+    gyro_threshold: Optional[float] = field(default=None) ## deg/s, after removing the block median (gyro bias); None: not used
+
+    n_samples: int = field(default=0, init=False)
+    n_moving: int = field(default=0, init=False)
+    _accel_columns: List[int] = field(default=None, init=False)
+    _gyro_columns: List[int] = field(default=None, init=False)
+
+    def __attrs_post_init__(self):
+        labels = self.channel_labels if len(self.channel_labels) == len(MOTION_CHANNEL_NAMES) else MOTION_CHANNEL_NAMES
+        self._accel_columns = [i for i, a_label in enumerate(labels) if a_label.lower().startswith('acc')]
+        self._gyro_columns = [i for i, a_label in enumerate(labels) if a_label.lower().startswith('gyro')]
+
+
+    def add(self, values: np.ndarray):
+        if len(values) == 0:
+            return
+        moving = np.zeros(len(values), dtype=bool)
+        if self._accel_columns:
+            accel = values[:, self._accel_columns]
+            moving |= (np.linalg.norm(accel - np.median(accel, axis=0), axis=1) > self.accel_threshold)
+        if self._gyro_columns and (self.gyro_threshold is not None):
+            gyro = values[:, self._gyro_columns]
+            moving |= (np.linalg.norm(gyro - np.median(gyro, axis=0), axis=1) > self.gyro_threshold)
+        self.n_samples += len(values)
+        self.n_moving += int(np.count_nonzero(moving))
+
+
+    def summary(self) -> Dict:
+        return {'n_samples': self.n_samples, 'artifact_fraction': round(self.n_moving / self.n_samples, 5) if self.n_samples else None,
+                'artifact_seconds': round(self.n_moving / self.srate, 2) if self.srate > 0 else None}
+
+
+def _channel_labels(source: StreamSource, n_channels: int, defaults: List[str]) -> List[str]:
+    """ the stream's own labels, else `defaults` if they fit, else ch0, ch1, ... """
+    if len(source.channel_labels) == n_channels:
+        return source.channel_labels
+    return list(defaults) if len(defaults) == n_channels else [f'ch{i}' for i in range(n_channels)]
+
+
+def eeg_signal_columns(channel_labels: Sequence[str]) -> List[int]:
+    """ columns of an EEG stream that are electrodes, i.e. all but the marker event channel """
+    return [i for i, a_label in enumerate(channel_labels) if a_label != MARKER_EVENT_CHANNEL_NAME]
+
+
+def build_quality_report(path: Union[str, Path], block_seconds: float = 60.0, eeg_stream: str = EEG_STREAM_NAME, quality_stream: str = QUALITY_STREAM_NAME,
+                         motion_stream: str = MOTION_STREAM_NAME, flat_min_seconds: float = 1.0, timeline_seconds: float = 60.0, max_flat_fraction: float = 0.05,
+                         max_saturated_fraction: float = 0.01, max_line_noise_ratio: float = 0.3, max_motion_fraction: float = 0.2, accel_threshold: float = 0.05, gyro_threshold: Optional[float] = None) -> Dict:
+    """ Quality report of one recording. Streams that are absent are reported as None; `flags` lists channels and streams beyond the `max_*` limits. """
+    path = Path(path)
+    start_time = time.perf_counter()
+    streams = list_recording_streams(path)
+    report = {'path': str(path), 'size': path.stat().st_size, 'generated_at': time.time(), 'eeg': None, 'quality': None, 'motion': None, 'flags': []}
+
+    if eeg_stream in streams:
+        source = streams[eeg_stream]
+        stats, first_timestamp, last_timestamp = None, None, None
+        for timestamps, values in iter_stream_blocks(path, source, block_seconds):
+            if stats is None:
+                labels = _channel_labels(source, values.shape[1], EEG_CHANNEL_NAMES)
+                columns = eeg_signal_columns(labels)
+                stats = EegSignalStats(channel_labels=[labels[i] for i in columns], srate=source.nominal_srate, flat_min_seconds=flat_min_seconds)
+                first_timestamp = float(timestamps[0])
+            last_timestamp = float(timestamps[-1])
+            stats.add(values[:, columns])
+        report['eeg'] = stats.summary() if stats is not None else None
+        report['duration_seconds'] = (last_timestamp - first_timestamp) if first_timestamp is not None else 0.0
+        for a_label, a_channel in ((report['eeg'] or {}).get('channels') or {}).items():
+            if a_channel['flat_fraction'] > max_flat_fraction:
+                report['flags'].append(f'{a_label}: flat for {100.0 * a_channel["flat_fraction"]:.1f}% of the session')
+            if a_channel['saturated_fraction'] > max_saturated_fraction:
+                report['flags'].append(f'{a_label}: saturated for {100.0 * a_channel["saturated_fraction"]:.1f}% of the session')
+            for a_freq, a_ratio in a_channel['line_noise_ratio'].items():
+                if (a_ratio is not None) and (a_ratio > max_line_noise_ratio):
+                    report['flags'].append(f'{a_label}: {100.0 * a_ratio:.0f}% of power at {a_freq} Hz')
+    else:
+        report['flags'].append(f'no {eeg_stream!r} stream')
+
+    if quality_stream in streams:
+        source = streams[quality_stream]
+        stats = None
+        for timestamps, values in iter_stream_blocks(path, source, block_seconds):
+            if stats is None:
+                stats = QualityValueStats(channel_labels=_channel_labels(source, values.shape[1], [f'q{a_name}' for a_name in EEG_CHANNEL_NAMES]), timeline_seconds=timeline_seconds)
+            stats.add(timestamps, values)
+        report['quality'] = stats.summary() if stats is not None else None
+
+    if motion_stream in streams:
+        source = streams[motion_stream]
+        stats = MotionStats(channel_labels=source.channel_labels, srate=source.nominal_srate, accel_threshold=accel_threshold, gyro_threshold=gyro_threshold)
+        for _timestamps, values in iter_stream_blocks(path, source, block_seconds):
+            stats.add(values)
+        report['motion'] = stats.summary()
+        if (report['motion']['artifact_fraction'] is not None) and (report['motion']['artifact_fraction'] > max_motion_fraction):
+            report['flags'].append(f'head movement in {100.0 * report["motion"]["artifact_fraction"]:.1f}% of motion samples')
+
+    report['elapsed_seconds'] = round(time.perf_counter() - start_time, 3)
+    return report
+
+
+def _timeline_svg(values: List[Optional[float]], width: int = 600, height: int = 60, maximum: float = QUALITY_LEVELS - 1) -> str:
+    points = [(i, a_value) for i, a_value in enumerate(values) if a_value is not None]
+    if len(points) < 2:
+        return ''
+    x_scale = width / max(len(values) - 1, 1)
+    path = ' '.join(f'{i * x_scale:.1f},{height - (a_value / maximum) * height:.1f}' for i, a_value in points)
+    return f'<svg width="{width}" height="{height}" style="border:1px solid #ccc"><polyline fill="none" stroke="#1f77b4" points="{path}"/></svg>'
+
+
+def render_quality_html(report: Dict) -> str:
+    """ self-contained HTML page of one report """
+    esc = html.escape
+    rows = []
+    quality_channels = (report.get('quality') or {}).get('channels', {})
+    for a_label, a_channel in ((report.get('eeg') or {}).get('channels') or {}).items():
+        quality = quality_channels.get(f'q{a_label}', {})
+        line_noise = ', '.join(f'{a_freq} Hz: {a_ratio:.3f}' for a_freq, a_ratio in a_channel['line_noise_ratio'].items() if a_ratio is not None)
+        rows.append(f'<tr><td>{esc(a_label)}</td><td>{a_channel["std"]:.1f}</td><td>{a_channel["flat_runs"]}</td><td>{100.0 * a_channel["flat_fraction"]:.2f}</td>'
+                    f'<td>{a_channel["longest_flat_seconds"]:.1f}</td><td>{100.0 * a_channel["saturated_fraction"]:.2f}</td><td>{esc(line_noise)}</td>'
+                    f'<td>{quality.get("mean", "")}</td></tr>')
+    motion = report.get('motion') or {}
+    motion_text = f'{100.0 * motion["artifact_fraction"]:.1f}% of motion samples' if motion.get('artifact_fraction') is not None else 'no motion stream'
+    timeline = (report.get('quality') or {}).get('timeline_mean', [])
+    flags = ''.join(f'<li>{esc(a_flag)}</li>' for a_flag in report['flags']) or '<li>none</li>'
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Quality: {esc(Path(report['path']).name)}</title>
+<style>body{{font-family:sans-serif;margin:2em}} table{{border-collapse:collapse}} td,th{{border:1px solid #ccc;padding:2px 8px;text-align:right}} td:first-child{{text-align:left}}</style></head>
+<body><h2>{esc(Path(report['path']).name)}</h2>
+<p>{report.get('duration_seconds', 0.0) / 60.0:.1f} min, {report['size'] / 1e6:.1f} MB. Head movement: {esc(motion_text)}.</p>
+<h3>Flags</h3><ul>{flags}</ul>
+<h3>EEG channels</h3>
+<table><tr><th>channel</th><th>std</th><th>flat runs</th><th>flat %</th><th>longest flat (s)</th><th>saturated %</th><th>line-noise ratio</th><th>mean quality</th></tr>
+{''.join(rows)}</table>
+<h3>Mean electrode quality over time ({(report.get('quality') or {}).get('timeline_seconds', 0):g} s bins)</h3>
+{_timeline_svg(timeline) or '<p>no quality stream</p>'}
+</body></html>
+"""
+
+
+def report_paths(recording_path: Union[str, Path], output_directory: Union[str, Path]) -> Tuple[Path, Path]:
+    stem = Path(recording_path).name
+    return Path(output_directory) / (stem + REPORT_JSON_SUFFIX), Path(output_directory) / (stem + REPORT_HTML_SUFFIX)
+
+
+def write_quality_report(path: Union[str, Path], output_directory: Optional[Union[str, Path]] = None, **kwargs) -> Dict:
+    """ builds the report of `path` and writes its JSON and HTML next to it (or into `output_directory`) """
+    path = Path(path)
+    output_directory = Path(output_directory) if output_directory is not None else path.parent
+    output_directory.mkdir(parents=True, exist_ok=True)
+    report = build_quality_report(path, **kwargs)
+    json_path, html_path = report_paths(path, output_directory)
+    with open(json_path, 'w') as f:
+        json.dump(report, f, separators=(',', ':'))
+    html_path.write_text(render_quality_html(report), encoding='utf-8')
+    return report
+
+
+def _report_job(path: str, output_directory: str, kwargs: Dict) -> Dict:
+    report = write_quality_report(path, output_directory, **kwargs)
+    return {'path': report['path'], 'duration_seconds': report.get('duration_seconds'), 'flags': report['flags'],
+            'motion_artifact_fraction': (report.get('motion') or {}).get('artifact_fraction')}
+
+
+def find_recordings(inputs: Iterable[Union[str, Path]], recursive: bool = True) -> List[Path]:
+    found = []
+    for an_input in inputs:
+        an_input = Path(an_input)
+        if an_input.is_file():
+            found.append(an_input.resolve())
+            continue
+        for a_suffix in (XDF_EXTENSION, HDF5_EXTENSION):
+            found.extend(a_path.resolve() for a_path in (an_input.rglob(f'*{a_suffix}') if recursive else an_input.glob(f'*{a_suffix}')) if a_path.is_file())
+    return sorted(set(found))
+
+
+def generate_quality_reports(inputs: Iterable[Union[str, Path]], output_directory: Union[str, Path], max_workers: Optional[int] = None, recursive: bool = True,
+                             force: bool = False, **kwargs) -> Dict[str, int]:
+    """ writes a report for every recording under `inputs` whose report is missing or older than it, `max_workers` sessions at a time (default: CPU count),
+    then rewrites `quality_index.html` from all the JSON reports in `output_directory`. Returns counts of written/unchanged/failed sessions.
+    """
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    jobs = []
+    counts = {'written': 0, 'unchanged': 0, 'failed': 0}
+    for a_path in find_recordings(inputs, recursive=recursive):
+        json_path, _html_path = report_paths(a_path, output_directory)
+        if (not force) and json_path.exists() and (json_path.stat().st_mtime >= a_path.stat().st_mtime):
+            counts['unchanged'] += 1
+            continue
+        jobs.append((str(a_path), str(output_directory), kwargs))
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if (max_workers == 1) or (len(jobs) <= 1):
+        for a_job in jobs:
+            try:
+                _report_job(*a_job)
+                counts['written'] += 1
+            except Exception as e:
+                counts['failed'] += 1
+                logger.error(f'failed to build the quality report of {a_job[0]}: {e}')
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_report_job, *a_job): a_job[0] for a_job in jobs}
+            for a_future in as_completed(futures):
+                try:
+                    a_future.result()
+                    counts['written'] += 1
+                except Exception as e:
+                    counts['failed'] += 1
+                    logger.error(f'failed to build the quality report of {futures[a_future]}: {e}')
+    write_quality_index(output_directory)
+    logger.info(f'quality reports in {output_directory}: {counts}')
+    return counts
+
+
+def write_quality_index(output_directory: Union[str, Path]) -> Path:
+    """ one-line-per-session overview of every JSON report in `output_directory`, linking to the session pages """
+    output_directory = Path(output_directory)
+    rows = []
+    for json_path in sorted(output_directory.glob(f'*{REPORT_JSON_SUFFIX}')):
+        with open(json_path) as f:
+            report = json.load(f)
+        motion = (report.get('motion') or {}).get('artifact_fraction')
+        html_name = json_path.name[:-len(REPORT_JSON_SUFFIX)] + REPORT_HTML_SUFFIX
+        rows.append(f'<tr><td><a href="{html.escape(html_name)}">{html.escape(Path(report["path"]).name)}</a></td><td>{(report.get("duration_seconds") or 0.0) / 60.0:.1f}</td>'
+                    f'<td>{"" if motion is None else f"{100.0 * motion:.1f}"}</td><td>{len(report["flags"])}</td><td>{html.escape("; ".join(report["flags"][:3]))}</td></tr>')
+    index_path = output_directory / INDEX_FILENAME
+    index_path.write_text('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Session quality</title>'
+                          '<style>body{font-family:sans-serif;margin:2em} table{border-collapse:collapse} td,th{border:1px solid #ccc;padding:2px 8px}</style></head><body>'
+                          '<table><tr><th>session</th><th>minutes</th><th>movement %</th><th>flags</th><th>first flags</th></tr>'
+                          + ''.join(rows) + '</table></body></html>\n', encoding='utf-8')
+    return index_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write JSON and HTML signal-quality reports for Emotiv recordings (XDF or HDF5).')
+    parser.add_argument('inputs', nargs='+', help='Recordings or directories of recordings')
+    parser.add_argument('--output', '-o', type=str, required=True, help='Directory for the reports')
+    parser.add_argument('--workers', '-j', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--block-seconds', type=float, default=60.0)
+    parser.add_argument('--flat-seconds', type=float, default=1.0, help='Shortest run of identical values counted as a flat line (default: 1 s)')
+    parser.add_argument('--accel-threshold', type=float, default=0.05, help='Head movement: acceleration change in g (default: 0.05)')
+    parser.add_argument('--gyro-threshold', type=float, default=None, help='Head movement: also flag gyro rates above this many deg/s (default: off)')
+    parser.add_argument('--force', action='store_true', help='Rebuild reports that are newer than their recording')
+    parser.add_argument('--no-recursive', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    print(generate_quality_reports(args.inputs, args.output, max_workers=args.workers, recursive=not args.no_recursive, force=args.force,
+                                   block_seconds=args.block_seconds, flat_min_seconds=args.flat_seconds, accel_threshold=args.accel_threshold,
+                                   gyro_threshold=args.gyro_threshold))
+
+
+if __name__ == '__main__':
+    main()
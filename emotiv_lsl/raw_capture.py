@@ -0,0 +1,171 @@
+import struct
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from attrs import define, field
+
+
+RAW_CAPTURE_MAGIC: bytes = b'EMOTRAW\x00'
+RAW_CAPTURE_VERSION: int = 1
+RAW_CAPTURE_EXTENSION: str = '.emraw'
+
+## per-packet `status` codes (written by `PacketFlightRecorder`)
+PACKET_STATUS_UNKNOWN: int = 0
+PACKET_STATUS_EEG: int = 1
+PACKET_STATUS_MOTION: int = 2
+PACKET_STATUS_INVALID_LENGTH: int = 3
+PACKET_STATUS_DECODE_FAILED: int = 4
+PACKET_STATUS_COUNTER_GAP: int = 5
+PACKET_STATUS_UNKNOWN_CHANNEL_COUNT: int = 6
+PACKET_STATUS_NAMES = {PACKET_STATUS_UNKNOWN: 'unknown', PACKET_STATUS_EEG: 'eeg', PACKET_STATUS_MOTION: 'motion', PACKET_STATUS_INVALID_LENGTH: 'invalid_length',
+                       PACKET_STATUS_DECODE_FAILED: 'decode_failed', PACKET_STATUS_COUNTER_GAP: 'counter_gap', PACKET_STATUS_UNKNOWN_CHANNEL_COUNT: 'unknown_channel_count'}
+
+## magic, version, header_size, packet_size, key_model, created (unix time), device_name
+_HEADER_STRUCT = struct.Struct('<8sHHHHd40s')
+
+
+def raw_capture_record_dtype(packet_size: int = 32) -> np.dtype:
+    """ one fixed-size record per raw HID report. `length` keeps the true report length (reports longer than `packet_size` are truncated), `status` is one of the `PACKET_STATUS_*` codes (0 when not annotated) """
+    return np.dtype([('timestamp', '<f8'), ('length', '<u2'), ('status', '<u2'), ('data', 'u1', (packet_size,))])
+
+
+@define(slots=False)
+class RawCapture:
+    """ A memory-mapped raw packet capture written by `RawCaptureWriter`.
+
+    Usage:
+        capture = read_raw_capture('session.emraw')
+        packets, timestamps = capture.packets, capture.timestamps
+    """
+    path: Path = field()
+    packet_size: int = field(default=32)
+    key_model: int = field(default=8)
+    created: float = field(default=0.0)
+    device_name: str = field(default='')
+    records: np.ndarray = field(default=None)
+
+    @property
+    def n_packets(self) -> int:
+        return len(self.records)
+
+    @property
+    def packets(self) -> np.ndarray:
+        """ (n_packets, packet_size) uint8 view of the encrypted reports """
+        return self.records['data']
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.records['timestamp']
+
+    @property
+    def statuses(self) -> np.ndarray:
+        return self.records['status']
+
+
+def read_raw_capture(path: Union[str, Path], mmap: bool = True) -> RawCapture:
+    """ Opens a raw capture file. With `mmap=True` the records are not read until accessed. """
+    path = Path(path)
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER_STRUCT.size)
+    if len(header) < _HEADER_STRUCT.size:
+        raise ValueError(f'{path} is too short to be a raw capture file')
+    magic, version, header_size, packet_size, key_model, created, device_name = _HEADER_STRUCT.unpack(header)
+    if magic != RAW_CAPTURE_MAGIC:
+        raise ValueError(f'{path} is not a raw capture file (magic: {magic!r})')
+    if version > RAW_CAPTURE_VERSION:
+        raise ValueError(f'{path} has unsupported raw capture version {version}')
+
+    dtype = raw_capture_record_dtype(packet_size)
+    n_records = (path.stat().st_size - header_size) // dtype.itemsize ## a partially written trailing record is ignored
+    if mmap and n_records > 0:
+        records = np.memmap(path, dtype=dtype, mode='r', offset=header_size, shape=(n_records,))
+    else:
+        with open(path, 'rb') as f:
+            f.seek(header_size)
+            records = np.fromfile(f, dtype=dtype, count=n_records)
+
+    return RawCapture(path=path, packet_size=packet_size, key_model=key_model, created=created, device_name=device_name.rstrip(b'\x00').decode('utf-8', errors='replace'), records=records)
+
+
+@define(slots=False)
+class RawCaptureWriter:
+    """ Appends raw HID reports to a `.emraw` capture file. Records are staged in a preallocated block and written in one call when it fills.
+
+    Usage:
+        with RawCaptureWriter('session.emraw') as writer:
+            writer.write_packet(data, timestamp=pylsl.local_clock())
+    """
+    path: Path = field(converter=Path)
+    packet_size: int = field(default=32)
+    key_model: int = field(default=8)
+    device_name: str = field(default='Emotiv Epoc X')
+    block_size: int = field(default=4096)
+
+    n_written: int = field(default=0, init=False)
+    _file: Optional[object] = field(default=None, init=False)
+    _block: np.ndarray = field(default=None, init=False)
+    _n_staged: int = field(default=0, init=False)
+
+    def __attrs_post_init__(self):
+        self._block = np.zeros(self.block_size, dtype=raw_capture_record_dtype(self.packet_size))
+        self._file = open(self.path, 'wb')
+        self._file.write(_HEADER_STRUCT.pack(RAW_CAPTURE_MAGIC, RAW_CAPTURE_VERSION, _HEADER_STRUCT.size, self.packet_size, self.key_model, time.time(), self.device_name.encode('utf-8')[:40]))
+
+
+    def write_packet(self, data, timestamp: float = np.nan, status: int = 0):
+        """ stages a single report """
+        i = self._n_staged
+        n_bytes = min(len(data), self.packet_size)
+        self._block['timestamp'][i] = timestamp
+        self._block['length'][i] = len(data)
+        self._block['status'][i] = status
+        self._block['data'][i, :n_bytes] = np.frombuffer(bytes(data[:n_bytes]), dtype=np.uint8)
+        self._block['data'][i, n_bytes:] = 0
+        self._n_staged += 1
+        if self._n_staged == self.block_size:
+            self.flush()
+
+
+    def write_packets(self, packets: np.ndarray, timestamps: Optional[np.ndarray] = None, statuses: Optional[np.ndarray] = None):
+        """ writes an (n, packet_size) block of reports directly """
+        self.flush()
+        packets = np.asarray(packets, dtype=np.uint8).reshape(-1, self.packet_size)
+        records = np.zeros(len(packets), dtype=self._block.dtype)
+        records['data'] = packets
+        records['length'] = self.packet_size
+        records['timestamp'] = np.nan if timestamps is None else timestamps
+        if statuses is not None:
+            records['status'] = statuses
+        self._file.write(records.tobytes())
+        self.n_written += len(records)
+
+
+    def write_records(self, records: np.ndarray):
+        """ writes already-built records (e.g. a `PacketFlightRecorder` snapshot) """
+        self.flush()
+        self._file.write(np.asarray(records, dtype=self._block.dtype).tobytes())
+        self.n_written += len(records)
+
+
+    def flush(self):
+        if self._n_staged > 0:
+            self._file.write(self._block[:self._n_staged].tobytes())
+            self.n_written += self._n_staged
+            self._n_staged = 0
+        self._file.flush()
+
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
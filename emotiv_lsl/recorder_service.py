@@ -1,20 +1,58 @@
 import logging
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple, Union
 from datetime import datetime
+from pathlib import Path
 
 import pylsl
 from pylsl import StreamInfo
 from attrs import define, field
 
 from emotiv_lsl.emotiv_base import EmotivBase
-from labrecorder import LabRecorder
+from emotiv_lsl.sample_sink import SampleSink
+from emotiv_lsl.xdf_writer import XdfRecorderSink
+from emotiv_lsl.hdf5_store import Hdf5SessionStore, HDF5_EXTENSION
+from emotiv_lsl.edf_writer import EdfRecorderSink, EDF_EXTENSION, BDF_EXTENSION
+from emotiv_lsl.recording_journal import RecordingJournal, JOURNAL_EXTENSION, recover_journal
 
 logger = logging.getLogger(__name__)
 
+SINK_BACKENDS: Tuple[str, ...] = ('native', 'hdf5', 'edf', 'bdf', 'journal')
+
+
+def default_recording_filename(backend: str) -> str:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"emotiv_recording_{timestamp}" + {'hdf5': HDF5_EXTENSION, 'edf': EDF_EXTENSION, 'bdf': BDF_EXTENSION}.get(backend, ".xdf")
+
+
+def create_recording_sink(backend: str, filename: Union[str, Path]) -> SampleSink:
+    """ the sink that records to `filename` with one of the SINK_BACKENDS (the journal backend writes a `.emjournal` next to it). Raises OSError if the file cannot be created. """
+    if backend == 'hdf5':
+        return Hdf5SessionStore(path=filename)
+    elif backend in ('edf', 'bdf'):
+        return EdfRecorderSink(path=filename)
+    elif backend == 'journal':
+        return RecordingJournal(path=Path(filename).with_suffix(JOURNAL_EXTENSION))
+    elif backend == 'native':
+        return XdfRecorderSink(path=filename)
+    raise ValueError(f"unknown sink backend {backend!r} (expected one of {SINK_BACKENDS})")
+
+
+def close_recording_sink(backend: str, sink: SampleSink, filename: Union[str, Path]):
+    """ closes a sink made by `create_recording_sink`; the journal backend's journal is converted to `filename` and removed """
+    closed_path = sink.close()
+    if backend == 'journal':
+        recover_journal(closed_path, filename)
+        closed_path.unlink()
+
 
 @define(slots=False)
 class RecorderService:
-    """ Records the LSL outlets produced by an EmotivBase delegate to XDF files using LabRecorder.
+    """ Records the LSL outlets produced by an EmotivBase delegate to XDF files.
+
+    With `backend='native'` (default) an `XdfRecorderSink` is attached to the delegate's publishing path: recording starts immediately and samples never
+    go through an LSL inlet. `backend='hdf5'` attaches an `Hdf5SessionStore` the same way,
+    `backend='edf'`/`'bdf'` an `EdfRecorderSink` (one streaming EDF+/BDF+ file per stream). `backend='journal'` records to a crash-safe `RecordingJournal` next to
+    the XDF file and converts it to the XDF file on stop; after a crash, `recover_journal` rebuilds the XDF file from it. `backend='labrecorder'` resolves the delegate's outlets over the network and records them with LabRecorder.
     
     Usage:
         emotiv = EmotivEpocX()
@@ -25,13 +63,14 @@ class RecorderService:
     """
     delegate: EmotivBase = field(default=None)
     filename: str = field(default=None)
-    _recorder: Optional[LabRecorder] = field(default=None, init=False)
+    backend: str = field(default='native') ## 'native', 'hdf5', 'edf', 'bdf', 'journal' or 'labrecorder'
+    _recorder: Optional[Any] = field(default=None, init=False) ## `LabRecorder` (labrecorder backend)
+    _sink: Optional[SampleSink] = field(default=None, init=False) ## `XdfRecorderSink`, `Hdf5SessionStore`, `EdfRecorderSink` or `RecordingJournal`
     _stream_names: List[str] = field(factory=list, init=False)
 
     def __attrs_post_init__(self):
         if self.filename is None:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            self.filename = f"emotiv_recording_{timestamp}.xdf"
+            self.filename = default_recording_filename(self.backend)
 
 
     def get_lsl_outlet_stream_names(self) -> List[str]:
@@ -66,14 +105,18 @@ class RecorderService:
         Returns:
             True if recording started successfully, False otherwise.
         """
-        if self._recorder is not None and self._recorder.is_recording():
+        if self.is_recording():
             logger.warning("Recording is already in progress")
             return False
 
         if filename is not None:
             self.filename = filename
 
+        if self.backend in SINK_BACKENDS:
+            return self._start_sink_recording()
+
         # Initialize LabRecorder
+        from labrecorder import LabRecorder
         self._recorder = LabRecorder(filename=self.filename, enable_remote_control=False)
 
         # Find streams matching delegate outlets
@@ -103,12 +146,40 @@ class RecorderService:
             return False
 
 
+    def _start_sink_recording(self) -> bool:
+        if self.delegate is None:
+            logger.error(f"The {self.backend} backend records from a delegate, but none was provided.")
+            return False
+        try:
+            self._sink = create_recording_sink(self.backend, self.filename)
+        except OSError as e:
+            logger.error(f"Failed to start recording: {e}")
+            return False
+        self.delegate.add_sample_sink(self._sink)
+        self._stream_names = self._sink.stream_names
+        logger.info(f"Started recording to {self.filename} ({self.backend}, streams so far: {self._stream_names})")
+        return True
+
+
     def stop_recording(self) -> bool:
         """Stop the current recording.
         
         Returns:
             True if recording stopped successfully, False otherwise.
         """
+        if self._sink is not None:
+            self.delegate.remove_sample_sink(self._sink)
+            try:
+                close_recording_sink(self.backend, self._sink, self.filename)
+                self._stream_names = self._sink.stream_names
+                logger.info(f"Stopped recording. File saved to: {self.filename}")
+                return True
+            except Exception as e:
+                logger.error(f"Error stopping recording: {e}")
+                return False
+            finally:
+                self._sink = None
+
         if self._recorder is None:
             logger.warning("No recording in progress")
             return False
@@ -133,11 +204,15 @@ class RecorderService:
 
     def is_recording(self) -> bool:
         """Check if recording is currently in progress."""
+        if self._sink is not None:
+            return self._sink.is_open
         return self._recorder is not None and self._recorder.is_recording()
 
 
     def get_status(self) -> Dict:
         """Get current recorder status."""
+        if self._sink is not None:
+            return self._sink.get_status()
         if self._recorder is None:
             return {'recording': False, 'filename': self.filename, 'streams': []}
         status = self._recorder.get_status()
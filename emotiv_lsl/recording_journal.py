@@ -0,0 +1,303 @@
+"""
+Crash-safe write-ahead journal for recordings.
+
+`RecordingJournal` is a `SampleSink` that appends every sample to a journal file. Samples are staged per stream and appended as one record per
+`block_samples` rows; a background thread writes out partial blocks, flushes and `fsync`s the file every `fsync_interval` seconds, so the acquisition
+thread never makes a syscall per sample and a crash (process kill, power loss) loses at most `fsync_interval` seconds of data.
+
+Journal layout: the 8-byte magic, then records of
+    [u8 kind][u32 stream index][u32 payload length][u32 CRC-32 of payload][payload]
+kinds: stream (payload = name, NUL, stream info XML), samples (payload = u32 n, n f8 timestamps, n x channel_count values, or a JSON list of
+lists for string streams) and end (written by a clean `close`). A record that is truncated or fails its CRC marks the end of the recoverable data.
+
+`recover_journal` rebuilds a valid XDF file (headers, samples, footers) from a journal in one sequential pass.
+
+Usage:
+    journal = RecordingJournal('session.emjournal', fsync_interval=1.0)
+    emotiv.add_sample_sink(journal)
+    ...
+    emotiv.remove_sample_sink(journal)
+    journal.close()
+
+    recover_journal('session.emjournal') ## -> session.xdf, also works on the journal of a crashed session
+
+    python -m emotiv_lsl.recording_journal session.emjournal -o session.xdf
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from pylsl import StreamInfo
+from attrs import define, field
+
+from emotiv_lsl.sample_sink import SampleSink
+from emotiv_lsl.xdf_reader import parse_stream_header_xml
+from emotiv_lsl.xdf_writer import XDF_EXTENSION, XDF_CHANNEL_FORMAT_DTYPES, LSL_CHANNEL_FORMAT_NAMES, XdfWriter
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_MAGIC: bytes = b'EMJRNL01'
+JOURNAL_EXTENSION: str = '.emjournal'
+
+RECORD_KIND_STREAM: int = 1
+RECORD_KIND_SAMPLES: int = 2
+RECORD_KIND_END: int = 3
+
+_RECORD_HEADER_STRUCT = struct.Struct('<BIII')
+_SAMPLE_COUNT_STRUCT = struct.Struct('<I')
+
+
+def encode_samples_payload(timestamps: np.ndarray, values: Union[np.ndarray, List], channel_format: str) -> bytes:
+    n_samples = len(timestamps)
+    head = _SAMPLE_COUNT_STRUCT.pack(n_samples) + np.ascontiguousarray(timestamps, dtype='<f8').tobytes()
+    if channel_format == 'string':
+        return head + json.dumps([[str(a_value) for a_value in a_sample] for a_sample in values]).encode('utf-8')
+    return head + np.ascontiguousarray(values, dtype=XDF_CHANNEL_FORMAT_DTYPES[channel_format]).tobytes()
+
+
+def decode_samples_payload(payload: bytes, channel_format: str, channel_count: int) -> Tuple[np.ndarray, Union[np.ndarray, List]]:
+    n_samples = _SAMPLE_COUNT_STRUCT.unpack_from(payload)[0]
+    offset = _SAMPLE_COUNT_STRUCT.size
+    timestamps = np.frombuffer(payload, dtype='<f8', count=n_samples, offset=offset)
+    offset += 8 * n_samples
+    if channel_format == 'string':
+        return timestamps, json.loads(payload[offset:].decode('utf-8'))
+    values = np.frombuffer(payload, dtype=XDF_CHANNEL_FORMAT_DTYPES[channel_format], count=n_samples * channel_count, offset=offset)
+    return timestamps, values.reshape(n_samples, channel_count)
+
+
+def iter_journal_records(f: BinaryIO) -> Iterator[Tuple[int, int, bytes]]:
+    """ yields (kind, stream index, payload) after the magic, stopping at the end of the file or at the first truncated or corrupt record """
+    while True:
+        header = f.read(_RECORD_HEADER_STRUCT.size)
+        if len(header) < _RECORD_HEADER_STRUCT.size:
+            if len(header) > 0:
+                logger.warning(f'journal ends with a truncated record header at offset {f.tell() - len(header)}')
+            return
+        kind, stream_index, length, crc = _RECORD_HEADER_STRUCT.unpack(header)
+        payload = f.read(length)
+        if (len(payload) < length) or (zlib.crc32(payload) != crc):
+            logger.warning(f'journal record at offset {f.tell() - len(payload) - _RECORD_HEADER_STRUCT.size} is truncated or corrupt, discarding it and everything after it')
+            return
+        yield kind, stream_index, payload
+
+
+@define(slots=False)
+class JournalStreamState:
+    """ per-stream staging block of a `RecordingJournal` """
+    index: int = field()
+    name: str = field()
+    channel_count: int = field()
+    channel_format: str = field()
+    timestamps: np.ndarray = field()
+    values: np.ndarray = field()
+    n_buffered: int = field(default=0)
+    sample_count: int = field(default=0)
+
+
+@define(slots=False)
+class RecordingJournal(SampleSink):
+    """ Appends every published sample to a crash-safe journal file; see the module docstring.
+
+    `block_samples` rows are staged per stream before a record is appended to the (buffered) file. Every `fsync_interval` seconds a background thread
+    appends the partially filled blocks and `fsync`s, which bounds what a crash can lose. `append_samples` journals an already-pulled chunk in one record.
+    """
+    path: Path = field(converter=Path)
+    block_samples: int = field(default=64)
+    fsync_interval: float = field(default=1.0)
+    buffer_size: int = field(default=1 << 20)
+
+    is_open: bool = field(default=False, init=False)
+    bytes_written: int = field(default=0, init=False)
+    fsync_count: int = field(default=0, init=False)
+    _file: Optional[BinaryIO] = field(default=None, init=False)
+    _streams: Dict[str, JournalStreamState] = field(factory=dict, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+    _sync_lock: threading.Lock = field(factory=threading.Lock, init=False) ## serializes `fsync` with `close`, without holding up `on_sample`
+    _stop_event: threading.Event = field(factory=threading.Event, init=False)
+    _sync_thread: Optional[threading.Thread] = field(default=None, init=False)
+
+
+    def __attrs_post_init__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'wb', buffering=self.buffer_size)
+        self._write(JOURNAL_MAGIC)
+        self.is_open = True
+        self._sync_thread = threading.Thread(target=self._sync_loop, name='journal fsync', daemon=True)
+        self._sync_thread.start()
+
+
+    @property
+    def stream_names(self) -> List[str]:
+        return list(self._streams.keys())
+
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+
+    def _write_record(self, kind: int, stream_index: int, payload: bytes):
+        self._write(_RECORD_HEADER_STRUCT.pack(kind, stream_index, len(payload), zlib.crc32(payload)) + payload)
+
+
+    def on_stream_started(self, stream_name: str, info: StreamInfo):
+        with self._lock:
+            if (not self.is_open) or (stream_name in self._streams):
+                return
+            channel_format = LSL_CHANNEL_FORMAT_NAMES[info.channel_format()]
+            channel_count = info.channel_count()
+            values_dtype = object if channel_format == 'string' else XDF_CHANNEL_FORMAT_DTYPES[channel_format]
+            state = JournalStreamState(index=len(self._streams), name=stream_name, channel_count=channel_count, channel_format=channel_format,
+                                       timestamps=np.zeros(self.block_samples, dtype=np.float64), values=np.zeros((self.block_samples, channel_count), dtype=values_dtype))
+            self._streams[stream_name] = state
+            self._write_record(RECORD_KIND_STREAM, state.index, stream_name.encode('utf-8') + b'\0' + info.as_xml().encode('utf-8'))
+            logger.info(f'journaling stream {stream_name!r} to {self.path} ({channel_count} x {channel_format})')
+
+
+    def on_sample(self, stream_name: str, sample: Sequence[float], timestamp: float):
+        with self._lock:
+            state = self._streams.get(stream_name)
+            if (state is None) or (not self.is_open):
+                return
+            i = state.n_buffered
+            state.timestamps[i] = timestamp
+            state.values[i] = sample
+            state.n_buffered += 1
+            state.sample_count += 1
+            if state.n_buffered == self.block_samples:
+                self._append_block(state)
+
+
+    def on_source_stopped(self):
+        self.sync()
+
+
+    def append_samples(self, stream_name: str, values: np.ndarray, timestamps: np.ndarray):
+        """ journals (n, channel_count) `values` of a stream registered with `on_stream_started` as one record, after its staged samples """
+        with self._lock:
+            state = self._streams.get(stream_name)
+            if (state is None) or (not self.is_open) or (len(timestamps) == 0):
+                return
+            self._append_block(state)
+            self._write_record(RECORD_KIND_SAMPLES, state.index, encode_samples_payload(timestamps, values, state.channel_format))
+            state.sample_count += len(timestamps)
+
+
+    def _append_block(self, state: JournalStreamState):
+        if state.n_buffered == 0:
+            return
+        self._write_record(RECORD_KIND_SAMPLES, state.index, encode_samples_payload(state.timestamps[:state.n_buffered], state.values[:state.n_buffered], state.channel_format))
+        state.n_buffered = 0
+
+
+    def sync(self):
+        """ appends all staged samples and makes the journal durable. The `fsync` itself runs outside the sample lock. """
+        with self._sync_lock:
+            with self._lock:
+                if not self.is_open:
+                    return
+                for a_state in self._streams.values():
+                    self._append_block(a_state)
+                self._file.flush()
+            os.fsync(self._file.fileno())
+            self.fsync_count += 1
+
+
+    def _sync_loop(self):
+        while not self._stop_event.wait(self.fsync_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f'journal fsync failed: {e}')
+
+
+    def close(self) -> Path:
+        """ appends the remaining samples and an end record, syncs and closes the journal """
+        self._stop_event.set()
+        if (self._sync_thread is not None) and (self._sync_thread is not threading.current_thread()):
+            self._sync_thread.join()
+        with self._sync_lock:
+            with self._lock:
+                if not self.is_open:
+                    return self.path
+                for a_state in self._streams.values():
+                    self._append_block(a_state)
+                self._write_record(RECORD_KIND_END, 0, b'')
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self.is_open = False
+        logger.info(f'closed journal {self.path} ({self.bytes_written} bytes, ' + ', '.join(f'{a_state.name}: {a_state.sample_count} samples' for a_state in self._streams.values()) + ')')
+        return self.path
+
+
+    def get_status(self) -> Dict:
+        return {'recording': self.is_open, 'filename': str(self.path), 'streams': self.stream_names, 'bytes_written': self.bytes_written, 'fsync_count': self.fsync_count,
+                'sample_counts': {a_name: a_state.sample_count for a_name, a_state in self._streams.items()}}
+
+
+def recover_journal(journal_path: Union[str, Path], output_path: Optional[Union[str, Path]] = None) -> Path:
+    """ rebuilds an XDF file from a journal, complete or cut short by a crash. Each samples record becomes one XDF samples chunk.
+    Returns the XDF path (default: the journal path with an `.xdf` suffix).
+    """
+    journal_path = Path(journal_path)
+    output_path = Path(output_path) if output_path is not None else journal_path.with_suffix(XDF_EXTENSION)
+    streams = {} ## journal stream index -> [XdfStream (parsed header), sample count, first timestamp, last timestamp]
+    is_complete = False
+    start_time = time.perf_counter()
+    with open(journal_path, 'rb') as f:
+        if f.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise ValueError(f'{journal_path} is not a recording journal')
+        writer = XdfWriter(output_path)
+        try:
+            for kind, stream_index, payload in iter_journal_records(f):
+                if kind == RECORD_KIND_STREAM:
+                    _name, info_xml = payload.split(b'\0', 1)
+                    header = parse_stream_header_xml(stream_index + 1, info_xml.decode('utf-8'))
+                    streams[stream_index] = [header, 0, 0.0, 0.0]
+                    writer.write_stream_header(header.stream_id, header.info_xml)
+                elif kind == RECORD_KIND_SAMPLES and stream_index in streams:
+                    entry = streams[stream_index]
+                    header = entry[0]
+                    timestamps, values = decode_samples_payload(payload, header.channel_format, header.channel_count)
+                    if len(timestamps) == 0:
+                        continue
+                    if entry[1] == 0:
+                        entry[2] = float(timestamps[0])
+                        writer.write_clock_offset(header.stream_id, entry[2], 0.0)
+                    writer.write_samples(header.stream_id, timestamps, values, header.channel_format)
+                    entry[1] += len(timestamps)
+                    entry[3] = float(timestamps[-1])
+                elif kind == RECORD_KIND_END:
+                    is_complete = True
+                    break
+            writer.write_boundary()
+            for header, sample_count, first_timestamp, last_timestamp in streams.values():
+                writer.write_stream_footer(header.stream_id, first_timestamp, last_timestamp, sample_count, [(first_timestamp, 0.0)] if sample_count > 0 else [])
+        finally:
+            writer.close()
+    logger.info(f'recovered {output_path} from {"complete" if is_complete else "interrupted"} journal {journal_path} in {time.perf_counter() - start_time:.2f} s ('
+                + ', '.join(f'{a_header.name}: {a_count} samples' for a_header, a_count, _, _ in streams.values()) + ')')
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild an XDF recording from a recording journal.')
+    parser.add_argument('journal', type=str)
+    parser.add_argument('--output', '-o', type=str, default=None, help='XDF file to write (default: the journal name with .xdf)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    print(f'wrote {recover_journal(args.journal, args.output)}')
+
+
+if __name__ == '__main__':
+    main()
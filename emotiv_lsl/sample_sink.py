@@ -0,0 +1,32 @@
+import logging
+from typing import Sequence
+
+from pylsl import StreamInfo
+from attrs import define
+
+logger = logging.getLogger(__name__)
+
+
+@define(slots=False)
+class SampleSink:
+    """ Receives every sample `EmotivBase.main_loop` publishes, on the acquisition thread, right after it is pushed to its LSL outlet.
+
+    Subclasses override the hooks they need. `on_sample` runs once per packet, so it must only stage the sample (copy into a buffer) and leave I/O to batched flushes.
+    A sink that raises is detached by the delegate and the exception is logged; acquisition continues.
+
+    Usage:
+        emotiv = EmotivEpocX()
+        emotiv.add_sample_sink(my_sink) ## may be called before or while `main_loop` runs
+    """
+
+    def on_stream_started(self, stream_name: str, info: StreamInfo):
+        """ called once per stream when its outlet is created (or replayed on attach if it already exists). `info` is the outlet's full info (`outlet.get_info()`) """
+        pass
+
+    def on_sample(self, stream_name: str, sample: Sequence[float], timestamp: float):
+        """ called for each sample with the LSL timestamp (`pylsl.local_clock()`) it was pushed with """
+        pass
+
+    def on_source_stopped(self):
+        """ called when `main_loop` exits (the packet source ended or raised) """
+        pass
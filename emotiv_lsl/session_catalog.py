@@ -0,0 +1,424 @@
+"""
+SQLite catalog of recording files, with time-range queries across them.
+
+`SessionCatalog.scan` walks recording directories and indexes `.xdf`, `.fif` and `.h5` (`Hdf5SessionStore`) files, one row per file and one per stream:
+name, type, source id, channel labels, sample count, first/last LSL timestamp, wall-clock start/end and, for electrode-quality data, per-channel means.
+Files whose size and mtime are unchanged since the last scan are skipped, and files that disappeared are dropped.
+
+Wall-clock times come from each format's own reference: the XDF file header `datetime` against the first clock-offset measurement, the FIF
+`meas_date`, and the `created`/`created_lsl_clock` attributes of an HDF5 store. FIF files without a `meas_date` (the legacy
+`data_<YYYYmmdd_HHMMSS>_chunk<N>_raw.fif` chunks) are placed by the local save time in their name, else by their mtime, both taken as the end of the
+recording; this is logged.
+
+Usage:
+    catalog = SessionCatalog('recordings.sqlite')
+    catalog.scan(['recordings/'])
+    data, times, labels = catalog.query_time_range(datetime(2025, 9, 9, 14), datetime(2025, 9, 9, 15), stream_name='Epoc X', source_id='%6566%')
+
+    python -m emotiv_lsl.session_catalog scan recordings/ --db recordings.sqlite
+    python -m emotiv_lsl.session_catalog query --db recordings.sqlite --start 2025-09-09T14:00 --end 2025-09-09T15:00 --stream 'Epoc X' -o eeg.npz
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from attrs import define, field
+
+from emotiv_lsl.decoded_chunk import EEG_CHANNEL_NAMES, MOTION_CHANNEL_NAMES
+from emotiv_lsl.hdf5_store import HDF5_EXTENSION, read_hdf5_time_range
+from emotiv_lsl.xdf_reader import IndexedXdfFile, read_xdf, find_xdf_stream
+from emotiv_lsl.xdf_writer import XDF_EXTENSION
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SUFFIXES = (XDF_EXTENSION, '.fif', HDF5_EXTENSION)
+TimeLike = Union[datetime, float]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    format TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    lsl_to_unix_offset REAL, -- add to an LSL timestamp of this file to get unix time
+    indexed_at REAL NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS streams (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    stream_name TEXT NOT NULL,
+    stream_type TEXT,
+    source_id TEXT,
+    channel_count INTEGER,
+    nominal_srate REAL,
+    channel_labels TEXT, -- JSON list
+    sample_count INTEGER,
+    first_timestamp REAL,
+    last_timestamp REAL,
+    start_time REAL, -- unix time of the first sample
+    end_time REAL, -- unix time of the last sample
+    quality_mean REAL,
+    quality_summary TEXT -- JSON {channel label: mean quality}
+);
+CREATE INDEX IF NOT EXISTS streams_by_time ON streams(stream_name, start_time, end_time);
+CREATE INDEX IF NOT EXISTS streams_by_file ON streams(file_id);
+"""
+
+_FIF_FIRST_TIMESTAMP_PATTERN = re.compile(r'first LSL timestamp ([-+0-9.eE]+)')
+_FIF_STREAM_NAME_PATTERN = re.compile(r'^(.+?)(?: chunk \d+| \(from [^)]*\)),')
+_FIF_LEGACY_CHUNK_NAME_PATTERN = re.compile(r'^data_(\d{8}_\d{6})_chunk\d+_raw\.fif$')
+
+
+def to_unix_time(value: TimeLike) -> float:
+    """ datetimes (naive ones are local time) and unix timestamps -> unix timestamp """
+    return value.timestamp() if isinstance(value, datetime) else float(value)
+
+
+def is_quality_stream(stream_name: str, channel_labels: List[str]) -> bool:
+    return ('quality' in stream_name.lower()) or ((len(channel_labels) > 0) and all(a_label.startswith('q') for a_label in channel_labels))
+
+
+def summarize_quality(channel_labels: List[str], values: np.ndarray) -> Tuple[Optional[float], Optional[str]]:
+    """ (overall mean, JSON of per-channel means) of (n_samples, n_channels) quality values """
+    if len(values) == 0:
+        return None, None
+    means = np.nanmean(np.asarray(values, dtype=np.float64), axis=0)
+    return float(np.nanmean(means)), json.dumps({a_label: round(float(a_mean), 4) for a_label, a_mean in zip(channel_labels, means)})
+
+
+@define(slots=False)
+class CatalogStream:
+    """ one indexed stream of one file """
+    path: Path = field(converter=Path)
+    format: str = field()
+    stream_name: str = field()
+    stream_type: Optional[str] = field()
+    source_id: Optional[str] = field()
+    channel_count: int = field()
+    nominal_srate: float = field()
+    channel_labels: List[str] = field()
+    sample_count: int = field()
+    first_timestamp: Optional[float] = field()
+    last_timestamp: Optional[float] = field()
+    start_time: Optional[float] = field()
+    end_time: Optional[float] = field()
+    lsl_to_unix_offset: Optional[float] = field()
+    quality_mean: Optional[float] = field(default=None)
+    quality_summary: Optional[Dict[str, float]] = field(default=None)
+
+    @property
+    def start_datetime(self) -> Optional[datetime]:
+        return datetime.fromtimestamp(self.start_time) if self.start_time is not None else None
+
+    @property
+    def end_datetime(self) -> Optional[datetime]:
+        return datetime.fromtimestamp(self.end_time) if self.end_time is not None else None
+
+
+    def load_range(self, start: float, end: float) -> Tuple[np.ndarray, np.ndarray]:
+        """ (data, unix times) of this stream's samples with `start <= time < end` (unix seconds) """
+        if self.format == 'xdf':
+            timestamps, data = IndexedXdfFile.open(self.path).read(self.stream_name, start - self.lsl_to_unix_offset, end - self.lsl_to_unix_offset)
+            return np.asarray(data), timestamps + self.lsl_to_unix_offset
+        elif self.format == 'h5':
+            data, timestamps = read_hdf5_time_range(self.path, self.stream_name, start - self.lsl_to_unix_offset, end - self.lsl_to_unix_offset)
+            return data, timestamps + self.lsl_to_unix_offset
+        elif self.format == 'fif':
+            import mne
+            raw = mne.io.read_raw_fif(self.path, preload=False, verbose=False)
+            first = max(int(np.ceil((start - self.start_time) * self.nominal_srate)), 0)
+            last = min(int(np.ceil((end - self.start_time) * self.nominal_srate)), raw.n_times)
+            if last <= first:
+                return np.zeros((0, self.channel_count)), np.zeros(0)
+            picks = [raw.ch_names.index(a_label) for a_label in self.channel_labels]
+            data = raw.get_data(picks=picks, start=first, stop=last).T
+            return data, self.start_time + np.arange(first, last) / self.nominal_srate
+        raise ValueError(f'unsupported format {self.format!r}')
+
+
+def index_xdf_file(path: Path) -> Tuple[Optional[float], List[Dict]]:
+    xdf = read_xdf(path, headers_only=True)
+    if any(a_stream.sample_count is None for a_stream in xdf.streams.values()):
+        xdf = read_xdf(path) ## no footers (recording did not finish cleanly): decode everything
+    quality_names = {a_stream.name for a_stream in xdf.streams.values() if is_quality_stream(a_stream.name, a_stream.channel_labels) and a_stream.is_numeric}
+    if quality_names and any(find_xdf_stream(xdf, a_name).time_series is None for a_name in quality_names):
+        quality_xdf = read_xdf(path, stream_names=quality_names)
+    else:
+        quality_xdf = xdf
+
+    offset = xdf.lsl_to_unix_offset
+    rows = []
+    for a_stream in xdf.streams.values():
+        quality_mean, quality_summary = None, None
+        if a_stream.name in quality_names:
+            quality_mean, quality_summary = summarize_quality(a_stream.channel_labels, find_xdf_stream(quality_xdf, a_stream.name).time_series)
+        first, last = a_stream.first_timestamp, a_stream.last_timestamp
+        rows.append(dict(stream_name=a_stream.name, stream_type=a_stream.type, source_id=a_stream.source_id, channel_count=a_stream.channel_count, nominal_srate=a_stream.nominal_srate,
+                         channel_labels=a_stream.channel_labels, sample_count=a_stream.sample_count or 0, first_timestamp=first, last_timestamp=last,
+                         start_time=(first + offset if (offset is not None and first is not None) else None), end_time=(last + offset if (offset is not None and last is not None) else None),
+                         quality_mean=quality_mean, quality_summary=quality_summary))
+    return offset, rows
+
+
+def guess_fif_stream_name(raw, path: Path) -> str:
+    """ the stream name recorded in the description by `save_fif_chunk` or `xdf_stream_to_raw`, else a guess from the channel names, else the file stem """
+    description = raw.info.get('description') or ''
+    match = _FIF_STREAM_NAME_PATTERN.match(description)
+    if match is not None:
+        return match.group(1)
+    ch_names = list(raw.ch_names)
+    if ch_names[:len(EEG_CHANNEL_NAMES)] == EEG_CHANNEL_NAMES:
+        return 'Epoc X'
+    if ch_names == MOTION_CHANNEL_NAMES:
+        return 'Epoc X Motion'
+    if is_quality_stream('', ch_names):
+        return 'Epoc X eQuality'
+    return path.stem
+
+
+def fif_start_time_fallback(path: Path, duration: float) -> Optional[float]:
+    """ unix start time of a FIF file without `meas_date`: the legacy chunk recorder named its files with the local time they were saved at, right after
+    their last sample; otherwise the file's mtime is used the same way
+    """
+    match = _FIF_LEGACY_CHUNK_NAME_PATTERN.match(path.name)
+    if match is not None:
+        end_time, source = datetime.strptime(match.group(1), '%Y%m%d_%H%M%S').timestamp(), 'the time in its name'
+    else:
+        try:
+            end_time, source = path.stat().st_mtime, 'its mtime'
+        except OSError as e:
+            logger.warning(f'{path} has no meas_date and no usable mtime ({e}), leaving its start time unknown')
+            return None
+    logger.warning(f'{path} has no meas_date, placing its end at {source} ({datetime.fromtimestamp(end_time).isoformat()})')
+    return end_time - duration
+
+
+def index_fif_file(path: Path) -> Tuple[Optional[float], List[Dict]]:
+    import mne
+    raw = mne.io.read_raw_fif(path, preload=False, verbose=False)
+    sfreq = float(raw.info['sfreq'])
+    stream_name = guess_fif_stream_name(raw, path)
+    meas_date = raw.info['meas_date']
+    start_time = meas_date.timestamp() if meas_date is not None else fif_start_time_fallback(path, (raw.n_times - 1) / sfreq)
+    end_time = (start_time + (raw.n_times - 1) / sfreq) if start_time is not None else None
+
+    first_timestamp, offset = None, None
+    match = _FIF_FIRST_TIMESTAMP_PATTERN.search(raw.info.get('description') or '')
+    if match is not None:
+        first_timestamp = float(match.group(1))
+        if start_time is not None:
+            offset = start_time - first_timestamp
+
+    if is_quality_stream(stream_name, list(raw.ch_names)):
+        quality_labels, signal_labels = list(raw.ch_names), list(raw.ch_names)
+    else:
+        ## `DecodedChunk.to_fif` stores the quality values as extra 'q<electrode>' channels of the EEG recording
+        quality_labels = [a_name for a_name in raw.ch_names if a_name.startswith('q')]
+        signal_labels = [a_name for a_name in raw.ch_names if a_name not in quality_labels]
+    quality_mean, quality_summary = None, None
+    if quality_labels:
+        quality_mean, quality_summary = summarize_quality(quality_labels, raw.get_data(picks=quality_labels).T)
+    row = dict(stream_name=stream_name, stream_type=('EEG' if 'eeg' in raw.get_channel_types() else None), source_id=None, channel_count=len(signal_labels), nominal_srate=sfreq,
+               channel_labels=signal_labels, sample_count=int(raw.n_times), first_timestamp=first_timestamp,
+               last_timestamp=(first_timestamp + (raw.n_times - 1) / sfreq if first_timestamp is not None else None),
+               start_time=start_time, end_time=end_time, quality_mean=quality_mean, quality_summary=quality_summary)
+    return offset, [row]
+
+
+def index_hdf5_file(path: Path) -> Tuple[Optional[float], List[Dict]]:
+    import h5py
+    rows = []
+    with h5py.File(path, 'r') as f:
+        offset = (float(f.attrs['created']) - float(f.attrs['created_lsl_clock'])) if ('created_lsl_clock' in f.attrs) else None
+        for a_name, a_group in f['streams'].items():
+            timestamps = a_group['timestamps']
+            n_samples = timestamps.shape[0]
+            first = float(timestamps[0]) if n_samples > 0 else None
+            last = float(timestamps[n_samples - 1]) if n_samples > 0 else None
+            labels = [str(a_label) for a_label in a_group.attrs.get('channel_labels', [])]
+            quality_mean, quality_summary = None, None
+            if is_quality_stream(a_name, labels):
+                quality_mean, quality_summary = summarize_quality(labels, a_group['data'][()])
+            rows.append(dict(stream_name=a_name, stream_type=str(a_group.attrs.get('type', '')), source_id=str(a_group.attrs.get('source_id', '')), channel_count=int(a_group['data'].shape[1]),
+                             nominal_srate=float(a_group.attrs.get('nominal_srate', 0.0)), channel_labels=labels, sample_count=int(n_samples), first_timestamp=first, last_timestamp=last,
+                             start_time=(first + offset if (offset is not None and first is not None) else None), end_time=(last + offset if (offset is not None and last is not None) else None),
+                             quality_mean=quality_mean, quality_summary=quality_summary))
+    return offset, rows
+
+
+_INDEXERS = {XDF_EXTENSION: ('xdf', index_xdf_file), '.fif': ('fif', index_fif_file), HDF5_EXTENSION: ('h5', index_hdf5_file)}
+
+
+@define(slots=False)
+class SessionCatalog:
+    """ SQLite index of recording files. See the module docstring. """
+    db_path: Path = field(converter=Path)
+    _connection: Optional[sqlite3.Connection] = field(default=None, init=False)
+
+    def __attrs_post_init__(self):
+        self._connection = sqlite3.connect(str(self.db_path))
+        self._connection.execute('PRAGMA foreign_keys = ON')
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.executescript(_SCHEMA)
+
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def index_file(self, path: Path, stat: Optional[os.stat_result] = None) -> int:
+        """ (re)indexes one file, returns its number of streams """
+        path = Path(path).resolve()
+        stat = stat or path.stat()
+        file_format, indexer = _INDEXERS[path.suffix.lower()]
+        error, offset, rows = None, None, []
+        try:
+            offset, rows = indexer(path)
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            logger.warning(f'failed to index {path}: {error}')
+        with self._connection:
+            self._connection.execute('DELETE FROM files WHERE path = ?', (str(path),))
+            file_id = self._connection.execute('INSERT INTO files (path, format, size, mtime, lsl_to_unix_offset, indexed_at, error) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                               (str(path), file_format, stat.st_size, stat.st_mtime, offset, time.time(), error)).lastrowid
+            self._connection.executemany('INSERT INTO streams (file_id, stream_name, stream_type, source_id, channel_count, nominal_srate, channel_labels, sample_count, first_timestamp, '
+                                         'last_timestamp, start_time, end_time, quality_mean, quality_summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                         [(file_id, a_row['stream_name'], a_row['stream_type'], a_row['source_id'], a_row['channel_count'], a_row['nominal_srate'], json.dumps(a_row['channel_labels']),
+                                           a_row['sample_count'], a_row['first_timestamp'], a_row['last_timestamp'], a_row['start_time'], a_row['end_time'], a_row['quality_mean'],
+                                           a_row['quality_summary']) for a_row in rows])
+        return len(rows)
+
+
+    def scan(self, directories: Iterable[Union[str, Path]], recursive: bool = True) -> Dict[str, int]:
+        """ indexes new and changed recording files under `directories` and forgets deleted ones. Returns counts of indexed/unchanged/removed files. """
+        known = {a_path: (a_size, a_mtime) for a_path, a_size, a_mtime in self._connection.execute('SELECT path, size, mtime FROM files')}
+        counts = {'indexed': 0, 'unchanged': 0, 'removed': 0}
+        for a_directory in directories:
+            a_directory = Path(a_directory).resolve()
+            candidates = a_directory.rglob('*') if recursive else a_directory.glob('*')
+            seen = set()
+            for a_path in candidates:
+                if (a_path.suffix.lower() not in _INDEXERS) or (not a_path.is_file()):
+                    continue
+                stat = a_path.stat()
+                seen.add(str(a_path))
+                if known.get(str(a_path)) == (stat.st_size, stat.st_mtime):
+                    counts['unchanged'] += 1
+                    continue
+                self.index_file(a_path, stat=stat)
+                counts['indexed'] += 1
+            prefix = str(a_directory) + os.sep
+            gone = [a_path for a_path in known if a_path.startswith(prefix) and (a_path not in seen) and (recursive or (os.sep not in a_path[len(prefix):]))]
+            with self._connection:
+                self._connection.executemany('DELETE FROM files WHERE path = ?', [(a_path,) for a_path in gone])
+            counts['removed'] += len(gone)
+        logger.info(f'catalog scan: {counts}')
+        return counts
+
+
+    def find_streams(self, start: Optional[TimeLike] = None, end: Optional[TimeLike] = None, stream_name: Optional[str] = None, source_id: Optional[str] = None,
+                     stream_type: Optional[str] = None, min_quality: Optional[float] = None) -> List[CatalogStream]:
+        """ streams overlapping [start, end), oldest first. `source_id` is a SQL LIKE pattern (e.g. '%6566%' for one headset's key). """
+        clauses, params = ['f.error IS NULL'], []
+        if start is not None:
+            clauses.append('s.end_time >= ?')
+            params.append(to_unix_time(start))
+        if end is not None:
+            clauses.append('s.start_time < ?')
+            params.append(to_unix_time(end))
+        for a_column, a_value, an_operator in (('s.stream_name', stream_name, '='), ('s.source_id', source_id, 'LIKE'), ('s.stream_type', stream_type, '='), ('s.quality_mean', min_quality, '>=')):
+            if a_value is not None:
+                clauses.append(f'{a_column} {an_operator} ?')
+                params.append(a_value)
+        query = ('SELECT f.path, f.format, s.stream_name, s.stream_type, s.source_id, s.channel_count, s.nominal_srate, s.channel_labels, s.sample_count, s.first_timestamp, '
+                 's.last_timestamp, s.start_time, s.end_time, f.lsl_to_unix_offset, s.quality_mean, s.quality_summary FROM streams s JOIN files f ON f.id = s.file_id WHERE '
+                 + ' AND '.join(clauses) + ' ORDER BY s.start_time')
+        results = []
+        for a_row in self._connection.execute(query, params):
+            (path, file_format, name, stream_type_, source, channel_count, srate, labels, sample_count, first, last, start_time, end_time, offset, quality_mean, quality_summary) = a_row
+            results.append(CatalogStream(path=path, format=file_format, stream_name=name, stream_type=stream_type_, source_id=source, channel_count=channel_count, nominal_srate=srate,
+                                         channel_labels=json.loads(labels or '[]'), sample_count=sample_count, first_timestamp=first, last_timestamp=last, start_time=start_time,
+                                         end_time=end_time, lsl_to_unix_offset=offset, quality_mean=quality_mean, quality_summary=(json.loads(quality_summary) if quality_summary else None)))
+        return results
+
+
+    def query_time_range(self, start: TimeLike, end: TimeLike, stream_name: str = 'Epoc X', source_id: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """ (data (n, n_channels), unix times (n,), channel labels) of `stream_name` in [start, end), stitched across every file that overlaps it.
+        Samples present in more than one file (overlapping recordings) are kept once; the labels are those of the earliest file.
+        """
+        start, end = to_unix_time(start), to_unix_time(end)
+        entries = [an_entry for an_entry in self.find_streams(start, end, stream_name=stream_name, source_id=source_id) if an_entry.start_time is not None]
+        if len(entries) == 0:
+            return np.zeros((0, 0)), np.zeros(0), []
+        labels = entries[0].channel_labels
+        pieces, times = [], []
+        for an_entry in entries:
+            if an_entry.channel_count != len(labels):
+                raise ValueError(f'{an_entry.path} has {an_entry.channel_count} channels in {stream_name!r}, expected {len(labels)}')
+            data, entry_times = an_entry.load_range(start, end)
+            pieces.append(np.asarray(data))
+            times.append(entry_times)
+        data, times = np.concatenate(pieces), np.concatenate(times)
+        order = np.argsort(times, kind='stable')
+        data, times = data[order], times[order]
+        keep = np.concatenate([[True], np.diff(times) > 0]) if len(times) > 0 else np.zeros(0, dtype=bool)
+        return data[keep], times[keep], labels
+
+
+def _parse_time_argument(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index recording files in SQLite and query them by time range.')
+    parser.add_argument('--db', type=str, default='emotiv_catalog.sqlite', help='Catalog database (default: emotiv_catalog.sqlite)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    scan_parser = subparsers.add_parser('scan', help='Index new and changed recordings')
+    scan_parser.add_argument('directories', nargs='+')
+    scan_parser.add_argument('--no-recursive', action='store_true')
+    query_parser = subparsers.add_parser('query', help='List (and optionally export) the streams in a time range')
+    query_parser.add_argument('--start', type=str, required=True, help='ISO datetime (local time) or unix timestamp')
+    query_parser.add_argument('--end', type=str, required=True)
+    query_parser.add_argument('--stream', type=str, default='Epoc X')
+    query_parser.add_argument('--source-id', type=str, default=None, help="SQL LIKE pattern, e.g. '%%6566%%'")
+    query_parser.add_argument('--output', '-o', type=str, default=None, help='Write the stitched samples to this .npz file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    with SessionCatalog(args.db) as catalog:
+        if args.command == 'scan':
+            print(catalog.scan(args.directories, recursive=not args.no_recursive))
+            return
+        start, end = _parse_time_argument(args.start), _parse_time_argument(args.end)
+        for an_entry in catalog.find_streams(start, end, stream_name=args.stream, source_id=args.source_id):
+            print(f'{an_entry.start_datetime} - {an_entry.end_datetime}  {an_entry.stream_name!r} ({an_entry.sample_count} samples)  {an_entry.path}')
+        if args.output is not None:
+            data, times, labels = catalog.query_time_range(start, end, stream_name=args.stream, source_id=args.source_id)
+            np.savez(args.output, data=data, times=times, channel_labels=np.array(labels))
+            print(f'wrote {len(times)} samples to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,487 @@
+"""
+Shared-memory ring buffers for consumers on the acquisition host.
+
+`SharedMemoryRingPublisher` is a `SampleSink` that writes every sample of each numeric stream into its own `multiprocessing.shared_memory` segment,
+named `<name_prefix>_<stream name>` (non-alphanumerics replaced by '_', e.g. 'emotiv_Epoc_X'). Local consumers (`SharedMemoryRingReader`) get
+NumPy views straight onto the segment instead of going through an LSL inlet; the LSL outlets keep running for remote consumers.
+
+Segment layout (little-endian):
+    header      `RING_HEADER_DTYPE`: magic, layout version, geometry, channel format, nominal rate, publisher state and pid, the notification
+                subscriber table, and the `sequence`/`write_count` pair
+    info xml    the outlet's full `StreamInfo` XML (channel labels etc.), `info_xml_size` bytes
+    timestamps  float64 [capacity]            LSL timestamp of each slot
+    sample_index int64 [capacity]             running sample number held by each slot (-1 while the slot is being written)
+    values      channel format [capacity, channel_count]
+
+Sample `n` lives in slot `n % capacity`. The writer is a seqlock: `sequence` is odd while a sample is being written and `write_count` (the total number
+of samples written) only changes inside that window, so readers take a consistent `write_count` by re-reading `sequence` around it. Slots a reader
+copies are checked against `write_count` afterwards and against their `sample_index` stamp, so samples overwritten during the copy are reported as lost
+instead of being returned torn.
+
+Notifications: a reader that calls `wait()` binds a UDP socket on 127.0.0.1 and writes its port into a free entry of the header's subscriber table;
+after each sample the publisher sends the new `write_count` (8 bytes) to every registered port. Polling `write_count` works without subscribing.
+The table has no atomic claim: a port (unique among live readers) is written, re-read after `RING_SUBSCRIBE_SETTLE_SECONDS`, and the entry is
+only kept if it still holds it; `wait()` re-checks its entry on every poll and claims a new one if another reader overwrote it.
+
+Usage:
+    emotiv = EmotivEpocX(enable_shared_memory_ring=True) ## or: emotiv.add_sample_sink(SharedMemoryRingPublisher())
+    emotiv.main_loop()
+
+    ## in another process on the same host
+    reader = SharedMemoryRingReader.open('Epoc X')
+    while reader.wait(timeout=1.0):
+        values, timestamps, n_lost = reader.read_new()
+        ...
+    window_values, window_timestamps = reader.latest(256) ## views onto the ring when the window does not wrap
+    reader.close()
+"""
+import logging
+import os
+import re
+import socket
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pylsl import StreamInfo
+from attrs import define, field
+
+from emotiv_lsl.sample_sink import SampleSink
+from emotiv_lsl.xdf_reader import XdfStream, parse_stream_header_xml
+from emotiv_lsl.xdf_writer import LSL_CHANNEL_FORMAT_NAMES, XDF_CHANNEL_FORMAT_DTYPES
+
+logger = logging.getLogger(__name__)
+
+RING_MAGIC: bytes = b'EMOTVRNG'
+RING_LAYOUT_VERSION: int = 1
+RING_MAX_SUBSCRIBERS: int = 32
+RING_ALIGNMENT: int = 64
+RING_SUBSCRIBE_SETTLE_SECONDS: float = 0.002 ## delay between claiming a subscriber entry and checking no concurrent reader overwrote it
+
+RING_STATE_RUNNING: int = 1
+RING_STATE_STOPPED: int = 2 ## the source stopped; the data stays readable until the publisher closes the segment
+
+RING_HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('state', '<u4'), ('capacity', '<u8'), ('channel_count', '<u4'), ('publisher_pid', '<u4'),
+                              ('channel_format', 'S16'), ('nominal_srate', '<f8'), ('info_xml_size', '<u8'), ('timestamps_offset', '<u8'), ('sample_index_offset', '<u8'),
+                              ('values_offset', '<u8'), ('subscriber_ports', '<u4', (RING_MAX_SUBSCRIBERS,)), ('sequence', '<u8'), ('write_count', '<u8')])
+
+
+def shared_memory_ring_name(stream_name: str, name_prefix: str = 'emotiv') -> str:
+    """ segment name of a stream's ring, e.g. 'emotiv_Epoc_X_Motion' for 'Epoc X Motion' """
+    return f"{name_prefix}_{re.sub(r'[^A-Za-z0-9]+', '_', stream_name).strip('_')}"
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // RING_ALIGNMENT) * RING_ALIGNMENT
+
+
+_attach_lock = threading.Lock()
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """ Attaches to an existing segment without registering it with this process's resource tracker (Python < 3.13 always does), which would unlink
+    it when a reader exits. Registering and then unregistering is not enough: a tracker keeps a set of names, and a reader started from the publisher
+    (fork or spawn) shares the publisher's tracker, so its unregister would drop the publisher's own entry and the publisher's unlink would then fail
+    in the tracker with a KeyError. While attaching, only the registration of this segment is skipped; other threads still register theirs.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        if os.name != 'posix':
+            return shared_memory.SharedMemory(name=name)
+    from multiprocessing import resource_tracker
+    with _attach_lock:
+        register = resource_tracker.register
+
+        def register_others(a_name, rtype):
+            if (rtype != 'shared_memory') or (a_name.lstrip('/') != name):
+                register(a_name, rtype)
+
+        resource_tracker.register = register_others
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+@define(slots=False)
+class RingArrays:
+    """ NumPy views onto one ring segment """
+    segment: shared_memory.SharedMemory = field()
+    header: np.ndarray = field() ## 0-d `RING_HEADER_DTYPE` record
+    control: np.ndarray = field() ## uint64 [sequence, write_count], the seqlock pair at the end of the header
+    timestamps: np.ndarray = field()
+    sample_index: np.ndarray = field()
+    values: np.ndarray = field()
+
+    @classmethod
+    def map(cls, segment: shared_memory.SharedMemory) -> 'RingArrays':
+        buffer = segment.buf
+        header = np.ndarray((), dtype=RING_HEADER_DTYPE, buffer=buffer)
+        if header['magic'].item() != RING_MAGIC:
+            raise ValueError(f'shared memory segment {segment.name!r} is not an Emotiv ring')
+        if int(header['version']) != RING_LAYOUT_VERSION:
+            raise ValueError(f"shared memory segment {segment.name!r} has ring layout version {int(header['version'])}, expected {RING_LAYOUT_VERSION}")
+        capacity, channel_count = int(header['capacity']), int(header['channel_count'])
+        values_dtype = np.dtype(XDF_CHANNEL_FORMAT_DTYPES[header['channel_format'].item().decode('ascii')])
+        return cls(segment=segment, header=header, control=np.ndarray((2,), dtype='<u8', buffer=buffer, offset=RING_HEADER_DTYPE.fields['sequence'][1]),
+                   timestamps=np.ndarray((capacity,), dtype='<f8', buffer=buffer, offset=int(header['timestamps_offset'])),
+                   sample_index=np.ndarray((capacity,), dtype='<i8', buffer=buffer, offset=int(header['sample_index_offset'])),
+                   values=np.ndarray((capacity, channel_count), dtype=values_dtype, buffer=buffer, offset=int(header['values_offset'])))
+
+    @property
+    def capacity(self) -> int:
+        return len(self.timestamps)
+
+
+    def release(self):
+        """ drops the views, which must happen before the segment can be closed """
+        self.header = self.control = self.timestamps = self.sample_index = self.values = None
+
+
+@define(slots=False)
+class PublishedRing:
+    """ one stream's ring in a `SharedMemoryRingPublisher` """
+    stream_name: str = field()
+    arrays: RingArrays = field()
+    write_count: int = field(default=0)
+
+
+@define(slots=False)
+class SharedMemoryRingPublisher(SampleSink):
+    """ Publishes each numeric stream into a shared-memory ring; see the module docstring.
+
+    Rings hold `capacity_seconds` of samples at the stream's nominal rate (`irregular_capacity` samples for irregular-rate streams). A stream that is
+    restarted with the same geometry keeps its segment and sample numbering; `close` unlinks every segment.
+    """
+    name_prefix: str = field(default='emotiv')
+    capacity_seconds: float = field(default=60.0)
+    irregular_capacity: int = field(default=4096)
+    notify: bool = field(default=True) ## send `write_count` to subscribed readers after each sample
+
+    is_open: bool = field(default=True, init=False)
+    _rings: Dict[str, PublishedRing] = field(factory=dict, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+    _notify_socket: Optional[socket.socket] = field(default=None, init=False)
+
+    def __attrs_post_init__(self):
+        if self.notify:
+            self._notify_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._notify_socket.setblocking(False)
+
+
+    @property
+    def stream_names(self) -> List[str]:
+        return list(self._rings.keys())
+
+
+    def segment_name(self, stream_name: str) -> str:
+        return shared_memory_ring_name(stream_name, self.name_prefix)
+
+
+    def _create_segment(self, name: str, info: StreamInfo, channel_format: str) -> RingArrays:
+        channel_count = info.channel_count()
+        capacity = int(np.ceil(self.capacity_seconds * info.nominal_srate())) if info.nominal_srate() > 0 else self.irregular_capacity
+        info_xml = info.as_xml().encode('utf-8')
+        values_dtype = np.dtype(XDF_CHANNEL_FORMAT_DTYPES[channel_format])
+        timestamps_offset = _aligned(RING_HEADER_DTYPE.itemsize + len(info_xml))
+        sample_index_offset = _aligned(timestamps_offset + 8 * capacity)
+        values_offset = _aligned(sample_index_offset + 8 * capacity)
+        size = values_offset + capacity * channel_count * values_dtype.itemsize
+        try:
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError: ## left behind by a publisher that did not close it
+            logger.warning(f'replacing stale shared memory segment {name!r}')
+            stale = shared_memory.SharedMemory(name=name) ## tracked, as `unlink` unregisters it
+            stale.close()
+            stale.unlink()
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        segment.buf[RING_HEADER_DTYPE.itemsize:RING_HEADER_DTYPE.itemsize + len(info_xml)] = info_xml
+        header = np.ndarray((), dtype=RING_HEADER_DTYPE, buffer=segment.buf)
+        header['version'] = RING_LAYOUT_VERSION
+        header['state'] = RING_STATE_RUNNING
+        header['capacity'] = capacity
+        header['channel_count'] = channel_count
+        header['publisher_pid'] = os.getpid()
+        header['channel_format'] = channel_format.encode('ascii')
+        header['nominal_srate'] = info.nominal_srate()
+        header['info_xml_size'] = len(info_xml)
+        header['timestamps_offset'], header['sample_index_offset'], header['values_offset'] = timestamps_offset, sample_index_offset, values_offset
+        header['magic'] = RING_MAGIC ## last, so a reader never maps a half-initialized header
+        del header
+        arrays = RingArrays.map(segment)
+        arrays.sample_index[:] = -1
+        return arrays
+
+
+    def on_stream_started(self, stream_name: str, info: StreamInfo):
+        with self._lock:
+            if not self.is_open:
+                return
+            channel_format = LSL_CHANNEL_FORMAT_NAMES[info.channel_format()]
+            if channel_format == 'string':
+                logger.warning(f'stream {stream_name!r} has string samples, which the shared-memory ring does not publish')
+                return
+            a_ring = self._rings.get(stream_name)
+            if a_ring is not None:
+                if (a_ring.arrays.values.shape[1] == info.channel_count()) and (a_ring.arrays.header['channel_format'].item().decode('ascii') == channel_format):
+                    a_ring.arrays.header['state'] = RING_STATE_RUNNING ## restarted outlet: keep publishing into the same ring
+                    return
+                self._close_ring(a_ring)
+            name = self.segment_name(stream_name)
+            arrays = self._create_segment(name, info, channel_format)
+            self._rings[stream_name] = PublishedRing(stream_name=stream_name, arrays=arrays)
+            logger.info(f'publishing stream {stream_name!r} to shared memory {name!r} ({arrays.capacity} x {info.channel_count()} x {channel_format})')
+
+
+    def on_sample(self, stream_name: str, sample: Sequence[float], timestamp: float):
+        with self._lock: ## `close` releases the views and the notification socket
+            a_ring = self._rings.get(stream_name)
+            if a_ring is None:
+                return
+            arrays = a_ring.arrays
+            n = a_ring.write_count
+            slot = n % arrays.capacity
+            control = arrays.control
+            control[0] += 1 ## odd: writing
+            arrays.sample_index[slot] = -1
+            arrays.values[slot] = sample
+            arrays.timestamps[slot] = timestamp
+            arrays.sample_index[slot] = n
+            control[1] = n + 1
+            control[0] += 1 ## even: consistent
+            a_ring.write_count = n + 1
+            if self._notify_socket is not None:
+                ports = arrays.header['subscriber_ports']
+                if ports.any():
+                    message = struct.pack('<Q', n + 1)
+                    for a_port in ports[ports != 0]:
+                        try:
+                            self._notify_socket.sendto(message, ('127.0.0.1', int(a_port)))
+                        except OSError:
+                            pass ## a reader that went away without unsubscribing
+
+
+    def on_source_stopped(self):
+        with self._lock:
+            for a_ring in self._rings.values():
+                a_ring.arrays.header['state'] = RING_STATE_STOPPED
+
+
+    def _close_ring(self, a_ring: PublishedRing):
+        segment = a_ring.arrays.segment
+        a_ring.arrays.header['state'] = RING_STATE_STOPPED
+        a_ring.arrays.release()
+        segment.close()
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+
+    def close(self):
+        """ unlinks every ring; readers that are still attached keep their mapping until they close it """
+        with self._lock:
+            if not self.is_open:
+                return
+            self.is_open = False
+            rings, self._rings = self._rings, {}
+            for a_ring in rings.values():
+                self._close_ring(a_ring)
+            if self._notify_socket is not None:
+                self._notify_socket.close()
+                self._notify_socket = None
+        logger.info('closed shared memory rings (' + ', '.join(f'{a_ring.stream_name}: {a_ring.write_count} samples' for a_ring in rings.values()) + ')')
+
+
+    def get_status(self) -> Dict:
+        with self._lock:
+            return {'publishing': self.is_open, 'streams': {a_ring.stream_name: {'segment': a_ring.arrays.segment.name, 'capacity': a_ring.arrays.capacity,
+                                                                                  'write_count': a_ring.write_count, 'subscribers': int(np.count_nonzero(a_ring.arrays.header['subscriber_ports']))}
+                                                         for a_ring in self._rings.values()}}
+
+
+@define(slots=False)
+class SharedMemoryRingReader:
+    """ Read side of one stream's ring; see the module docstring.
+
+    `timestamps`, `sample_index` and `values` are read-only views onto the whole ring (slot order). `read_new` returns the samples written since the
+    previous call (from the oldest one still in the ring on the first call, unless `from_latest`), and `latest` the most recent `n`.
+    """
+    arrays: RingArrays = field()
+    stream: XdfStream = field() ## stream metadata parsed from the published info xml (name, channel labels, nominal rate, ...)
+    position: int = field(default=0) ## sample number `read_new` continues from
+    n_lost: int = field(default=0) ## samples overwritten before `read_new` got to them, in total
+    _notify_socket: Optional[socket.socket] = field(default=None, init=False)
+    _subscriber_slot: Optional[int] = field(default=None, init=False)
+
+    @classmethod
+    def open(cls, stream_name: str, name_prefix: str = 'emotiv', timeout: float = 0.0, from_latest: bool = False) -> 'SharedMemoryRingReader':
+        """ attaches to the ring of `stream_name`, waiting up to `timeout` seconds for the publisher to create it """
+        name = shared_memory_ring_name(stream_name, name_prefix)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                segment = _attach_shared_memory(name)
+                arrays = RingArrays.map(segment)
+                break
+            except (FileNotFoundError, ValueError):
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+        info_xml = bytes(segment.buf[RING_HEADER_DTYPE.itemsize:RING_HEADER_DTYPE.itemsize + int(arrays.header['info_xml_size'])]).decode('utf-8')
+        for an_array in (arrays.timestamps, arrays.sample_index, arrays.values):
+            an_array.flags.writeable = False
+        reader = cls(arrays=arrays, stream=parse_stream_header_xml(0, info_xml))
+        write_count = reader.write_count
+        reader.position = write_count if from_latest else max(write_count - arrays.capacity + 1, 0)
+        return reader
+
+
+    @property
+    def capacity(self) -> int:
+        return self.arrays.capacity
+
+
+    @property
+    def channel_labels(self) -> List[str]:
+        return self.stream.channel_labels
+
+
+    @property
+    def is_stopped(self) -> bool:
+        """ the publisher's source stopped (or the publisher closed the ring) """
+        return int(self.arrays.header['state']) != RING_STATE_RUNNING
+
+
+    @property
+    def write_count(self) -> int:
+        """ total number of samples the publisher has written, read consistently under the seqlock """
+        control = self.arrays.control
+        while True:
+            sequence = int(control[0])
+            if sequence & 1:
+                continue ## a sample is being written
+            write_count = int(control[1])
+            if int(control[0]) == sequence:
+                return write_count
+
+
+    def _slots(self, start: int, stop: int) -> Tuple[slice, Optional[slice]]:
+        first, last = start % self.capacity, stop % self.capacity
+        if (stop - start) == 0:
+            return slice(first, first), None
+        if first < last:
+            return slice(first, last), None
+        return slice(first, self.capacity), slice(0, last)
+
+
+    def _copy_range(self, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        """ (values, timestamps, first valid sample number) of samples [start, stop), copied and validated """
+        head, tail = self._slots(start, stop)
+        arrays = self.arrays
+        if tail is None:
+            values, timestamps, stamps = arrays.values[head].copy(), arrays.timestamps[head].copy(), arrays.sample_index[head].copy()
+        else:
+            values = np.concatenate([arrays.values[head], arrays.values[tail]])
+            timestamps = np.concatenate([arrays.timestamps[head], arrays.timestamps[tail]])
+            stamps = np.concatenate([arrays.sample_index[head], arrays.sample_index[tail]])
+        ## the writer may be writing sample `write_count` (overwriting sample `write_count - capacity`) right now
+        first_valid = max(start, self.write_count - self.capacity + 1)
+        invalid = np.flatnonzero(stamps != np.arange(start, stop))
+        if len(invalid):
+            first_valid = max(first_valid, start + int(invalid[-1]) + 1)
+        skip = first_valid - start
+        return values[skip:], timestamps[skip:], first_valid
+
+
+    def read_new(self, max_samples: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, int]:
+        """ (values, timestamps, n_lost) of the samples written since the previous call; `n_lost` counts those overwritten before they could be read """
+        stop = self.write_count
+        start = max(self.position, stop - self.capacity + 1)
+        if max_samples is not None:
+            stop = min(stop, start + max_samples)
+        values, timestamps, first_valid = self._copy_range(start, stop)
+        n_lost = first_valid - self.position
+        self.n_lost += n_lost
+        self.position = stop
+        return values, timestamps, n_lost
+
+
+    def latest(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ (values, timestamps) of the most recent `n` samples (fewer if the ring holds fewer). Read-only views onto the ring when the window does not
+        wrap around its end, which stay valid until the publisher has written `capacity - n` more samples; copies otherwise.
+        """
+        stop = self.write_count
+        start = max(stop - min(n, self.capacity - 1), 0)
+        head, tail = self._slots(start, stop)
+        if tail is None:
+            return self.arrays.values[head], self.arrays.timestamps[head]
+        values, timestamps, _ = self._copy_range(start, stop)
+        return values, timestamps
+
+
+    def _subscribe(self):
+        if self._notify_socket is None:
+            self._notify_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._notify_socket.bind(('127.0.0.1', 0))
+        port = self._notify_socket.getsockname()[1]
+        ports = self.arrays.header['subscriber_ports']
+        self._subscriber_slot = None
+        while True:
+            free_slots = np.flatnonzero(ports == 0)
+            if len(free_slots) == 0:
+                logger.warning(f'no free notification entry in {self.arrays.segment.name!r}; wait() falls back to polling')
+                return
+            a_slot = int(free_slots[0])
+            ports[a_slot] = port
+            time.sleep(RING_SUBSCRIBE_SETTLE_SECONDS)
+            if int(ports[a_slot]) == port: ## otherwise a reader that found the same free entry wrote its port over ours: it keeps the entry
+                self._subscriber_slot = a_slot
+                return
+
+
+    def _is_subscribed(self) -> bool:
+        return (self._subscriber_slot is not None) and (int(self.arrays.header['subscriber_ports'][self._subscriber_slot]) == self._notify_socket.getsockname()[1])
+
+
+    def wait(self, timeout: Optional[float] = None, poll_interval: float = 0.005) -> bool:
+        """ blocks until samples newer than `position` exist or `timeout` seconds pass; returns whether there are new samples """
+        if self.write_count > self.position:
+            return True
+        if self._notify_socket is None:
+            self._subscribe()
+        deadline = (time.monotonic() + timeout) if timeout is not None else None
+        while self.write_count <= self.position:
+            remaining = (deadline - time.monotonic()) if deadline is not None else None
+            if (remaining is not None) and (remaining <= 0):
+                return False
+            if (self._subscriber_slot is not None) and (not self._is_subscribed()):
+                self._subscribe() ## lost the entry to a concurrent claim
+            if self._subscriber_slot is None:
+                time.sleep(poll_interval if remaining is None else min(poll_interval, remaining))
+                continue
+            self._notify_socket.settimeout(min(remaining, 0.1) if remaining is not None else 0.1) ## re-checks `write_count` even if a notification is lost
+            try:
+                while True: ## drain queued notifications
+                    self._notify_socket.recv(64)
+                    self._notify_socket.settimeout(0.0)
+            except (socket.timeout, BlockingIOError):
+                pass
+        return True
+
+
+    def close(self):
+        if self._notify_socket is not None:
+            if (self.arrays.header is not None) and self._is_subscribed(): ## never clear an entry another reader holds
+                self.arrays.header['subscriber_ports'][self._subscriber_slot] = 0
+            self._notify_socket.close()
+            self._notify_socket = None
+            self._subscriber_slot = None
+        if self.arrays.header is not None:
+            segment = self.arrays.segment
+            self.arrays.release()
+            segment.close()
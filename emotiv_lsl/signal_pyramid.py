@@ -0,0 +1,237 @@
+"""
+Multi-resolution min/max/mean pyramid of a recording, for drawing any zoom level of a long file without reading all of it.
+
+`build_signal_pyramid` reads a FIF file once, block by block (optionally band-pass filtering each block with a stateful IIR filter, so the result equals
+filtering the whole file), and stores per-channel min, max and mean envelopes at power-of-two decimation levels in an uncompressed `.pyramid.npz`
+sidecar next to it. `SignalPyramid.get_envelope` picks the coarsest level that still gives at least the requested number of points for a time window
+and reads only that level's arrays; it returns None when the window is short enough to be drawn from the raw samples.
+
+Usage:
+    pyramid = SignalPyramid.for_recording('session_raw.fif', l_freq=0.5, h_freq=40.0) ## builds the sidecar if missing or stale
+    envelope = pyramid.get_envelope(start=3600.0, stop=7200.0, max_points=2000)
+    if envelope is None:
+        ... ## zoomed to native resolution: read `raw.get_data(start=..., stop=...)`
+"""
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from attrs import define, field
+
+logger = logging.getLogger(__name__)
+
+PYRAMID_SUFFIX: str = '.pyramid.npz'
+PYRAMID_FORMAT_VERSION: int = 2 ## 2: stores the build parameters (picks, base_factor, min_bins)
+
+
+def pyramid_path_for(recording_path: Union[str, Path]) -> Path:
+    recording_path = Path(recording_path)
+    return recording_path.with_name(recording_path.name + PYRAMID_SUFFIX)
+
+
+@define(slots=False)
+class PyramidEnvelope:
+    """ one window of one pyramid level: (n_bins, n_channels) `minimum`/`maximum`/`mean`, and the start time of each bin in seconds """
+    times: np.ndarray = field()
+    minimum: np.ndarray = field()
+    maximum: np.ndarray = field()
+    mean: np.ndarray = field()
+    factor: int = field() ## samples per bin
+
+
+def _reduce_pairs(minimum: np.ndarray, maximum: np.ndarray, sums: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ next pyramid level: merges bins pairwise (an odd last bin is carried over alone) """
+    n_bins = len(counts)
+    n_pairs, has_odd = n_bins // 2, (n_bins % 2) == 1
+    even = slice(0, 2 * n_pairs, 2)
+    odd = slice(1, 2 * n_pairs, 2)
+    new_minimum = np.minimum(minimum[even], minimum[odd])
+    new_maximum = np.maximum(maximum[even], maximum[odd])
+    new_sums = sums[even] + sums[odd]
+    new_counts = counts[even] + counts[odd]
+    if has_odd:
+        new_minimum = np.concatenate([new_minimum, minimum[-1:]])
+        new_maximum = np.concatenate([new_maximum, maximum[-1:]])
+        new_sums = np.concatenate([new_sums, sums[-1:]])
+        new_counts = np.concatenate([new_counts, counts[-1:]])
+    return new_minimum, new_maximum, new_sums, new_counts
+
+
+def build_signal_pyramid(recording_path: Union[str, Path], output_path: Optional[Union[str, Path]] = None, base_factor: int = 4, min_bins: int = 512,
+                         block_seconds: float = 600.0, l_freq: Optional[float] = None, h_freq: Optional[float] = None, picks: Optional[List[str]] = None) -> Path:
+    """ Builds the pyramid sidecar of a FIF recording, reading it `block_seconds` at a time.
+
+    The finest level has `base_factor` samples per bin; each following level halves the number of bins, down to `min_bins`. With `l_freq`/`h_freq`
+    the signal is band-pass (or high/low-pass) filtered first, by a 4th-order Butterworth whose state is carried from block to block.
+    """
+    import mne
+    from scipy.signal import butter, sosfilt, sosfilt_zi
+
+    recording_path = Path(recording_path)
+    output_path = Path(output_path) if output_path is not None else pyramid_path_for(recording_path)
+    start_time = time.perf_counter()
+    raw = mne.io.read_raw_fif(recording_path, preload=False, verbose=False)
+    pick_indices = [raw.ch_names.index(a_name) for a_name in picks] if picks is not None else list(range(len(raw.ch_names)))
+    sfreq = float(raw.info['sfreq'])
+    n_times, n_channels = raw.n_times, len(pick_indices)
+
+    sos, filter_state = None, None
+    if (l_freq is not None) or (h_freq is not None):
+        if (l_freq is not None) and (h_freq is not None):
+            sos = butter(4, [l_freq, h_freq], btype='bandpass', fs=sfreq, output='sos')
+        elif l_freq is not None:
+            sos = butter(4, l_freq, btype='highpass', fs=sfreq, output='sos')
+        else:
+            sos = butter(4, h_freq, btype='lowpass', fs=sfreq, output='sos')
+
+    n_base_bins = -(-n_times // base_factor)
+    minimum = np.empty((n_base_bins, n_channels), dtype=np.float32)
+    maximum = np.empty((n_base_bins, n_channels), dtype=np.float32)
+    sums = np.empty((n_base_bins, n_channels), dtype=np.float64)
+    counts = np.full(n_base_bins, base_factor, dtype=np.int64)
+    if n_times % base_factor:
+        counts[-1] = n_times % base_factor
+
+    block_samples = max(int(block_seconds * sfreq) // base_factor, 1) * base_factor ## whole bins per block
+    for block_start in range(0, n_times, block_samples):
+        block_stop = min(block_start + block_samples, n_times)
+        block = raw.get_data(picks=pick_indices, start=block_start, stop=block_stop).T ## (n, n_channels)
+        if sos is not None:
+            if filter_state is None:
+                filter_state = sosfilt_zi(sos)[:, :, np.newaxis] * block[0][np.newaxis, np.newaxis, :]
+            block, filter_state = sosfilt(sos, block, axis=0, zi=filter_state)
+        first_bin = block_start // base_factor
+        n_full = len(block) // base_factor
+        if n_full > 0:
+            full = block[:n_full * base_factor].reshape(n_full, base_factor, n_channels)
+            minimum[first_bin:first_bin + n_full] = full.min(axis=1)
+            maximum[first_bin:first_bin + n_full] = full.max(axis=1)
+            sums[first_bin:first_bin + n_full] = full.sum(axis=1)
+        if len(block) > n_full * base_factor: ## partial last bin (end of file)
+            rest = block[n_full * base_factor:]
+            minimum[first_bin + n_full] = rest.min(axis=0)
+            maximum[first_bin + n_full] = rest.max(axis=0)
+            sums[first_bin + n_full] = rest.sum(axis=0)
+
+    arrays: Dict[str, np.ndarray] = {}
+    factor = base_factor
+    factors = []
+    while True:
+        arrays[f'min_{factor}'] = minimum
+        arrays[f'max_{factor}'] = maximum
+        arrays[f'mean_{factor}'] = (sums / counts[:, np.newaxis]).astype(np.float32)
+        factors.append(factor)
+        if len(counts) <= min_bins:
+            break
+        minimum, maximum, sums, counts = _reduce_pairs(minimum, maximum, sums, counts)
+        factor *= 2
+
+    stat = recording_path.stat()
+    np.savez(output_path, factors=np.array(factors), sfreq=np.float64(sfreq), n_times=np.int64(n_times), ch_names=np.array([raw.ch_names[i] for i in pick_indices]),
+             source_size=np.int64(stat.st_size), source_mtime=np.float64(stat.st_mtime), l_freq=np.float64(np.nan if l_freq is None else l_freq),
+             h_freq=np.float64(np.nan if h_freq is None else h_freq), picks=np.array(picks if picks is not None else [], dtype=str), all_channels=np.bool_(picks is None),
+             base_factor=np.int64(base_factor), min_bins=np.int64(min_bins), format_version=np.int64(PYRAMID_FORMAT_VERSION), **arrays)
+    logger.info(f'built {len(factors)}-level pyramid of {recording_path} ({n_times} samples x {n_channels} channels) in {time.perf_counter() - start_time:.1f} s')
+    return output_path
+
+
+@define(slots=False)
+class SignalPyramid:
+    """ Read side of a pyramid sidecar. Level arrays are read from the archive on first use and cached, so a zoom level costs one read. """
+    path: Path = field(converter=Path)
+
+    factors: List[int] = field(init=False)
+    sfreq: float = field(init=False)
+    n_times: int = field(init=False)
+    ch_names: List[str] = field(init=False)
+    l_freq: Optional[float] = field(init=False)
+    h_freq: Optional[float] = field(init=False)
+    source_size: int = field(init=False)
+    source_mtime: float = field(init=False)
+    picks: Optional[List[str]] = field(init=False) ## channels the pyramid was built from, None for all
+    base_factor: Optional[int] = field(init=False) ## None in sidecars older than format version 2
+    min_bins: Optional[int] = field(init=False)
+    format_version: int = field(init=False)
+    _archive: Optional[object] = field(default=None, init=False)
+    _levels: Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]] = field(factory=dict, init=False)
+
+
+    def __attrs_post_init__(self):
+        self._archive = np.load(self.path)
+        self.factors = [int(a_factor) for a_factor in self._archive['factors']]
+        self.sfreq = float(self._archive['sfreq'])
+        self.n_times = int(self._archive['n_times'])
+        self.ch_names = [str(a_name) for a_name in self._archive['ch_names']]
+        self.l_freq = None if np.isnan(self._archive['l_freq']) else float(self._archive['l_freq'])
+        self.h_freq = None if np.isnan(self._archive['h_freq']) else float(self._archive['h_freq'])
+        self.source_size = int(self._archive['source_size'])
+        self.source_mtime = float(self._archive['source_mtime'])
+        self.format_version = int(self._archive['format_version']) if 'format_version' in self._archive.files else 1
+        if self.format_version >= 2:
+            self.picks = None if bool(self._archive['all_channels']) else [str(a_name) for a_name in self._archive['picks']]
+            self.base_factor = int(self._archive['base_factor'])
+            self.min_bins = int(self._archive['min_bins'])
+        else:
+            self.picks, self.base_factor, self.min_bins = None, None, None
+
+
+    @classmethod
+    def for_recording(cls, recording_path: Union[str, Path], l_freq: Optional[float] = None, h_freq: Optional[float] = None, picks: Optional[List[str]] = None,
+                      base_factor: int = 4, min_bins: int = 512, **build_kwargs) -> "SignalPyramid":
+        """ opens the sidecar of `recording_path`, (re)building it first if it is missing, older than the recording, or built with other filter or build settings """
+        recording_path = Path(recording_path)
+        path = pyramid_path_for(recording_path)
+        if path.exists():
+            pyramid = cls(path)
+            stat = recording_path.stat()
+            if (pyramid.format_version == PYRAMID_FORMAT_VERSION) and ((pyramid.source_size, pyramid.source_mtime, pyramid.l_freq, pyramid.h_freq, pyramid.picks, pyramid.base_factor, pyramid.min_bins)
+                                                                        == (stat.st_size, stat.st_mtime, l_freq, h_freq, (list(picks) if picks is not None else None), base_factor, min_bins)):
+                return pyramid
+            pyramid.close()
+        build_signal_pyramid(recording_path, path, l_freq=l_freq, h_freq=h_freq, picks=picks, base_factor=base_factor, min_bins=min_bins, **build_kwargs)
+        return cls(path)
+
+
+    @property
+    def duration(self) -> float:
+        return self.n_times / self.sfreq
+
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+        self._levels.clear()
+
+
+    def get_level(self, factor: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ (min, max, mean) arrays of the level with `factor` samples per bin """
+        if factor not in self._levels:
+            self._levels[factor] = (self._archive[f'min_{factor}'], self._archive[f'max_{factor}'], self._archive[f'mean_{factor}'])
+        return self._levels[factor]
+
+
+    def choose_factor(self, n_samples: int, max_points: int) -> Optional[int]:
+        """ coarsest level giving at least `max_points` bins over `n_samples` samples (the finest level if none does), or None if the raw samples fit in `max_points` """
+        if n_samples <= max_points:
+            return None
+        chosen = self.factors[0]
+        for a_factor in self.factors:
+            if (n_samples / a_factor) >= max_points:
+                chosen = a_factor
+        return chosen
+
+
+    def get_envelope(self, start: float, stop: float, max_points: int = 2000) -> Optional[PyramidEnvelope]:
+        """ envelope of [start, stop) seconds with at most about 2 * `max_points` bins, or None when the window should be drawn from raw samples """
+        first_sample = max(int(start * self.sfreq), 0)
+        last_sample = min(int(np.ceil(stop * self.sfreq)), self.n_times)
+        factor = self.choose_factor(max(last_sample - first_sample, 0), max_points)
+        if factor is None:
+            return None
+        minimum, maximum, mean = self.get_level(factor)
+        first_bin, last_bin = first_sample // factor, -(-last_sample // factor)
+        times = np.arange(first_bin, last_bin) * (factor / self.sfreq)
+        return PyramidEnvelope(times=times, minimum=minimum[first_bin:last_bin], maximum=maximum[first_bin:last_bin], mean=mean[first_bin:last_bin], factor=factor)
@@ -0,0 +1,588 @@
+"""
+asyncio TCP/WebSocket bridge for consumers without pylsl.
+
+`StreamBridge` is a `SampleSink`: on the acquisition thread it only stages samples, and every `chunk_samples` samples (or `max_latency` seconds) hands
+the chunk to an asyncio event loop on its own thread, which fans it out to all connected clients. Each client has a bounded queue of chunks
+(`max_queue_chunks`) and its own sender coroutine, so a slow client only ever falls behind itself:
+    'drop-oldest'  a full queue drops its oldest chunk; the client sees the gap in `n_dropped` of the next chunk of that stream
+    'decimate'     the client's decimation factor doubles (up to `max_decimation`) while its queue is more than 3/4 full and halves again below 1/4;
+                   chunks are sent with every `decimation`-th sample (on the sample-number grid), and a full queue still drops its oldest chunk
+
+Clients: raw TCP on `tcp_port` (each message prefixed with its uint32 length), or WebSocket on `websocket_port` (one binary WebSocket message per
+message; `ws://host:port/?streams=Epoc%20X,Epoc%20X%20Motion` subscribes to some streams only). Messages are little-endian:
+    header      uint8 message type, uint8 reserved, uint16 stream id
+    type 1      stream info: UTF-8 JSON {stream_id, name, type, channel_count, nominal_srate, channel_labels, source_id}, sent on connect and for each new stream
+    type 2      samples: uint32 n_samples, uint16 decimation, uint16 channel_count, uint32 n_dropped, uint64 first sample number,
+                then float64 timestamps [n_samples] (at byte 24, so `new Float64Array(buffer, 24, n)` works) and float32 values [n_samples, channel_count]
+
+Queue depth, decimation, dropped samples and throughput of every client are in `get_status()`, and logged every `status_interval` seconds.
+
+Usage:
+    bridge = StreamBridge(tcp_port=16571, websocket_port=16572)
+    bridge.start() ## background event loop
+    emotiv.add_sample_sink(bridge)
+    ...
+    bridge.stop()
+
+    for a_message in iter_bridge_messages('127.0.0.1', 16571): ## blocking TCP client, no pylsl needed
+        ...
+
+    python -m emotiv_lsl.stream_bridge [--tcp-port 16571] [--websocket-port 16572] [--policy decimate] ## runs the headset with the bridge attached
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import functools
+import hashlib
+import json
+import logging
+import socket
+import struct
+import threading
+import time
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pylsl
+from pylsl import StreamInfo
+from attrs import define, field
+
+from emotiv_lsl.sample_sink import SampleSink
+from emotiv_lsl.hdf5_store import get_stream_channel_labels
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TCP_PORT: int = 16571
+DEFAULT_WEBSOCKET_PORT: int = 16572
+QUEUE_POLICIES: Tuple[str, ...] = ('drop-oldest', 'decimate')
+CLOSE_TIMEOUT_SECONDS: float = 1.0 ## on stop, how long closed connections get to finish before their transports are aborted
+
+BRIDGE_MESSAGE_STREAM_INFO: int = 1
+BRIDGE_MESSAGE_SAMPLES: int = 2
+MESSAGE_HEADER = struct.Struct('<BBH') ## message type, reserved, stream id
+SAMPLES_HEADER = struct.Struct('<IHHIQ') ## n_samples, decimation, channel_count, n_dropped, first sample number
+TCP_LENGTH_PREFIX = struct.Struct('<I')
+
+WEBSOCKET_GUID: str = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WEBSOCKET_OPCODE_BINARY: int = 0x2
+WEBSOCKET_OPCODE_CLOSE: int = 0x8
+WEBSOCKET_OPCODE_PING: int = 0x9
+WEBSOCKET_OPCODE_PONG: int = 0xA
+
+
+@define(slots=False)
+class BridgeChunk:
+    """ consecutive samples of one stream """
+    stream_id: int = field()
+    first_sample: int = field() ## running sample number of the first row
+    timestamps: np.ndarray = field() ## float64 [n]
+    values: np.ndarray = field() ## float32 [n, channel_count]
+    decimation: int = field(default=1) ## row i is sample `first_sample + i * decimation`
+    n_dropped: int = field(default=0) ## samples of this stream dropped (not decimated) before this chunk
+
+    @property
+    def n_samples(self) -> int:
+        return len(self.timestamps)
+
+
+def encode_samples_message(chunk: BridgeChunk) -> bytes:
+    return (MESSAGE_HEADER.pack(BRIDGE_MESSAGE_SAMPLES, 0, chunk.stream_id) + SAMPLES_HEADER.pack(chunk.n_samples, chunk.decimation, chunk.values.shape[1], chunk.n_dropped, chunk.first_sample)
+            + np.ascontiguousarray(chunk.timestamps, dtype='<f8').tobytes() + np.ascontiguousarray(chunk.values, dtype='<f4').tobytes())
+
+
+def decode_bridge_message(message: bytes) -> Union[Dict, BridgeChunk]:
+    """ the stream info dict (type 1) or `BridgeChunk` (type 2) of one message """
+    message_type, _, stream_id = MESSAGE_HEADER.unpack_from(message)
+    if message_type == BRIDGE_MESSAGE_STREAM_INFO:
+        return json.loads(message[MESSAGE_HEADER.size:].decode('utf-8'))
+    if message_type != BRIDGE_MESSAGE_SAMPLES:
+        raise ValueError(f'unknown bridge message type {message_type}')
+    n_samples, decimation, channel_count, n_dropped, first_sample = SAMPLES_HEADER.unpack_from(message, MESSAGE_HEADER.size)
+    offset = MESSAGE_HEADER.size + SAMPLES_HEADER.size
+    timestamps = np.frombuffer(message, dtype='<f8', count=n_samples, offset=offset)
+    values = np.frombuffer(message, dtype='<f4', count=n_samples * channel_count, offset=offset + 8 * n_samples).reshape(n_samples, channel_count)
+    return BridgeChunk(stream_id=stream_id, first_sample=first_sample, timestamps=timestamps, values=values, decimation=decimation, n_dropped=n_dropped)
+
+
+def encode_websocket_frame(payload: bytes, opcode: int = WEBSOCKET_OPCODE_BINARY) -> bytes:
+    """ one unmasked (server to client) final frame """
+    n = len(payload)
+    if n < 126:
+        head = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 65536:
+        head = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return head + payload
+
+
+async def read_websocket_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """ (opcode, unmasked payload) of the next frame from a client """
+    first, second = await reader.readexactly(2)
+    n = second & 0x7F
+    if n == 126:
+        n = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif n == 127:
+        n = struct.unpack('!Q', await reader.readexactly(8))[0]
+    mask = (await reader.readexactly(4)) if (second & 0x80) else None
+    payload = await reader.readexactly(n)
+    if mask is not None:
+        payload = (np.frombuffer(payload, dtype=np.uint8) ^ np.resize(np.frombuffer(mask, dtype=np.uint8), n)).tobytes()
+    return first & 0x0F, payload
+
+
+@define(slots=False)
+class BridgeStream:
+    """ staging block of one stream in a `StreamBridge` """
+    stream_id: int = field()
+    name: str = field()
+    info_message: bytes = field()
+    block_values: np.ndarray = field()
+    block_timestamps: np.ndarray = field()
+    n_pending: int = field(default=0)
+    staged_at: float = field(default=0.0) ## `time.monotonic()` when the first pending sample was staged
+    sample_count: int = field(default=0) ## samples received, including pending ones
+    lock: threading.Lock = field(factory=threading.Lock) ## the acquisition thread stages under it, the event loop takes it to flush a stalled stream
+
+
+@define(slots=False)
+class BridgeClient:
+    """ one connected client of a `StreamBridge`, owned by the event loop """
+    client_id: int = field()
+    peer: str = field()
+    kind: str = field() ## 'tcp' or 'websocket'
+    writer: asyncio.StreamWriter = field()
+    stream_filter: Optional[Set[str]] = field(default=None) ## stream names to send, None for all
+    queue: Deque[BridgeChunk] = field(factory=collections.deque)
+    control: Deque[bytes] = field(factory=collections.deque) ## stream infos and WebSocket control frames, never dropped
+    wakeup: asyncio.Event = field(factory=asyncio.Event)
+    decimation: int = field(default=1)
+    next_sample: Dict[int, int] = field(factory=dict) ## stream id -> sample number the client expects next
+    connected_at: float = field(factory=time.monotonic)
+    bytes_sent: int = field(default=0)
+    samples_sent: int = field(default=0)
+    samples_dropped: int = field(default=0)
+    max_queue_depth: int = field(default=0)
+    _rate_mark: Tuple[float, int] = field(default=None) ## (time, bytes_sent) of the previous status, for the recent throughput
+
+    def frame(self, message: bytes) -> bytes:
+        return encode_websocket_frame(message) if self.kind == 'websocket' else (TCP_LENGTH_PREFIX.pack(len(message)) + message)
+
+
+    def get_status(self) -> Dict:
+        now = time.monotonic()
+        mark_time, mark_bytes = self._rate_mark if self._rate_mark is not None else (self.connected_at, 0)
+        self._rate_mark = (now, self.bytes_sent)
+        return {'peer': self.peer, 'kind': self.kind, 'queue_depth': len(self.queue), 'max_queue_depth': self.max_queue_depth, 'decimation': self.decimation,
+                'samples_sent': self.samples_sent, 'samples_dropped': self.samples_dropped, 'bytes_sent': self.bytes_sent,
+                'bytes_per_second': (self.bytes_sent - mark_bytes) / max(now - mark_time, 1e-9), 'connected_seconds': now - self.connected_at}
+
+
+@define(slots=False)
+class StreamBridge(SampleSink):
+    """ Serves the published streams to TCP and WebSocket clients; see the module docstring. Either port may be None to disable that server. """
+    host: str = field(default='127.0.0.1')
+    tcp_port: Optional[int] = field(default=DEFAULT_TCP_PORT)
+    websocket_port: Optional[int] = field(default=DEFAULT_WEBSOCKET_PORT)
+    policy: str = field(default='drop-oldest')
+    chunk_samples: int = field(default=8)
+    max_latency: float = field(default=0.05) ## seconds a staged sample may wait for its chunk to fill, also when its stream pauses (checked every max_latency / 2)
+    max_queue_chunks: int = field(default=256) ## per client
+    max_decimation: int = field(default=16)
+    status_interval: float = field(default=30.0) ## seconds between client status log lines, 0 to disable
+
+    _streams: Dict[str, BridgeStream] = field(factory=dict, init=False)
+    _clients: Dict[int, BridgeClient] = field(factory=dict, init=False) ## only touched on the event loop
+    _connections: Dict[asyncio.Task, asyncio.StreamWriter] = field(factory=dict, init=False) ## handler task -> its writer, only touched on the event loop
+    _next_client_id: int = field(default=0, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+    _loop: Optional[asyncio.AbstractEventLoop] = field(default=None, init=False)
+    _thread: Optional[threading.Thread] = field(default=None, init=False)
+    _stopped: Optional[asyncio.Event] = field(default=None, init=False)
+    _ready: threading.Event = field(factory=threading.Event, init=False)
+    _startup_error: Optional[BaseException] = field(default=None, init=False)
+    bound_ports: Dict[str, int] = field(factory=dict, init=False) ## 'tcp'/'websocket' -> listening port (useful with port 0)
+
+    def __attrs_post_init__(self):
+        if self.policy not in QUEUE_POLICIES:
+            raise ValueError(f"unknown queue policy {self.policy!r} (expected one of {QUEUE_POLICIES})")
+
+
+    @property
+    def is_running(self) -> bool:
+        return (self._thread is not None) and self._thread.is_alive()
+
+
+    @property
+    def stream_names(self) -> List[str]:
+        return list(self._streams.keys())
+
+
+    def start(self, timeout: float = 5.0):
+        """ starts the servers on a background event loop; raises if they cannot listen """
+        if self.is_running:
+            return
+        self._ready.clear()
+        self._startup_error = None
+        self._thread = threading.Thread(target=self._run_loop, name='StreamBridge', daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout)
+        if self._startup_error is not None:
+            self._thread.join(timeout)
+            self._thread = None
+            raise self._startup_error
+
+
+    def stop(self, timeout: float = 5.0):
+        """ flushes staged samples, disconnects every client and stops the event loop """
+        if not self.is_running:
+            return
+        self._flush_all()
+        loop, stopped = self._loop, self._stopped
+        if (loop is not None) and (stopped is not None):
+            loop.call_soon_threadsafe(stopped.set)
+        self._thread.join(timeout)
+        self._thread = None
+
+
+    def _run_loop(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._serve())
+        except BaseException as e:
+            if not self._ready.is_set():
+                self._startup_error = e
+                self._ready.set()
+            else:
+                logger.error(f'stream bridge event loop failed: {e!r}')
+        finally:
+            self._loop = None
+            loop.close()
+
+
+    async def _serve(self):
+        self._stopped = asyncio.Event()
+        servers = []
+        background_tasks = []
+        try:
+            if self.tcp_port is not None:
+                servers.append(await asyncio.start_server(functools.partial(self._handle_connection, self._handle_tcp), self.host, self.tcp_port))
+                self.bound_ports['tcp'] = servers[-1].sockets[0].getsockname()[1]
+            if self.websocket_port is not None:
+                servers.append(await asyncio.start_server(functools.partial(self._handle_connection, self._handle_websocket), self.host, self.websocket_port))
+                self.bound_ports['websocket'] = servers[-1].sockets[0].getsockname()[1]
+            self._loop = asyncio.get_running_loop()
+            self._ready.set()
+            logger.info(f'stream bridge listening on {self.host} (' + ', '.join(f'{kind} port {port}' for kind, port in self.bound_ports.items()) + f', {self.policy})')
+            background_tasks.append(asyncio.ensure_future(self._flush_stalled_periodically()))
+            if self.status_interval > 0:
+                background_tasks.append(asyncio.ensure_future(self._log_status_periodically()))
+            await self._stopped.wait()
+        finally:
+            for a_task in background_tasks:
+                a_task.cancel()
+            await asyncio.gather(*background_tasks, return_exceptions=True)
+            for a_server in servers:
+                a_server.close()
+            await self._close_connections()
+            for a_server in servers:
+                await a_server.wait_closed()
+
+
+    async def _close_connections(self):
+        """ Closes every connection and waits for its handler to return. Handlers are not cancelled: a cancelled `start_server` callback task
+        logs a CancelledError traceback on some Python versions. Connections still open after `CLOSE_TIMEOUT_SECONDS` (a client that stopped
+        reading, with `drain()` pending) have their transports aborted, which fails their pending reads and writes.
+        """
+        for a_writer in list(self._connections.values()):
+            a_writer.close()
+        if not self._connections:
+            return
+        _done, pending = await asyncio.wait(list(self._connections.keys()), timeout=CLOSE_TIMEOUT_SECONDS)
+        if pending:
+            for a_task in pending:
+                self._connections[a_task].transport.abort()
+            await asyncio.wait(pending, timeout=CLOSE_TIMEOUT_SECONDS)
+
+
+    async def _log_status_periodically(self):
+        while True:
+            await asyncio.sleep(self.status_interval)
+            for a_client in list(self._clients.values()):
+                status = a_client.get_status()
+                logger.info(f"client {a_client.client_id} ({status['kind']} {status['peer']}): {status['bytes_per_second'] / 1e3:.1f} kB/s, queue {status['queue_depth']}/{self.max_queue_chunks}"
+                            f" (max {status['max_queue_depth']}), decimation {status['decimation']}, {status['samples_dropped']} samples dropped")
+
+
+    async def _flush_stalled_periodically(self):
+        """ `on_sample` only checks `max_latency` when the next sample arrives; this sends what a paused stream left staged """
+        while True:
+            await asyncio.sleep(self.max_latency / 2.0)
+            now = time.monotonic()
+            for a_stream in list(self._streams.values()):
+                if (a_stream.n_pending > 0) and ((now - a_stream.staged_at) >= self.max_latency):
+                    with a_stream.lock:
+                        if (a_stream.n_pending > 0) and ((now - a_stream.staged_at) >= self.max_latency):
+                            self._flush_stream(a_stream)
+
+
+    ## acquisition side ________________________________________________________________________________________________________________________ #
+    def on_stream_started(self, stream_name: str, info: StreamInfo):
+        if info.channel_format() == pylsl.cf_string:
+            logger.warning(f'stream {stream_name!r} has string samples, which the stream bridge does not forward')
+            return
+        with self._lock:
+            existing = self._streams.get(stream_name)
+            stream_id = existing.stream_id if existing is not None else len(self._streams)
+            metadata = {'stream_id': stream_id, 'name': stream_name, 'type': info.type(), 'channel_count': info.channel_count(), 'nominal_srate': info.nominal_srate(),
+                        'channel_labels': get_stream_channel_labels(info), 'source_id': info.source_id()}
+            a_stream = BridgeStream(stream_id=stream_id, name=stream_name, info_message=MESSAGE_HEADER.pack(BRIDGE_MESSAGE_STREAM_INFO, 0, stream_id) + json.dumps(metadata).encode('utf-8'),
+                                    block_values=np.zeros((self.chunk_samples, info.channel_count()), dtype=np.float32), block_timestamps=np.zeros(self.chunk_samples, dtype=np.float64),
+                                    sample_count=(existing.sample_count if existing is not None else 0)) ## a restarted outlet continues the sample numbering
+            self._streams[stream_name] = a_stream
+        self._call_in_loop(self._broadcast_stream_info, a_stream)
+
+
+    def on_sample(self, stream_name: str, sample: Sequence[float], timestamp: float):
+        a_stream = self._streams.get(stream_name)
+        if a_stream is None:
+            return
+        with a_stream.lock:
+            i = a_stream.n_pending
+            if i == 0:
+                a_stream.staged_at = time.monotonic()
+            a_stream.block_values[i] = sample
+            a_stream.block_timestamps[i] = timestamp
+            a_stream.n_pending += 1
+            a_stream.sample_count += 1
+            if (a_stream.n_pending == self.chunk_samples) or ((timestamp - a_stream.block_timestamps[0]) >= self.max_latency):
+                self._flush_stream(a_stream)
+
+
+    def on_source_stopped(self):
+        self._flush_all()
+
+
+    def _flush_stream(self, a_stream: BridgeStream):
+        """ hands the staged samples to the event loop; the caller holds `a_stream.lock` """
+        n = a_stream.n_pending
+        if n == 0:
+            return
+        chunk = BridgeChunk(stream_id=a_stream.stream_id, first_sample=a_stream.sample_count - n, timestamps=a_stream.block_timestamps[:n].copy(), values=a_stream.block_values[:n].copy())
+        a_stream.n_pending = 0
+        self._call_in_loop(self._dispatch, a_stream.name, chunk)
+
+
+    def _flush_all(self):
+        for a_stream in list(self._streams.values()):
+            with a_stream.lock:
+                self._flush_stream(a_stream)
+
+
+    def _call_in_loop(self, callback, *args):
+        loop = self._loop
+        if loop is None:
+            return ## not started: nobody to send to
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass ## the loop is shutting down
+
+
+    ## event loop side _________________________________________________________________________________________________________________________ #
+    def _broadcast_stream_info(self, a_stream: BridgeStream):
+        for a_client in self._clients.values():
+            if (a_client.stream_filter is None) or (a_stream.name in a_client.stream_filter):
+                a_client.control.append(a_client.frame(a_stream.info_message))
+                a_client.wakeup.set()
+
+
+    def _dispatch(self, stream_name: str, chunk: BridgeChunk):
+        for a_client in self._clients.values():
+            if (a_client.stream_filter is not None) and (stream_name not in a_client.stream_filter):
+                continue
+            queue = a_client.queue
+            if self.policy == 'decimate':
+                if (len(queue) > (3 * self.max_queue_chunks) // 4) and (a_client.decimation < self.max_decimation):
+                    a_client.decimation *= 2
+                elif (len(queue) < self.max_queue_chunks // 4) and (a_client.decimation > 1):
+                    a_client.decimation //= 2
+            if len(queue) >= self.max_queue_chunks:
+                a_client.samples_dropped += queue.popleft().n_samples
+            queue.append(chunk)
+            a_client.max_queue_depth = max(a_client.max_queue_depth, len(queue))
+            a_client.wakeup.set()
+
+
+    def _encode_for_client(self, a_client: BridgeClient, chunk: BridgeChunk) -> Optional[bytes]:
+        expected = a_client.next_sample.get(chunk.stream_id, chunk.first_sample)
+        n_dropped = max(chunk.first_sample - expected, 0)
+        a_client.next_sample[chunk.stream_id] = chunk.first_sample + chunk.n_samples
+        decimation = a_client.decimation
+        if decimation > 1:
+            keep = np.flatnonzero(((chunk.first_sample + np.arange(chunk.n_samples)) % decimation) == 0)
+            if len(keep) == 0:
+                return None
+            chunk = BridgeChunk(stream_id=chunk.stream_id, first_sample=chunk.first_sample + int(keep[0]), timestamps=chunk.timestamps[keep], values=chunk.values[keep], decimation=decimation)
+        chunk.n_dropped = n_dropped
+        a_client.samples_sent += chunk.n_samples
+        return a_client.frame(encode_samples_message(chunk))
+
+
+    async def _send_loop(self, a_client: BridgeClient):
+        writer = a_client.writer
+        while True:
+            await a_client.wakeup.wait()
+            a_client.wakeup.clear()
+            while a_client.control or a_client.queue:
+                data = a_client.control.popleft() if a_client.control else self._encode_for_client(a_client, a_client.queue.popleft())
+                if data is None:
+                    continue
+                writer.write(data)
+                a_client.bytes_sent += len(data)
+                await writer.drain() ## only this client's coroutine waits on a slow reader
+
+
+    async def _run_client(self, a_client: BridgeClient, receive_loop):
+        self._clients[a_client.client_id] = a_client
+        with self._lock:
+            streams = list(self._streams.values())
+        for a_stream in streams:
+            if (a_client.stream_filter is None) or (a_stream.name in a_client.stream_filter):
+                a_client.control.append(a_client.frame(a_stream.info_message))
+        a_client.wakeup.set()
+        logger.info(f'client {a_client.client_id} connected ({a_client.kind} {a_client.peer}' + (f", streams {sorted(a_client.stream_filter)}" if a_client.stream_filter else '') + ')')
+        tasks = [asyncio.ensure_future(self._send_loop(a_client)), asyncio.ensure_future(receive_loop)]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for a_task in done:
+                if (not a_task.cancelled()) and (a_task.exception() is not None) and (not isinstance(a_task.exception(), (ConnectionError, asyncio.IncompleteReadError))):
+                    logger.warning(f'client {a_client.client_id}: {a_task.exception()!r}')
+        finally:
+            for a_task in tasks:
+                a_task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._clients.pop(a_client.client_id, None)
+            a_client.writer.close()
+            status = a_client.get_status()
+            logger.info(f"client {a_client.client_id} disconnected after {status['connected_seconds']:.0f} s ({status['samples_sent']} samples sent, {status['samples_dropped']} dropped)")
+
+
+    def _new_client(self, writer: asyncio.StreamWriter, kind: str, stream_filter: Optional[Set[str]] = None) -> BridgeClient:
+        self._next_client_id += 1
+        peer = writer.get_extra_info('peername')
+        return BridgeClient(client_id=self._next_client_id, peer=(f'{peer[0]}:{peer[1]}' if peer else '?'), kind=kind, writer=writer, stream_filter=stream_filter)
+
+
+    async def _handle_connection(self, handler, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """ runs `handler` for one connection, registered so that `_close_connections` can close it on stop """
+        a_task = asyncio.current_task()
+        self._connections[a_task] = writer
+        try:
+            await handler(reader, writer)
+        finally:
+            self._connections.pop(a_task, None)
+
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async def receive_loop():
+            while await reader.read(4096): ## clients have nothing to say; EOF means they left
+                pass
+        await self._run_client(self._new_client(writer, 'tcp'), receive_loop())
+
+
+    async def _handle_websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=5.0)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode('latin-1').split('\r\n')
+        request_line = lines[0].split(' ')
+        headers = {a_name.strip().lower(): a_value.strip() for a_name, a_value in (a_line.split(':', 1) for a_line in lines[1:] if ':' in a_line)}
+        key = headers.get('sec-websocket-key')
+        if (len(request_line) < 2) or (request_line[0] != 'GET') or (key is None) or ('websocket' not in headers.get('upgrade', '').lower()):
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            writer.close()
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n' f'Sec-WebSocket-Accept: {accept}\r\n\r\n').encode('ascii'))
+        requested = parse_qs(urlsplit(request_line[1]).query).get('streams')
+        stream_filter = {a_name for a_value in requested for a_name in a_value.split(',') if a_name} if requested else None
+        a_client = self._new_client(writer, 'websocket', stream_filter=stream_filter)
+
+        async def receive_loop():
+            while True:
+                opcode, payload = await read_websocket_frame(reader)
+                if opcode == WEBSOCKET_OPCODE_CLOSE:
+                    a_client.control.append(encode_websocket_frame(payload[:2], WEBSOCKET_OPCODE_CLOSE))
+                    a_client.wakeup.set()
+                    await asyncio.sleep(0.1) ## let the sender echo the close frame
+                    return
+                if opcode == WEBSOCKET_OPCODE_PING:
+                    a_client.control.append(encode_websocket_frame(payload, WEBSOCKET_OPCODE_PONG))
+                    a_client.wakeup.set()
+        await self._run_client(a_client, receive_loop())
+
+
+    def get_status(self) -> Dict:
+        """ per-stream sample counts and per-client queue depth, decimation, drops and throughput (bytes/s since the previous call) """
+        clients = {}
+        loop = self._loop
+        if loop is not None:
+            future = asyncio.run_coroutine_threadsafe(self._collect_client_status(), loop)
+            try:
+                clients = future.result(timeout=2.0)
+            except Exception as e:
+                logger.warning(f'could not collect client status: {e!r}')
+        return {'running': self.is_running, 'ports': dict(self.bound_ports), 'policy': self.policy,
+                'streams': {a_stream.name: a_stream.sample_count for a_stream in list(self._streams.values())}, 'clients': clients}
+
+
+    async def _collect_client_status(self) -> Dict[int, Dict]:
+        return {a_client.client_id: a_client.get_status() for a_client in self._clients.values()}
+
+
+def iter_bridge_messages(host: str = '127.0.0.1', port: int = DEFAULT_TCP_PORT, timeout: Optional[float] = None) -> Iterator[Union[Dict, BridgeChunk]]:
+    """ connects to a bridge's TCP port and yields its decoded messages (stream info dicts and `BridgeChunk`s) until it disconnects """
+    with socket.create_connection((host, port), timeout=timeout) as a_socket:
+        a_file = a_socket.makefile('rb')
+        while True:
+            prefix = a_file.read(TCP_LENGTH_PREFIX.size)
+            if len(prefix) < TCP_LENGTH_PREFIX.size:
+                return
+            (length,) = TCP_LENGTH_PREFIX.unpack(prefix)
+            message = a_file.read(length)
+            if len(message) < length:
+                return
+            yield decode_bridge_message(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream the Emotiv headset to TCP/WebSocket clients (and LSL as usual).')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to listen on (default: 127.0.0.1, local clients only)')
+    parser.add_argument('--tcp-port', type=int, default=DEFAULT_TCP_PORT, help=f'TCP port, 0 to disable (default: {DEFAULT_TCP_PORT})')
+    parser.add_argument('--websocket-port', type=int, default=DEFAULT_WEBSOCKET_PORT, help=f'WebSocket port, 0 to disable (default: {DEFAULT_WEBSOCKET_PORT})')
+    parser.add_argument('--policy', type=str, default='drop-oldest', choices=QUEUE_POLICIES, help='What a full client queue does (default: drop-oldest)')
+    parser.add_argument('--queue', type=int, default=256, help='Chunks queued per client (default: 256)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from emotiv_lsl.emotiv_epoc_x import EmotivEpocX
+    bridge = StreamBridge(host=args.host, tcp_port=(args.tcp_port or None), websocket_port=(args.websocket_port or None), policy=args.policy, max_queue_chunks=args.queue)
+    bridge.start()
+    emotiv = EmotivEpocX()
+    emotiv.add_sample_sink(bridge)
+    try:
+        emotiv.main_loop()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bridge.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""
+Native USB capture sources: pcap/pcapng files and the Linux binary `/dev/usbmonN` interface, parsed directly with `struct`.
+
+Replaces the tshark/pyshark round trip of `EmotivEpocXPyShark` (stringified `usb.capdata` re-parsed with `bytearray.fromhex`). Reports are filtered by bus, device address and endpoint and come out as raw bytes ready for the normal decoder.
+
+Usage:
+    python -m emotiv_lsl.usbmon_capture capture.pcapng -o capture.emraw
+    sudo python -m emotiv_lsl.usbmon_capture --live -o capture.emraw      # needs `modprobe usbmon`
+"""
+import argparse
+import glob
+import logging
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Iterator, Optional, Tuple, Union
+
+import numpy as np
+from attrs import define, field
+
+logger = logging.getLogger(__name__)
+
+## Emotiv USB dongle (see the interface path in `EmotivEpocXPyShark`)
+EMOTIV_USB_VENDOR_ID: int = 0x1234
+EMOTIV_USB_PRODUCT_ID: int = 0xED02
+
+LINKTYPE_USB_LINUX: int = 189           ## 48-byte usbmon header
+LINKTYPE_USB_LINUX_MMAPPED: int = 220   ## 64-byte usbmon header
+LINKTYPE_USBPCAP: int = 249             ## Windows USBPcap
+
+USB_TRANSFER_INTERRUPT: int = 1
+USB_DIR_IN: int = 0x80
+
+## struct usbmon_packet: id, type, xfer_type, epnum, devnum, busnum, flag_setup, flag_data, ts_sec, ts_usec, status, length, len_cap, setup
+USBMON_HEADER = struct.Struct('<QBBBBHbbqiiII8s')
+USBMON_MMAPPED_HEADER_SIZE: int = 64
+## USBPCAP_BUFFER_PACKET_HEADER: headerLen, irpId, status, function, info, bus, device, endpoint, transfer, dataLength
+USBPCAP_HEADER = struct.Struct('<HQIHBHHBBI')
+
+_PCAP_RECORD = {'<': struct.Struct('<IIII'), '>': struct.Struct('>IIII')}
+_PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+
+
+@define(slots=False)
+class UsbReport:
+    """ one completed interrupt-IN transfer """
+    timestamp: float = field()
+    bus: int = field()
+    device_address: int = field()
+    endpoint: int = field() ## including the 0x80 direction bit
+    data: bytes = field()
+
+
+@define(slots=False)
+class UsbReportFilter:
+    """ Which transfers to keep. `None` matches anything. `endpoint` may be given with or without the 0x80 direction bit. """
+    bus: Optional[int] = field(default=None)
+    device_address: Optional[int] = field(default=None)
+    endpoint: Optional[int] = field(default=None)
+    report_size: Optional[int] = field(default=32)
+
+    def matches(self, bus: int, device_address: int, endpoint: int, data_length: int) -> bool:
+        if (self.bus is not None) and (bus != self.bus):
+            return False
+        if (self.device_address is not None) and (device_address != self.device_address):
+            return False
+        if (self.endpoint is not None) and ((endpoint & 0x7F) != (self.endpoint & 0x7F)):
+            return False
+        if (self.report_size is not None) and (data_length != self.report_size):
+            return False
+        return True
+
+
+def find_emotiv_usb_address(vendor_id: int = EMOTIV_USB_VENDOR_ID, product_id: int = EMOTIV_USB_PRODUCT_ID) -> Optional[Tuple[int, int]]:
+    """ (bus, device_address) of the first matching device in sysfs, or None. Linux only. """
+    for a_device_dir in glob.glob('/sys/bus/usb/devices/*'):
+        try:
+            with open(os.path.join(a_device_dir, 'idVendor')) as f:
+                a_vendor = int(f.read().strip(), 16)
+            with open(os.path.join(a_device_dir, 'idProduct')) as f:
+                a_product = int(f.read().strip(), 16)
+            if (a_vendor == vendor_id) and (a_product == product_id):
+                with open(os.path.join(a_device_dir, 'busnum')) as f:
+                    bus = int(f.read().strip())
+                with open(os.path.join(a_device_dir, 'devnum')) as f:
+                    devnum = int(f.read().strip())
+                return bus, devnum
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def _parse_usbmon(buf, offset: int, length: int, header_size: int, report_filter: UsbReportFilter) -> Optional[Tuple[int, int, int, bytes]]:
+    if length < header_size:
+        return None
+    _id, event_type, xfer_type, epnum, devnum, busnum, _flag_setup, _flag_data, _ts_sec, _ts_usec, _status, _length, len_cap, _setup = USBMON_HEADER.unpack_from(buf, offset)
+    if (event_type != 0x43) or (xfer_type != USB_TRANSFER_INTERRUPT) or not (epnum & USB_DIR_IN): ## 'C'ompletion of an interrupt IN transfer
+        return None
+    len_cap = min(len_cap, length - header_size)
+    if not report_filter.matches(busnum, devnum, epnum, len_cap):
+        return None
+    start = offset + header_size
+    return busnum, devnum, epnum, bytes(buf[start:start + len_cap])
+
+
+def _parse_usbpcap(buf, offset: int, length: int, report_filter: UsbReportFilter) -> Optional[Tuple[int, int, int, bytes]]:
+    if length < USBPCAP_HEADER.size:
+        return None
+    header_len, _irp_id, _status, _function, info, bus, device, endpoint, transfer, data_length = USBPCAP_HEADER.unpack_from(buf, offset)
+    if (transfer != USB_TRANSFER_INTERRUPT) or not (info & 0x01) or not (endpoint & USB_DIR_IN): ## info bit 0: device -> host
+        return None
+    data_length = min(data_length, length - header_len)
+    if not report_filter.matches(bus, device, endpoint, data_length):
+        return None
+    start = offset + header_len
+    return bus, device, endpoint, bytes(buf[start:start + data_length])
+
+
+def _parse_link_layer(linktype: int, buf, offset: int, length: int, report_filter: UsbReportFilter) -> Optional[Tuple[int, int, int, bytes]]:
+    if linktype == LINKTYPE_USB_LINUX:
+        return _parse_usbmon(buf, offset, length, USBMON_HEADER.size, report_filter)
+    elif linktype == LINKTYPE_USB_LINUX_MMAPPED:
+        return _parse_usbmon(buf, offset, length, USBMON_MMAPPED_HEADER_SIZE, report_filter)
+    elif linktype == LINKTYPE_USBPCAP:
+        return _parse_usbpcap(buf, offset, length, report_filter)
+    raise ValueError(f'unsupported link type {linktype} (expected USB_LINUX, USB_LINUX_MMAPPED or USBPCAP)')
+
+
+def _iter_pcap_frames(buf) -> Iterator[Tuple[int, float, int, int]]:
+    """ yields (linktype, timestamp, offset, captured_length) for a classic pcap file """
+    magic = buf[0:4]
+    if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+        endian = '<'
+    elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+        endian = '>'
+    else:
+        raise ValueError('not a pcap file')
+    fraction_scale = 1e-9 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') else 1e-6
+    linktype = struct.unpack_from(endian + 'I', buf, 20)[0] & 0x0FFFFFFF
+    record = _PCAP_RECORD[endian]
+    offset, end = 24, len(buf)
+    while offset + record.size <= end:
+        ts_sec, ts_fraction, incl_len, _orig_len = record.unpack_from(buf, offset)
+        offset += record.size
+        if offset + incl_len > end:
+            break ## truncated final record
+        yield linktype, ts_sec + ts_fraction * fraction_scale, offset, incl_len
+        offset += incl_len
+
+
+def _iter_pcapng_frames(buf) -> Iterator[Tuple[int, float, int, int]]:
+    """ yields (linktype, timestamp, offset, captured_length) for a pcapng file """
+    offset, end = 0, len(buf)
+    endian = '<'
+    interfaces = [] ## (linktype, timestamp resolution) per interface, reset at each section
+    while offset + 12 <= end:
+        block_type = struct.unpack_from(endian + 'I', buf, offset)[0]
+        if block_type == _PCAPNG_SECTION_HEADER:
+            endian = '<' if buf[offset + 8:offset + 12] == b'\x4d\x3c\x2b\x1a' else '>'
+            interfaces = []
+        block_length = struct.unpack_from(endian + 'I', buf, offset + 4)[0]
+        if (block_length < 12) or (offset + block_length > end):
+            break ## truncated final block
+        body = offset + 8
+        if block_type == 1: ## interface description
+            linktype, _reserved, _snaplen = struct.unpack_from(endian + 'HHI', buf, body)
+            interfaces.append((linktype, _read_if_tsresol(buf, body + 8, offset + block_length - 4, endian)))
+        elif block_type == 6: ## enhanced packet
+            interface_id, ts_high, ts_low, cap_len, _orig_len = struct.unpack_from(endian + 'IIIII', buf, body)
+            linktype, resolution = interfaces[interface_id]
+            yield linktype, ((ts_high << 32) | ts_low) * resolution, body + 20, cap_len
+        elif block_type == 3: ## simple packet, no timestamp
+            orig_len = struct.unpack_from(endian + 'I', buf, body)[0]
+            linktype, _resolution = interfaces[0]
+            yield linktype, float('nan'), body + 4, min(orig_len, block_length - 16)
+        offset += block_length
+
+
+def _read_if_tsresol(buf, offset: int, end: int, endian: str) -> float:
+    while offset + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', buf, offset)
+        if code == 0:
+            break
+        if (code == 9) and (length >= 1): ## if_tsresol
+            value = buf[offset + 4]
+            return (2.0 ** -(value & 0x7F)) if (value & 0x80) else (10.0 ** -value)
+        offset += 4 + ((length + 3) & ~3)
+    return 1e-6
+
+
+def iter_pcap_reports(path: Union[str, Path], report_filter: Optional[UsbReportFilter] = None) -> Iterator[UsbReport]:
+    """ Yields the interrupt-IN reports of a pcap or pcapng USB capture (usbmon or USBPcap link types). The file is memory-mapped. """
+    if report_filter is None:
+        report_filter = UsbReportFilter()
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        frames = _iter_pcapng_frames(buf) if (struct.unpack_from('<I', buf, 0)[0] == _PCAPNG_SECTION_HEADER) else _iter_pcap_frames(buf)
+        for linktype, timestamp, offset, length in frames:
+            parsed = _parse_link_layer(linktype, buf, offset, length, report_filter)
+            if parsed is not None:
+                bus, device_address, endpoint, data = parsed
+                yield UsbReport(timestamp=timestamp, bus=bus, device_address=device_address, endpoint=endpoint, data=data)
+
+
+def read_pcap_reports(path: Union[str, Path], report_filter: Optional[UsbReportFilter] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """ (packets, timestamps) of all matching fixed-size reports in a capture file, as an (n, report_size) uint8 array and capture-clock seconds """
+    if report_filter is None:
+        report_filter = UsbReportFilter()
+    report_size = report_filter.report_size or 32
+    if report_filter.report_size is None:
+        report_filter = UsbReportFilter(bus=report_filter.bus, device_address=report_filter.device_address, endpoint=report_filter.endpoint, report_size=report_size)
+    timestamps = []
+    payload = bytearray()
+    for a_report in iter_pcap_reports(path, report_filter=report_filter):
+        timestamps.append(a_report.timestamp)
+        payload += a_report.data
+    return np.frombuffer(bytes(payload), dtype=np.uint8).reshape(-1, report_size), np.array(timestamps, dtype=np.float64)
+
+
+@define(slots=False)
+class UsbmonLiveCapture:
+    """ Live capture from the Linux binary usbmon interface (`/dev/usbmonN`, N = bus number, 0 = all buses). No tshark subprocess.
+
+    Each read(2) on the device returns one event: the 48-byte `usbmon_packet` header followed by its captured data. Requires the `usbmon` module and read access to the device node.
+
+    Usage:
+        with UsbmonLiveCapture(report_filter=UsbReportFilter(bus=1, device_address=5)) as capture:
+            for report in capture:
+                decoded = emotiv.decode_data(bytearray(report.data))
+    """
+    report_filter: UsbReportFilter = field(factory=UsbReportFilter)
+    read_size: int = field(default=USBMON_HEADER.size + 4096)
+    _fd: Optional[int] = field(default=None, init=False)
+
+    @property
+    def device_path(self) -> str:
+        return f'/dev/usbmon{self.report_filter.bus or 0}'
+
+    def open(self) -> "UsbmonLiveCapture":
+        if self._fd is None:
+            self._fd = os.open(self.device_path, os.O_RDONLY)
+        return self
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def read_report(self) -> UsbReport:
+        """ blocks until the next matching report """
+        while True:
+            event = os.read(self._fd, self.read_size)
+            parsed = _parse_usbmon(event, 0, len(event), USBMON_HEADER.size, self.report_filter)
+            if parsed is not None:
+                bus, device_address, endpoint, data = parsed
+                return UsbReport(timestamp=time.time(), bus=bus, device_address=device_address, endpoint=endpoint, data=data)
+
+    def __iter__(self) -> Iterator[UsbReport]:
+        self.open()
+        while True:
+            yield self.read_report()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main():
+    from emotiv_lsl.raw_capture import RawCaptureWriter
+
+    parser = argparse.ArgumentParser(description='Extract Emotiv HID reports from a pcap/pcapng file or live usbmon into a .emraw capture.')
+    parser.add_argument('pcap', nargs='?', default=None, help='pcap/pcapng file (omit with --live)')
+    parser.add_argument('--live', action='store_true', help='Capture live from /dev/usbmonN instead of a file')
+    parser.add_argument('--bus', type=int, default=None)
+    parser.add_argument('--device', type=int, default=None, help='USB device address (default: the Emotiv dongle for --live, any for files)')
+    parser.add_argument('--endpoint', type=lambda x: int(x, 0), default=None, help='Endpoint, e.g. 0x82')
+    parser.add_argument('--output', '-o', required=True, help='Output .emraw file')
+    args = parser.parse_args()
+
+    report_filter = UsbReportFilter(bus=args.bus, device_address=args.device, endpoint=args.endpoint)
+    if args.live and (args.device is None):
+        address = find_emotiv_usb_address()
+        if address is None:
+            raise Exception('Emotiv dongle not found in /sys/bus/usb/devices')
+        report_filter.bus, report_filter.device_address = address
+
+    with RawCaptureWriter(args.output) as writer:
+        if args.live:
+            print(f'Capturing from /dev/usbmon{report_filter.bus or 0} (bus {report_filter.bus}, device {report_filter.device_address}). Press Ctrl+C to stop.')
+            try:
+                for a_report in UsbmonLiveCapture(report_filter=report_filter):
+                    writer.write_packet(a_report.data, timestamp=a_report.timestamp)
+            except KeyboardInterrupt:
+                pass
+        else:
+            start_time = time.perf_counter()
+            packets, timestamps = read_pcap_reports(args.pcap, report_filter=report_filter)
+            writer.write_packets(packets, timestamps=timestamps)
+            print(f'extracted {len(packets)} reports in {time.perf_counter() - start_time:.3f} s')
+    print(f'wrote {writer.n_written} reports to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Incremental, parallel batch conversion of XDF recordings to MNE FIF (or NPZ).
+
+`convert_xdf_directories` finds the `.xdf` files written by `RecorderService` / `scripts/lsl_reciever.py` and converts them across a process pool.
+Each numeric stream becomes one MNE Raw with the stream's nominal sampling rate and the channel labels and types of its `<channels>` metadata
+(as written by `get_lsl_outlet_eeg_stream_info`); values are kept as recorded (microvolts for EEG), like `DecodedChunk.to_fif` and `save_fif_chunk`.
+String (marker) streams become annotations on every Raw of the file.
+
+A manifest (`conversion_manifest.json` in the output directory) records the SHA-256 of each converted file and its outputs. On re-runs, files
+whose content hash is unchanged and whose outputs still exist are skipped; the hash is only recomputed for files whose size or mtime changed.
+
+Usage:
+    python -m emotiv_lsl.xdf_converter recordings/ -o converted/ --workers 4
+    python -m emotiv_lsl.xdf_converter recordings/ -o converted/ --format npz
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+from emotiv_lsl.xdf_reader import XdfFile, XdfStream, read_xdf
+from emotiv_lsl.xdf_writer import XDF_EXTENSION
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME: str = 'conversion_manifest.json'
+CONVERSION_FORMATS = ('fif', 'npz')
+
+## `<channels><channel><type>` -> MNE channel type; anything else is 'misc'
+_MNE_CHANNEL_TYPES: Dict[str, str] = {'eeg': 'eeg', 'eog': 'eog', 'ecg': 'ecg', 'emg': 'emg', 'stim': 'stim'}
+
+
+def file_sha256(path: Union[str, Path], block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for a_block in iter(lambda: f.read(block_size), b''):
+            digest.update(a_block)
+    return digest.hexdigest()
+
+
+def stream_slug(stream_name: str) -> str:
+    """ 'Epoc X Motion' -> 'Epoc_X_Motion', safe for filenames """
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', stream_name).strip('_') or 'stream'
+
+
+def xdf_stream_to_raw(stream: XdfStream, lsl_to_unix_offset: Optional[float] = None, source_name: str = '', markers: Optional[List[XdfStream]] = None):
+    """ MNE RawArray of a numeric stream. `lsl_to_unix_offset` (see `XdfFile.lsl_to_unix_offset`) sets `meas_date`; `markers` string streams become annotations. """
+    import mne
+    labels = stream.channel_labels if (len(stream.channel_labels) == stream.channel_count and all(stream.channel_labels)) else [f'CH{i + 1}' for i in range(stream.channel_count)]
+    types = [_MNE_CHANNEL_TYPES.get(a_type.lower(), 'misc') for a_type in stream.channel_types] if len(stream.channel_types) == stream.channel_count else []
+    if len(types) == 0:
+        types = 'eeg' if stream.type.upper() == 'EEG' else 'misc'
+    sfreq = stream.nominal_srate
+    if (sfreq <= 0) and (len(stream.time_stamps) > 1):
+        sfreq = (len(stream.time_stamps) - 1) / (stream.time_stamps[-1] - stream.time_stamps[0]) ## irregular stream: effective rate
+    info = mne.create_info(ch_names=labels, sfreq=sfreq, ch_types=types)
+    raw = mne.io.RawArray(np.asarray(stream.time_series, dtype=np.float64).T, info, verbose=False)
+    description = f'{stream.name} (from {source_name})' if source_name else stream.name
+    if len(stream.time_stamps) > 0:
+        first_timestamp = float(stream.time_stamps[0])
+        description = f'{description}, first LSL timestamp {first_timestamp!r}, last LSL timestamp {float(stream.time_stamps[-1])!r}'
+        if lsl_to_unix_offset is not None:
+            raw.set_meas_date(datetime.fromtimestamp(first_timestamp + lsl_to_unix_offset, tz=timezone.utc))
+        for a_marker_stream in (markers or []):
+            onsets = np.asarray(a_marker_stream.time_stamps) - first_timestamp
+            in_range = (onsets >= 0) & (onsets <= raw.times[-1])
+            if np.any(in_range):
+                labels_in_range = ['/'.join(a_sample) for a_sample, keep in zip(a_marker_stream.time_series, in_range) if keep]
+                raw.annotations.append(onsets[in_range], 0.0, labels_in_range)
+    raw.info['description'] = description
+    return raw
+
+
+def convert_xdf_file(path: Union[str, Path], output_directory: Union[str, Path], output_format: str = 'fif', overwrite: bool = True) -> List[Path]:
+    """ converts one XDF file: one `<stem>_<stream>_raw.fif` per numeric stream, or one `<stem>.npz` holding every numeric stream. Returns the written paths. """
+    path, output_directory = Path(path), Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    xdf: XdfFile = read_xdf(path)
+    numeric = [a_stream for a_stream in xdf.streams.values() if a_stream.is_numeric and (len(a_stream.time_stamps) > 0)]
+    markers = [a_stream for a_stream in xdf.streams.values() if (not a_stream.is_numeric) and (len(a_stream.time_stamps) > 0)]
+    offset = xdf.lsl_to_unix_offset
+    written = []
+    if output_format == 'npz':
+        arrays = {}
+        for a_stream in numeric:
+            slug = stream_slug(a_stream.name)
+            arrays[f'{slug}_data'] = a_stream.time_series
+            arrays[f'{slug}_timestamps'] = a_stream.time_stamps
+            arrays[f'{slug}_channel_names'] = np.array(a_stream.channel_labels)
+            arrays[f'{slug}_sfreq'] = np.float64(a_stream.nominal_srate)
+        for a_stream in markers:
+            slug = stream_slug(a_stream.name)
+            arrays[f'{slug}_markers'] = np.array(['/'.join(a_sample) for a_sample in a_stream.time_series])
+            arrays[f'{slug}_timestamps'] = a_stream.time_stamps
+        arrays['lsl_to_unix_offset'] = np.float64(offset if offset is not None else np.nan)
+        out_path = output_directory.joinpath(f'{path.stem}.npz')
+        np.savez(out_path, **arrays)
+        written.append(out_path)
+    elif output_format == 'fif':
+        for a_stream in numeric:
+            out_path = output_directory.joinpath(f'{path.stem}_{stream_slug(a_stream.name)}_raw.fif')
+            xdf_stream_to_raw(a_stream, lsl_to_unix_offset=offset, source_name=path.name, markers=markers).save(out_path, overwrite=overwrite, verbose=False)
+            written.append(out_path)
+    else:
+        raise ValueError(f'unknown output format {output_format!r}, expected one of {CONVERSION_FORMATS}')
+    return written
+
+
+def _convert_job(path: str, output_directory: str, output_format: str, known_hash: Optional[str], previous_hash: Optional[str], previous_outputs: List[str]) -> Dict:
+    """ process-pool worker: hashes (unless the size/mtime check already vouched for `known_hash`) and converts unless the content is unchanged """
+    start_time = time.perf_counter()
+    stat = os.stat(path)
+    content_hash = known_hash or file_sha256(path)
+    if (content_hash == previous_hash) and previous_outputs and all(os.path.exists(an_output) for an_output in previous_outputs):
+        outputs, converted = previous_outputs, False
+    else:
+        outputs, converted = [str(an_output) for an_output in convert_xdf_file(path, output_directory, output_format)], True
+    return {'path': path, 'sha256': content_hash, 'size': stat.st_size, 'mtime': stat.st_mtime, 'format': output_format, 'outputs': outputs,
+            'converted': converted, 'seconds': time.perf_counter() - start_time}
+
+
+def load_manifest(output_directory: Union[str, Path]) -> Dict[str, Dict]:
+    manifest_path = Path(output_directory).joinpath(MANIFEST_FILENAME)
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(output_directory: Union[str, Path], manifest: Dict[str, Dict]):
+    """ atomically replaces the manifest, so an interrupted run never leaves it half-written """
+    manifest_path = Path(output_directory).joinpath(MANIFEST_FILENAME)
+    temporary_path = manifest_path.with_suffix('.json.tmp')
+    with open(temporary_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temporary_path, manifest_path)
+
+
+def find_xdf_files(directories: Iterable[Union[str, Path]], recursive: bool = True) -> List[Path]:
+    found = []
+    for a_directory in directories:
+        a_directory = Path(a_directory)
+        if a_directory.is_file():
+            found.append(a_directory.resolve())
+            continue
+        found.extend(a_path.resolve() for a_path in (a_directory.rglob(f'*{XDF_EXTENSION}') if recursive else a_directory.glob(f'*{XDF_EXTENSION}')) if a_path.is_file())
+    return sorted(set(found))
+
+
+def convert_xdf_directories(directories: Iterable[Union[str, Path]], output_directory: Union[str, Path], output_format: str = 'fif', max_workers: Optional[int] = None,
+                            recursive: bool = True) -> Dict[str, int]:
+    """ converts every new or changed XDF file under `directories` into `output_directory`, `max_workers` files at a time (default: CPU count).
+    The manifest is saved after each file, so an interrupted run resumes where it stopped. Returns counts of converted/unchanged/failed files.
+    """
+    if output_format not in CONVERSION_FORMATS:
+        raise ValueError(f'unknown output format {output_format!r}, expected one of {CONVERSION_FORMATS}')
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(output_directory)
+    counts = {'converted': 0, 'unchanged': 0, 'failed': 0}
+    jobs = []
+    for a_path in find_xdf_files(directories, recursive=recursive):
+        entry = manifest.get(str(a_path), {})
+        if entry.get('format') != output_format:
+            entry = {}
+        stat = a_path.stat()
+        known_hash = entry.get('sha256') if (entry.get('size'), entry.get('mtime')) == (stat.st_size, stat.st_mtime) else None
+        jobs.append((str(a_path), str(output_directory), output_format, known_hash, entry.get('sha256'), entry.get('outputs', [])))
+
+    def _record(a_result: Dict):
+        counts['converted' if a_result.pop('converted') else 'unchanged'] += 1
+        manifest[a_result.pop('path')] = {**a_result, 'converted_at': datetime.now().isoformat()}
+        save_manifest(output_directory, manifest)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if (max_workers == 1) or (len(jobs) <= 1):
+        for a_job in jobs:
+            try:
+                _record(_convert_job(*a_job))
+            except Exception as e:
+                counts['failed'] += 1
+                logger.error(f'failed to convert {a_job[0]}: {e}')
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_convert_job, *a_job): a_job[0] for a_job in jobs}
+            for a_future in as_completed(futures):
+                try:
+                    _record(a_future.result())
+                except Exception as e:
+                    counts['failed'] += 1
+                    logger.error(f'failed to convert {futures[a_future]}: {e}')
+    logger.info(f'conversion into {output_directory}: {counts}')
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert directories of XDF recordings to FIF or NPZ, skipping files converted before.')
+    parser.add_argument('inputs', nargs='+', help='XDF files or directories to search')
+    parser.add_argument('--output', '-o', type=str, required=True, help='Output directory (also holds the manifest)')
+    parser.add_argument('--format', '-f', type=str, choices=CONVERSION_FORMATS, default='fif')
+    parser.add_argument('--workers', '-j', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--no-recursive', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    print(convert_xdf_directories(args.inputs, args.output, output_format=args.format, max_workers=args.workers, recursive=not args.no_recursive))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,572 @@
+"""
+Minimal XDF reader for the files written by `XdfRecorderSink` and LabRecorder.
+
+Sample chunks whose samples all carry a timestamp (what both writers produce) are decoded with one `np.frombuffer` per chunk;
+other layouts (omitted timestamps, string streams) fall back to a per-sample parser. Timestamps are returned as recorded, without clock
+synchronization or dejittering; use pyxdf for that.
+
+Usage:
+    streams = read_xdf('session.xdf')
+    eeg = find_xdf_stream(streams, 'Epoc X')
+    eeg.time_series, eeg.time_stamps
+
+    headers = read_xdf('session.xdf', headers_only=True) ## metadata and footers only, sample chunks are skipped
+
+`IndexedXdfFile` serves time-range reads of long files without loading them: it indexes the samples chunks of each stream once (cached in a
+`.xdfindex.npz` sidecar, extended incrementally when the file grows) and decodes only the chunks a request overlaps, from a memory map.
+
+    xdf = IndexedXdfFile.open('session.xdf')
+    timestamps, eeg = xdf.read('Epoc X', start=t0, stop=t0 + 10.0)
+"""
+import logging
+import struct
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+from attrs import define, field
+
+from emotiv_lsl.xdf_writer import (XDF_MAGIC, XDF_CHANNEL_FORMAT_DTYPES, CHUNK_TAG_FILE_HEADER, CHUNK_TAG_STREAM_HEADER, CHUNK_TAG_SAMPLES, CHUNK_TAG_CLOCK_OFFSET,
+                                   CHUNK_TAG_STREAM_FOOTER, xdf_sample_record_dtype)
+
+logger = logging.getLogger(__name__)
+
+_VARLEN_FORMATS = {1: '<B', 4: '<I', 8: '<Q'}
+
+
+@define(slots=False)
+class XdfStream:
+    """ one stream of an XDF file. `time_series` is (n_samples, channel_count), or a list of lists for string streams """
+    stream_id: int = field()
+    info_xml: str = field(default='')
+    name: str = field(default='')
+    type: str = field(default='')
+    source_id: str = field(default='')
+    channel_count: int = field(default=0)
+    nominal_srate: float = field(default=0.0)
+    channel_format: str = field(default='float32')
+    channel_labels: List[str] = field(factory=list)
+    channel_types: List[str] = field(factory=list) ## `<type>` of each `<channel>`, '' where absent
+    created_at: Optional[float] = field(default=None)
+    footer: Dict[str, str] = field(factory=dict)
+    clock_times: List[float] = field(factory=list)
+    clock_values: List[float] = field(factory=list)
+    time_stamps: np.ndarray = field(default=None)
+    time_series: Union[np.ndarray, List, None] = field(default=None)
+
+    @property
+    def first_timestamp(self) -> Optional[float]:
+        if (self.time_stamps is not None) and (len(self.time_stamps) > 0):
+            return float(self.time_stamps[0])
+        return float(self.footer['first_timestamp']) if 'first_timestamp' in self.footer else None
+
+    @property
+    def last_timestamp(self) -> Optional[float]:
+        if (self.time_stamps is not None) and (len(self.time_stamps) > 0):
+            return float(self.time_stamps[-1])
+        return float(self.footer['last_timestamp']) if 'last_timestamp' in self.footer else None
+
+    @property
+    def sample_count(self) -> Optional[int]:
+        if self.time_stamps is not None:
+            return len(self.time_stamps)
+        return int(self.footer['sample_count']) if 'sample_count' in self.footer else None
+
+    @property
+    def is_numeric(self) -> bool:
+        return self.channel_format in XDF_CHANNEL_FORMAT_DTYPES
+
+
+@define(slots=False)
+class XdfFile:
+    path: Path = field()
+    header: Dict[str, str] = field(factory=dict)
+    streams: Dict[int, XdfStream] = field(factory=dict)
+
+    @property
+    def recorded_at(self) -> Optional[datetime]:
+        """ wall-clock time the file was created, from the file header `datetime`, if present """
+        value = self.header.get('datetime')
+        if not value:
+            return None
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+
+    @property
+    def lsl_to_unix_offset(self) -> Optional[float]:
+        """ seconds to add to this file's LSL timestamps to get unix time: the header `datetime` is taken to coincide with the earliest clock-offset
+        measurement (written when recording started), or with the earliest sample if there are none """
+        recorded_at = self.recorded_at
+        if recorded_at is None:
+            return None
+        clock_times = [a_stream.clock_times[0] for a_stream in self.streams.values() if len(a_stream.clock_times) > 0]
+        first_timestamps = [a_stream.first_timestamp for a_stream in self.streams.values() if a_stream.first_timestamp is not None]
+        if len(clock_times) > 0:
+            return recorded_at.timestamp() - min(clock_times)
+        if len(first_timestamps) > 0:
+            return recorded_at.timestamp() - min(first_timestamps)
+        return None
+
+
+def parse_stream_header_xml(stream_id: int, info_xml: str) -> XdfStream:
+    root = ET.fromstring(info_xml)
+    channels = root.findall('./desc/channels/channel')
+    labels = [(a_channel.findtext('label') or '') for a_channel in channels]
+    created_at = root.findtext('created_at')
+    return XdfStream(stream_id=stream_id, info_xml=info_xml, name=root.findtext('name') or '', type=root.findtext('type') or '', source_id=root.findtext('source_id') or '',
+                     channel_count=int(root.findtext('channel_count') or 0), nominal_srate=float(root.findtext('nominal_srate') or 0.0),
+                     channel_format=root.findtext('channel_format') or 'float32', channel_labels=labels, channel_types=[(a_channel.findtext('type') or '') for a_channel in channels], created_at=(float(created_at) if created_at else None))
+
+
+def _parse_flat_xml(content: bytes) -> Dict[str, str]:
+    """ top-level text fields of a file header / stream footer `<info>` element """
+    root = ET.fromstring(content.decode('utf-8', errors='replace'))
+    return {a_child.tag: (a_child.text or '') for a_child in root if len(a_child) == 0}
+
+
+def _read_varlen_int(buffer, position: int) -> Tuple[int, int]:
+    n_bytes = int(buffer[position])
+    fmt = _VARLEN_FORMATS.get(n_bytes)
+    if fmt is None:
+        raise ValueError(f'invalid XDF variable-length integer width {n_bytes} at offset {position}')
+    return struct.unpack_from(fmt, buffer, position + 1)[0], position + 1 + n_bytes
+
+
+def iter_xdf_chunks(f: BinaryIO, skip_tags: Set[int] = frozenset()) -> Iterator[Tuple[int, int, Optional[bytes]]]:
+    """ yields (tag, content offset, content) for each chunk after the magic; content is None (and not read) for tags in `skip_tags`.
+    Stops at the end of the file or at a truncated chunk.
+    """
+    while True:
+        width_byte = f.read(1)
+        if len(width_byte) == 0:
+            return
+        fmt = _VARLEN_FORMATS.get(width_byte[0])
+        if fmt is None:
+            logger.warning(f'invalid chunk length width {width_byte[0]} at offset {f.tell() - 1}, stopping')
+            return
+        length_bytes = f.read(width_byte[0])
+        tag_bytes = f.read(2)
+        if (len(length_bytes) < width_byte[0]) or (len(tag_bytes) < 2):
+            return
+        length = struct.unpack(fmt, length_bytes)[0]
+        tag = struct.unpack('<H', tag_bytes)[0]
+        offset = f.tell()
+        if tag in skip_tags:
+            f.seek(length - 2, 1)
+            yield tag, offset, None
+        else:
+            content = f.read(length - 2)
+            if len(content) < length - 2:
+                logger.warning(f'truncated chunk (tag {tag}) at offset {offset}, stopping')
+                return
+            yield tag, offset, content
+
+
+def decode_samples_chunk(content: bytes, stream: XdfStream, previous_timestamp: float = np.nan) -> Tuple[np.ndarray, Union[np.ndarray, List]]:
+    """ decodes the samples of one samples chunk (content after the stream id). Missing timestamps are extrapolated from the previous one at the nominal rate. """
+    n_samples, position = _read_varlen_int(content, 0)
+    if stream.is_numeric:
+        dtype = xdf_sample_record_dtype(stream.channel_format, stream.channel_count)
+        if len(content) - position == n_samples * dtype.itemsize:
+            records = np.frombuffer(content, dtype=dtype, count=n_samples, offset=position)
+            if np.all(records['timestamp_bytes'] == 8):
+                return records['timestamp'].copy(), records['values'].copy()
+        value_dtype = np.dtype(XDF_CHANNEL_FORMAT_DTYPES[stream.channel_format])
+        values = np.empty((n_samples, stream.channel_count), dtype=value_dtype)
+    else:
+        values = []
+    timestamps = np.empty(n_samples, dtype=np.float64)
+    period = (1.0 / stream.nominal_srate) if stream.nominal_srate > 0 else np.nan
+    view = memoryview(content)
+    for i in range(n_samples):
+        if content[position] == 8:
+            previous_timestamp = struct.unpack_from('<d', content, position + 1)[0]
+            position += 9
+        else:
+            previous_timestamp = previous_timestamp + period
+            position += 1
+        timestamps[i] = previous_timestamp
+        if stream.is_numeric:
+            n_bytes = stream.channel_count * values.itemsize
+            values[i] = np.frombuffer(view[position:position + n_bytes], dtype=values.dtype)
+            position += n_bytes
+        else:
+            a_sample = []
+            for _ in range(stream.channel_count):
+                length, position = _read_varlen_int(content, position)
+                a_sample.append(bytes(view[position:position + length]).decode('utf-8', errors='replace'))
+                position += length
+            values.append(a_sample)
+    return timestamps, values
+
+
+def decode_samples_chunk_timestamps(content: bytes, stream: XdfStream, previous_timestamp: float = np.nan) -> np.ndarray:
+    """ timestamps of one samples chunk (content after the stream id), without copying the values where the layout is fixed """
+    n_samples, position = _read_varlen_int(content, 0)
+    if stream.is_numeric:
+        dtype = xdf_sample_record_dtype(stream.channel_format, stream.channel_count)
+        if len(content) - position == n_samples * dtype.itemsize:
+            records = np.frombuffer(content, dtype=dtype, count=n_samples, offset=position)
+            if np.all(records['timestamp_bytes'] == 8):
+                return records['timestamp']
+    timestamps, _values = decode_samples_chunk(content, stream, previous_timestamp=previous_timestamp)
+    return timestamps
+
+
+def read_xdf(path: Union[str, Path], stream_names: Optional[Set[str]] = None, headers_only: bool = False) -> XdfFile:
+    """ Reads an XDF file. `stream_names` limits which streams' samples are decoded; `headers_only` skips all sample chunks. """
+    path = Path(path)
+    result = XdfFile(path=path)
+    series: Dict[int, List] = {}
+    stamps: Dict[int, List[np.ndarray]] = {}
+    skip_tags = frozenset([CHUNK_TAG_SAMPLES]) if headers_only else frozenset()
+    with open(path, 'rb') as f:
+        if f.read(4) != XDF_MAGIC:
+            raise ValueError(f'{path} is not an XDF file')
+        for tag, _offset, content in iter_xdf_chunks(f, skip_tags=skip_tags):
+            if tag == CHUNK_TAG_FILE_HEADER:
+                result.header = _parse_flat_xml(content)
+            elif tag == CHUNK_TAG_STREAM_HEADER:
+                stream_id = struct.unpack_from('<I', content)[0]
+                result.streams[stream_id] = parse_stream_header_xml(stream_id, content[4:].decode('utf-8', errors='replace'))
+                series[stream_id], stamps[stream_id] = [], []
+            elif tag == CHUNK_TAG_SAMPLES and content is not None:
+                stream_id = struct.unpack_from('<I', content)[0]
+                stream = result.streams.get(stream_id)
+                if (stream is None) or ((stream_names is not None) and (stream.name not in stream_names)):
+                    continue
+                previous = stamps[stream_id][-1][-1] if (len(stamps[stream_id]) > 0 and len(stamps[stream_id][-1]) > 0) else np.nan
+                timestamps, values = decode_samples_chunk(content[4:], stream, previous_timestamp=previous)
+                stamps[stream_id].append(timestamps)
+                series[stream_id].append(values)
+            elif tag == CHUNK_TAG_CLOCK_OFFSET:
+                stream_id, collection_time, offset_value = struct.unpack_from('<Idd', content)
+                if stream_id in result.streams:
+                    result.streams[stream_id].clock_times.append(collection_time)
+                    result.streams[stream_id].clock_values.append(offset_value)
+            elif tag == CHUNK_TAG_STREAM_FOOTER:
+                stream_id = struct.unpack_from('<I', content)[0]
+                if stream_id in result.streams:
+                    result.streams[stream_id].footer = _parse_flat_xml(content[4:])
+
+    if not headers_only:
+        for stream_id, a_stream in result.streams.items():
+            if (stream_names is not None) and (a_stream.name not in stream_names):
+                continue
+            a_stream.time_stamps = np.concatenate(stamps[stream_id]) if len(stamps[stream_id]) > 0 else np.zeros(0)
+            if a_stream.is_numeric:
+                a_stream.time_series = np.concatenate(series[stream_id]) if len(series[stream_id]) > 0 else np.zeros((0, a_stream.channel_count), dtype=XDF_CHANNEL_FORMAT_DTYPES[a_stream.channel_format])
+            else:
+                a_stream.time_series = [a_sample for a_chunk in series[stream_id] for a_sample in a_chunk]
+    return result
+
+
+def find_xdf_stream(xdf: XdfFile, name: str) -> Optional[XdfStream]:
+    for a_stream in xdf.streams.values():
+        if a_stream.name == name:
+            return a_stream
+    return None
+
+
+## ==================================================================================================================== ##
+## Indexed random access                                                                                                ##
+## ==================================================================================================================== ##
+
+XDF_INDEX_SUFFIX: str = '.xdfindex.npz'
+XDF_INDEX_FORMAT_VERSION: int = 1
+_FINGERPRINT_BYTES: int = 4096 ## file header and first stream headers: tells a grown file from a rewritten one
+
+
+@define(slots=False)
+class XdfChunkIndex:
+    """ the samples chunks of one stream: content offset (of the samples, after the stream id), content length, sample count, first/last timestamp,
+    and whether every sample carries a timestamp (fixed-size records, readable straight from the memory map) """
+    offsets: np.ndarray = field(factory=lambda: np.zeros(0, dtype=np.int64))
+    lengths: np.ndarray = field(factory=lambda: np.zeros(0, dtype=np.int64))
+    counts: np.ndarray = field(factory=lambda: np.zeros(0, dtype=np.int64))
+    first_timestamps: np.ndarray = field(factory=lambda: np.zeros(0, dtype=np.float64))
+    last_timestamps: np.ndarray = field(factory=lambda: np.zeros(0, dtype=np.float64))
+    fixed: np.ndarray = field(factory=lambda: np.zeros(0, dtype=bool))
+
+    @property
+    def sample_starts(self) -> np.ndarray:
+        """ index of the first sample of each chunk within the stream """
+        return np.concatenate([[0], np.cumsum(self.counts)[:-1]]).astype(np.int64) if len(self.counts) > 0 else np.zeros(0, dtype=np.int64)
+
+    @property
+    def sample_count(self) -> int:
+        return int(self.counts.sum())
+
+    def extend(self, rows: List[Tuple[int, int, int, float, float, bool]]):
+        if len(rows) == 0:
+            return
+        offsets, lengths, counts, firsts, lasts, fixed = zip(*rows)
+        self.offsets = np.concatenate([self.offsets, np.array(offsets, dtype=np.int64)])
+        self.lengths = np.concatenate([self.lengths, np.array(lengths, dtype=np.int64)])
+        self.counts = np.concatenate([self.counts, np.array(counts, dtype=np.int64)])
+        self.first_timestamps = np.concatenate([self.first_timestamps, np.array(firsts, dtype=np.float64)])
+        self.last_timestamps = np.concatenate([self.last_timestamps, np.array(lasts, dtype=np.float64)])
+        self.fixed = np.concatenate([self.fixed, np.array(fixed, dtype=bool)])
+
+
+@define(slots=False)
+class IndexedXdfFile:
+    """ Random access to the streams of an XDF file through a chunk index.
+
+    On first open the file is scanned once (chunk headers only; sample values are not touched) and the per-stream chunk index is cached in a
+    `.xdfindex.npz` sidecar. Later opens load the sidecar; if the file has grown since (a recording in progress, or footers written on close),
+    only the new part is scanned. `read` then decodes just the chunks overlapping the requested time range, as zero-copy views of a memory map
+    for fixed-size records.
+
+    Usage:
+        xdf = IndexedXdfFile.open('session.xdf')
+        timestamps, eeg = xdf.read('Epoc X', start=t0, stop=t0 + 10.0)
+    """
+    path: Path = field(converter=Path)
+    use_cache: bool = field(default=True)
+
+    header: Dict[str, str] = field(factory=dict, init=False)
+    streams: Dict[int, XdfStream] = field(factory=dict, init=False) ## headers, footers and clock offsets; `time_series` is not loaded
+    chunk_index: Dict[int, XdfChunkIndex] = field(factory=dict, init=False)
+    indexed_until: int = field(default=len(XDF_MAGIC), init=False) ## file offset after the last indexed chunk
+    _indexed_size: int = field(default=0, init=False)
+    _indexed_mtime: float = field(default=0.0, init=False)
+    _fingerprint: str = field(default='', init=False)
+    _map: Optional[np.memmap] = field(default=None, init=False)
+
+
+    @classmethod
+    def open(cls, path: Union[str, Path], use_cache: bool = True) -> "IndexedXdfFile":
+        xdf = cls(path=path, use_cache=use_cache)
+        if not (use_cache and xdf._load_index()):
+            xdf.refresh()
+        return xdf
+
+
+    @property
+    def index_path(self) -> Path:
+        return self.path.with_name(self.path.name + XDF_INDEX_SUFFIX)
+
+
+    @property
+    def recorded_at(self) -> Optional[datetime]:
+        return XdfFile(path=self.path, header=self.header, streams=self.streams).recorded_at
+
+
+    @property
+    def lsl_to_unix_offset(self) -> Optional[float]:
+        return XdfFile(path=self.path, header=self.header, streams=self.streams).lsl_to_unix_offset
+
+
+    def _read_fingerprint(self) -> str:
+        import hashlib
+        with open(self.path, 'rb') as f:
+            return hashlib.sha1(f.read(_FINGERPRINT_BYTES)).hexdigest()
+
+
+    def refresh(self) -> bool:
+        """ indexes whatever was appended to the file since the last scan (everything, the first time). Returns True if anything changed. """
+        stat = self.path.stat()
+        if (stat.st_size, stat.st_mtime) == (self._indexed_size, self._indexed_mtime):
+            return False
+        fingerprint = self._read_fingerprint()
+        if (stat.st_size < self._indexed_size) or ((self._indexed_size >= _FINGERPRINT_BYTES) and (fingerprint != self._fingerprint)): ## rewritten: start over
+            self.header, self.streams, self.chunk_index, self.indexed_until = {}, {}, {}, len(XDF_MAGIC)
+        self._scan(stat.st_size)
+        self._indexed_size, self._indexed_mtime, self._fingerprint = stat.st_size, stat.st_mtime, fingerprint
+        self._map = None
+        if self.use_cache:
+            self._save_index()
+        return True
+
+
+    def _scan(self, file_size: int):
+        import mmap
+        with open(self.path, 'rb') as f:
+            if f.read(len(XDF_MAGIC)) != XDF_MAGIC:
+                raise ValueError(f'{self.path} is not an XDF file')
+            if file_size <= self.indexed_until:
+                return
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            rows: Dict[int, List] = {}
+            position = self.indexed_until
+            while position < file_size:
+                width = buffer[position]
+                fmt = _VARLEN_FORMATS.get(width)
+                if (fmt is None) or (position + 1 + width + 2 > file_size):
+                    break
+                length = struct.unpack_from(fmt, buffer, position + 1)[0]
+                tag = struct.unpack_from('<H', buffer, position + 1 + width)[0]
+                content_offset = position + 1 + width + 2
+                content_end = content_offset + length - 2
+                if content_end > file_size:
+                    break ## chunk still being written
+                if tag == CHUNK_TAG_SAMPLES:
+                    stream_id = struct.unpack_from('<I', buffer, content_offset)[0]
+                    stream = self.streams.get(stream_id)
+                    if stream is not None:
+                        rows.setdefault(stream_id, []).append(self._index_samples_chunk(buffer, stream, content_offset + 4, content_end))
+                elif tag == CHUNK_TAG_FILE_HEADER:
+                    self.header = _parse_flat_xml(buffer[content_offset:content_end])
+                elif tag == CHUNK_TAG_STREAM_HEADER:
+                    stream_id = struct.unpack_from('<I', buffer, content_offset)[0]
+                    self.streams[stream_id] = parse_stream_header_xml(stream_id, buffer[content_offset + 4:content_end].decode('utf-8', errors='replace'))
+                    self.chunk_index[stream_id] = XdfChunkIndex()
+                elif tag == CHUNK_TAG_CLOCK_OFFSET:
+                    stream_id, collection_time, offset_value = struct.unpack_from('<Idd', buffer, content_offset)
+                    if stream_id in self.streams:
+                        self.streams[stream_id].clock_times.append(collection_time)
+                        self.streams[stream_id].clock_values.append(offset_value)
+                elif tag == CHUNK_TAG_STREAM_FOOTER:
+                    stream_id = struct.unpack_from('<I', buffer, content_offset)[0]
+                    if stream_id in self.streams:
+                        self.streams[stream_id].footer = _parse_flat_xml(buffer[content_offset + 4:content_end])
+                position = content_end
+            self.indexed_until = position
+            for stream_id, stream_rows in rows.items():
+                self.chunk_index[stream_id].extend(stream_rows)
+        finally:
+            buffer.close()
+
+
+    def _index_samples_chunk(self, buffer, stream: XdfStream, start: int, end: int) -> Tuple[int, int, int, float, float, bool]:
+        n_samples, position = _read_varlen_int(buffer, start)
+        if n_samples == 0:
+            return start, end - start, 0, np.nan, np.nan, True
+        if stream.is_numeric:
+            itemsize = xdf_sample_record_dtype(stream.channel_format, stream.channel_count).itemsize
+            if ((end - position) == n_samples * itemsize) and (buffer[position] == 8):
+                last_record = position + (n_samples - 1) * itemsize
+                return (start, end - start, n_samples, struct.unpack_from('<d', buffer, position + 1)[0], struct.unpack_from('<d', buffer, last_record + 1)[0], True)
+        timestamps, _values = decode_samples_chunk(bytes(buffer[start:end]), stream) ## variable layout: decode once to learn its time span
+        return start, end - start, n_samples, float(timestamps[0]), float(timestamps[-1]), False
+
+
+    def _save_index(self):
+        import json
+        arrays = {}
+        for stream_id, an_index in self.chunk_index.items():
+            for a_name in ('offsets', 'lengths', 'counts', 'first_timestamps', 'last_timestamps', 'fixed'):
+                arrays[f's{stream_id}_{a_name}'] = getattr(an_index, a_name)
+        meta = {'version': XDF_INDEX_FORMAT_VERSION, 'size': self._indexed_size, 'mtime': self._indexed_mtime, 'fingerprint': self._fingerprint, 'indexed_until': self.indexed_until,
+                'header': self.header,
+                'streams': {str(stream_id): {'info_xml': a_stream.info_xml, 'footer': a_stream.footer, 'clock_times': a_stream.clock_times, 'clock_values': a_stream.clock_values}
+                            for stream_id, a_stream in self.streams.items()}}
+        try:
+            with open(self.index_path, 'wb') as f:
+                np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+        except OSError as e:
+            logger.debug(f'could not cache the index of {self.path}: {e}')
+
+
+    def _load_index(self) -> bool:
+        """ loads the cached index; True if it was usable. A stale one is still loaded when the file only grew, so `refresh` continues from it. """
+        import json
+        if not self.index_path.exists():
+            return False
+        try:
+            with np.load(self.index_path) as archive:
+                meta = json.loads(str(archive['meta']))
+                if meta.get('version') != XDF_INDEX_FORMAT_VERSION:
+                    return False
+                self.header = meta['header']
+                for stream_id_text, a_stream_meta in meta['streams'].items():
+                    stream_id = int(stream_id_text)
+                    a_stream = parse_stream_header_xml(stream_id, a_stream_meta['info_xml'])
+                    a_stream.footer, a_stream.clock_times, a_stream.clock_values = a_stream_meta['footer'], a_stream_meta['clock_times'], a_stream_meta['clock_values']
+                    self.streams[stream_id] = a_stream
+                    self.chunk_index[stream_id] = XdfChunkIndex(**{a_name: archive[f's{stream_id}_{a_name}'] for a_name in ('offsets', 'lengths', 'counts', 'first_timestamps', 'last_timestamps', 'fixed')})
+        except (OSError, ValueError, KeyError) as e:
+            logger.debug(f'ignoring unreadable index {self.index_path}: {e}')
+            self.header, self.streams, self.chunk_index = {}, {}, {}
+            return False
+        self.indexed_until, self._indexed_size, self._indexed_mtime, self._fingerprint = meta['indexed_until'], meta['size'], meta['mtime'], meta['fingerprint']
+        self.refresh() ## no-op unless the file changed since
+        return True
+
+
+    def find_stream(self, name: str) -> Tuple[int, XdfStream]:
+        for stream_id, a_stream in self.streams.items():
+            if a_stream.name == name:
+                return stream_id, a_stream
+        raise KeyError(f'no stream named {name!r} in {self.path} (streams: {[a_stream.name for a_stream in self.streams.values()]})')
+
+
+    def time_range(self, name: str) -> Tuple[Optional[float], Optional[float]]:
+        stream_id, _stream = self.find_stream(name)
+        an_index = self.chunk_index[stream_id]
+        valid = an_index.counts > 0
+        if not np.any(valid):
+            return None, None
+        return float(an_index.first_timestamps[valid][0]), float(an_index.last_timestamps[valid][-1])
+
+
+    def _memory_map(self) -> np.memmap:
+        if self._map is None:
+            self._map = np.memmap(self.path, dtype=np.uint8, mode='r', shape=(self.indexed_until,))
+        return self._map
+
+
+    def _decode_chunk(self, stream: XdfStream, an_index: XdfChunkIndex, i: int) -> Tuple[np.ndarray, Union[np.ndarray, List]]:
+        data = self._memory_map()
+        offset, length = int(an_index.offsets[i]), int(an_index.lengths[i])
+        if an_index.fixed[i] and stream.is_numeric:
+            n_samples, position = _read_varlen_int(data, offset)
+            records = data[position:offset + length].view(xdf_sample_record_dtype(stream.channel_format, stream.channel_count))
+            return records['timestamp'], records['values'] ## views into the memory map
+        return decode_samples_chunk(bytes(data[offset:offset + length]), stream)
+
+
+    def _read_chunks(self, stream: XdfStream, an_index: XdfChunkIndex, chunk_indices: Sequence[int]) -> Tuple[np.ndarray, Union[np.ndarray, List]]:
+        stamps, values = [], []
+        for i in chunk_indices:
+            a_stamps, a_values = self._decode_chunk(stream, an_index, int(i))
+            stamps.append(a_stamps)
+            values.append(a_values)
+        if len(stamps) == 0:
+            empty_values = np.zeros((0, stream.channel_count), dtype=XDF_CHANNEL_FORMAT_DTYPES[stream.channel_format]) if stream.is_numeric else []
+            return np.zeros(0), empty_values
+        if stream.is_numeric:
+            return np.concatenate(stamps), np.concatenate(values)
+        return np.concatenate(stamps), [a_sample for a_chunk in values for a_sample in a_chunk]
+
+
+    def read(self, name: str, start: Optional[float] = None, stop: Optional[float] = None) -> Tuple[np.ndarray, Union[np.ndarray, List]]:
+        """ (timestamps, values) of the samples of stream `name` with `start <= timestamp < stop` (None: unbounded), decoding only the chunks overlapping the range """
+        stream_id, stream = self.find_stream(name)
+        an_index = self.chunk_index[stream_id]
+        candidates = np.flatnonzero(an_index.counts > 0)
+        if start is not None:
+            candidates = candidates[an_index.last_timestamps[candidates] >= start]
+        if stop is not None:
+            candidates = candidates[an_index.first_timestamps[candidates] < stop]
+        timestamps, values = self._read_chunks(stream, an_index, candidates)
+        mask = np.ones(len(timestamps), dtype=bool)
+        if start is not None:
+            mask &= (timestamps >= start)
+        if stop is not None:
+            mask &= (timestamps < stop)
+        if stream.is_numeric:
+            return timestamps[mask], values[mask]
+        return timestamps[mask], [a_sample for a_sample, keep in zip(values, mask) if keep]
+
+
+    def read_samples(self, name: str, first: int, count: int) -> Tuple[np.ndarray, Union[np.ndarray, List]]:
+        """ (timestamps, values) of samples `first` to `first + count` of stream `name`, by position """
+        stream_id, stream = self.find_stream(name)
+        an_index = self.chunk_index[stream_id]
+        starts = an_index.sample_starts
+        ends = starts + an_index.counts
+        chunk_indices = np.flatnonzero((ends > first) & (starts < first + count))
+        timestamps, values = self._read_chunks(stream, an_index, chunk_indices)
+        skip = (first - int(starts[chunk_indices[0]])) if len(chunk_indices) > 0 else 0
+        return timestamps[skip:skip + count], values[skip:skip + count]
+
+
+    def close(self):
+        self._map = None
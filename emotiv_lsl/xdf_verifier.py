@@ -0,0 +1,314 @@
+"""
+One-pass integrity and timing verification of XDF recordings.
+
+`verify_xdf` streams through a file chunk by chunk (memory is bounded by the largest chunk, whatever the file size), decoding only sample timestamps.
+For each stream it reports:
+    - sample count against nominal rate x duration, and the implied number of missing samples;
+    - gaps: intervals longer than `gap_periods` nominal periods (locations of the first `max_listed_gaps`, plus totals);
+    - non-increasing timestamps;
+    - effective rate from a running least-squares fit of timestamp against sample index, its deviation from nominal in ppm, the spread of the
+      rate over `drift_window` second windows, and the timing jitter (residual of the fit);
+    - clock offsets: drift (slope of a linear fit, in ppm) and residuals from that fit;
+    - whether a footer was written and agrees with what the file contains.
+File-level problems (truncated last chunk, missing footers) are reported too.
+
+Usage:
+    report = verify_xdf('session.xdf')
+
+    python -m emotiv_lsl.xdf_verifier recordings/ -j 4            ## one summary per file, exit status 1 if any file has errors
+    python -m emotiv_lsl.xdf_verifier session.xdf --json report.json
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+from attrs import define, field
+
+from emotiv_lsl.xdf_reader import XdfStream, _parse_flat_xml, decode_samples_chunk_timestamps, iter_xdf_chunks, parse_stream_header_xml
+from emotiv_lsl.xdf_writer import (XDF_MAGIC, XDF_EXTENSION, CHUNK_TAG_FILE_HEADER, CHUNK_TAG_STREAM_HEADER, CHUNK_TAG_SAMPLES, CHUNK_TAG_CLOCK_OFFSET,
+                                   CHUNK_TAG_STREAM_FOOTER)
+
+logger = logging.getLogger(__name__)
+
+STATUS_OK: str = 'ok'
+STATUS_WARNING: str = 'warning'
+STATUS_ERROR: str = 'error'
+
+
+@define(slots=False)
+class StreamTimingStats:
+    """ constant-memory accumulator of one stream's timestamps """
+    nominal_srate: float = field()
+    gap_periods: float = field(default=3.0)
+    min_gap_seconds: float = field(default=0.1)
+    drift_window: float = field(default=60.0)
+    max_listed_gaps: int = field(default=20)
+
+    count: int = field(default=0)
+    first_timestamp: Optional[float] = field(default=None)
+    last_timestamp: Optional[float] = field(default=None)
+    n_gaps: int = field(default=0)
+    total_gap_seconds: float = field(default=0.0)
+    largest_gap_seconds: float = field(default=0.0)
+    gaps: List[Dict] = field(factory=list) ## first `max_listed_gaps`: {'after_sample', 'timestamp', 'seconds'}
+    n_non_increasing: int = field(default=0)
+    ## running regression of timestamp on sample slot (Welford co-moments, relative to the first timestamp for precision). A sample's slot is its index,
+    ## plus the nominal number of samples lost in the gaps before it, so dropouts do not bias the fitted rate.
+    _last_slot: float = field(default=-1.0)
+    _mean_index: float = field(default=0.0)
+    _mean_time: float = field(default=0.0)
+    _m2_index: float = field(default=0.0)
+    _m2_time: float = field(default=0.0)
+    _co_moment: float = field(default=0.0)
+    ## windowed effective rate
+    _window_start_time: Optional[float] = field(default=None)
+    _window_start_count: int = field(default=0)
+    window_rates: List[float] = field(factory=list)
+
+    @property
+    def gap_threshold(self) -> float:
+        if self.nominal_srate > 0:
+            return max(self.gap_periods / self.nominal_srate, self.min_gap_seconds)
+        return np.inf
+
+
+    def add(self, timestamps: np.ndarray):
+        n = len(timestamps)
+        if n == 0:
+            return
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if self.first_timestamp is None:
+            self.first_timestamp = float(timestamps[0])
+            self._window_start_time = self.first_timestamp
+        previous = self.last_timestamp if self.last_timestamp is not None else timestamps[0]
+        steps = np.diff(timestamps, prepend=previous)
+        if self.count == 0:
+            steps[0] = 0.0
+        else:
+            self.n_non_increasing += int(np.count_nonzero(steps[:1] <= 0))
+        self.n_non_increasing += int(np.count_nonzero(steps[1:] <= 0))
+        gap_positions = np.flatnonzero(steps > self.gap_threshold)
+        for a_position in gap_positions:
+            seconds = float(steps[a_position])
+            self.n_gaps += 1
+            self.total_gap_seconds += seconds
+            self.largest_gap_seconds = max(self.largest_gap_seconds, seconds)
+            if len(self.gaps) < self.max_listed_gaps:
+                self.gaps.append({'after_sample': self.count + int(a_position) - 1, 'timestamp': float(timestamps[a_position] - seconds), 'seconds': seconds})
+
+        ## merge this block's regression moments (Chan et al. parallel update)
+        advances = np.ones(n, dtype=np.float64)
+        advances[gap_positions] = np.maximum(np.round(steps[gap_positions] * self.nominal_srate), 1.0)
+        indices = self._last_slot + np.cumsum(advances)
+        self._last_slot = float(indices[-1])
+        times = timestamps - self.first_timestamp
+        block_mean_index, block_mean_time = indices.mean(), times.mean()
+        block_m2_index = float(np.sum((indices - block_mean_index) ** 2))
+        block_m2_time = float(np.sum((times - block_mean_time) ** 2))
+        block_co_moment = float(np.sum((indices - block_mean_index) * (times - block_mean_time)))
+        total = self.count + n
+        delta_index, delta_time = block_mean_index - self._mean_index, block_mean_time - self._mean_time
+        self._m2_index += block_m2_index + delta_index ** 2 * self.count * n / total
+        self._m2_time += block_m2_time + delta_time ** 2 * self.count * n / total
+        self._co_moment += block_co_moment + delta_index * delta_time * self.count * n / total
+        self._mean_index += delta_index * n / total
+        self._mean_time += delta_time * n / total
+        self.count = total
+        self.last_timestamp = float(timestamps[-1])
+
+        if (self.last_timestamp - self._window_start_time) >= self.drift_window:
+            self.window_rates.append((self.count - 1 - self._window_start_count) / (self.last_timestamp - self._window_start_time))
+            self._window_start_time, self._window_start_count = self.last_timestamp, self.count - 1
+
+
+    @property
+    def duration(self) -> float:
+        return (self.last_timestamp - self.first_timestamp) if self.count > 1 else 0.0
+
+    @property
+    def effective_srate(self) -> Optional[float]:
+        """ 1 / slope of the least-squares fit of timestamp against sample slot """
+        if (self.count < 2) or (self._co_moment <= 0):
+            return None
+        return self._m2_index / self._co_moment
+
+    @property
+    def jitter_seconds(self) -> Optional[float]:
+        """ standard deviation of the timestamps around the fitted line (regular-rate streams only) """
+        if (self.nominal_srate <= 0) or (self.count < 3) or (self._m2_index <= 0):
+            return None
+        residual = max(self._m2_time - self._co_moment ** 2 / self._m2_index, 0.0)
+        return float(np.sqrt(residual / (self.count - 2)))
+
+
+    def summary(self) -> Dict:
+        expected = int(round(self.duration * self.nominal_srate)) + 1 if (self.nominal_srate > 0 and self.count > 0) else None
+        effective = self.effective_srate
+        return {'sample_count': self.count, 'first_timestamp': self.first_timestamp, 'last_timestamp': self.last_timestamp, 'duration_seconds': self.duration,
+                'expected_samples': expected, 'missing_samples': (expected - self.count) if expected is not None else None,
+                'completeness': (self.count / expected) if expected else None,
+                'effective_srate': effective, 'rate_error_ppm': ((effective / self.nominal_srate - 1.0) * 1e6) if (effective and self.nominal_srate > 0) else None,
+                'window_rate_min': min(self.window_rates) if self.window_rates else None, 'window_rate_max': max(self.window_rates) if self.window_rates else None,
+                'jitter_seconds': self.jitter_seconds, 'gap_threshold_seconds': self.gap_threshold if np.isfinite(self.gap_threshold) else None,
+                'n_gaps': self.n_gaps, 'total_gap_seconds': self.total_gap_seconds, 'largest_gap_seconds': self.largest_gap_seconds, 'gaps': self.gaps,
+                'n_non_increasing_timestamps': self.n_non_increasing}
+
+
+def clock_offset_summary(times: List[float], values: List[float]) -> Dict:
+    """ drift (ppm) and residuals of a linear fit of clock offset against collection time """
+    n = len(times)
+    if n == 0:
+        return {'n_clock_offsets': 0}
+    values_array = np.asarray(values, dtype=np.float64)
+    result = {'n_clock_offsets': n, 'clock_offset_mean': float(values_array.mean()), 'clock_offset_range': float(values_array.max() - values_array.min())}
+    if n >= 3:
+        times_array = np.asarray(times, dtype=np.float64)
+        slope, intercept = np.polyfit(times_array - times_array[0], values_array, 1)
+        residuals = values_array - (slope * (times_array - times_array[0]) + intercept)
+        result.update({'clock_drift_ppm': float(slope * 1e6), 'clock_residual_std': float(residuals.std()), 'clock_residual_max': float(np.abs(residuals).max())})
+    return result
+
+
+def verify_xdf(path: Union[str, Path], gap_periods: float = 3.0, min_gap_seconds: float = 0.1, drift_window: float = 60.0, min_completeness: float = 0.99,
+               max_rate_error_ppm: float = 1e4, max_listed_gaps: int = 20) -> Dict:
+    """ Verifies one XDF file in a single streaming pass. Returns a JSON-serializable report with a per-stream breakdown and an overall `status`
+    ('ok', 'warning' or 'error') with the reasons in `problems`.
+    """
+    path = Path(path)
+    report = {'path': str(path), 'size': path.stat().st_size, 'header': {}, 'streams': {}, 'problems': [], 'status': STATUS_OK}
+    streams: Dict[int, XdfStream] = {}
+    stats: Dict[int, StreamTimingStats] = {}
+    n_chunks = 0
+    with open(path, 'rb') as f:
+        if f.read(len(XDF_MAGIC)) != XDF_MAGIC:
+            report['problems'].append('not an XDF file')
+            report['status'] = STATUS_ERROR
+            return report
+        end_offset = len(XDF_MAGIC)
+        for tag, offset, content in iter_xdf_chunks(f):
+            n_chunks += 1
+            end_offset = offset + len(content)
+            if tag == CHUNK_TAG_SAMPLES:
+                stream_id = struct.unpack_from('<I', content)[0]
+                if stream_id in stats:
+                    a_stats = stats[stream_id]
+                    a_stats.add(decode_samples_chunk_timestamps(content[4:], streams[stream_id], a_stats.last_timestamp if a_stats.last_timestamp is not None else np.nan))
+            elif tag == CHUNK_TAG_FILE_HEADER:
+                report['header'] = _parse_flat_xml(content)
+            elif tag == CHUNK_TAG_STREAM_HEADER:
+                stream_id = struct.unpack_from('<I', content)[0]
+                streams[stream_id] = parse_stream_header_xml(stream_id, content[4:].decode('utf-8', errors='replace'))
+                stats[stream_id] = StreamTimingStats(nominal_srate=streams[stream_id].nominal_srate, gap_periods=gap_periods, min_gap_seconds=min_gap_seconds,
+                                                     drift_window=drift_window, max_listed_gaps=max_listed_gaps)
+            elif tag == CHUNK_TAG_CLOCK_OFFSET:
+                stream_id, collection_time, offset_value = struct.unpack_from('<Idd', content)
+                if stream_id in streams:
+                    streams[stream_id].clock_times.append(collection_time)
+                    streams[stream_id].clock_values.append(offset_value)
+            elif tag == CHUNK_TAG_STREAM_FOOTER:
+                stream_id = struct.unpack_from('<I', content)[0]
+                if stream_id in streams:
+                    streams[stream_id].footer = _parse_flat_xml(content[4:])
+    report['n_chunks'] = n_chunks
+    if end_offset < report['size']:
+        report['problems'].append(f'file ends with {report["size"] - end_offset} bytes of a truncated or corrupt chunk (at offset {end_offset})')
+
+    for stream_id, a_stream in streams.items():
+        summary = {'name': a_stream.name, 'type': a_stream.type, 'source_id': a_stream.source_id, 'channel_count': a_stream.channel_count,
+                   'channel_format': a_stream.channel_format, 'nominal_srate': a_stream.nominal_srate, **stats[stream_id].summary(),
+                   **clock_offset_summary(a_stream.clock_times, a_stream.clock_values), 'has_footer': bool(a_stream.footer)}
+        label = f'stream {a_stream.name!r}'
+        if not a_stream.footer:
+            report['problems'].append(f'{label}: no footer (recording not closed cleanly)')
+        elif ('sample_count' in a_stream.footer) and (int(a_stream.footer['sample_count']) != summary['sample_count']):
+            report['problems'].append(f'{label}: footer says {a_stream.footer["sample_count"]} samples, file contains {summary["sample_count"]}')
+        if summary['sample_count'] == 0:
+            report['problems'].append(f'{label}: no samples')
+        if (summary['completeness'] is not None) and (summary['completeness'] < min_completeness):
+            report['problems'].append(f'{label}: {summary["missing_samples"]} samples missing ({100.0 * summary["completeness"]:.2f}% of nominal rate x duration)')
+        if (summary['rate_error_ppm'] is not None) and (abs(summary['rate_error_ppm']) > max_rate_error_ppm):
+            report['problems'].append(f'{label}: effective rate {summary["effective_srate"]:.3f} Hz differs from nominal {a_stream.nominal_srate:g} Hz by {summary["rate_error_ppm"]:+.0f} ppm')
+        if summary['n_gaps'] > 0:
+            report['problems'].append(f'{label}: {summary["n_gaps"]} gaps totalling {summary["total_gap_seconds"]:.3f} s (largest {summary["largest_gap_seconds"]:.3f} s)')
+        if summary['n_non_increasing_timestamps'] > 0:
+            report['problems'].append(f'{label}: {summary["n_non_increasing_timestamps"]} non-increasing timestamps')
+        report['streams'][a_stream.name or str(stream_id)] = summary
+
+    if report['problems']:
+        is_error = any(('no samples' in a_problem) or ('truncated' in a_problem) or ('missing' in a_problem) for a_problem in report['problems'])
+        report['status'] = STATUS_ERROR if is_error else STATUS_WARNING
+    return report
+
+
+def format_report(report: Dict) -> str:
+    lines = [f'{report["path"]}: {report["status"].upper()} ({report["size"] / 1e6:.1f} MB)']
+    for a_name, a_stream in report['streams'].items():
+        rate = f'{a_stream["effective_srate"]:.4f} Hz ({a_stream["rate_error_ppm"]:+.0f} ppm)' if a_stream.get('rate_error_ppm') is not None else 'n/a'
+        completeness = f'{100.0 * a_stream["completeness"]:.2f}%' if a_stream.get('completeness') is not None else 'n/a'
+        jitter = f'{1e3 * a_stream["jitter_seconds"]:.2f} ms' if a_stream.get('jitter_seconds') is not None else 'n/a'
+        drift = f'{a_stream["clock_drift_ppm"]:.1f} ppm' if a_stream.get('clock_drift_ppm') is not None else 'n/a'
+        lines.append(f'  {a_name}: {a_stream["sample_count"]} samples over {a_stream["duration_seconds"]:.1f} s, complete {completeness}, rate {rate}, jitter {jitter}, '
+                     f'gaps {a_stream["n_gaps"]}, clock drift {drift}')
+        for a_gap in a_stream['gaps'][:5]:
+            lines.append(f'      gap of {a_gap["seconds"]:.3f} s after sample {a_gap["after_sample"]} (t={a_gap["timestamp"]:.3f})')
+    lines.extend(f'  ! {a_problem}' for a_problem in report['problems'])
+    return '\n'.join(lines)
+
+
+def _verify_job(path: str, kwargs: Dict) -> Dict:
+    try:
+        return verify_xdf(path, **kwargs)
+    except Exception as e:
+        return {'path': path, 'status': STATUS_ERROR, 'problems': [f'{type(e).__name__}: {e}'], 'streams': {}, 'size': os.path.getsize(path)}
+
+
+def verify_xdf_files(inputs: Iterable[Union[str, Path]], max_workers: Optional[int] = None, recursive: bool = True, **kwargs) -> List[Dict]:
+    """ verifies every XDF file given or found under the given directories, `max_workers` files at a time. Reports are in path order. """
+    paths = []
+    for an_input in inputs:
+        an_input = Path(an_input)
+        if an_input.is_dir():
+            paths.extend(sorted(an_input.rglob(f'*{XDF_EXTENSION}') if recursive else an_input.glob(f'*{XDF_EXTENSION}')))
+        else:
+            paths.append(an_input)
+    paths = [str(a_path) for a_path in paths]
+    max_workers = max_workers or os.cpu_count() or 1
+    if (max_workers == 1) or (len(paths) <= 1):
+        return [_verify_job(a_path, kwargs) for a_path in paths]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_verify_job, paths, [kwargs] * len(paths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check XDF recordings for dropped samples, timestamp gaps, rate drift and clock-offset problems.')
+    parser.add_argument('inputs', nargs='+', help='XDF files or directories')
+    parser.add_argument('--workers', '-j', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--gap-periods', type=float, default=3.0, help='A gap is an interval longer than this many nominal sample periods (default: 3)')
+    parser.add_argument('--min-gap', type=float, default=0.1, help='... and longer than this many seconds (default: 0.1)')
+    parser.add_argument('--drift-window', type=float, default=60.0, help='Window for the effective-rate spread, in seconds (default: 60)')
+    parser.add_argument('--min-completeness', type=float, default=0.99, help='Fraction of nominal samples below which a stream is an error (default: 0.99)')
+    parser.add_argument('--max-rate-error', type=float, default=1e4, help='Effective-rate deviation from nominal, in ppm, above which a stream is flagged (default: 10000)')
+    parser.add_argument('--json', type=str, default=None, help='Also write the full reports to this JSON file')
+    parser.add_argument('--no-recursive', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    reports = verify_xdf_files(args.inputs, max_workers=args.workers, recursive=not args.no_recursive, gap_periods=args.gap_periods, min_gap_seconds=args.min_gap,
+                               drift_window=args.drift_window, min_completeness=args.min_completeness, max_rate_error_ppm=args.max_rate_error)
+    for a_report in reports:
+        print(format_report(a_report))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=1)
+    sys.exit(1 if any(a_report['status'] == STATUS_ERROR for a_report in reports) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+"""
+Native XDF writer, fed directly from the `EmotivBase` publishing path.
+
+`XdfWriter` writes the XDF 1.0 chunk format (https://github.com/sccn/xdf/wiki/Specifications): file header, stream headers, sample chunks,
+clock offsets, boundary chunks and stream footers, laid out the way LabRecorder writes them so pyxdf, MNE and SigViewer read the files unchanged.
+`XdfRecorderSink` is a `SampleSink`: samples are copied into a preallocated per-stream block and written as one chunk when it fills, so recording costs
+a row copy per sample instead of an LSL loopback round trip.
+
+Usage:
+    sink = XdfRecorderSink('session.xdf')
+    emotiv.add_sample_sink(sink)
+    ...
+    emotiv.remove_sample_sink(sink)
+    sink.close()
+"""
+import logging
+import struct
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pylsl
+from pylsl import StreamInfo
+from attrs import define, field
+
+from emotiv_lsl.sample_sink import SampleSink
+
+logger = logging.getLogger(__name__)
+
+XDF_MAGIC: bytes = b'XDF:'
+XDF_EXTENSION: str = '.xdf'
+
+CHUNK_TAG_FILE_HEADER: int = 1
+CHUNK_TAG_STREAM_HEADER: int = 2
+CHUNK_TAG_SAMPLES: int = 3
+CHUNK_TAG_CLOCK_OFFSET: int = 4
+CHUNK_TAG_BOUNDARY: int = 5
+CHUNK_TAG_STREAM_FOOTER: int = 6
+
+## fixed 16-byte payload of a boundary chunk, lets readers resynchronize inside a damaged file
+BOUNDARY_UUID: bytes = bytes([0x43, 0xA5, 0x46, 0xDC, 0xCB, 0xF5, 0x41, 0x0F, 0xB3, 0x0E, 0xD5, 0x46, 0x73, 0x83, 0xCB, 0xE4])
+
+## XDF channel_format -> little-endian numpy dtype ('string' is handled separately)
+XDF_CHANNEL_FORMAT_DTYPES: Dict[str, str] = {'float32': '<f4', 'double64': '<f8', 'int8': 'i1', 'int16': '<i2', 'int32': '<i4', 'int64': '<i8'}
+## pylsl `cf_*` constants -> XDF channel_format
+LSL_CHANNEL_FORMAT_NAMES: Dict[int, str] = {pylsl.cf_float32: 'float32', pylsl.cf_double64: 'double64', pylsl.cf_string: 'string', pylsl.cf_int32: 'int32',
+                                            pylsl.cf_int16: 'int16', pylsl.cf_int8: 'int8', pylsl.cf_int64: 'int64'}
+
+_CHUNK_TAG_STRUCT = struct.Struct('<H')
+_STREAM_ID_STRUCT = struct.Struct('<I')
+_CLOCK_OFFSET_STRUCT = struct.Struct('<Idd')
+
+
+def encode_varlen_int(value: int) -> bytes:
+    """ XDF variable-length integer: one byte giving the width (1, 4 or 8), then the value """
+    if value < 0x100:
+        return struct.pack('<BB', 1, value)
+    if value < 0x100000000:
+        return struct.pack('<BI', 4, value)
+    return struct.pack('<BQ', 8, value)
+
+
+def xdf_sample_record_dtype(channel_format: str, channel_count: int) -> np.dtype:
+    """ packed dtype of one numeric sample as stored in a samples chunk: timestamp-bytes flag (8), timestamp, values """
+    return np.dtype([('timestamp_bytes', 'u1'), ('timestamp', '<f8'), ('values', XDF_CHANNEL_FORMAT_DTYPES[channel_format], (channel_count,))])
+
+
+def xdf_footer_xml(first_timestamp: float, last_timestamp: float, sample_count: int, clock_offsets: Sequence[Tuple[float, float]]) -> str:
+    offsets = ''.join(f'<offset><time>{a_time!r}</time><value>{a_value!r}</value></offset>' for a_time, a_value in clock_offsets)
+    return (f'<?xml version="1.0"?><info><first_timestamp>{first_timestamp!r}</first_timestamp><last_timestamp>{last_timestamp!r}</last_timestamp>'
+            f'<sample_count>{sample_count}</sample_count><clock_offsets>{offsets}</clock_offsets></info>')
+
+
+@define(slots=False)
+class XdfWriter:
+    """ Low-level XDF chunk writer over a large buffered file. Not thread-safe; `XdfRecorderSink` serializes access. """
+    path: Path = field(converter=Path)
+    buffer_size: int = field(default=1 << 20)
+
+    bytes_written: int = field(default=0, init=False)
+    _file: Optional[object] = field(default=None, init=False)
+
+
+    def __attrs_post_init__(self):
+        self._file = open(self.path, 'wb', buffering=self.buffer_size)
+        self._write(XDF_MAGIC)
+        self.write_chunk(CHUNK_TAG_FILE_HEADER, f'<?xml version="1.0"?><info><version>1.0</version><datetime>{datetime.now().astimezone().isoformat()}</datetime></info>'.encode('utf-8'))
+
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+
+    def write_chunk(self, tag: int, *parts: bytes):
+        """ writes one chunk: [varlen length][tag][content], where `content` is the concatenation of `parts` """
+        length = 2 + sum(len(a_part) for a_part in parts)
+        self._write(encode_varlen_int(length) + _CHUNK_TAG_STRUCT.pack(tag))
+        for a_part in parts:
+            self._write(a_part)
+
+
+    def write_stream_header(self, stream_id: int, info_xml: str):
+        self.write_chunk(CHUNK_TAG_STREAM_HEADER, _STREAM_ID_STRUCT.pack(stream_id), info_xml.encode('utf-8'))
+
+
+    def write_samples(self, stream_id: int, timestamps: np.ndarray, values: np.ndarray, channel_format: str):
+        """ writes (n,) timestamps and (n, channel_count) values as one samples chunk, every sample carrying its own timestamp """
+        n_samples = len(timestamps)
+        if n_samples == 0:
+            return
+        if channel_format == 'string':
+            payload = bytearray()
+            for a_timestamp, a_sample in zip(timestamps, values):
+                payload += struct.pack('<Bd', 8, a_timestamp)
+                for a_value in a_sample:
+                    encoded = str(a_value).encode('utf-8')
+                    payload += encode_varlen_int(len(encoded)) + encoded
+            self.write_chunk(CHUNK_TAG_SAMPLES, _STREAM_ID_STRUCT.pack(stream_id), encode_varlen_int(n_samples), bytes(payload))
+            return
+        records = np.empty(n_samples, dtype=xdf_sample_record_dtype(channel_format, values.shape[1]))
+        records['timestamp_bytes'] = 8
+        records['timestamp'] = timestamps
+        records['values'] = values
+        self.write_chunk(CHUNK_TAG_SAMPLES, _STREAM_ID_STRUCT.pack(stream_id), encode_varlen_int(n_samples), records.tobytes())
+
+
+    def write_clock_offset(self, stream_id: int, collection_time: float, offset_value: float):
+        self.write_chunk(CHUNK_TAG_CLOCK_OFFSET, _CLOCK_OFFSET_STRUCT.pack(stream_id, collection_time, offset_value))
+
+
+    def write_boundary(self):
+        self.write_chunk(CHUNK_TAG_BOUNDARY, BOUNDARY_UUID)
+
+
+    def write_stream_footer(self, stream_id: int, first_timestamp: float, last_timestamp: float, sample_count: int, clock_offsets: Sequence[Tuple[float, float]]):
+        self.write_chunk(CHUNK_TAG_STREAM_FOOTER, _STREAM_ID_STRUCT.pack(stream_id), xdf_footer_xml(first_timestamp, last_timestamp, sample_count, clock_offsets).encode('utf-8'))
+
+
+    def flush(self):
+        self._file.flush()
+
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+@define(slots=False)
+class XdfStreamState:
+    """ per-stream staging block and footer bookkeeping of an `XdfRecorderSink` """
+    stream_id: int = field()
+    name: str = field()
+    channel_count: int = field()
+    channel_format: str = field()
+    timestamps: np.ndarray = field()
+    values: np.ndarray = field()
+    n_buffered: int = field(default=0)
+    sample_count: int = field(default=0)
+    first_timestamp: float = field(default=0.0)
+    last_timestamp: float = field(default=0.0)
+    last_clock_offset_time: float = field(default=-np.inf)
+    clock_offsets: List[Tuple[float, float]] = field(factory=list)
+
+
+@define(slots=False)
+class XdfRecorderSink(SampleSink):
+    """ Records every stream published by an `EmotivBase` delegate to an XDF file, without going through LSL.
+
+    Each stream's samples are staged in a `chunk_samples`-row block and written as one samples chunk when it fills. Like LabRecorder, a clock offset
+    is written per stream every `clock_offset_interval` seconds (always 0.0: the samples are stamped with this machine's `pylsl.local_clock()`)
+    and a boundary chunk every `boundary_interval` seconds. The file buffer is flushed to the OS every `flush_interval` seconds.
+    """
+    path: Path = field(converter=Path)
+    chunk_samples: int = field(default=128)
+    clock_offset_interval: float = field(default=5.0)
+    boundary_interval: float = field(default=10.0)
+    flush_interval: float = field(default=1.0)
+
+    is_open: bool = field(default=False, init=False)
+    _writer: Optional[XdfWriter] = field(default=None, init=False)
+    _streams: Dict[str, XdfStreamState] = field(factory=dict, init=False)
+    _lock: threading.Lock = field(factory=threading.Lock, init=False)
+    _last_boundary_time: float = field(default=-np.inf, init=False)
+    _last_flush_time: float = field(default=-np.inf, init=False)
+
+
+    def __attrs_post_init__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._writer = XdfWriter(self.path)
+        self.is_open = True
+        self._last_boundary_time = pylsl.local_clock()
+        self._last_flush_time = self._last_boundary_time
+
+
+    @property
+    def stream_names(self) -> List[str]:
+        return list(self._streams.keys())
+
+
+    def on_stream_started(self, stream_name: str, info: StreamInfo):
+        with self._lock:
+            if (not self.is_open) or (stream_name in self._streams):
+                return ## a restarted outlet keeps writing into the stream it had
+            channel_format = LSL_CHANNEL_FORMAT_NAMES[info.channel_format()]
+            channel_count = info.channel_count()
+            values_dtype = object if channel_format == 'string' else XDF_CHANNEL_FORMAT_DTYPES[channel_format]
+            state = XdfStreamState(stream_id=len(self._streams) + 1, name=stream_name, channel_count=channel_count, channel_format=channel_format,
+                                   timestamps=np.zeros(self.chunk_samples, dtype=np.float64), values=np.zeros((self.chunk_samples, channel_count), dtype=values_dtype))
+            self._streams[stream_name] = state
+            self._writer.write_stream_header(state.stream_id, info.as_xml())
+            self._write_clock_offset(state, pylsl.local_clock())
+            logger.info(f'recording stream {stream_name!r} as XDF stream {state.stream_id} ({channel_count} x {channel_format})')
+
+
+    def on_sample(self, stream_name: str, sample: Sequence[float], timestamp: float):
+        with self._lock:
+            state = self._streams.get(stream_name)
+            if (state is None) or (not self.is_open):
+                return
+            i = state.n_buffered
+            state.timestamps[i] = timestamp
+            state.values[i] = sample
+            state.n_buffered += 1
+            if state.sample_count == 0:
+                state.first_timestamp = timestamp
+            state.sample_count += 1
+            state.last_timestamp = timestamp
+            if state.n_buffered == self.chunk_samples:
+                self._flush_stream(state)
+            self._write_periodic_chunks(state, timestamp)
+
+
+    def on_source_stopped(self):
+        self.flush()
+
+
+    def _flush_stream(self, state: XdfStreamState):
+        if state.n_buffered > 0:
+            self._writer.write_samples(state.stream_id, state.timestamps[:state.n_buffered], state.values[:state.n_buffered], state.channel_format)
+            state.n_buffered = 0
+
+
+    def _write_clock_offset(self, state: XdfStreamState, now: float):
+        self._writer.write_clock_offset(state.stream_id, now, 0.0)
+        state.clock_offsets.append((now, 0.0))
+        state.last_clock_offset_time = now
+
+
+    def _write_periodic_chunks(self, state: XdfStreamState, now: float):
+        """ clock offsets, boundaries and file flushes, checked against the sample timestamp so no extra clock read is needed per sample """
+        if (now - state.last_clock_offset_time) >= self.clock_offset_interval:
+            self._flush_stream(state) ## keep offsets between the samples they bracket
+            self._write_clock_offset(state, now)
+        if (now - self._last_boundary_time) >= self.boundary_interval:
+            for a_state in self._streams.values():
+                self._flush_stream(a_state)
+            self._writer.write_boundary()
+            self._last_boundary_time = now
+        if (now - self._last_flush_time) >= self.flush_interval:
+            self._writer.flush()
+            self._last_flush_time = now
+
+
+    def flush(self):
+        """ writes all staged samples and flushes the file buffer """
+        with self._lock:
+            if not self.is_open:
+                return
+            for a_state in self._streams.values():
+                self._flush_stream(a_state)
+            self._writer.flush()
+
+
+    def close(self) -> Path:
+        """ writes the remaining samples and one footer per stream, then closes the file """
+        with self._lock:
+            if not self.is_open:
+                return self.path
+            for a_state in self._streams.values():
+                self._flush_stream(a_state)
+            self._writer.write_boundary()
+            for a_state in self._streams.values():
+                self._writer.write_stream_footer(a_state.stream_id, a_state.first_timestamp, a_state.last_timestamp, a_state.sample_count, a_state.clock_offsets)
+            self._writer.close()
+            self.is_open = False
+        logger.info(f'closed {self.path} ({self._writer.bytes_written} bytes, ' + ', '.join(f'{a_state.name}: {a_state.sample_count} samples' for a_state in self._streams.values()) + ')')
+        return self.path
+
+
+    def get_status(self) -> Dict:
+        return {'recording': self.is_open, 'filename': str(self.path), 'streams': self.stream_names,
+                'sample_counts': {a_name: a_state.sample_count for a_name, a_state in self._streams.items()}, 'bytes_written': (self._writer.bytes_written if self._writer else 0)}
@@ -6,16 +6,19 @@ import numpy as np
 from mne import Info, create_info
 from mne.io.array import RawArray
 from pathlib import Path
-from typing import List
-from pylsl import StreamInlet, resolve_stream, StreamInfo
+from typing import Dict, List, Optional, Tuple
+from pylsl import StreamInlet, resolve_stream, StreamInfo, local_clock
 import mne
 from datetime import datetime
 from pylsl import StreamInlet, resolve_stream
 from attrs import define, field, Factory
 import os
 import time
+import queue
+import threading
 import signal
 import sys
+from datetime import timezone
 
 stream_names = ['Epoc X eQuality', 'Epoc X', 'Epoc X Motion']
 stream_channels_dict = {'Epoc X': ['AF3', 'F7', 'F3', 'FC5', 'T7', 'P7', 'O1', 'O2', 'P8', 'T8', 'FC6', 'F4', 'F8', 'AF4'],
@@ -28,16 +31,65 @@ stream_channels_dict = {'Epoc X': ['AF3', 'F7', 'F3', 'FC5', 'T7', 'P7', 'O1', '
 # }
 
 
+def get_stream_channel_names(info: StreamInfo, default: Optional[List[str]] = None) -> List[str]:
+    """ channel labels from the stream's `<channels>` description, else `default` if it has one name per channel, else generic `CH<n>` names """
+    ch_names = []
+    ch = info.desc().child("channels").child("channel")
+    while not ch.empty():
+        ch_names.append(ch.child_value("label"))
+        ch = ch.next_sibling("channel")
+    if (len(ch_names) != info.channel_count()) or (not all(ch_names)):
+        ch_names = list(default) if ((default is not None) and (len(default) == info.channel_count())) else [f'CH{i+1}' for i in range(info.channel_count())]
+    return ch_names
+
+
+def get_stream_channel_types(info: StreamInfo) -> List[str]:
+    """ MNE type of each channel: 'stim' for channels described with type stim (the MARKER event channel), else 'eeg' for EEG streams and 'misc' otherwise """
+    default = 'eeg' if info.type().upper() == 'EEG' else 'misc'
+    ch_types = []
+    ch = info.desc().child("channels").child("channel")
+    while not ch.empty():
+        ch_types.append('stim' if ch.child_value("type").lower() == 'stim' else default)
+        ch = ch.next_sibling("channel")
+    if len(ch_types) != info.channel_count():
+        ch_types = [default] * info.channel_count()
+    return ch_types
+
+
+def lsl_to_wall_clock(timestamp: float) -> datetime:
+    """ converts an LSL timestamp taken on this machine to an aware UTC datetime """
+    return datetime.fromtimestamp(time.time() - local_clock() + timestamp, tz=timezone.utc)
+
+
+def save_fif_chunk(data: np.ndarray, timestamps: np.ndarray, mne_info: mne.Info, filename: Path, description: str = '') -> Path:
+    """ saves (n_samples, n_channels) `data` as a FIF file. The measurement date is the wall-clock time of the first sample; the first/last LSL timestamps are appended to the description. """
+    raw = mne.io.RawArray(data.T, mne_info, verbose=False)
+    if len(timestamps) > 0:
+        raw.set_meas_date(lsl_to_wall_clock(float(timestamps[0])))
+        description = f'{description}, first LSL timestamp {float(timestamps[0])!r}, last LSL timestamp {float(timestamps[-1])!r}'
+    raw.info['description'] = description
+    raw.save(filename, overwrite=True, verbose=False)
+    return filename
+
+
 @define(slots=False)
 class ActiveLSLStream:
     """ Attempts to manage an independent recorder for an LSL stream
     from emotiv-lsl.examples.common import ActiveLSLStream
+
+    Samples are pulled with `pull_chunk` straight into one of two preallocated (chunk_samples, n_channels) buffers. When a buffer fills, acquisition
+    switches to the other one and a background writer thread saves the full buffer as a FIF file, so consecutive files have no gap between them.
+    With a `journal` (`emotiv_lsl.recording_journal.RecordingJournal`), every pulled chunk is also journaled, so a crash loses at most the journal's
+    fsync interval instead of the unsaved part of the chunk; `recover_journal` turns the journal into an XDF file.
     """
     name: str = field()
     stream: StreamInlet = field()
     ch_names: List[str] = field(default=Factory(list))
 
-    chunk_duration_minutes: int = field(default=10)
+    chunk_duration_minutes: float = field(default=10)
+    output_directory: Path = field(default=Path('.'), converter=Path)
+    max_pull_samples: int = field(default=256)
+    journal: Optional["RecordingJournal"] = field(default=None)
 
     ## Computed:    
     info: StreamInfo = field(init=False)
@@ -50,6 +102,13 @@ class ActiveLSLStream:
 
     running: bool = field(default=True)
     chunk_count: int = field(default=0)
+    saved_filenames: List[Path] = field(default=Factory(list))
+
+    _buffers: List[np.ndarray] = field(default=Factory(list), init=False)
+    _timestamp_buffers: List[np.ndarray] = field(default=Factory(list), init=False)
+    _buffer_free: List[threading.Event] = field(default=Factory(list), init=False)
+    _save_queue: "queue.Queue" = field(default=Factory(lambda: queue.Queue(maxsize=1)), init=False)
+    _writer_thread: Optional[threading.Thread] = field(default=None, init=False)
 
 
     def __attrs_post_init__(self):
@@ -75,10 +134,20 @@ class ActiveLSLStream:
 
         self.chunk_samples = int(self.sfreq * 60 * self.chunk_duration_minutes)
 
+        ## two chunk buffers in the inlet's native sample type (float32 for all Emotiv streams), C-ordered so `pull_chunk` can fill a row range in place
+        sample_dtype = np.dtype(self.stream.value_type)
+        self._buffers = [np.zeros((self.chunk_samples, self.n_channels), dtype=sample_dtype) for _ in range(2)]
+        self._timestamp_buffers = [np.zeros(self.chunk_samples, dtype=np.float64) for _ in range(2)]
+        self._buffer_free = [threading.Event() for _ in range(2)]
+        for an_event in self._buffer_free:
+            an_event.set()
+
+        if self.journal is not None:
+            self.journal.on_stream_started(self.name, self.info)
 
 
     @classmethod
-    def init_from_name(cls, name: str, ch_names = ['AF3', 'F7', 'F3', 'FC5', 'T7', 'P7', 'O1', 'O2', 'P8', 'T8', 'FC6', 'F4', 'F8', 'AF4']):
+    def init_from_name(cls, name: str, ch_names = ['AF3', 'F7', 'F3', 'FC5', 'T7', 'P7', 'O1', 'O2', 'P8', 'T8', 'FC6', 'F4', 'F8', 'AF4'], **kwargs):
         # first resolve an EEG stream on the lab network
         print('Looking for an EEG stream...')
         # streams = resolve_stream('type', 'EEG')
@@ -90,10 +159,44 @@ class ActiveLSLStream:
         # create a new inlet to read from the stream
         inlet = StreamInlet(stream_inlet_dict[name])
 
-        _obj = cls(name=name, stream=inlet, ch_names=ch_names)
+        _obj = cls(name=name, stream=inlet, ch_names=ch_names, **kwargs)
         return _obj
 
 
+    def save_chunk(self, data: np.ndarray, timestamps: np.ndarray, chunk_number: int) -> Path:
+        """ saves (n_samples, n_channels) `data` as a FIF file. The measurement date is the wall-clock time of the first sample, and its LSL timestamp goes in the description. """
+        # Create a valid filename with timestamp
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = self.output_directory.joinpath(f"data_{timestamp}_chunk{chunk_number}_raw.fif")
+        return save_fif_chunk(data, timestamps, self.mne_info, filename, description=f'{self.name} chunk {chunk_number}')
+
+
+    def _writer_loop(self):
+        """ background thread: saves each full buffer handed over by `run`, then marks it free again """
+        while True:
+            job = self._save_queue.get()
+            if job is None:
+                return
+            buffer_index, n_samples, chunk_number = job
+            try:
+                print(f"Saving chunk {chunk_number}...")
+                filename = self.save_chunk(self._buffers[buffer_index][:n_samples], self._timestamp_buffers[buffer_index][:n_samples], chunk_number)
+                self.saved_filenames.append(filename)
+                print(f"Data saved to {os.path.abspath(filename)}")
+            except Exception as e:
+                print(f"Error saving chunk {chunk_number}: {e}")
+            finally:
+                self._buffer_free[buffer_index].set()
+
+
+    def _begin_chunk(self, buffer_index: int) -> float:
+        """ takes ownership of a buffer for the next chunk. The writer has had a whole chunk duration to release it; the inlet queues samples meanwhile. """
+        self._buffer_free[buffer_index].wait()
+        self._buffer_free[buffer_index].clear()
+        self.chunk_count += 1
+        print(f"\nStarting chunk {self.chunk_count}...")
+        return time.time()
+
 
     def run(self):
         """ main run loop 
@@ -102,66 +205,211 @@ class ActiveLSLStream:
         print(f"Sampling rate: {self.sfreq} Hz")
         print(f"Channels: {self.ch_names}") 
 
-        while self.running:
-            self.chunk_count += 1
-            print(f"\nStarting chunk {self.chunk_count}...")
-
-            # Create a buffer for this chunk
-            buffer = np.zeros((self.n_channels, self.chunk_samples))
-
-            # Record start time for this chunk
-            chunk_start_time = time.time()
-
-            # Fill the buffer
-            for i in range(self.chunk_samples):
-                if not self.running:
-                    print("Recording interrupted.")
-                    break
+        self._writer_thread = threading.Thread(target=self._writer_loop, name=f'{self.name} writer', daemon=True)
+        self._writer_thread.start()
 
+        buffer_index = 0
+        n_filled = 0
+        progress_interval = int(self.sfreq * 5)
+        chunk_start_time = self._begin_chunk(buffer_index)
+        try:
+            while self.running:
+                n_wanted = min(self.max_pull_samples, self.chunk_samples - n_filled)
                 try:
-                    sample, timestamp = self.inlet.pull_sample(timeout=1.0)
-                    if sample:
-                        buffer[:, i] = sample
-                    else:
-                        # If no sample received, repeat the last sample or use zeros
-                        if i > 0:
-                            buffer[:, i] = buffer[:, i-1]
-                        continue
+                    _, timestamps = self.stream.pull_chunk(timeout=1.0, max_samples=n_wanted, dest_obj=self._buffers[buffer_index][n_filled:n_filled + n_wanted])
                 except Exception as e:
-                    print(f"Error reading sample: {e}")
-                    if i > 0:
-                        buffer[:, i] = buffer[:, i-1]
+                    print(f"Error reading samples: {e}")
                     continue
+                n_new = len(timestamps)
+                if n_new == 0:
+                    continue
+                self._timestamp_buffers[buffer_index][n_filled:n_filled + n_new] = timestamps
+                if self.journal is not None:
+                    self.journal.append_samples(self.name, self._buffers[buffer_index][n_filled:n_filled + n_new], self._timestamp_buffers[buffer_index][n_filled:n_filled + n_new])
 
                 # Print progress every 5 seconds
-                if i % int(self.sfreq * 5) == 0 and i > 0:
+                if (n_filled // progress_interval) != ((n_filled + n_new) // progress_interval):
                     elapsed = time.time() - chunk_start_time
                     total = self.chunk_samples / self.sfreq
                     print(f"Recording: {elapsed:.1f}s / {total:.1f}s ({elapsed/total*100:.1f}%)")
+                n_filled += n_new
+
+                if n_filled == self.chunk_samples:
+                    self._save_queue.put((buffer_index, n_filled, self.chunk_count))
+                    buffer_index = 1 - buffer_index
+                    n_filled = 0
+                    chunk_start_time = self._begin_chunk(buffer_index)
+        finally:
+            if n_filled > self.sfreq * 10:  # At least 10 seconds of data
+                self._save_queue.put((buffer_index, n_filled, self.chunk_count))
+            else:
+                if n_filled > 0:
+                    print("Recording interrupted.")
+                self._buffer_free[buffer_index].set()
+            self._save_queue.put(None)
+            self._writer_thread.join()
+
+        print("Recording stopped.")
+
 
-            # If we have data and haven't been interrupted mid-chunk
-            if self.running or i > self.sfreq * 10:  # At least 10 seconds of data
-                # Create a raw object with the recorded data
-                # If interrupted, use only the filled portion of the buffer
-                if not self.running and i < self.chunk_samples - 1:
-                    buffer = buffer[:, :i+1]
+    def stop(self):
+        self.running = False ## stop running; `run` saves the partial chunk and waits for the writer
 
-                raw = mne.io.RawArray(buffer, self.mne_info)
 
-                # Create a valid filename with timestamp
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"data_{timestamp}_chunk{self.chunk_count}_raw.fif"
 
-                # Save the raw data
-                print(f"Saving chunk {self.chunk_count}...")
-                raw.save(filename)
+@define(slots=False)
+class StreamRecordingBuffer:
+    """ one stream of a `MultiStreamRecorder`: its inlet and a preallocated sample/timestamp buffer that `pull_chunk` fills in place """
+    name: str = field()
+    inlet: StreamInlet = field()
+    mne_info: mne.Info = field()
+    capacity: int = field()
+
+    data: np.ndarray = field(init=False)
+    timestamps: np.ndarray = field(init=False)
+    n_filled: int = field(default=0, init=False)
+    n_total: int = field(default=0, init=False)
+
+    def __attrs_post_init__(self):
+        self.data = np.zeros((self.capacity, self.inlet.channel_count), dtype=np.dtype(self.inlet.value_type))
+        self.timestamps = np.zeros(self.capacity, dtype=np.float64)
+
+
+    def pull(self, max_samples: int) -> int:
+        """ pulls whatever is available without blocking, returns the number of new samples """
+        if self.n_filled == self.capacity:
+            ## only happens if rotation falls far behind; grow rather than drop samples
+            self.capacity *= 2
+            self.data = np.concatenate([self.data, np.zeros_like(self.data)])
+            self.timestamps = np.concatenate([self.timestamps, np.zeros_like(self.timestamps)])
+        n_wanted = min(max_samples, self.capacity - self.n_filled)
+        _, timestamps = self.inlet.pull_chunk(timeout=0.0, max_samples=n_wanted, dest_obj=self.data[self.n_filled:self.n_filled + n_wanted])
+        n_new = len(timestamps)
+        if n_new > 0:
+            self.timestamps[self.n_filled:self.n_filled + n_new] = timestamps
+            self.n_filled += n_new
+            self.n_total += n_new
+        return n_new
+
+
+    def take_before(self, boundary: Optional[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """ removes and returns (copies of) the samples stamped before `boundary` (all of them if None), moving the rest to the front """
+        n = self.n_filled if boundary is None else int(np.searchsorted(self.timestamps[:self.n_filled], boundary, side='left'))
+        data, timestamps = self.data[:n].copy(), self.timestamps[:n].copy()
+        n_rest = self.n_filled - n
+        self.data[:n_rest] = self.data[n:self.n_filled]
+        self.timestamps[:n_rest] = self.timestamps[n:self.n_filled]
+        self.n_filled = n_rest
+        return data, timestamps
+
+
+@define(slots=False)
+class MultiStreamRecorder:
+    """ Records several LSL streams (by default all of `stream_channels_dict`) from a single acquisition loop.
+
+    Each stream has its own inlet and preallocated buffer. The loop polls every inlet with non-blocking `pull_chunk` calls and sleeps `poll_interval` when all are idle.
+    Chunks rotate on one shared LSL-time clock: every `chunk_duration_minutes` a boundary is fixed, and once `rotation_latency` seconds have passed after it
+    (so late-arriving samples stamped before it are in), each stream's samples before the boundary are handed to one background writer thread.
+    All files of a chunk share the chunk number and cover the same time span.
+
+    Usage:
+        recorder = MultiStreamRecorder.init_from_names(stream_channels_dict)
+        recorder.run() ## until `recorder.stop()`
+    """
+    streams: Dict[str, StreamRecordingBuffer] = field()
+    chunk_duration_minutes: float = field(default=10)
+    output_directory: Path = field(default=Path('.'), converter=Path)
+    poll_interval: float = field(default=0.01)
+    rotation_latency: float = field(default=1.0)
+    max_pull_samples: int = field(default=256)
+
+    running: bool = field(default=True)
+    chunk_count: int = field(default=0)
+    saved_filenames: List[Path] = field(default=Factory(list))
+    _save_queue: "queue.Queue" = field(default=Factory(queue.Queue), init=False)
+
+    @property
+    def chunk_seconds(self) -> float:
+        return self.chunk_duration_minutes * 60.0
+
+
+    @classmethod
+    def init_from_names(cls, channels_dict: Dict[str, Optional[List[str]]] = None, timeout: float = 5.0, **kwargs) -> "MultiStreamRecorder":
+        """ opens an inlet for each stream named in `channels_dict` that is found on the network. Channel names come from the stream's description;
+        the names in `channels_dict` (None for none) are only used for streams that do not describe their channels, and only if there is one per channel.
+        """
+        if channels_dict is None:
+            channels_dict = stream_channels_dict
+        available = {a_stream.name(): a_stream for a_stream in resolve_stream()}
+        chunk_seconds = kwargs.get('chunk_duration_minutes', 10) * 60.0
+        streams = {}
+        for a_name, a_ch_names in channels_dict.items():
+            if a_name not in available:
+                print(f'stream {a_name!r} not found, skipping it')
+                continue
+            inlet = StreamInlet(available[a_name], max_buflen=360)
+            info = inlet.info(timeout=timeout)
+            ch_names = get_stream_channel_names(info, default=a_ch_names)
+            if (a_ch_names is not None) and (ch_names != list(a_ch_names)):
+                print(f'stream {a_name!r} has channels {ch_names}, recording those instead of {list(a_ch_names)}')
+            mne_info = mne.create_info(ch_names=ch_names, sfreq=info.nominal_srate(), ch_types=get_stream_channel_types(info))
+            streams[a_name] = StreamRecordingBuffer(name=a_name, inlet=inlet, mne_info=mne_info, capacity=int(info.nominal_srate() * (chunk_seconds + 60.0)))
+        assert len(streams) > 0, f"none of {list(channels_dict.keys())} were found among {list(available.keys())}"
+        return cls(streams=streams, **kwargs)
+
+
+    def _writer_loop(self):
+        """ background thread: saves the per-stream pieces of each rotated chunk """
+        while True:
+            job = self._save_queue.get()
+            if job is None:
+                return
+            a_stream, chunk_number, chunk_start, data, timestamps = job
+            if len(timestamps) == 0:
+                continue
+            safe_name = a_stream.name.replace(' ', '_')
+            filename = self.output_directory.joinpath(f"data_{lsl_to_wall_clock(chunk_start).astimezone().strftime('%Y%m%d_%H%M%S')}_chunk{chunk_number}_{safe_name}_raw.fif")
+            try:
+                save_fif_chunk(data, timestamps, a_stream.mne_info, filename, description=f'{a_stream.name} chunk {chunk_number}')
+                self.saved_filenames.append(filename)
                 print(f"Data saved to {os.path.abspath(filename)}")
+            except Exception as e:
+                print(f"Error saving {a_stream.name} chunk {chunk_number}: {e}")
 
-        print("Recording stopped.")
 
+    def _rotate(self, chunk_start: float, boundary: Optional[float]):
+        self.chunk_count += 1
+        for a_stream in self.streams.values():
+            data, timestamps = a_stream.take_before(boundary)
+            self._save_queue.put((a_stream, self.chunk_count, chunk_start, data, timestamps))
 
-    def stop(self):
-        self.running = False ## stop running
-        ## wait for a while
+
+    def run(self):
+        """ main run loop """
+        print(f"Recording {list(self.streams.keys())} in {self.chunk_duration_minutes}-minute chunks. Press Ctrl+C to stop.")
+        writer_thread = threading.Thread(target=self._writer_loop, name='MultiStreamRecorder writer', daemon=True)
+        writer_thread.start()
+        for a_stream in self.streams.values():
+            a_stream.inlet.open_stream()
+
+        chunk_start = local_clock()
+        boundary = chunk_start + self.chunk_seconds
+        try:
+            while self.running:
+                n_new = sum(a_stream.pull(self.max_pull_samples) for a_stream in self.streams.values())
+                if local_clock() >= (boundary + self.rotation_latency):
+                    self._rotate(chunk_start, boundary)
+                    chunk_start, boundary = boundary, boundary + self.chunk_seconds
+                if n_new == 0:
+                    time.sleep(self.poll_interval)
+        finally:
+            for a_stream in self.streams.values():
+                a_stream.pull(a_stream.capacity) ## drain what is already queued
+            self._rotate(chunk_start, None)
+            self._save_queue.put(None)
+            writer_thread.join()
+        print(f"Recording stopped. Samples per stream: {({a_name: a_stream.n_total for a_name, a_stream in self.streams.items()})}")
 
 
+    def stop(self):
+        self.running = False
@@ -1,26 +1,131 @@
 #!/usr/bin/env python3
+"""
+Browse a FIF recording of any length.
+
+By default the recording is drawn from its min/max pyramid sidecar (`emotiv_lsl.signal_pyramid`, built on first open): each zoom level reads only the
+matching pyramid level, and raw samples are read (and filtered, with a few seconds of lead-in) only when zoomed in to native resolution.
+`--mne` opens the MNE-Qt-Browser instead, filtering the whole file first.
+
+Usage:
+    python scripts/analysis/launch_emotiv_viewer.py <data_file.fif> [--l-freq 0.5] [--h-freq 40] [--no-filter] [--mne]
+"""
+import argparse
+import os
 import sys
 import mne
+import numpy as np
 from pathlib import Path
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from emotiv_lsl.signal_pyramid import SignalPyramid
+
+FILTER_LEAD_IN_SECONDS = 10.0 ## raw samples read before a native-resolution window to settle the filter
+
+
+class PyramidViewer:
+    """ matplotlib viewer: stacked channels, redrawn from the pyramid level matching the visible time span whenever the x-range changes """
+
+    def __init__(self, raw: mne.io.BaseRaw, pyramid: SignalPyramid, max_points: int = 2000, initial_span: float = 60.0):
+        import matplotlib.pyplot as plt
+        self.raw = raw
+        self.pyramid = pyramid
+        self.max_points = max_points
+        self.picks = [raw.ch_names.index(a_name) for a_name in pyramid.ch_names]
+        self.sos = None
+        if (pyramid.l_freq is not None) or (pyramid.h_freq is not None):
+            from scipy.signal import butter
+            if (pyramid.l_freq is not None) and (pyramid.h_freq is not None):
+                self.sos = butter(4, [pyramid.l_freq, pyramid.h_freq], btype='bandpass', fs=pyramid.sfreq, output='sos')
+            elif pyramid.l_freq is not None:
+                self.sos = butter(4, pyramid.l_freq, btype='highpass', fs=pyramid.sfreq, output='sos')
+            else:
+                self.sos = butter(4, pyramid.h_freq, btype='lowpass', fs=pyramid.sfreq, output='sos')
+
+        ## channel spacing from the coarsest level: a robust peak-to-peak per channel
+        minimum, maximum, mean = pyramid.get_level(pyramid.factors[-1])
+        self.spacing = float(np.nanmedian(maximum - minimum)) or 1.0
+        self.offsets = -np.arange(len(self.picks)) * self.spacing
+        self.centers = np.nanmedian(mean, axis=0)
+
+        self.fig, self.ax = plt.subplots(figsize=(14, 8))
+        self.artists = []
+        self.ax.set_yticks(self.offsets)
+        self.ax.set_yticklabels(pyramid.ch_names)
+        self.ax.set_xlabel('time (s)')
+        self.ax.set_ylim(self.offsets[-1] - self.spacing, self.spacing)
+        self.ax.set_xlim(0.0, min(initial_span, pyramid.duration))
+        self.ax.callbacks.connect('xlim_changed', lambda _ax: self.redraw())
+        self.redraw()
+
+
+    def read_native(self, start: float, stop: float):
+        first = max(int(start * self.pyramid.sfreq), 0)
+        last = min(int(np.ceil(stop * self.pyramid.sfreq)), self.pyramid.n_times)
+        if last <= first:
+            return np.zeros(0), np.zeros((0, len(self.picks)))
+        lead_in = min(int(FILTER_LEAD_IN_SECONDS * self.pyramid.sfreq), first) if self.sos is not None else 0
+        data = self.raw.get_data(picks=self.picks, start=first - lead_in, stop=last).T
+        if self.sos is not None:
+            from scipy.signal import sosfilt, sosfilt_zi
+            data = sosfilt(self.sos, data, axis=0, zi=sosfilt_zi(self.sos)[:, :, np.newaxis] * data[0][np.newaxis, np.newaxis, :])[0]
+        return np.arange(first, last) / self.pyramid.sfreq, data[lead_in:]
+
+
+    def redraw(self):
+        for an_artist in self.artists:
+            an_artist.remove()
+        self.artists = []
+        start, stop = self.ax.get_xlim()
+        envelope = self.pyramid.get_envelope(max(start, 0.0), stop, max_points=self.max_points)
+        for i, an_offset in enumerate(self.offsets):
+            if envelope is None:
+                continue
+            shifted = an_offset - self.centers[i]
+            self.artists.append(self.ax.fill_between(envelope.times, envelope.minimum[:, i] + shifted, envelope.maximum[:, i] + shifted, step='post', color='C0', linewidth=0))
+        if envelope is None:
+            times, data = self.read_native(max(start, 0.0), stop)
+            for i, an_offset in enumerate(self.offsets):
+                self.artists.extend(self.ax.plot(times, data[:, i] + an_offset - self.centers[i], color='C0', linewidth=0.7))
+            resolution = 'native resolution'
+        else:
+            resolution = f'{envelope.factor} samples/bin'
+        self.ax.set_title(f'{Path(self.raw.filenames[0]).name}  [{resolution}]')
+        self.fig.canvas.draw_idle()
+
+
+    def show(self):
+        import matplotlib.pyplot as plt
+        plt.show()
+
+
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python launch_emotiv_viewer.py <data_file.fif>")
-        sys.exit(1)
-    
-    file_path = Path(sys.argv[1])
+    parser = argparse.ArgumentParser(description='Browse a FIF recording, drawing long spans from a min/max pyramid.')
+    parser.add_argument('file', type=str, help='FIF recording')
+    parser.add_argument('--l-freq', type=float, default=0.5)
+    parser.add_argument('--h-freq', type=float, default=40.0)
+    parser.add_argument('--no-filter', action='store_true')
+    parser.add_argument('--mne', action='store_true', help='Open the MNE-Qt-Browser instead (loads and filters the whole file)')
+    args = parser.parse_args()
+
+    file_path = Path(args.file)
     if not file_path.exists():
         print(f"File not found: {file_path}")
         sys.exit(1)
-    
+    l_freq, h_freq = (None, None) if args.no_filter else (args.l_freq, args.h_freq)
+
     print(f"Loading {file_path}...")
-    raw = mne.io.read_raw_fif(file_path)
-    
-    # Basic preprocessing for better visualization
-    raw.filter(l_freq=0.5, h_freq=40)  # Optional filtering
-    
-    print("Launching MNE-Qt-Browser...")
-    raw.plot()
+    raw = mne.io.read_raw_fif(file_path, preload=args.mne)
+
+    if args.mne:
+        if not args.no_filter:
+            raw.filter(l_freq=l_freq, h_freq=h_freq)
+        print("Launching MNE-Qt-Browser...")
+        raw.plot()
+        return
+
+    pyramid = SignalPyramid.for_recording(file_path, l_freq=l_freq, h_freq=h_freq)
+    print(f"Pyramid levels (samples/bin): {pyramid.factors}")
+    PyramidViewer(raw, pyramid).show()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
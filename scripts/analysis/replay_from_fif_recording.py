@@ -25,15 +25,13 @@ def stream_from_fif(file_path: Path):
         return
 
     print(f"Loading data from {file_path}...")
-    # Preload data into memory to prevent disk I/O during streaming
-    raw = mne.io.read_raw_fif(file_path, preload=True)
+    # Read lazily: samples are loaded one block at a time while streaming, so long recordings replay in constant memory
+    raw = mne.io.read_raw_fif(file_path, preload=False)
 
     # Extract information from the MNE Raw object
     sfreq = raw.info['sfreq']
     ch_names = raw.info['ch_names']
     n_channels = len(ch_names)
-    # MNE loads data in shape (n_channels, n_samples)
-    data = raw.get_data()
 
     # Create a new LSL stream outlet
     # Use the filename to create a unique stream name
@@ -62,12 +60,15 @@ def stream_from_fif(file_path: Path):
     print("Press Ctrl+C to stop.")
 
     try:
-        # Transpose data for easier iteration over samples (n_samples, n_channels)
-        data_to_stream = data.T
-        total_samples = data_to_stream.shape[0]
+        total_samples = raw.n_times
         wait_time = 1.0 / sfreq
+        block_samples = max(int(sfreq * 10), 1)
 
-        for i, sample in enumerate(data_to_stream):
+        for i in range(total_samples):
+            if (i % block_samples) == 0:
+                # MNE returns (n_channels, n_samples); transpose for easier iteration over samples
+                data_to_stream = raw.get_data(start=i, stop=min(i + block_samples, total_samples)).T
+            sample = data_to_stream[i % block_samples]
             # Push the sample to the LSL stream
             # The sample is a numpy array of shape (n_channels,)
             outlet.push_sample(sample)